@@ -2,6 +2,9 @@
     在这个代码中我们定义了一个Agent基类, 这个基础类定义了Agent的属性,与运行方法
 """
 from openai import OpenAI
+from backend.app.service.chat_request import encode_json
+from backend.app.global_resource import stream_buffer
+from backend.app.service.checkpoint import PHASE_REQUEST, resume_session
 from backend.app.service.request_display_action_and_save import request_display_action_and_save
 from backend.config import DEFAULT_MODEL, DEFAULT_API_KEY, DEFAULT_URL
 from backend.domain.predefined.property import LLMSettingsProperty
@@ -10,6 +13,7 @@ from backend.infra.function_calling import tool_manager
 import backend.infra.function_calling.register_tool  # noqa: F401  ensure tools registered before get_payload_components
 from backend.domain.predefined.model_settings_property import ModelSettings
 from backend.infra.database import db
+from backend.infra.frozen import freeze
 
 
 class basic_agent:
@@ -23,7 +27,9 @@ class basic_agent:
         :param soul: Agent的灵魂
         :param tools: Agent的工具列表
         :param llm_settings: LLM 运行配置
-        :param kwargs: 其他参数
+        :param kwargs: 其他参数；token_coalesce 控制流式输出的合并（None 默认阈值，False 逐字输出，
+            或 {"max_bytes": 64, "max_delay": 0.016}）；client 传入共享的 OpenAI 客户端（复用连接池），
+            缺省时按 llm_settings 新建；speculative_tools=True 时只读工具在参数完整后即提前执行
         :return: 初始化Agent的属性, 包括名称、描述、技能、规则、系统提示、工具
     """
     def __init__(self, 
@@ -41,17 +47,33 @@ class basic_agent:
         self.skills = skills
         self.rules = "\n".join(rules)
         self.soul = soul
-        self.tools = tools
         self.workspace_root = kwargs.pop("workspace_root", None)
+        self.token_coalesce = kwargs.pop("token_coalesce", None)
+        self.speculative_tools = kwargs.pop("speculative_tools", False)
+        client = kwargs.pop("client", None)
         if llm_settings is None:
             self.llm_settings = LLMSettingsProperty(model=DEFAULT_MODEL,url=DEFAULT_URL,api_key=DEFAULT_API_KEY)
         else:
             self.llm_settings = llm_settings
         #self.llm_settings = llm_settings
 
+        self.set_tools(tools)
+
+        #**kwargs, 如果出现basic_agent(params=params)，存储为self.params=params
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        if client is None:
+            client = OpenAI(api_key=self.llm_settings.api_key,
+                    base_url=self.llm_settings.url)
+        self.client = client
+    
+    def set_tools(self, tools: list[str]):
+        """设置工具列表：重建 ModelSettings，并使缓存的 payload 失效"""
+        self.tools = tools
         # 1. 从管理器获取允许使用的工具定义和可执行函数列表
         tools_defs, registry = tool_manager.get_payload_components(tools)
-        
+
         # 2. 构建类型安全的 ModelSettings 对象
         self.model_settings = ModelSettings(
             model=self.llm_settings.model,
@@ -60,17 +82,19 @@ class basic_agent:
             tools=tools_defs, # 自动解析为 ToolDefinition 列表
             tool_registry=registry
         )
+        self._payload = None
 
-        #**kwargs, 如果出现basic_agent(params=params)，存储为self.params=params
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-
-        self.client = OpenAI(api_key=self.llm_settings.api_key,
-                    base_url=self.llm_settings.url)
-    
     def get_payload(self):
-        """生成最终发送给 LLM 的配置字典"""
-        return self.model_settings.to_payload()
+        """
+            生成最终发送给 LLM 的配置字典
+            每轮 RDAS 都会调用：结果按工具列表缓存（只读），并附带预编码的 tools JSON（tools_json），
+            供调度器估算请求大小；工具变更须经 set_tools
+        """
+        if self._payload is None:
+            payload = self.model_settings.to_payload()
+            payload["tools_json"] = encode_json(payload["tools"])
+            self._payload = freeze(payload)
+        return self._payload
     
     def run(self,request: dict):
         """
@@ -78,26 +102,50 @@ class basic_agent:
             request: 用户请求,包括用户输入的文本，以及上下文存储的文件路径
             格式为: {"text": "用户输入的文本", "session_id": "上下文存储的文件路径"}
             运行这个指令，等效于用户输入了命令，并且按下了回车键
+            每轮的进度写入检查点，进程中途退出后用 resume(session_id) 继续，不必重发请求
         """
         system = self.prompt_builder()
         db.append_message(request["session_id"], system)
         messages={"role": "user", "content": request["text"]}
         db.append_message(request["session_id"], messages)
-        # while循环，直到返回值是False
-        session_id = request["session_id"]
-        agent_context = {
+        db.set_checkpoint(request["session_id"], PHASE_REQUEST)
+        return self._loop(request["session_id"])
+
+    def resume(self, session_id: str):
+        """
+            从检查点继续被中断的 run：跳过已完成的模型请求，只补执行未完成的工具调用（非幂等工具不重复执行），
+            然后继续 RDAS 循环直到给出最终答案；该 session 已完成时直接返回
+        """
+        if resume_session(session_id, db, stream_buffer, self.get_payload(), self._agent_context(),
+                          write=self._print_token):
+            return True
+        return self._loop(session_id)
+
+    def _agent_context(self) -> dict:
+        return {
             "workspace_root": self.workspace_root,
             "allowed_tools": self.tools,
             "agent_id": self.name,
             "skills_provider": skills_manager,
         }
+
+    @staticmethod
+    def _print_token(t: str) -> None:
+        print(t, end="", flush=True)
+
+    def _loop(self, session_id: str):
+        # while循环，直到返回值是False
+        agent_context = self._agent_context()
         while True:
             is_final_answer = request_display_action_and_save(
                 client=self.client,
                 session_id=session_id,
                 model_settings=self.get_payload(),
-                token=lambda t: print(t, end="", flush=True),
+                token=self._print_token,
                 agent_context=agent_context,
+                token_coalesce=self.token_coalesce,
+                checkpoint_store=db,
+                speculative_tools=self.speculative_tools,
             )
             if is_final_answer:
                 break
@@ -0,0 +1,182 @@
+"""
+Agent 实例池：从 agents 表（role_settings_yaml / system_prompt_text）构建 basic_agent，按定义哈希缓存复用。
+
+构建一个 basic_agent 要解析工具、校验 ModelSettings、新建 OpenAI 客户端（新的 HTTP 连接池，
+远端还要重新 TLS 握手）；服务端每个请求都构建一次代价很高。AgentRegistry：
+- 同一定义（agent_name + role_settings_yaml + system_prompt_text 的哈希）只构建一次；
+- OpenAI 客户端按 (url, api_key) 共享，所有用同一 endpoint 的 agent 复用一个连接池；
+- 客户端外包一层 ScheduledClient，请求经 llm_scheduler 按 (url, model) 限流排队；
+- 监听存储的 upsert_agent / delete_agent（add_agent_listener），变更即失效；
+  不支持监听的存储（如 StorageClient，写入发生在别的进程）自动改为 verify 模式：每次 get 读一行比对哈希。
+
+role_settings_yaml 的字段与 basic_agent 的参数一致：description / skills / rules / soul / tools / llm_settings，
+另可带 workspace_root、token_coalesce、speculative_tools 等 kwargs。llm_settings 为 "default"、可选项名（如 option_1）或 {model, url, api_key}；
+"routed" 表示在默认配置与全部可选项之间按实时 TTFT / 错误率路由（共享一个 RoutedClient，见 service/endpoint_router）。
+"""
+import hashlib
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import yaml
+from openai import OpenAI
+
+import backend.config as config
+from backend.app.agent import basic_agent
+from backend.app.service.endpoint_router import EndpointRouter, RoutedClient
+from backend.app.service.llm_scheduler import LLMScheduler, ScheduledClient, llm_scheduler
+from backend.config import DEFAULT_API_KEY, DEFAULT_MODEL, DEFAULT_URL
+from backend.domain.predefined.property import LLMSettingsProperty
+from backend.infra.database import db
+
+ROUTED = "routed"
+# "routed" 的对冲阈值：主 endpoint 超过其 TTFT p90 仍无首个 chunk 时向次优 endpoint 再发一个请求
+ROUTED_HEDGE_PERCENTILE = 0.9
+
+
+def resolve_llm_settings(value) -> LLMSettingsProperty:
+    """role_settings 中的 llm_settings -> LLMSettingsProperty；无法识别时用系统默认配置。"""
+    if isinstance(value, dict):
+        return LLMSettingsProperty(model=value.get("model"), url=value.get("url"), api_key=value.get("api_key"))
+    if isinstance(value, str) and value != "default":
+        option = getattr(config, value.upper(), None)
+        if isinstance(option, LLMSettingsProperty):
+            return option
+    return LLMSettingsProperty(model=DEFAULT_MODEL, url=DEFAULT_URL, api_key=DEFAULT_API_KEY)
+
+
+def definition_hash(agent_name: str, row: Dict) -> str:
+    h = hashlib.sha256()
+    for part in (agent_name, row.get("role_settings_yaml") or "", row.get("system_prompt_text") or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class AgentRegistry:
+    def __init__(
+        self,
+        store=db,
+        client_factory: Callable[..., OpenAI] = OpenAI,
+        verify: bool = False,
+        scheduler: Optional[LLMScheduler] = llm_scheduler,
+    ):
+        """
+        :param store: 提供 get_agent 的存储（MessageDB / ShardedMessageDB / StorageClient）
+        :param client_factory: 按 (api_key, base_url) 构建客户端，测试时可替换
+        :param verify: 每次 get 都读取 agents 行并比对定义哈希（存储不支持变更监听时使用）
+        :param scheduler: 请求限流调度器；None 不经调度直接请求
+        """
+        self._store = store
+        self._client_factory = client_factory
+        self.scheduler = scheduler
+        self.verify = verify
+        self._lock = threading.Lock()
+        # agent_name -> (定义哈希, agent)
+        self._agents: Dict[str, Tuple[str, basic_agent]] = {}
+        self._clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._routed: Optional[RoutedClient] = None
+        # 每次失效 +1：构建期间发生过失效则不写入缓存，避免旧定义覆盖
+        self._generation = 0
+        self.builds = 0
+        add_listener = getattr(store, "add_agent_listener", None)
+        if add_listener is not None:
+            add_listener(self.invalidate)
+        elif not verify:
+            self.verify = True
+
+    def get(self, agent_name: str) -> basic_agent:
+        """取 agent；未缓存或定义已变更时构建。agent 不存在抛 KeyError。"""
+        with self._lock:
+            generation = self._generation
+            cached = self._agents.get(agent_name)
+        if cached is not None and not self.verify:
+            return cached[1]
+        row = self._store.get_agent(agent_name)
+        if row is None:
+            self.invalidate(agent_name)
+            raise KeyError(f"Agent 不存在: {agent_name}")
+        digest = definition_hash(agent_name, row)
+        with self._lock:
+            cached = self._agents.get(agent_name)
+            if cached is not None and cached[0] == digest:
+                return cached[1]
+        # 在锁外构建（解析工具、校验配置较慢），并发构建同一定义时后写入者覆盖，结果等价
+        agent = self.build(agent_name, row)
+        with self._lock:
+            self.builds += 1
+            if self._generation == generation:
+                self._agents[agent_name] = (digest, agent)
+        return agent
+
+    def build(self, agent_name: str, row: Dict) -> basic_agent:
+        """按 agents 行构建 agent（不缓存）；system prompt 已在建 session 时写入，不在此重复。"""
+        settings = yaml.safe_load(row.get("role_settings_yaml") or "") or {}
+        if not isinstance(settings, dict):
+            raise ValueError(f"Agent {agent_name} 的 role_settings_yaml 不是映射")
+        settings = dict(settings)
+        llm_value = settings.pop("llm_settings", None)
+        llm_settings = resolve_llm_settings(llm_value)
+        client = self.routed_client() if llm_value == ROUTED else self.client_for(llm_settings)
+        return basic_agent(
+            name=agent_name,
+            description=settings.pop("description", ""),
+            skills=settings.pop("skills", None) or [],
+            rules=settings.pop("rules", None) or [],
+            soul=settings.pop("soul", ""),
+            tools=settings.pop("tools", None) or [],
+            llm_settings=llm_settings,
+            client=client,
+            **settings,
+        )
+
+    def client_for(self, llm_settings: LLMSettingsProperty) -> OpenAI:
+        """同一 (url, api_key) 共享一个客户端（及其 HTTP 连接池）。"""
+        key = (llm_settings.url, llm_settings.api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._new_client(api_key=llm_settings.api_key, base_url=llm_settings.url)
+                self._clients[key] = client
+            return client
+
+    def _new_client(self, **kwargs):
+        client = self._client_factory(**kwargs)
+        if self.scheduler is None:
+            return client
+        return ScheduledClient(client, self.scheduler, kwargs.get("base_url"))
+
+    def routed_client(self) -> RoutedClient:
+        """llm_settings 为 "routed" 的 agent 共享同一个路由客户端（统计数据也共享）。"""
+        with self._lock:
+            if self._routed is None:
+                self._routed = RoutedClient(EndpointRouter.from_options(
+                    client_factory=self._new_client, hedge_percentile=ROUTED_HEDGE_PERCENTILE
+                ))
+            return self._routed
+
+    def invalidate(self, agent_name: Optional[str] = None) -> None:
+        """使某个 agent（None 为全部）的缓存失效；共享客户端保留。"""
+        with self._lock:
+            self._generation += 1
+            if agent_name is None:
+                self._agents.clear()
+            else:
+                self._agents.pop(agent_name, None)
+
+    def close(self) -> None:
+        """清空缓存并关闭共享客户端。"""
+        remove_listener = getattr(self._store, "remove_agent_listener", None)
+        if remove_listener is not None:
+            remove_listener(self.invalidate)
+        with self._lock:
+            clients = list(self._clients.values())
+            if self._routed is not None:
+                clients.append(self._routed)
+                self._routed = None
+            self._clients.clear()
+            self._agents.clear()
+        for client in clients:
+            client.close()
+
+
+agent_registry = AgentRegistry()
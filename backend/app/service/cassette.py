@@ -0,0 +1,292 @@
+"""
+LLM 流式响应的录制与回放（cassette）。
+
+request_display_action_and_save 的每次运行都依赖在线模型，性能测试无法复现、回归用例也离不开网络。
+- RecordingClient 包装真实客户端：照常转发请求，同时把每个流的 chunk 序列及其相对请求发出的时间偏移
+  按请求哈希（model + messages + tools）记入 Cassette；
+- ReplayClient 按同样的哈希取出录制内容，按录制时的节奏（speed=1）、加速（speed>1）或不等待（speed=None）
+  逐个返回 ChatCompletionChunk，可直接传给 RDAS / basic_agent（client=...）；
+- cassette 文件为 gzip 压缩的 JSON Lines：每个 chunk 只存与该流首个 chunk 不同的顶层字段（通常只有 choices），
+  id / created / model 等每流一份。
+
+同一请求录制了多次时按出现顺序依次回放；on_miss="sequential" 时未命中的请求按录制顺序取下一条未用过的录制
+（工具输出含时间戳等不确定内容时使用）。
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from openai.types.chat import ChatCompletionChunk
+
+from backend.app.service.chat_request import create_chat_stream
+from backend.infra.streambuffer.compact_message import to_openai_messages
+
+CASSETTE_VERSION = 1
+ON_MISS_ERROR = "error"
+ON_MISS_SEQUENTIAL = "sequential"
+
+
+class CassetteMiss(KeyError):
+    """回放时找不到与请求对应的录制。"""
+
+
+def request_key(model: str, messages: Iterable[Any], tools: Optional[List[Dict]] = None) -> str:
+    """请求哈希：与消息的内存表示（dict / CompactMessage）及 tools 是否预编码无关。"""
+    h = hashlib.sha256()
+    h.update(str(model).encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(to_openai_messages(messages), ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(list(tools or ()), ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class Recording:
+    """一次请求的流：chunk（dict）及各 chunk 相对请求发出的秒数。"""
+
+    __slots__ = ("key", "offsets", "chunks", "_parsed")
+
+    def __init__(self, key: str, offsets: List[float], chunks: List[Dict]):
+        self.key = key
+        self.offsets = offsets
+        self.chunks = chunks
+        self._parsed: Optional[List[ChatCompletionChunk]] = None
+
+    def parsed(self) -> List[ChatCompletionChunk]:
+        """解析后的 chunk 对象，只构建一次（回放时 RDAS 只读不改）。"""
+        if self._parsed is None:
+            self._parsed = [ChatCompletionChunk.model_validate(c) for c in self.chunks]
+        return self._parsed
+
+    def to_record(self) -> Dict:
+        base = self.chunks[0] if self.chunks else {}
+        deltas = [{k: v for k, v in chunk.items() if base.get(k) != v} for chunk in self.chunks[1:]]
+        return {"key": self.key, "t": [round(t, 4) for t in self.offsets], "base": base, "chunks": deltas}
+
+    @classmethod
+    def from_record(cls, record: Dict) -> "Recording":
+        base = record.get("base") or {}
+        chunks = [base] + [{**base, **delta} for delta in record.get("chunks") or ()] if base else []
+        return cls(record["key"], list(record.get("t") or ()), chunks)
+
+
+class Cassette:
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: cassette 文件；存在则加载。None 为纯内存（测试用）。
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.recordings: List[Recording] = []
+        self._by_key: Dict[str, List[int]] = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self.recordings)
+
+    def add(self, recording: Recording) -> None:
+        with self._lock:
+            self._by_key.setdefault(recording.key, []).append(len(self.recordings))
+            self.recordings.append(recording)
+
+    def find(self, key: str) -> List[int]:
+        return self._by_key.get(key, [])
+
+    def load(self, path: str) -> None:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"不支持的 cassette 版本: {header.get('version')}")
+            for line in f:
+                if line.strip():
+                    self.add(Recording.from_record(json.loads(line)))
+
+    def save(self, path: Optional[str] = None) -> str:
+        """整体写出（先写临时文件再替换，中途失败不破坏旧文件）。"""
+        path = path or self.path
+        if path is None:
+            raise ValueError("没有指定 cassette 文件路径")
+        tmp = f"{path}.tmp"
+        with self._lock:
+            recordings = list(self.recordings)
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+            for recording in recordings:
+                f.write(json.dumps(recording.to_record(), ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, path)
+        return path
+
+
+# ---------- 录制 ----------
+
+
+class _RecordingStream:
+    """转发底层流并记录；流完整读完才写入 cassette（中途关闭的不录）。"""
+
+    def __init__(self, stream, cassette: Cassette, key: str, start: float):
+        self._stream = stream
+        self._cassette = cassette
+        self._key = key
+        self._start = start
+
+    def __iter__(self) -> Iterator:
+        offsets: List[float] = []
+        chunks: List[Dict] = []
+        for chunk in self._stream:
+            offsets.append(time.perf_counter() - self._start)
+            chunks.append(chunk.model_dump(mode="json", exclude_unset=True))
+            yield chunk
+        self._cassette.add(Recording(self._key, offsets, chunks))
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _RecordingCompletions:
+    def __init__(self, client: "RecordingClient"):
+        self._client = client
+
+    def create(self, *, model: str, messages, stream: bool = False, tools=None, **kwargs):
+        if not stream:
+            raise ValueError("cassette 只录制 stream=True 的请求")
+        client = self._client
+        messages = list(messages)
+        if tools is not None:
+            kwargs["tools"] = tools
+        start = time.perf_counter()
+        response = client.client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        return _RecordingStream(response, client.cassette, request_key(model, messages, tools), start)
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class RecordingClient:
+    """包装真实客户端，录制所有流式 chat completion；结束后 cassette.save()。"""
+
+    def __init__(self, client, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+        self.chat = _Chat(_RecordingCompletions(self))
+
+    def create_chat_stream(self, model_settings: Dict[str, Any], messages, **kwargs):
+        """chat_request.create_chat_stream 的扩展点：录制底层客户端的流式响应。"""
+        messages = list(messages)
+        key = request_key(model_settings["model"], messages, model_settings.get("tools"))
+        start = time.perf_counter()
+        stream = create_chat_stream(self.client, model_settings, messages, **kwargs)
+        return _RecordingStream(stream, self.cassette, key, start)
+
+    def close(self) -> None:
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+# ---------- 回放 ----------
+
+
+class ReplayStream:
+    def __init__(self, recording: Recording, speed: Optional[float]):
+        self._recording = recording
+        self._speed = speed
+        self._closed = False
+
+    def __iter__(self) -> Iterator[ChatCompletionChunk]:
+        chunks = self._recording.parsed()
+        if not self._speed:
+            for chunk in chunks:
+                if self._closed:
+                    return
+                yield chunk
+            return
+        start = time.perf_counter()
+        for offset, chunk in zip(self._recording.offsets, chunks):
+            if self._closed:
+                return
+            delay = start + offset / self._speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    def close(self) -> None:
+        self._closed = True
+
+
+class _ReplayCompletions:
+    def __init__(self, client: "ReplayClient"):
+        self._client = client
+
+    def create(self, *, model: str, messages, stream: bool = False, tools=None, **kwargs):
+        if not stream:
+            raise ValueError("cassette 只回放 stream=True 的请求")
+        return self._client.replay(request_key(model, list(messages), tools))
+
+
+class ReplayClient:
+    """按 cassette 回放流式 chat completion，不访问网络。"""
+
+    def __init__(self, cassette: Cassette, speed: Optional[float] = None, on_miss: str = ON_MISS_ERROR):
+        """
+        :param speed: 1 为录制时的节奏，10 为 10 倍速；None / 0 不等待（全速）
+        :param on_miss: "error" 抛 CassetteMiss；"sequential" 取录制顺序中下一条未用过的录制
+        """
+        if on_miss not in (ON_MISS_ERROR, ON_MISS_SEQUENTIAL):
+            raise ValueError(f"未知 on_miss: {on_miss}")
+        self.cassette = cassette
+        self.speed = speed
+        self.on_miss = on_miss
+        self.chat = _Chat(_ReplayCompletions(self))
+        self._lock = threading.Lock()
+        self._played: Dict[str, int] = {}
+        self._used: set = set()
+        self.hits = 0
+        self.misses = 0
+
+    def create_chat_stream(self, model_settings: Dict[str, Any], messages, **kwargs) -> ReplayStream:
+        return self.replay(request_key(model_settings["model"], messages, model_settings.get("tools")))
+
+    def replay(self, key: str) -> ReplayStream:
+        return ReplayStream(self.cassette.recordings[self._select(key)], self.speed)
+
+    def _select(self, key: str) -> int:
+        with self._lock:
+            candidates = self.cassette.find(key)
+            if candidates:
+                n = self._played.get(key, 0)
+                self._played[key] = n + 1
+                index = candidates[n % len(candidates)]
+                self._used.add(index)
+                self.hits += 1
+                return index
+            self.misses += 1
+            if self.on_miss == ON_MISS_SEQUENTIAL:
+                for index in range(len(self.cassette.recordings)):
+                    if index not in self._used:
+                        self._used.add(index)
+                        return index
+            raise CassetteMiss(f"cassette 中没有该请求的录制: {key[:12]}")
+
+    def reset(self) -> None:
+        """重新从头回放（多轮基准测试之间调用）。"""
+        with self._lock:
+            self._played.clear()
+            self._used.clear()
+
+    def close(self) -> None:
+        pass
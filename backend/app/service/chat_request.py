@@ -0,0 +1,41 @@
+"""
+RDAS 的模型请求：复用 agent 上缓存的 payload。
+
+basic_agent.get_payload() 按工具列表缓存 ModelSettings 的转换结果（只读），每轮不再重建；
+请求经公开的 client.chat.completions.create 发出，参数校验与响应类型由 openai 客户端负责。
+payload["tools_json"] 为 tools 的预编码 JSON，只用于估算请求大小（见 llm_scheduler.estimate_tokens），不拼入请求体。
+
+- client 自带 create_chat_stream(model_settings, messages, **kwargs) 时交由它处理（如 endpoint_router.RoutedClient）；
+- 其余 client 调用 chat.completions.create，内存中的紧凑消息在此处才展开为 dict。
+"""
+import json
+from typing import Any, Dict, Iterable
+
+from backend.infra.streambuffer.compact_message import CompactMessage, to_openai_messages
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, CompactMessage):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(value: Any) -> bytes:
+    """与 openai 客户端一致的紧凑 JSON 编码（UTF-8 原文，不转义非 ASCII）。"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=_default).encode()
+
+
+def create_chat_stream(client, model_settings: Dict[str, Any], messages: Iterable[Any], **kwargs):
+    """发起流式 chat completion，返回可迭代的 ChatCompletionChunk 流。"""
+    # 包装型客户端（如 endpoint_router.RoutedClient）自行分发到底层客户端；
+    # 在类型上查找，避免 MagicMock 之类的替身被误认为实现了该方法
+    hook = getattr(type(client), "create_chat_stream", None)
+    if hook is not None:
+        return hook(client, model_settings, messages, **kwargs)
+    return client.chat.completions.create(
+        model=model_settings["model"],
+        messages=to_openai_messages(messages),
+        tools=model_settings["tools"],
+        stream=True,
+        **kwargs
+    )
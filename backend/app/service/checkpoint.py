@@ -0,0 +1,68 @@
+"""
+可恢复的 agent 运行：每轮 RDAS 在消息存储中记录检查点（见 MessageDB.set_checkpoint），进程中途退出后 resume 从检查点继续。
+
+阶段（phase）：
+- request：用户消息已写入，尚未请求模型；
+- stream：模型请求进行中，message_id 之后的行为（可能只写了一半的）占位 assistant 消息；
+- tools：带 tool_calls 的 assistant 消息已保存，正在逐个执行工具（started / done 记录进度）；
+- done：本轮已给出最终答案（或被取消）。
+
+resume_session 只做修复，不请求模型：
+- stream：删掉 message_id 之后的半截 assistant 消息，之后重新请求模型；
+- tools：已完成的调用跳过（done 中或已有 tool 结果消息）；已开始但未完成的调用，幂等工具重新执行，
+  其余写入一条"执行被中断"的结果交给模型判断，不重复产生副作用；未开始的照常执行。
+之后由调用方（basic_agent.resume / chat.resume_chat）继续 RDAS 循环。
+"""
+from typing import Callable, Dict, Optional
+
+from backend.app.service.tool_execution import ToolEnvironment, execute_tool_call, record_tool_result
+from backend.infra.function_calling import tool_manager
+
+PHASE_REQUEST = "request"
+PHASE_STREAM = "stream"
+PHASE_TOOLS = "tools"
+PHASE_DONE = "done"
+
+INTERRUPTED_RESULT = (
+    "[tool interrupted] 进程在该工具执行期间退出，结果未知；该工具不是幂等的，未自动重试。"
+    "请先确认其效果（如检查文件或状态），再决定是否重新调用。"
+)
+
+
+def resume_session(
+    session_id: str,
+    store,  # CheckpointingMessageStore
+    buffer,  # Stream_Buffer
+    model_settings: Dict,
+    agent_context: Optional[dict] = None,
+    write: Callable[[str], None] = lambda t: None,
+    is_idempotent: Callable[[str], bool] = tool_manager.is_idempotent,
+) -> bool:
+    """
+    按检查点修复中断的一轮。返回 True 表示该 session 已有最终答案、无需继续；False 表示应继续 RDAS 循环。
+    没有检查点的 session（未经检查点运行过）按最后一条消息判断：user / tool 消息之后需要继续。
+    """
+    buffer.discard(session_id)
+    checkpoint = store.get_checkpoint(session_id)
+    if checkpoint is None:
+        messages = store.load_messages(session_id)
+        return not messages or messages[-1].get("role") not in ("user", "tool")
+    phase = checkpoint["phase"]
+    if phase == PHASE_DONE:
+        return True
+    if phase == PHASE_STREAM:
+        store.truncate_session(session_id, checkpoint["message_id"] or 0)
+        store.set_checkpoint(session_id, PHASE_REQUEST)
+    elif phase == PHASE_TOOLS:
+        answered = {m.get("tool_call_id") for m in store.load_messages(session_id) if m.get("role") == "tool"}
+        done = set(checkpoint["done"]) | answered
+        started = set(checkpoint["started"])
+        env = ToolEnvironment(session_id, model_settings, agent_context)
+        for tool_call in checkpoint["tool_calls"]:
+            if tool_call["id"] in done:
+                continue
+            if tool_call["id"] in started and not is_idempotent(tool_call["function"]["name"]):
+                record_tool_result(buffer, session_id, tool_call, INTERRUPTED_RESULT, write, store)
+            else:
+                execute_tool_call(buffer, session_id, tool_call, env, write, store)
+    return False
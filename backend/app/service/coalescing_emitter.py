@@ -0,0 +1,172 @@
+"""
+UI token 回调前的合并层。
+
+模型流式返回的 delta 常常只有一两个字符，逐个调用 token(...)（终端里是 print(..., flush=True)，
+网络里是一次写出）时，消费端的时间大多花在系统调用上。CoalescingEmitter 把 delta 攒成批：
+- 缓冲达到 max_bytes（UTF-8 字节数）立即输出；
+- 否则自第一段待发文本起最多等待 max_delay 秒，由后台定时线程输出，模型停顿时文本也不会滞留；
+- <think> / </think> 由这里统一加框：首段思考前输出 <think>，转入正文或工具调用时输出 </think>\\n，
+  stream 以思考结尾时在 close() 中补齐闭合标签。标签与文本同批输出，不会被拆到两次回调里。
+
+max_bytes <= 1 或 max_delay <= 0 时退化为逐段直接回调（与旧行为一致），便于调试或需要逐字渲染的 UI。
+"""
+import threading
+import time
+from typing import Callable, List, Optional
+
+DEFAULT_MAX_BYTES = 64
+DEFAULT_MAX_DELAY = 0.016
+# 定时线程空闲这么久后退出，下一批文本到来时再按需启动（异常中断的 stream 不会遗留线程）
+_TIMER_IDLE = 1.0
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>\n"
+
+# 思考框状态：未开始 / 进行中 / 已闭合（闭合后再来的思考内容不再展示，与旧行为一致）
+_THINK_NONE = 0
+_THINK_OPEN = 1
+_THINK_CLOSED = -1
+
+
+class CoalescingEmitter:
+    def __init__(
+        self,
+        token: Callable[[str], None],
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self._token = token
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.passthrough = max_bytes <= 1 or max_delay <= 0
+        self._buffer: List[str] = []
+        self._size = 0
+        self._deadline: Optional[float] = None
+        self._think = _THINK_NONE
+        self._closed = False
+        # token 回调只在持锁时调用：定时线程与生产者线程的输出保持顺序、互不交错
+        self._cond = threading.Condition()
+        self._timer: Optional[threading.Thread] = None
+        # 统计：实际回调次数与收到的 delta 数
+        self.emits = 0
+        self.deltas = 0
+
+    @classmethod
+    def from_config(cls, token: Callable[[str], None], config=None) -> "CoalescingEmitter":
+        """
+        按 agent 配置构造：
+        None / True 使用默认阈值；False 关闭合并；dict 形如 {"max_bytes": 64, "max_delay": 0.016}。
+        """
+        if config is None or config is True:
+            return cls(token)
+        if config is False:
+            return cls(token, max_bytes=0)
+        return cls(token, **config)
+
+    # ---------- 写入 ----------
+
+    def reasoning(self, text: str) -> None:
+        """思考内容；首段前自动加 <think>。"""
+        if not text:
+            return
+        with self._cond:
+            self.deltas += 1
+            if self._think == _THINK_NONE:
+                self._think = _THINK_OPEN
+                self._push(THINK_OPEN + text)
+            elif self._think == _THINK_OPEN:
+                self._push(text)
+
+    def content(self, text: str) -> None:
+        """正文内容；若思考框未闭合先闭合。"""
+        if not text:
+            return
+        with self._cond:
+            self.deltas += 1
+            self._close_think()
+            self._push(text)
+
+    def tool_calls(self) -> None:
+        """模型开始输出工具调用：闭合思考框。"""
+        with self._cond:
+            self._close_think()
+
+    def write(self, text: str) -> None:
+        """整段文本（工具结果、轮末换行等）：连同已缓冲内容立即输出。"""
+        with self._cond:
+            self._close_think()
+            if text:
+                self.deltas += 1
+                self._append(text)
+            self._flush_locked()
+
+    def flush(self) -> None:
+        with self._cond:
+            self._flush_locked()
+
+    def close(self) -> None:
+        """闭合未结束的思考框，输出剩余内容并停止定时线程。可重复调用。"""
+        with self._cond:
+            self._close_think()
+            self._flush_locked()
+            self._closed = True
+            self._cond.notify_all()
+        timer = self._timer
+        if timer is not None and timer is not threading.current_thread():
+            timer.join()
+
+    def __enter__(self) -> "CoalescingEmitter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    # ---------- 内部（调用方持有 _cond） ----------
+
+    def _close_think(self) -> None:
+        if self._think == _THINK_OPEN:
+            self._think = _THINK_CLOSED
+            self._append(THINK_CLOSE)
+
+    def _push(self, text: str) -> None:
+        self._append(text)
+        if self.passthrough or self._closed or self._size >= self.max_bytes:
+            self._flush_locked()
+        elif self._deadline is None:
+            self._deadline = time.monotonic() + self.max_delay
+            self._ensure_timer()
+            self._cond.notify_all()
+
+    def _append(self, text: str) -> None:
+        self._buffer.append(text)
+        self._size += len(text.encode("utf-8"))
+
+    def _flush_locked(self) -> None:
+        self._deadline = None
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._size = 0
+        self.emits += 1
+        self._token(text)
+
+    def _ensure_timer(self) -> None:
+        if self._timer is None and not self._closed:
+            self._timer = threading.Thread(target=self._timer_loop, name="token-coalescer", daemon=True)
+            self._timer.start()
+
+    def _timer_loop(self) -> None:
+        with self._cond:
+            while not self._closed:
+                if self._deadline is None:
+                    self._cond.wait(_TIMER_IDLE)
+                    if self._deadline is None:
+                        break
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._flush_locked()
+            self._timer = None
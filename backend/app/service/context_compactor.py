@@ -0,0 +1,210 @@
+"""
+长 session 的上下文压缩：超过 token 阈值时，把较早的消息交给廉价模型总结成一段摘要。
+
+RDAS 每一步都要重发整个历史，跑了上百步的 session 延迟与花费线性增长，直到超出上下文窗口。
+ContextCompactor 在每一步请求前检查（chat.continue_chat 调用 maybe_compact）：
+- 按字符数估算压缩后上下文（摘要 + 未压缩消息）的 token 数，超过 threshold_tokens 才压缩；
+  先用存储层记录的消息大小（recall_size，不解码）粗估，只有粗估超过阈值时才解码消息精确估算；
+- 保留最近约 keep_tokens 的消息，切分点落在 user / assistant 消息上（工具结果不与其调用分开）；
+- 被切下的消息连同上一份摘要交给 llm_settings 指定的模型（通常是 LLM_SETTINGS_OPTIONS 中的廉价模型），
+  得到新的摘要；原消息留在库中，只标记 compacted_upto，recall 时跳过（见 MessageDB.load_recall_messages）；
+- 摘要按内容哈希缓存在 summaries 表：相同内容（重试、同一前缀的多个分叉）不再请求模型。
+
+配置见 settings.yaml 的 compaction 段；未配置时 context_compactor 为 None，不压缩。
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.app.agent_registry import agent_registry, resolve_llm_settings
+from backend.app.service.llm_scheduler import CHARS_PER_TOKEN, estimate_tokens
+from backend.domain.predefined.property import LLMSettingsProperty
+from backend.infra.database import db
+
+DEFAULT_THRESHOLD_TOKENS = 64000
+DEFAULT_KEEP_TOKENS = 16000
+# 单条消息写入待总结文本时的长度上限（字符），超出部分保留首尾
+MAX_MESSAGE_CHARS = 4000
+# 摘要提示词变更时递增，使旧缓存失效
+PROMPT_VERSION = 1
+
+SUMMARY_HEADER = "## 早前对话摘要\n以下是本会话较早部分的摘要，原始消息已省略：\n"
+
+SUMMARY_PROMPT = (
+    "你负责压缩一段 AI 助手与用户的对话历史。请把给出的内容（可能包含上一份摘要）总结为一份新的摘要，"
+    "供助手继续工作时参考。保留：用户的目标与约束、已做出的决定与理由、工具调用得到的关键事实"
+    "（文件路径、数值、命令、错误信息）、尚未完成的事项。省略寒暄与重复内容，不要编造。直接输出摘要正文。"
+)
+
+_ROLE_LABELS = {"user": "用户", "assistant": "助手", "tool": "工具结果", "system": "系统"}
+
+
+def _clip(text: str, limit: int = MAX_MESSAGE_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n…（省略 {len(text) - limit} 字）…\n{text[-half:]}"
+
+
+def render_transcript(messages: Sequence[Dict], previous_summary: Optional[str] = None) -> str:
+    """把消息渲染为供模型总结的纯文本。"""
+    parts = []
+    if previous_summary:
+        parts.append(f"【上一份摘要】\n{previous_summary}")
+    for message in messages:
+        label = _ROLE_LABELS.get(message.get("role"), message.get("role") or "")
+        content = message.get("content")
+        if content and not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        if content:
+            parts.append(f"【{label}】\n{_clip(content)}")
+        for call in message.get("tool_calls") or ():
+            function = call.get("function") or {}
+            parts.append(f"【{label}调用工具】{function.get('name')}({_clip(function.get('arguments') or '')})")
+    return "\n\n".join(parts)
+
+
+def summary_key(model: str, previous_hash: Optional[str], messages: Sequence[Dict]) -> str:
+    h = hashlib.sha256()
+    h.update(f"{PROMPT_VERSION}\0{model}\0{previous_hash or ''}\0".encode("utf-8"))
+    for message in messages:
+        h.update(json.dumps(message, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ContextCompactor:
+    def __init__(
+        self,
+        llm_settings: LLMSettingsProperty,
+        store=db,
+        client=None,
+        threshold_tokens: int = DEFAULT_THRESHOLD_TOKENS,
+        keep_tokens: int = DEFAULT_KEEP_TOKENS,
+    ):
+        """
+        :param llm_settings: 生成摘要用的模型
+        :param store: 支持压缩的消息存储（MessageDB / ShardedMessageDB）
+        :param client: 模型客户端；缺省取 agent_registry 的共享客户端（经限流调度）
+        """
+        if keep_tokens >= threshold_tokens:
+            raise ValueError("keep_tokens 必须小于 threshold_tokens")
+        self.llm_settings = llm_settings
+        self.store = store
+        self._client = client
+        self.threshold_tokens = threshold_tokens
+        self.keep_tokens = keep_tokens
+        self.summarized = 0
+        self.cache_hits = 0
+
+    @classmethod
+    def from_config(cls, settings: Optional[Dict[str, Any]] = None, **kwargs) -> Optional["ContextCompactor"]:
+        """按 settings.yaml 的 compaction 段构建；未配置返回 None。"""
+        from backend import config
+
+        settings = config.COMPACTION if settings is None else settings
+        if not settings:
+            return None
+        return cls(
+            resolve_llm_settings(settings.get("llm_settings")),
+            threshold_tokens=settings.get("threshold_tokens", DEFAULT_THRESHOLD_TOKENS),
+            keep_tokens=settings.get("keep_tokens", DEFAULT_KEEP_TOKENS),
+            **kwargs,
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = agent_registry.client_for(self.llm_settings)
+        return self._client
+
+    def maybe_compact(self, session_id: str) -> bool:
+        """上下文超过阈值时压缩，返回是否压缩了。"""
+        # JSON 字符数不少于 estimate_tokens 计入的字符数（每条消息的键名也多于其固定开销），粗估未超阈值即可返回
+        if self.store.recall_size(session_id) // CHARS_PER_TOKEN <= self.threshold_tokens:
+            return False
+        messages = self.store.load_recall_messages(session_id)
+        if messages is None:
+            messages = self.store.load_messages(session_id)
+        if estimate_tokens(messages, max_tokens=0) <= self.threshold_tokens:
+            return False
+        return self.compact(session_id)
+
+    def compact(self, session_id: str) -> bool:
+        """把未压缩部分中较早的消息并入摘要，保留最近约 keep_tokens；没有可切分的位置返回 False。"""
+        ids = self.store.list_message_ids(session_id)
+        messages = self.store.load_messages(session_id)
+        compaction = self.store.get_compaction(session_id)
+        upto, previous_hash = compaction if compaction is not None else (0, None)
+        active = self._active(ids, messages, upto)
+        split = self._split(active)
+        if split is None:
+            return False
+        head = [m for _, m in active[:split]]
+        previous = self.store.get_summary(previous_hash) if previous_hash else None
+        key = summary_key(self.llm_settings.model, previous_hash, head)
+        summary = self.store.get_summary(key)
+        if summary is None:
+            if previous is not None and previous.startswith(SUMMARY_HEADER):
+                previous = previous[len(SUMMARY_HEADER):]
+            body = self.summarize(head, previous)
+            summary = SUMMARY_HEADER + body
+            self.store.put_summary(key, summary, self.llm_settings.model)
+            self.summarized += 1
+        else:
+            self.cache_hits += 1
+        self.store.set_compaction(session_id, active[split - 1][0], key)
+        return True
+
+    @staticmethod
+    def _active(ids: List[int], messages: List[Dict], upto: int) -> List[Tuple[int, Dict]]:
+        """未压缩的 (id, message)，不含开头的 system 消息。"""
+        active = []
+        leading = True
+        for message_id, message in zip(ids, messages):
+            if leading and message.get("role") == "system":
+                continue
+            leading = False
+            if message_id > upto:
+                active.append((message_id, message))
+        return active
+
+    def _split(self, active: List[Tuple[int, Dict]]) -> Optional[int]:
+        """保留部分的起点：尽量多压缩，但保留的消息不超过 keep_tokens；至少保留最后一个切分点之后的内容。"""
+        boundaries = [i for i in range(1, len(active)) if active[i][1].get("role") in ("user", "assistant")]
+        if not boundaries:
+            return None
+        tail_tokens = 0
+        tokens_from = {}
+        for i in range(len(active) - 1, 0, -1):
+            tail_tokens += estimate_tokens([active[i][1]], max_tokens=0)
+            tokens_from[i] = tail_tokens
+        for i in boundaries:
+            if tokens_from[i] <= self.keep_tokens:
+                return i
+        return boundaries[-1]
+
+    def summarize(self, messages: Sequence[Dict], previous_summary: Optional[str] = None) -> str:
+        """请求模型生成摘要（流式接收，只取 content）。"""
+        stream = self.client.chat.completions.create(
+            model=self.llm_settings.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": render_transcript(messages, previous_summary)},
+            ],
+            stream=True,
+        )
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta is not None and delta.content:
+                parts.append(delta.content)
+        summary = "".join(parts).strip()
+        if not summary:
+            raise RuntimeError("摘要模型返回了空内容")
+        return summary
+
+
+context_compactor = ContextCompactor.from_config()
@@ -0,0 +1,465 @@
+"""
+多 endpoint 路由与对冲请求（hedged request）。
+
+config 中的 LLM_SETTINGS_OPTIONS 提供了多个等价 endpoint，但每个 agent 固定用一个；慢或过载的 provider
+直接决定了 TTFT 的 p99。EndpointRouter 按 endpoint 实时统计：
+- TTFT（请求发出到首个 chunk）的 EWMA 与最近样本（用于分位数）；
+- 错误率 EWMA 与连续错误数：超过 error_threshold 或连续 eject_after 次失败视为不健康，
+  最后一次失败后 cooldown 秒内不再选择（之后放行探测请求）；
+- 进行中的请求数（从发出请求到流被关闭或读完）：score = TTFT_EWMA × (1 + in_flight) / (1 - 错误率)，取最小者；
+  尚无样本的 endpoint 优先以便测量，但刚失败过的排在最后。
+
+RoutedClient 把路由器包装成与 OpenAI 客户端相同的 chat.completions.create(stream=True) 接口：
+- 首个 chunk 之前出错时，连接失败、超时、5xx 与 429 自动换下一个 endpoint 重试并计入错误率；
+  其余错误（400 / 422 等请求本身的问题，换 endpoint 也一样）立即抛出，不计入 endpoint 的错误率；
+  首个 chunk 之后出错照常抛出；
+- 设置 hedge_percentile 时，主请求超过该 endpoint TTFT 的对应分位数仍未出首个 chunk，
+  就向次优 endpoint 再发一个请求，谁先出首个 chunk 用谁，另一个立即关闭；
+- 只有对冲等待期间用到后台线程，流的主体仍在调用方线程里迭代；后台线程继承调用方的 contextvars
+  （如 llm_scheduler.scheduling() 设置的优先级与 agent）。
+"""
+import contextvars
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from openai import APIConnectionError, APIStatusError, OpenAI
+
+from backend.app.service.chat_request import create_chat_stream
+from backend.domain.predefined.property import LLMSettingsProperty
+
+DEFAULT_ALPHA = 0.2
+DEFAULT_ERROR_THRESHOLD = 0.5
+DEFAULT_EJECT_AFTER = 3
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_SAMPLES = 200
+# 计算对冲延迟所需的最少 TTFT 样本数
+MIN_HEDGE_SAMPLES = 5
+
+
+class NoHealthyEndpoint(RuntimeError):
+    """所有 endpoint 都不可用（或都已失败）。"""
+
+
+def _retryable(error: BaseException) -> bool:
+    """是否换 endpoint 重试并计入错误：连接失败、超时、5xx 与 429。"""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (APIConnectionError, ConnectionError, TimeoutError))
+
+
+class EndpointStats:
+    def __init__(self, alpha: float = DEFAULT_ALPHA, samples: int = DEFAULT_SAMPLES):
+        self.alpha = alpha
+        self.ttft_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error_at: Optional[float] = None
+        self._samples: Deque[float] = deque(maxlen=samples)
+
+    def record_ttft(self, ttft: float) -> None:
+        self.ttft_ewma = ttft if self.ttft_ewma is None else self.alpha * ttft + (1 - self.alpha) * self.ttft_ewma
+        self.error_ewma *= 1 - self.alpha
+        self.consecutive_errors = 0
+        self._samples.append(ttft)
+
+    def record_error(self, now: float) -> None:
+        self.errors += 1
+        self.consecutive_errors += 1
+        self.error_ewma = self.alpha + (1 - self.alpha) * self.error_ewma
+        self.last_error_at = now
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ttft_ewma": self.ttft_ewma,
+            "error_ewma": self.error_ewma,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class Endpoint:
+    def __init__(self, name: str, settings: LLMSettingsProperty, client):
+        self.name = name
+        self.settings = settings
+        self.client = client
+
+
+class EndpointRouter:
+    def __init__(
+        self,
+        endpoints: Dict[str, LLMSettingsProperty],
+        client_factory: Callable[..., Any] = OpenAI,
+        hedge_percentile: Optional[float] = None,
+        min_hedge_delay: float = 0.05,
+        alpha: float = DEFAULT_ALPHA,
+        error_threshold: float = DEFAULT_ERROR_THRESHOLD,
+        eject_after: int = DEFAULT_EJECT_AFTER,
+        cooldown: float = DEFAULT_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param endpoints: 名称 -> LLMSettingsProperty（各 endpoint 自带 model 名，请求时替换）
+        :param hedge_percentile: 如 0.9：主请求 TTFT 超过其 p90 时发对冲请求；None 关闭对冲
+        :param min_hedge_delay: 对冲延迟下限，避免样本很快时过度对冲
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个 endpoint")
+        self.endpoints = {
+            # 失败由路由器换 endpoint 重试，关闭客户端自身的重试（否则 5xx 要先退避重试两次）
+            name: Endpoint(
+                name, settings, client_factory(api_key=settings.api_key, base_url=settings.url, max_retries=0)
+            )
+            for name, settings in endpoints.items()
+        }
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.error_threshold = error_threshold
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {name: EndpointStats(alpha) for name in endpoints}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Dict]] = None, include_default: bool = True, **kwargs):
+        """从 settings.yaml 的 llm_settings_options（及默认配置）构建。"""
+        from backend import config
+
+        if options is None:
+            options = config.LLM_SETTINGS_OPTIONS or {}
+        endpoints = {}
+        if include_default:
+            endpoints["default"] = LLMSettingsProperty(
+                model=config.DEFAULT_MODEL, url=config.DEFAULT_URL, api_key=config.DEFAULT_API_KEY
+            )
+        for name, value in options.items():
+            endpoints[name] = LLMSettingsProperty(model=value.get("model"), url=value.get("url"), api_key=value.get("api_key"))
+        return cls(endpoints, **kwargs)
+
+    # ---------- 统计 ----------
+
+    def _recent_error(self, stats: EndpointStats, now: float) -> bool:
+        return stats.last_error_at is not None and now - stats.last_error_at < self.cooldown
+
+    def _healthy(self, stats: EndpointStats, now: float) -> bool:
+        if not self._recent_error(stats, now):
+            return True
+        return stats.error_ewma <= self.error_threshold and stats.consecutive_errors < self.eject_after
+
+    def _score(self, stats: EndpointStats, now: float) -> float:
+        if stats.ttft_ewma is None:
+            return math.inf if self._recent_error(stats, now) else 0.0
+        return stats.ttft_ewma * (1 + stats.in_flight) / max(1 - stats.error_ewma, 0.01)
+
+    def rank(self, exclude: Sequence[str] = ()) -> List[Endpoint]:
+        """健康 endpoint 按 score 升序；全部不健康时按错误率升序返回（总要有个去处）。"""
+        now = self._clock()
+        with self._lock:
+            candidates = [(name, s) for name, s in self._stats.items() if name not in exclude]
+            healthy = [(name, s) for name, s in candidates if self._healthy(s, now)]
+            if healthy:
+                ordered = sorted(healthy, key=lambda item: (self._score(item[1], now), item[0]))
+            else:
+                ordered = sorted(candidates, key=lambda item: (item[1].error_ewma, item[0]))
+        return [self.endpoints[name] for name, _ in ordered]
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            p = self._stats[name].percentile(self.hedge_percentile)
+        return None if p is None else max(p, self.min_hedge_delay)
+
+    def _begin(self, name: str) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            stats.in_flight += 1
+            stats.requests += 1
+
+    def _record(self, name: str, ttft: Optional[float] = None, error: bool = False) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            if error:
+                stats.record_error(self._clock())
+            elif ttft is not None:
+                stats.record_ttft(ttft)
+
+    def _release(self, name: str) -> None:
+        with self._lock:
+            self._stats[name].in_flight -= 1
+
+    def _count_hedge(self, won: bool = False) -> None:
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: s.snapshot() for name, s in self._stats.items()}
+
+    def close(self) -> None:
+        for endpoint in self.endpoints.values():
+            close = getattr(endpoint.client, "close", None)
+            if close is not None:
+                close()
+
+
+class _Attempt:
+    """一次对某 endpoint 的请求：run() 启动到首个 chunk 为止，in_flight 占用到流被关闭（cancel）为止。"""
+
+    def __init__(self, router: EndpointRouter, endpoint: Endpoint, open_stream: Callable[[Endpoint], Any]):
+        self.router = router
+        self.endpoint = endpoint
+        self._open_stream = open_stream
+        self.stream = None
+        self.iterator: Optional[Iterator] = None
+        self.first = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+        self._done = False
+        self._settled = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def run(self) -> bool:
+        """
+        发请求并取首个 chunk；成功返回 True。统计只记一次：被取消的不计 TTFT，
+        不可重试的错误（见 _retryable）不计入错误率。失败或已被取消时立即释放 in_flight。
+        """
+        self.router._begin(self.endpoint.name)
+        start = time.perf_counter()
+        ok = True
+        try:
+            stream = self._open_stream(self.endpoint)
+            with self._lock:
+                self.stream = stream
+                cancelled = self.cancelled
+            if cancelled:
+                # cancel() 发生在 _open_stream 返回之前，没能关闭这个流
+                _close(stream)
+                raise _Cancelled()
+            self.iterator = iter(stream)
+            self.first = next(self.iterator)
+        except StopIteration:
+            # 空流也算成功：没有内容可等
+            self.first = None
+            self._settle(ttft=time.perf_counter() - start)
+        except BaseException as e:
+            ok = False
+            self.error = e
+            self._settle(error=not self.cancelled and _retryable(e))
+            if self.stream is not None and not isinstance(e, _Cancelled):
+                _close(self.stream)
+        else:
+            self._settle(ttft=time.perf_counter() - start)
+        with self._lock:
+            self._done = True
+            cancelled = self.cancelled
+        if not ok or cancelled:
+            self._release()
+        return ok
+
+    @property
+    def retryable(self) -> bool:
+        return self.cancelled or self.error is None or _retryable(self.error)
+
+    def _settle(self, ttft: Optional[float] = None, error: bool = False) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        self.router._record(self.endpoint.name, None if self.cancelled else ttft, error)
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.router._release(self.endpoint.name)
+
+    def cancel(self) -> None:
+        """关闭流；run() 已结束时同时释放 in_flight（否则由 run() 结束时释放）。"""
+        with self._lock:
+            self.cancelled = True
+            stream = self.stream
+            done = self._done
+        if stream is not None:
+            _close(stream)
+        if done:
+            self._release()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _close(stream) -> None:
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class RoutedStream:
+    """RoutedClient 返回的流：可迭代、可 close()；endpoint 为最终选中的 endpoint 名。"""
+
+    def __init__(self, router: EndpointRouter, open_stream: Callable[[Endpoint], Any]):
+        self._router = router
+        self._open_stream = open_stream
+        self._winner: Optional[_Attempt] = None
+        self._attempts: List[_Attempt] = []
+        self._closed = False
+        self.endpoint: Optional[str] = None
+        self.hedged = False
+
+    def __iter__(self):
+        winner = self._start()
+        self._winner = winner
+        self.endpoint = winner.endpoint.name
+        try:
+            if winner.first is None:
+                return
+            yield winner.first
+            for chunk in winner.iterator:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._closed = True
+        for attempt in self._attempts:
+            attempt.cancel()
+
+    def _start(self) -> _Attempt:
+        """依次尝试 endpoint，直到拿到首个 chunk；对冲时与次优 endpoint 竞速。"""
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            ranked = self._router.rank(exclude=tried)
+            if not ranked or self._closed:
+                raise NoHealthyEndpoint("没有可用的 endpoint") from last_error
+            primary = ranked[0]
+            tried.append(primary.name)
+            delay = self._router.hedge_delay(primary.name)
+            if delay is None or len(ranked) < 2:
+                attempt = self._new_attempt(primary)
+                if attempt.run():
+                    return attempt
+                if not attempt.retryable:
+                    raise attempt.error
+                last_error = attempt.error
+                continue
+            winner, failed = self._race(primary, ranked[1], delay, tried)
+            if winner is not None:
+                return winner
+            last_error = failed
+
+    def _new_attempt(self, endpoint: Endpoint) -> _Attempt:
+        attempt = _Attempt(self._router, endpoint, self._open_stream)
+        self._attempts.append(attempt)
+        return attempt
+
+    def _race(
+        self, primary: Endpoint, backup: Endpoint, delay: float, tried: List[str]
+    ) -> Tuple[Optional[_Attempt], Optional[BaseException]]:
+        results: "queue.Queue[Tuple[_Attempt, bool]]" = queue.Queue()
+
+        def launch(endpoint: Endpoint) -> _Attempt:
+            attempt = self._new_attempt(endpoint)
+            # 每个线程各用一份调用方上下文的副本（同一个 Context 不能在两个线程里同时进入）
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=lambda: context.run(lambda: results.put((attempt, attempt.run()))),
+                name=f"hedge-{endpoint.name}",
+                daemon=True,
+            ).start()
+            return attempt
+
+        running = [launch(primary)]
+        try:
+            attempt, ok = results.get(timeout=delay)
+        except queue.Empty:
+            # 主请求超过分位数仍无首个 chunk：对冲
+            self.hedged = True
+            self._router._count_hedge()
+            tried.append(backup.name)
+            running.append(launch(backup))
+            attempt, ok = results.get()
+        last_error = None
+        while True:
+            if ok:
+                for other in running:
+                    if other is not attempt:
+                        other.cancel()
+                if attempt.endpoint is backup:
+                    self._router._count_hedge(won=True)
+                return attempt, None
+            if not attempt.retryable:
+                for other in running:
+                    if other is not attempt:
+                        other.cancel()
+                raise attempt.error
+            last_error = attempt.error
+            running.remove(attempt)
+            if not running:
+                return None, last_error
+            attempt, ok = results.get()
+
+
+class _Completions:
+    def __init__(self, client: "RoutedClient"):
+        self._client = client
+
+    def create(self, *, model: Optional[str] = None, messages, stream: bool = False, **kwargs):
+        """与 OpenAI 的 chat.completions.create 相同；model 由选中的 endpoint 决定。仅支持 stream=True。"""
+        if not stream:
+            raise ValueError("RoutedClient 只支持 stream=True")
+        return RoutedStream(
+            self._client.router,
+            lambda ep: ep.client.chat.completions.create(
+                model=ep.settings.model, messages=messages, stream=True, **kwargs
+            ),
+        )
+
+
+class _Chat:
+    def __init__(self, client: "RoutedClient"):
+        self.completions = _Completions(client)
+
+
+class RoutedClient:
+    """可替换 OpenAI 客户端注入 basic_agent / RDAS 的路由客户端。"""
+
+    def __init__(self, router: EndpointRouter):
+        self.router = router
+        self.chat = _Chat(self)
+
+    def create_chat_stream(self, model_settings: Dict[str, Any], messages, **kwargs) -> RoutedStream:
+        """chat_request.create_chat_stream 的扩展点：按路由选择 endpoint，模型名换成该 endpoint 的。"""
+        messages = list(messages)
+        return RoutedStream(
+            self.router,
+            lambda ep: create_chat_stream(ep.client, {**model_settings, "model": ep.settings.model}, messages, **kwargs),
+        )
+
+    def close(self) -> None:
+        self.router.close()
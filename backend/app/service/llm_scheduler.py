@@ -0,0 +1,509 @@
+"""
+LLM 请求的限流与公平调度：RDAS 发请求前按 (url, model) 排队取令牌。
+
+几十个 agent 同时跑时，各自直接调用 chat.completions.create，很快触发 provider 的限流，
+429 风暴加上 SDK 的退避重试，比排队浪费的时间还多。LLMScheduler 在进程内（跨线程共享）：
+- 每个 (url, model) 一条通道，两只令牌桶：rpm（每分钟请求数）与 tpm（每分钟 token 数）；
+  请求的 token 数按消息字符数预估（含预留的输出），结束后按实际用量（usage 或输出字符数）多退少补；
+- 通道内排队按 (priority, 虚拟开始时间) 出队：priority 小者优先（交互会话 PRIORITY_INTERACTIVE
+  在批处理 PRIORITY_BATCH 之前）；同一优先级内按 agent 做开始时间公平排队（SFQ），
+  一个 agent 一次压入大量请求也不会饿死其他 agent；
+- 收到 429 时通道暂停 retry-after 秒（backoff），不再让排队的请求继续撞限流；
+- metrics() 给出各通道与各优先级的排队等待时间（次数、总/平均/最大、p50/p99）。
+
+未配置限额的通道不排队（仍记录等待时间为 0，并响应 backoff）。
+priority 与 agent 经 scheduling() 上下文传入（chat.continue_chat 已按 agent 设置），无需改动调用链。
+"""
+import heapq
+import json
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from openai import RateLimitError
+
+from backend.app.service.chat_request import create_chat_stream
+from backend.infra.streambuffer.compact_message import CompactMessage
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# 预估 token 数：中英文混合按每 2 个字符 1 个 token 计（中文约 1~1.5 字/token，英文约 4 字符/token）
+CHARS_PER_TOKEN = 2
+# JSON schema 基本是 ASCII
+TOOLS_BYTES_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+# 未指定 max_tokens 时为输出预留的 token 数，结束后按实际用量退还
+DEFAULT_COMPLETION_TOKENS = 1024
+DEFAULT_BACKOFF = 1.0
+_WAIT_SAMPLES = 1000
+
+_schedule: ContextVar[Tuple[int, Optional[str]]] = ContextVar("llm_schedule", default=(PRIORITY_INTERACTIVE, None))
+
+
+def _normalize_url(url: str) -> str:
+    # OpenAI 客户端的 base_url 带结尾的 "/"，配置里通常不带
+    return str(url).rstrip("/")
+
+
+class RateLimitTimeout(TimeoutError):
+    """排队超过 timeout 仍未取得令牌。"""
+
+
+@contextmanager
+def scheduling(priority: int = PRIORITY_INTERACTIVE, agent_id: Optional[str] = None):
+    """在此上下文中（当前线程 / 协程）发出的 LLM 请求按给定优先级与 agent 排队。"""
+    token = _schedule.set((priority, agent_id))
+    try:
+        yield
+    finally:
+        _schedule.reset(token)
+
+
+def _text_chars(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        # 多模态 content：[{"type": "text", "text": ...}, ...]
+        return sum(_text_chars(part.get("text") if isinstance(part, dict) else part) for part in value)
+    return len(str(value))
+
+
+def estimate_tokens(messages: Iterable[Any], tools_json: Optional[bytes] = None, max_tokens: Optional[int] = None) -> int:
+    """请求的 token 预估：输入（消息 + tools）+ 输出预留。只看长度，不做编码。"""
+    chars = 0
+    count = 0
+    for message in messages:
+        count += 1
+        chars += _text_chars(message.get("content"))
+        chars += _text_chars(message.get("reasoning_content"))
+        # CompactMessage 的 tool_calls 存为紧凑 JSON 字符串，直接取长度，不还原
+        tool_calls = getattr(message, "tool_calls", None) if isinstance(message, CompactMessage) \
+            else message.get("tool_calls")
+        if isinstance(tool_calls, str):
+            chars += len(tool_calls)
+        elif tool_calls:
+            chars += len(json.dumps(tool_calls, ensure_ascii=False, separators=(",", ":"), default=str))
+    tokens = chars // CHARS_PER_TOKEN + count * MESSAGE_OVERHEAD_TOKENS
+    if tools_json:
+        tokens += len(tools_json) // TOOLS_BYTES_PER_TOKEN
+    return tokens + (max_tokens if max_tokens is not None else DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: Optional[float] = None, now: float = 0.0):
+        """
+        :param per_minute: 每分钟补充的令牌数
+        :param burst: 桶容量（允许的突发量），默认等于 per_minute
+        """
+        if per_minute <= 0:
+            raise ValueError("per_minute 必须为正数")
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, n: float, now: float) -> float:
+        """还需等待多少秒才有 n 个令牌；n 超过容量时按容量计（桶满即放行，之后欠账）。"""
+        self._refill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= n
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正：delta > 0 为多用（可透支），< 0 为退还。"""
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class _WaitStats:
+    def __init__(self):
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def record(self, wait: float, contended: bool) -> None:
+        self.acquired += 1
+        if contended:
+            self.waited += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        self._recent.append(wait)
+
+    def _percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "total_wait": self.total_wait,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+            "p50_wait": self._percentile(0.5),
+            "p99_wait": self._percentile(0.99),
+        }
+
+
+class _Waiter:
+    __slots__ = ("priority", "start", "seq", "tokens", "agent_id")
+
+    def __init__(self, priority: int, start: float, seq: int, tokens: int, agent_id: Optional[str]):
+        self.priority = priority
+        self.start = start
+        self.seq = seq
+        self.tokens = tokens
+        self.agent_id = agent_id
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.start, self.seq) < (other.priority, other.start, other.seq)
+
+
+class _Lane:
+    def __init__(self, rpm: Optional[TokenBucket], tpm: Optional[TokenBucket]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.queue: List[_Waiter] = []
+        # SFQ 虚拟时间：最近出队请求的开始标签；agent -> 其上一个请求的结束标签
+        self.vtime = 0.0
+        self.finish: Dict[Optional[str], float] = {}
+        self.blocked_until = 0.0
+        self.stats = _WaitStats()
+
+    @property
+    def limited(self) -> bool:
+        return self.rpm is not None or self.tpm is not None
+
+    def delay(self, tokens: int, now: float) -> float:
+        delay = max(0.0, self.blocked_until - now)
+        if self.rpm is not None:
+            delay = max(delay, self.rpm.delay(1, now))
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.delay(tokens, now))
+        return delay
+
+    def take(self, waiter: _Waiter, now: float) -> None:
+        if self.rpm is not None:
+            self.rpm.take(1, now)
+        if self.tpm is not None:
+            self.tpm.take(waiter.tokens, now)
+        self.vtime = max(self.vtime, waiter.start)
+        if len(self.finish) > 256:
+            # 已落后于虚拟时间的 agent 不影响排序，清理掉
+            self.finish = {k: v for k, v in self.finish.items() if v > self.vtime}
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        limits: Optional[Iterable[Dict[str, Any]]] = None,
+        default_rpm: Optional[float] = None,
+        default_tpm: Optional[float] = None,
+        timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param limits: [{url, model, rpm, tpm, rpm_burst, tpm_burst}, ...]；model 缺省表示该 url 下所有模型
+        :param default_rpm / default_tpm: 未单独配置的通道使用的限额，None 不限
+        :param timeout: 排队等待上限（秒），超时抛 RateLimitTimeout；None 一直等
+        """
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.timeout = timeout
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._limits: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+        self._priority_stats: Dict[int, _WaitStats] = {}
+        self._seq = itertools.count()
+        for limit in limits or ():
+            self.set_limit(**limit)
+
+    @classmethod
+    def from_config(cls, **kwargs) -> "LLMScheduler":
+        """按 settings.yaml 的 rate_limits 构建。"""
+        from backend import config
+
+        return cls(limits=config.RATE_LIMITS, **kwargs)
+
+    def set_limit(
+        self,
+        url: str,
+        model: Optional[str] = None,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        rpm_burst: Optional[float] = None,
+        tpm_burst: Optional[float] = None,
+    ) -> None:
+        """设置 (url, model) 的限额；已存在的通道按新限额重建令牌桶。"""
+        url = _normalize_url(url)
+        with self._cond:
+            self._limits[(url, model)] = {"rpm": rpm, "tpm": tpm, "rpm_burst": rpm_burst, "tpm_burst": tpm_burst}
+            for (lane_url, lane_model), lane in self._lanes.items():
+                if lane_url == url and (model is None or model == lane_model):
+                    lane.rpm, lane.tpm = self._buckets(lane_url, lane_model)
+            self._cond.notify_all()
+
+    def _buckets(self, url: str, model: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        limit = self._limits.get((url, model)) or self._limits.get((url, None))
+        if limit is None:
+            limit = {"rpm": self.default_rpm, "tpm": self.default_tpm}
+        now = self._clock()
+        rpm = TokenBucket(limit["rpm"], limit.get("rpm_burst"), now) if limit.get("rpm") else None
+        tpm = TokenBucket(limit["tpm"], limit.get("tpm_burst"), now) if limit.get("tpm") else None
+        return rpm, tpm
+
+    def _lane(self, url: str, model: str) -> _Lane:
+        url = _normalize_url(url)
+        lane = self._lanes.get((url, model))
+        if lane is None:
+            lane = self._lanes[(url, model)] = _Lane(*self._buckets(url, model))
+        return lane
+
+    def acquire(
+        self,
+        url: str,
+        model: str,
+        tokens: int,
+        priority: Optional[int] = None,
+        agent_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> float:
+        """
+        排队直到 (url, model) 通道放行，返回等待秒数。
+        priority / agent_id 缺省时取 scheduling() 上下文中的值。
+        """
+        context_priority, context_agent = _schedule.get()
+        priority = context_priority if priority is None else priority
+        agent_id = context_agent if agent_id is None else agent_id
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        with self._cond:
+            lane = self._lane(url, model)
+            if not lane.limited and not lane.queue and lane.blocked_until <= self._clock():
+                self._record(lane, priority, 0.0, False)
+                return 0.0
+            tag = max(lane.vtime, lane.finish.get(agent_id, 0.0))
+            lane.finish[agent_id] = tag + max(tokens, 1)
+            waiter = _Waiter(priority, tag, next(self._seq), tokens, agent_id)
+            heapq.heappush(lane.queue, waiter)
+            # 新来的请求可能排到队首：唤醒原队首重新计算
+            self._cond.notify_all()
+            contended = False
+            try:
+                while True:
+                    now = self._clock()
+                    if lane.queue[0] is waiter:
+                        delay = lane.delay(tokens, now)
+                        if delay <= 0:
+                            heapq.heappop(lane.queue)
+                            lane.take(waiter, now)
+                            self._cond.notify_all()
+                            break
+                    else:
+                        delay = None
+                    contended = True
+                    if timeout is not None:
+                        remaining = timeout - (time.perf_counter() - start)
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f"{model}@{url} 排队超过 {timeout} 秒")
+                        delay = remaining if delay is None else min(delay, remaining)
+                    self._cond.wait(delay)
+            except BaseException:
+                if waiter in lane.queue:
+                    lane.queue.remove(waiter)
+                    heapq.heapify(lane.queue)
+                    self._cond.notify_all()
+                raise
+            wait = time.perf_counter() - start
+            self._record(lane, priority, wait, contended)
+            return wait
+
+    def _record(self, lane: _Lane, priority: int, wait: float, contended: bool) -> None:
+        lane.stats.record(wait, contended)
+        stats = self._priority_stats.get(priority)
+        if stats is None:
+            stats = self._priority_stats[priority] = _WaitStats()
+        stats.record(wait, contended)
+
+    def adjust(self, url: str, model: str, delta: int) -> None:
+        """请求结束后按实际 token 用量修正 tpm 桶：delta = 实际 - 预估。"""
+        if not delta:
+            return
+        with self._cond:
+            lane = self._lane(url, model)
+            if lane.tpm is not None:
+                lane.tpm.adjust(delta)
+                if delta < 0:
+                    self._cond.notify_all()
+
+    def backoff(self, url: str, model: str, seconds: float = DEFAULT_BACKOFF) -> None:
+        """收到 429：通道暂停 seconds 秒。"""
+        with self._cond:
+            lane = self._lane(url, model)
+            lane.blocked_until = max(lane.blocked_until, self._clock() + seconds)
+            if lane.rpm is not None:
+                lane.rpm.tokens = min(lane.rpm.tokens, 0.0)
+
+    def queued(self, url: str, model: str) -> int:
+        with self._cond:
+            lane = self._lanes.get((_normalize_url(url), model))
+            return len(lane.queue) if lane is not None else 0
+
+    def metrics(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """各通道（model@url）与各优先级的排队等待统计，通道另含当前排队数。"""
+        with self._cond:
+            lanes = {
+                f"{model}@{url}": {**lane.stats.as_dict(), "queued": len(lane.queue)}
+                for (url, model), lane in self._lanes.items()
+            }
+            priorities = {str(p): stats.as_dict() for p, stats in sorted(self._priority_stats.items())}
+        return {"lanes": lanes, "priorities": priorities}
+
+
+def _retry_after(error: RateLimitError) -> float:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_BACKOFF
+    return seconds if math.isfinite(seconds) and seconds > 0 else DEFAULT_BACKOFF
+
+
+class _MeteredStream:
+    """统计输出长度（或读取 usage），读完或 close() 时向调度器修正 tpm 用量（只修正一次）。"""
+
+    def __init__(self, stream, scheduler: LLMScheduler, url: str, model: str, prompt_tokens: int, reserved: int):
+        self._stream = stream
+        self._scheduler = scheduler
+        self._url = url
+        self._model = model
+        self._prompt_tokens = prompt_tokens
+        self._reserved = reserved
+        self._chars = 0
+        self._usage: Optional[int] = None
+        self._settled = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                if getattr(chunk, "usage", None) is not None:
+                    self._usage = chunk.usage.total_tokens
+                for choice in chunk.choices or ():
+                    delta = choice.delta
+                    if delta is None:
+                        continue
+                    self._chars += _text_chars(delta.content) + _text_chars(getattr(delta, "reasoning_content", None))
+                    for call in delta.tool_calls or ():
+                        if call.function is not None:
+                            self._chars += _text_chars(call.function.arguments)
+                yield chunk
+        finally:
+            self._settle()
+
+    def _settle(self) -> None:
+        if not self._settled:
+            self._settled = True
+            actual = self._usage if self._usage is not None else self._prompt_tokens + self._chars // CHARS_PER_TOKEN
+            self._scheduler.adjust(self._url, self._model, actual - self._reserved)
+
+    def close(self) -> None:
+        # 未迭代（或未读完）就关闭时生成器的 finally 不会执行，在这里按已读到的部分修正
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._settle()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _Completions:
+    def __init__(self, client: "ScheduledClient"):
+        self._client = client
+
+    def create(self, *, model: str, messages, stream: bool = False, **kwargs):
+        client = self._client
+        messages = list(messages)
+        return client._schedule(
+            model, messages, kwargs.get("max_tokens"), None,
+            lambda: client.client.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs),
+            stream,
+        )
+
+
+class _Chat:
+    def __init__(self, client: "ScheduledClient"):
+        self.completions = _Completions(client)
+
+
+class ScheduledClient:
+    """包装 OpenAI 客户端：每次请求先经 LLMScheduler 按 (url, model) 取令牌。"""
+
+    def __init__(self, client, scheduler: LLMScheduler, url: Optional[str] = None):
+        self.client = client
+        self.scheduler = scheduler
+        self.url = _normalize_url(url if url is not None else getattr(client, "base_url", ""))
+        self.chat = _Chat(self)
+
+    def create_chat_stream(self, model_settings: Dict[str, Any], messages, **kwargs):
+        """chat_request.create_chat_stream 的扩展点：取令牌后交给底层客户端。"""
+        messages = list(messages)
+        return self._schedule(
+            model_settings["model"], messages, kwargs.get("max_tokens"), model_settings.get("tools_json"),
+            lambda: create_chat_stream(self.client, model_settings, messages, **kwargs),
+            True,
+        )
+
+    def _schedule(self, model: str, messages: List[Any], max_tokens, tools_json, send, stream: bool):
+        reserved = estimate_tokens(messages, tools_json, max_tokens)
+        self.scheduler.acquire(self.url, model, reserved)
+        try:
+            response = send()
+        except BaseException as e:
+            # 请求没有发出或被拒绝：退还全部预留，429 时通道另外暂停
+            if isinstance(e, RateLimitError):
+                self.scheduler.backoff(self.url, model, _retry_after(e))
+            self.scheduler.adjust(self.url, model, -reserved)
+            raise
+        if not stream:
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self.scheduler.adjust(self.url, model, usage.total_tokens - reserved)
+            return response
+        prompt_tokens = reserved - (max_tokens if max_tokens is not None else DEFAULT_COMPLETION_TOKENS)
+        return _MeteredStream(response, self.scheduler, self.url, model, prompt_tokens, reserved)
+
+    def close(self) -> None:
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+llm_scheduler = LLMScheduler.from_config()
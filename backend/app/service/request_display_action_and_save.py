@@ -1,21 +1,12 @@
-import json
-from pathlib import Path
+import threading
 from typing import Callable, Optional
 
-from backend.config import DOCUMENT_ROOT
-from backend.infra.function_calling.context import ToolContext
 from backend.app.global_resource import stream_buffer
-
-
-def _tool_result_to_plain_text(value) -> str:
-    """将 function calling 的返回值或错误统一转为纯文本，供模型观察。"""
-    if value is None:
-        return ""
-    if isinstance(value, str):
-        return value
-    if isinstance(value, (dict, list)):
-        return json.dumps(value, ensure_ascii=False, indent=2)
-    return str(value)
+from backend.app.service.chat_request import create_chat_stream
+from backend.app.service.checkpoint import PHASE_DONE, PHASE_STREAM, PHASE_TOOLS
+from backend.app.service.coalescing_emitter import CoalescingEmitter
+from backend.app.service.speculative_tools import SpeculativeTools
+from backend.app.service.tool_execution import ToolEnvironment, execute_tool_calls
 
 
 def request_display_action_and_save(
@@ -24,6 +15,10 @@ def request_display_action_and_save(
     model_settings,  # 模型设置
     token: Callable[[str], None],
     agent_context: Optional[dict] = None,  # workspace_root, allowed_tools, agent_id, skills_provider 等
+    token_coalesce=None,  # token 合并配置：None 默认阈值，False 关闭，dict 见 CoalescingEmitter.from_config
+    cancel: Optional[threading.Event] = None,  # 置位后中止本轮：停止读流、不执行工具
+    checkpoint_store=None,  # 支持检查点的消息存储（如 MessageDB）：记录本轮进度，供 resume 使用
+    speculative_tools: bool = False,  # 只读工具的参数一完整即在后台提前执行（见 speculative_tools.py）
     **kwargs
 ):
     """
@@ -40,138 +35,113 @@ def request_display_action_and_save(
         ::param client: 模型客户端
         ::param session_id: 对话历史文件路径
         ::param model_settings: 模型设置
+        ::param token: UI 回调；经 CoalescingEmitter 合并后调用，每次收到的是一批 delta
+        ::param token_coalesce: token 合并配置
+        ::param cancel: 取消信号（如 HTTP 客户端断开）；已收到的内容照常保存，返回 True 以结束外层循环
+        ::param checkpoint_store: 每个阶段（请求模型 / 执行工具 / 完成）及每个工具调用的开始与完成写入检查点，
+            进程中途退出后可由 checkpoint.resume_session 继续；None 不记录
+        ::param speculative_tools: 模型仍在输出时提前执行参数已完整的只读工具，结果在流结束后按顺序写入
         ::param kwargs: 其他参数, 必须符合client的参数要求
     """
-    # 0. 初始化
+    # 0. 初始化（检查点先于占位消息写入：中断后 resume 删除其后的所有行）
+    if checkpoint_store is not None:
+        checkpoint_store.set_checkpoint(session_id, PHASE_STREAM)
     assistant_message = stream_buffer.start_stream(session_id)
     messages = stream_buffer.recall(session_id)
-    # 1. 请求模型进行思考和工具请求 Request
-    stream = client.chat.completions.create(
-        model=model_settings["model"],
-        messages=messages,
-        tools=model_settings["tools"],
-        stream=True,
-        **kwargs
-    )
-    # 2. 收集思考、工具请求、内容，并展示 Display
+    # 1. 请求模型进行思考和工具请求 Request（内存中的紧凑消息在此处才展开；tools 复用预编码的 JSON）
+    stream = create_chat_stream(client, model_settings, messages, **kwargs)
+    # 2. 收集思考、工具请求、内容，并展示 Display（<think> 加框与批量输出由 emitter 负责）
+    emitter = CoalescingEmitter.from_config(token, token_coalesce)
     tool_calls_collector = {}
     reasoning_content = ""
     content = ""
-    think_flag = 0
-    for chunk in stream:
-        delta = chunk.choices[0].delta
-        if not delta:
-            continue
-        # 接收思考内容
-        if delta.reasoning_content:
-            reasoning_content += delta.reasoning_content
-            stream_buffer.append_reasoning(
-                session_id,
-                delta.reasoning_content
-                )
-            if think_flag==0:
-                token("<think>"+delta.reasoning_content)
-                think_flag=1
-            elif think_flag==1:
-                token(delta.reasoning_content)
+    cancelled = False
+    env = ToolEnvironment(session_id, model_settings, agent_context)
+    speculation = SpeculativeTools(env) if speculative_tools else None
+    try:
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                # 关闭底层 HTTP 响应，不再继续消耗模型输出
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+                break
+            delta = chunk.choices[0].delta
+            if not delta:
+                continue
+            # 接收思考内容
+            if delta.reasoning_content:
+                reasoning_content += delta.reasoning_content
+                stream_buffer.append_reasoning(
+                    session_id,
+                    delta.reasoning_content
+                    )
+                emitter.reasoning(delta.reasoning_content)
 
-        # 接收工具请求
-        if delta.tool_calls:
-            if think_flag==1:
-                token("</think>\n")
-                think_flag=-1
-            for tc_delta in delta.tool_calls:
-                index = tc_delta.index
-                if index not in tool_calls_collector:
-                    tool_calls_collector[index] = {
-                        "id": tc_delta.id,
-                        "type": "function",
-                        "function": {"name": tc_delta.function.name or "", "arguments": ""}
-                    }
-                if tc_delta.function.arguments:
-                    tool_calls_collector[index]["function"]["arguments"] += tc_delta.function.arguments
-        # 接收正文内容
-        if delta.content:
-            if think_flag == 1:
-                token("</think>\n")
-                think_flag = -1
-            content += delta.content
-            stream_buffer.append_content(
-                session_id,
-                delta.content
-                )
-            token(delta.content)
+            # 接收工具请求
+            if delta.tool_calls:
+                emitter.tool_calls()
+                for tc_delta in delta.tool_calls:
+                    index = tc_delta.index
+                    if index not in tool_calls_collector:
+                        tool_calls_collector[index] = {
+                            "id": tc_delta.id,
+                            "type": "function",
+                            "function": {"name": tc_delta.function.name or "", "arguments": ""}
+                        }
+                    if tc_delta.function.arguments:
+                        tool_calls_collector[index]["function"]["arguments"] += tc_delta.function.arguments
+                    if speculation is not None:
+                        speculation.feed(index, tool_calls_collector[index], tc_delta.function.arguments)
+            # 接收正文内容
+            if delta.content:
+                content += delta.content
+                stream_buffer.append_content(
+                    session_id,
+                    delta.content
+                    )
+                emitter.content(delta.content)
+    except BaseException:
+        # 流出错或被中断（网络错误、endpoint 全部失败、进程退出等）：推测中的工具不再执行，
+        # 已缓冲的输出送出并停止合并线程，关闭底层 HTTP 响应
+        if speculation is not None:
+            speculation.discard_all()
+        emitter.close()
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+        raise
+    finally:
+        emitter.flush()
     # 将思考、工具请求、内容，写入对话历史
-    final_tool_calls = [
-        tool_calls_collector[i]
-        for i in sorted(tool_calls_collector.keys())
-        ]
+    # 取消时丢弃（可能不完整的）工具请求：没有对应 tool 消息的 tool_calls 会让下一轮请求被拒绝
+    final_indices = [] if cancelled else sorted(tool_calls_collector.keys())
+    final_tool_calls = [tool_calls_collector[i] for i in final_indices]
+    if cancelled and speculation is not None:
+        speculation.discard_all()
 
     stream_buffer.end_stream(
         session_id,
         tool_calls=final_tool_calls if final_tool_calls else None
         )
 
-    # 构造要存入 json 的 message
+    if checkpoint_store is not None:
+        if final_tool_calls:
+            checkpoint_store.set_checkpoint(session_id, PHASE_TOOLS, tool_calls=final_tool_calls)
+        else:
+            checkpoint_store.set_checkpoint(session_id, PHASE_DONE)
+
     if len(final_tool_calls) > 0:
         is_final_answer = False
-        # 3. 执行工具 Action and Observe（带上下文与权限）
-        tool_registry = model_settings.get("tool_registry", {})
-        allowed_tools = None
-        if agent_context:
-            allowed_tools = agent_context.get("allowed_tools")
-            if allowed_tools is not None:
-                allowed_tools = set(allowed_tools)
-        if allowed_tools is None:
-            allowed_tools = set(tool_registry.keys())
-
-        workspace_root = None
-        if agent_context and agent_context.get("workspace_root") is not None:
-            workspace_root = Path(agent_context["workspace_root"])
-        if workspace_root is None:
-            workspace_root = Path(DOCUMENT_ROOT)
-
-        ctx = ToolContext(
-            workspace_root=workspace_root,
-            agent_id=agent_context.get("agent_id", "") if agent_context else "",
-            session_id=session_id,
-            skills_provider=agent_context.get("skills_provider") if agent_context else None,
-        )
-
-        for tool_call in tool_calls_collector.values():
-            tool_name = tool_call["function"]["name"]
-            raw_args = tool_call["function"]["arguments"]
-
-            try:
-                args = json.loads(raw_args) if raw_args else {}
-            except json.JSONDecodeError as e:
-                tool_result = f"[tool args parse error] {str(e)}"
-            else:
-                if tool_name not in allowed_tools:
-                    tool_result = f"[Permission denied: tool '{tool_name}' is not allowed for this agent.]"
-                else:
-                    tool_fn = tool_registry.get(tool_name)
-                    if tool_fn is None:
-                        tool_result = f"[unknown tool] {tool_name}"
-                    else:
-                        try:
-                            tool_result = tool_fn(ctx, **args)
-                        except PermissionError as e:
-                            tool_result = f"[Permission denied] {e}"
-                        except Exception as e:
-                            tool_result = f"[tool execution error] {str(e)}"
-            tool_result = _tool_result_to_plain_text(tool_result)
-            new_message = {
-                "role": "tool",
-                "content": tool_result,
-                "tool_call_id": tool_call["id"],
-            }
-            token(tool_result)
-            stream_buffer.append_message(
-                session_id,new_message
-                )
-            #print(db.load_messages(session_id)[-1])
+        # 3. 执行工具 Action and Observe（带上下文与权限），结果写入上下文；已推测执行的直接取结果，
+        # 连续的只读调用重叠执行
+        results = None
+        if speculation is not None:
+            results = [speculation.take(index, tool_call) for index, tool_call in zip(final_indices, final_tool_calls)]
+        execute_tool_calls(stream_buffer, session_id, final_tool_calls, env, emitter.write, checkpoint_store, results)
     else:
         is_final_answer=True
-    token("\n")
+    emitter.write("\n")
+    emitter.close()
     return is_final_answer
\ No newline at end of file
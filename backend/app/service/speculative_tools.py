@@ -0,0 +1,181 @@
+"""
+推测执行工具调用：模型还在输出时，参数已完整的只读工具提前开始执行。
+
+RDAS 要等整个流结束才执行工具；模型先发出工具调用、随后继续输出文本或更多调用时，前面的工具一直空等。
+开启推测执行（agent 配置 speculative_tools: true）后：
+- 每个工具调用的参数片段送入 JsonObjectScanner，只跟踪括号深度与字符串 / 转义状态，O(片段长度)；
+- 参数对象闭合、且工具注册为 read_only 时，立即在后台线程执行；结果先缓存，流结束后按原顺序写入上下文；
+- 闭合后该调用又收到非空白的参数片段（参数变了），推测作废；流结束时名称或参数与推测时不一致的同样作废，
+  照常重新执行。只读工具的作废结果没有副作用，直接丢弃；过长结果只在被采用时才转存为 artifact。
+"""
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from backend.app.service.tool_execution import ToolEnvironment
+from backend.infra.function_calling import tool_manager
+
+# 推测执行的后台线程数（只读工具多为文件 / 检索 IO）
+SPECULATIVE_WORKERS = 4
+
+
+class JsonObjectScanner:
+    """增量判断工具参数是否已是一个完整的 JSON 对象（不构建对象，闭合后再 json.loads 校验一次）。"""
+
+    __slots__ = ("depth", "in_string", "escape", "complete", "invalid")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+        # 不是以对象开头，或闭合后又出现了非空白内容
+        self.invalid = False
+
+    def feed(self, text: str) -> bool:
+        """送入一个参数片段，返回参数对象此刻是否完整。"""
+        if self.invalid:
+            return False
+        for ch in text:
+            if self.complete:
+                if not ch.isspace():
+                    self.complete = False
+                    self.invalid = True
+                    return False
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                elif not ch.isspace():
+                    self.invalid = True
+                    return False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+
+class _Speculation:
+    __slots__ = ("scanner", "name", "arguments", "future", "discarded")
+
+    def __init__(self):
+        self.scanner = JsonObjectScanner()
+        self.name: Optional[str] = None
+        self.arguments: Optional[str] = None
+        self.future: Optional[Future] = None
+        self.discarded = False
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative-tool")
+        return _executor
+
+
+class SpeculativeTools:
+    """一轮 RDAS 内的推测执行状态：按工具调用的 index 跟踪参数与后台结果。"""
+
+    def __init__(
+        self,
+        env: ToolEnvironment,
+        is_read_only: Optional[Callable[[str], bool]] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        """
+        :param is_read_only: 判断工具能否推测执行，缺省按 tool_manager 的 read_only 注册标记
+        :param executor: 执行推测调用的线程池，缺省为模块共享的线程池
+        """
+        self.env = env
+        self.is_read_only = is_read_only or tool_manager.is_read_only
+        self._executor = executor
+        self._calls: Dict[int, _Speculation] = {}
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    def feed(self, index: int, tool_call: Dict, fragment: Optional[str]) -> None:
+        """
+        收到 index 号工具调用的一个 delta 后调用。
+        :param tool_call: RDAS 累积中的调用（function.name / function.arguments 为当前值）
+        :param fragment: 本次 delta 的参数片段
+        """
+        spec = self._calls.get(index)
+        if spec is None:
+            spec = self._calls[index] = _Speculation()
+        if spec.discarded:
+            return
+        complete = spec.scanner.feed(fragment or "")
+        if spec.future is not None:
+            if not complete:
+                self._discard(spec)
+            return
+        if not complete:
+            return
+        name = tool_call["function"]["name"]
+        arguments = tool_call["function"]["arguments"]
+        if not self._eligible(name, arguments):
+            spec.discarded = True
+            return
+        spec.name = name
+        spec.arguments = arguments
+        executor = self._executor or _default_executor()
+        # 过长结果的 artifact 转存推迟到 take()：作废的推测不留下无人引用的 artifact
+        spec.future = executor.submit(self.env.run, {"id": tool_call.get("id"), "function": {
+            "name": name, "arguments": arguments,
+        }}, spill=False)
+        self.started += 1
+
+    def _eligible(self, name: str, arguments: str) -> bool:
+        if not name or not self.is_read_only(name) or name not in self.env.allowed_tools:
+            return False
+        if name not in self.env.tool_registry:
+            return False
+        try:
+            return isinstance(json.loads(arguments), dict)
+        except json.JSONDecodeError:
+            return False
+
+    def _discard(self, spec: _Speculation) -> None:
+        spec.discarded = True
+        if spec.future is not None:
+            spec.future.cancel()
+            self.discarded += 1
+
+    def take(self, index: int, tool_call: Dict) -> Optional[str]:
+        """流结束后取 index 号调用的推测结果（等待其完成）；没有推测、已作废或调用已变化时返回 None。"""
+        spec = self._calls.pop(index, None)
+        if spec is None or spec.future is None or spec.discarded:
+            return None
+        function = tool_call["function"]
+        if function["name"] != spec.name or function["arguments"].strip() != spec.arguments.strip():
+            self._discard(spec)
+            return None
+        result = self.env.spill(spec.name, spec.future.result())
+        self.used += 1
+        return result
+
+    def discard_all(self) -> None:
+        """本轮取消或出错时调用：尚未开始的推测不再执行，已完成的结果丢弃。"""
+        for spec in self._calls.values():
+            if spec.future is not None and not spec.discarded:
+                self._discard(spec)
+        self._calls.clear()
@@ -0,0 +1,233 @@
+"""
+工具调用的执行：RDAS 每轮执行模型请求的工具，resume 补执行中断的工具，共用这里的权限检查、参数解析与结果持久化。
+"""
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from backend.app.service.tool_executor import ToolExecutor, ToolTimeout, tool_executor
+from backend.app.service.tool_results import READ_ARTIFACT, ToolResultPolicy, tool_result_policy
+from backend.config import DOCUMENT_ROOT
+from backend.infra.function_calling.context import ToolContext
+
+
+def _tool_result_to_plain_text(value) -> str:
+    """将 function calling 的返回值或错误统一转为纯文本，供模型观察。"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, indent=2)
+    return str(value)
+
+
+def _tool_error_to_plain_text(error: Exception) -> str:
+    if isinstance(error, PermissionError):
+        return f"[Permission denied] {error}"
+    if isinstance(error, ToolTimeout):
+        return f"[tool timeout] {error}"
+    return f"[tool execution error] {str(error)}"
+
+
+class ToolEnvironment:
+    """一轮工具执行的上下文：可执行函数、允许的工具与 ToolContext。"""
+
+    def __init__(
+        self,
+        session_id: str,
+        model_settings: Dict,
+        agent_context: Optional[dict] = None,
+        result_policy: Optional[ToolResultPolicy] = None,
+        executor: Optional[ToolExecutor] = None,
+    ):
+        """
+        :param result_policy: 过长结果的转存策略，缺省为模块共享的 tool_result_policy；
+            仅当 agent 可以使用 read_artifact 时生效
+        :param executor: 工具执行器（协程工具、超时、并发），缺省为模块共享的 tool_executor
+        """
+        self.executor = executor or tool_executor
+        self.session_id = session_id
+        self.tool_registry: Dict[str, Callable] = model_settings.get("tool_registry", {})
+        allowed_tools: Optional[Set[str]] = None
+        if agent_context:
+            allowed_tools = agent_context.get("allowed_tools")
+            if allowed_tools is not None:
+                allowed_tools = set(allowed_tools)
+        if allowed_tools is None:
+            allowed_tools = set(self.tool_registry.keys())
+        self.allowed_tools = allowed_tools
+
+        policy = result_policy or tool_result_policy
+        self.result_policy: Optional[ToolResultPolicy] = None
+        if READ_ARTIFACT in allowed_tools and READ_ARTIFACT in self.tool_registry:
+            self.result_policy = policy
+
+        workspace_root = None
+        if agent_context and agent_context.get("workspace_root") is not None:
+            workspace_root = Path(agent_context["workspace_root"])
+        if workspace_root is None:
+            workspace_root = Path(DOCUMENT_ROOT)
+
+        self.ctx = ToolContext(
+            workspace_root=workspace_root,
+            agent_id=agent_context.get("agent_id", "") if agent_context else "",
+            session_id=session_id,
+            skills_provider=agent_context.get("skills_provider") if agent_context else None,
+            artifact_store=policy.store,
+        )
+
+    def _prepare(self, tool_call: Dict) -> Union[str, Tuple[str, Callable, Dict]]:
+        """解析参数并检查权限：可以执行时返回 (工具名, 函数, 参数)，否则返回供模型观察的错误文本。"""
+        tool_name = tool_call["function"]["name"]
+        raw_args = tool_call["function"]["arguments"]
+        try:
+            args = json.loads(raw_args) if raw_args else {}
+        except json.JSONDecodeError as e:
+            return f"[tool args parse error] {str(e)}"
+        if tool_name not in self.allowed_tools:
+            return f"[Permission denied: tool '{tool_name}' is not allowed for this agent.]"
+        tool_fn = self.tool_registry.get(tool_name)
+        if tool_fn is None:
+            return f"[unknown tool] {tool_name}"
+        return tool_name, tool_fn, args
+
+    def _finish(self, tool_name: str, value, spill: bool = True) -> str:
+        text = _tool_result_to_plain_text(value)
+        return self.spill(tool_name, text) if spill else text
+
+    def spill(self, tool_name: str, text: str) -> str:
+        """过长的结果转存为 artifact 并返回预览；未启用转存或 read_artifact 自身的结果原样返回。"""
+        if self.result_policy is not None and tool_name != READ_ARTIFACT:
+            text = self.result_policy.apply(self.session_id, text)
+        return text
+
+    def run(self, tool_call: Dict, spill: bool = True) -> str:
+        """
+        执行单个工具调用，返回供模型观察的纯文本（错误也以文本返回）。
+        spill=False 时过长的结果不转存（推测执行：结果被采用时再经 spill() 转存，作废的不留 artifact）。
+        """
+        prepared = self._prepare(tool_call)
+        if isinstance(prepared, str):
+            return prepared
+        tool_name, tool_fn, args = prepared
+        try:
+            value = self.executor.call(tool_name, tool_fn, self.ctx, args)
+        except Exception as e:
+            value = _tool_error_to_plain_text(e)
+        return self._finish(tool_name, value, spill)
+
+    def start(self, tool_call: Dict) -> Callable[[], str]:
+        """开始执行（卸载到执行器）并返回取结果的函数：多个调用先全部 start 再依次取结果即可重叠执行。"""
+        prepared = self._prepare(tool_call)
+        if isinstance(prepared, str):
+            return lambda: prepared
+        tool_name, tool_fn, args = prepared
+        try:
+            future = self.executor.submit(tool_name, tool_fn, self.ctx, args)
+        except Exception as e:
+            error = _tool_error_to_plain_text(e)
+            return lambda: error
+
+        def result() -> str:
+            try:
+                value = self.executor.wait(future, tool_name)
+            except Exception as e:
+                value = _tool_error_to_plain_text(e)
+            return self._finish(tool_name, value)
+
+        return result
+
+    async def arun(self, tool_call: Dict) -> str:
+        """run 的协程版本，供已在事件循环上的调用方使用：同步工具卸载到线程池，不阻塞事件循环。"""
+        prepared = self._prepare(tool_call)
+        if isinstance(prepared, str):
+            return prepared
+        tool_name, tool_fn, args = prepared
+        try:
+            value = await self.executor.acall(tool_name, tool_fn, self.ctx, args)
+        except Exception as e:
+            value = _tool_error_to_plain_text(e)
+        return self._finish(tool_name, value)
+
+    def can_overlap(self, tool_call: Dict) -> bool:
+        """该调用能否与同一步内的其他调用并发执行：只读、能重叠执行（协程、io_bound 或进程池中的 cpu_bound）、且确实会执行。"""
+        tool_name = tool_call["function"]["name"]
+        tool_fn = self.tool_registry.get(tool_name)
+        if tool_fn is None or tool_name not in self.allowed_tools:
+            return False
+        meta = self.executor.metadata_for(tool_name, tool_fn)
+        return meta.read_only and self.executor.overlaps(meta)
+
+
+def record_tool_result(
+    buffer,
+    session_id: str,
+    tool_call: Dict,
+    result: str,
+    write: Callable[[str], None],
+    checkpoint_store=None,
+) -> None:
+    """把工具结果写入上下文并展示；checkpoint_store 非 None 时随后标记该调用已完成。"""
+    write(result)
+    buffer.append_message(session_id, {"role": "tool", "content": result, "tool_call_id": tool_call["id"]})
+    if checkpoint_store is not None:
+        checkpoint_store.mark_tool_call(session_id, tool_call["id"], done=True)
+
+
+def execute_tool_call(
+    buffer,
+    session_id: str,
+    tool_call: Dict,
+    env: ToolEnvironment,
+    write: Callable[[str], None],
+    checkpoint_store=None,
+    result: Optional[str] = None,
+) -> Tuple[Dict, str]:
+    """
+    执行并记录一个工具调用：检查点标记已开始 → 执行 → 写入 tool 消息 → 标记已完成。
+    :param buffer: Stream_Buffer（写入消息并广播）
+    :param checkpoint_store: 支持检查点的消息存储；None 不记录
+    :param result: 已提前得到的结果（推测执行）；None 时在此执行
+    """
+    if checkpoint_store is not None:
+        checkpoint_store.mark_tool_call(session_id, tool_call["id"])
+    if result is None:
+        result = env.run(tool_call)
+    record_tool_result(buffer, session_id, tool_call, result, write, checkpoint_store)
+    return tool_call, result
+
+
+def execute_tool_calls(
+    buffer,
+    session_id: str,
+    tool_calls: List[Dict],
+    env: ToolEnvironment,
+    write: Callable[[str], None],
+    checkpoint_store=None,
+    results: Optional[List[Optional[str]]] = None,
+) -> None:
+    """
+    按顺序执行并记录一步中的全部工具调用。连续的只读调用（见 ToolEnvironment.can_overlap）一起开始、重叠执行，
+    结果仍按原顺序写入；其余调用逐个执行，写操作之间的先后不变。
+    :param results: 与 tool_calls 对应的已知结果（推测执行），None 表示需要执行
+    """
+    if results is None:
+        results = [None] * len(tool_calls)
+    i = 0
+    while i < len(tool_calls):
+        j = i
+        while j < len(tool_calls) and results[j] is None and env.can_overlap(tool_calls[j]):
+            j += 1
+        if j - i < 2:
+            execute_tool_call(buffer, session_id, tool_calls[i], env, write, checkpoint_store, results[i])
+            i += 1
+            continue
+        batch = tool_calls[i:j]
+        if checkpoint_store is not None:
+            for tool_call in batch:
+                checkpoint_store.mark_tool_call(session_id, tool_call["id"])
+        pending = [env.start(tool_call) for tool_call in batch]
+        for tool_call, result in zip(batch, pending):
+            record_tool_result(buffer, session_id, tool_call, result(), write, checkpoint_store)
+        i = j
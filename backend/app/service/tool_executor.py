@@ -0,0 +1,146 @@
+"""
+工具执行器：按 ToolMetadata 决定工具在哪里执行。
+
+- async def 工具：在模块共享的事件循环（后台线程）上执行，多个 IO 协程彼此重叠，不占线程；
+  事件循环上不能做阻塞调用，阻塞的 IO 请写成同步工具并标 io_bound；
+- 同步工具：同步入口 call() 在调用线程直接执行（与原先一致）；需要与其他调用重叠（submit）、设置了 timeout
+  或从事件循环上调用（acall）时，自动卸载到有界线程池；
+- cpu_bound 的同步工具在 worker 进程中执行（见 tool_processes），不占用本进程的 GIL；进程池关闭或函数 / 上下文
+  无法 pickle 时退回本进程：不进 IO 线程池（GIL 下线程并发无益，还会挤占 IO 工具），submit 时在调用线程执行；
+- timeout 到期抛 ToolTimeout：协程被取消；同步函数的线程无法中断，只是不再等待，结果丢弃。
+
+RDAS 在工作线程上同步执行：一步内连续的只读调用先全部 submit 再按顺序等待（见 tool_execution），
+HTTP 服务等已在事件循环上的调用方使用 acall。
+"""
+import asyncio
+import dataclasses
+import functools
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from backend.app.service.tool_processes import ToolNotPicklable, ToolProcessPool, tool_process_pool
+from backend.infra.function_calling import ToolMetadata, tool_manager
+
+# 同步工具卸载用的线程数上限
+TOOL_WORKERS = 8
+
+
+class ToolTimeout(Exception):
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"tool '{name}' did not finish within {timeout}s")
+        self.name = name
+        self.timeout = timeout
+
+
+class ToolExecutor:
+    def __init__(
+        self,
+        max_workers: int = TOOL_WORKERS,
+        metadata: Optional[Callable[[str], ToolMetadata]] = None,
+        processes: Optional[ToolProcessPool] = None,
+    ):
+        """
+        :param max_workers: 同步工具线程池大小
+        :param metadata: 按工具名取 ToolMetadata，缺省为 tool_manager.metadata
+        :param processes: cpu_bound 工具的进程池，缺省为模块共享的 tool_process_pool
+        """
+        self.max_workers = max_workers
+        self._metadata = metadata
+        self._processes = processes
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def metadata_for(self, name: str, fn: Callable) -> ToolMetadata:
+        """工具的调度信息；未注册（如测试直接注入 registry）的协程函数同样按 async 执行。"""
+        meta = (self._metadata or tool_manager.metadata)(name)
+        if not meta.is_async and inspect.iscoroutinefunction(fn):
+            meta = dataclasses.replace(meta, is_async=True)
+        return meta
+
+    @property
+    def processes(self) -> ToolProcessPool:
+        return self._processes or tool_process_pool
+
+    def overlaps(self, meta: ToolMetadata) -> bool:
+        """该工具的调用能否与其他调用重叠执行（不考虑副作用，是否只读由调用方判断）。"""
+        return meta.is_async or meta.io_bound or (meta.cpu_bound and self.processes.enabled)
+
+    def _io_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool-io")
+            return self._pool
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="tool-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, name: str, fn: Callable, ctx, args: Dict[str, Any]) -> Future:
+        """开始执行并立即返回 Future，用 wait() 取结果；多个调用先全部 submit 即可重叠执行。"""
+        meta = self.metadata_for(name, fn)
+        if meta.is_async:
+            return asyncio.run_coroutine_threadsafe(fn(ctx, **args), self._event_loop())
+        if meta.cpu_bound and self.processes.enabled:
+            try:
+                return self.processes.submit(fn, ctx, args)
+            except ToolNotPicklable:
+                pass
+        if meta.cpu_bound and meta.timeout is None:
+            future: Future = Future()
+            try:
+                future.set_result(fn(ctx, **args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._io_pool().submit(fn, ctx, **args)
+
+    def wait(self, future: Future, name: str, timeout: Optional[float] = None) -> Any:
+        """等待 submit 的结果；timeout 缺省取工具注册的超时。"""
+        if timeout is None:
+            timeout = (self._metadata or tool_manager.metadata)(name).timeout
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise ToolTimeout(name, timeout) from None
+
+    def call(self, name: str, fn: Callable, ctx, args: Dict[str, Any]) -> Any:
+        """同步入口：返回工具的原始返回值，工具异常原样抛出，超时抛 ToolTimeout。"""
+        meta = self.metadata_for(name, fn)
+        if not meta.is_async and meta.timeout is None and not (meta.cpu_bound and self.processes.enabled):
+            return fn(ctx, **args)
+        return self.wait(self.submit(name, fn, ctx, args), name, meta.timeout)
+
+    async def acall(self, name: str, fn: Callable, ctx, args: Dict[str, Any]) -> Any:
+        """事件循环上的入口：协程工具直接 await，同步工具卸载到线程池，不阻塞调用方的事件循环。"""
+        meta = self.metadata_for(name, fn)
+        if meta.is_async:
+            awaitable = fn(ctx, **args)
+        elif meta.cpu_bound and self.processes.enabled:
+            awaitable = asyncio.wrap_future(self.submit(name, fn, ctx, args))
+        else:
+            awaitable = asyncio.get_running_loop().run_in_executor(self._io_pool(), functools.partial(fn, ctx, **args))
+        try:
+            return await asyncio.wait_for(awaitable, meta.timeout)
+        except asyncio.TimeoutError:
+            raise ToolTimeout(name, meta.timeout) from None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            loop, self._loop = self._loop, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+tool_executor = ToolExecutor()
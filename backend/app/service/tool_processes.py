@@ -0,0 +1,175 @@
+"""
+CPU 密集工具的进程池：AST 解析（list_modules / read_module）、模糊 diff（apply_diff）、技能模糊搜索（search_skills）
+是纯 Python 计算，在服务进程内执行会长时间持有 GIL，同一进程中所有 session 的流式输出都随之卡顿。
+
+ToolProcessPool：
+- 以 spawn 方式启动的固定数量 worker 进程（服务启动时 start() 预先拉起，避免首个调用承担启动开销），
+  服务进程里已有多个线程，不使用 fork；
+- 工具函数、ToolContext 与参数按值（pickle）传给 worker，函数需为模块级函数；
+  无法 pickle 的（lambda、带 Mock 的上下文等）抛 ToolNotPicklable，由调用方退回进程内执行；
+- 结果在 worker 内 pickle：小于 shm_threshold 字节的随返回值传回，更大的写入 shared_memory 段，
+  父进程直接从共享内存反序列化后释放该段，避免大结果经结果管道多次分块拷贝；
+- 每个 worker 执行 max_tasks_per_child 次后替换为新进程，工具中的内存泄漏或缓存膨胀不会一直累积；
+- worker 崩溃导致进程池损坏时，下一次提交重建进程池。
+
+配置见 settings.yaml 的 tool_processes 段（workers 为 0 时关闭，cpu_bound 工具退回进程内执行）。
+"""
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_MAX_TASKS_PER_CHILD = 200
+# 结果 pickle 后超过该字节数时经共享内存传回
+DEFAULT_SHM_THRESHOLD = 256 * 1024
+
+_INLINE = "inline"
+_SHARED = "shared"
+
+
+class ToolNotPicklable(Exception):
+    """工具函数、上下文或参数无法按值传给 worker 进程。"""
+
+
+def _warm() -> int:
+    return os.getpid()
+
+
+def _run_in_worker(payload: bytes, shm_threshold: int) -> Tuple[str, Any]:
+    fn, ctx, args = pickle.loads(payload)
+    data = pickle.dumps(fn(ctx, **args), protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) < shm_threshold:
+        return _INLINE, data
+    shm = SharedMemory(create=True, size=len(data))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return _SHARED, (shm.name, len(data))
+
+
+def _load_result(kind: str, payload: Any) -> Any:
+    if kind == _INLINE:
+        return pickle.loads(payload)
+    name, size = payload
+    shm = SharedMemory(name=name)
+    try:
+        with shm.buf[:size] as view:
+            return pickle.loads(view)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class ToolProcessPool:
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_tasks_per_child: Optional[int] = DEFAULT_MAX_TASKS_PER_CHILD,
+        shm_threshold: int = DEFAULT_SHM_THRESHOLD,
+    ):
+        """
+        :param workers: worker 进程数，0 表示关闭
+        :param max_tasks_per_child: 每个 worker 执行多少次后替换，None 不替换
+        :param shm_threshold: 结果超过该字节数时经共享内存传回
+        """
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.shm_threshold = shm_threshold
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, settings: Optional[Dict[str, Any]] = None) -> "ToolProcessPool":
+        """按 settings.yaml 的 tool_processes 段构建（workers / max_tasks_per_child / shm_threshold）。"""
+        from backend import config
+
+        settings = config.TOOL_PROCESSES if settings is None else settings
+        return cls(
+            workers=settings.get("workers", DEFAULT_WORKERS),
+            max_tasks_per_child=settings.get("max_tasks_per_child", DEFAULT_MAX_TASKS_PER_CHILD),
+            shm_threshold=settings.get("shm_threshold", DEFAULT_SHM_THRESHOLD),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._pool
+
+    def start(self) -> None:
+        """预先拉起全部 worker：每个 worker 至少执行一次空任务。"""
+        if not self.enabled:
+            return
+        pool = self._executor()
+        for future in [pool.submit(_warm) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, fn: Callable, ctx, args: Dict[str, Any]) -> Future:
+        """在 worker 中执行 fn(ctx, **args)，返回结果的 Future；无法 pickle 时抛 ToolNotPicklable。"""
+        try:
+            payload = pickle.dumps((fn, ctx, args), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise ToolNotPicklable(str(e)) from e
+        pool = self._executor()
+        try:
+            raw = pool.submit(_run_in_worker, payload, self.shm_threshold)
+        except BrokenProcessPool:
+            self._discard_broken(pool)
+            pool = self._executor()
+            raw = pool.submit(_run_in_worker, payload, self.shm_threshold)
+
+        result: Future = Future()
+
+        def on_raw_done(done: Future) -> None:
+            if done.cancelled():
+                result.cancel()
+                return
+            error = done.exception()
+            if isinstance(error, BrokenProcessPool):
+                self._discard_broken(pool)
+            if error is not None:
+                if not result.cancelled():
+                    result.set_exception(error)
+                return
+            # 调用方已放弃（超时）时仍要读出并释放共享内存段
+            try:
+                value = _load_result(*done.result())
+            except Exception as e:
+                if not result.cancelled():
+                    result.set_exception(e)
+                return
+            if not result.cancelled():
+                result.set_result(value)
+
+        result.add_done_callback(lambda f: f.cancelled() and raw.cancel())
+        raw.add_done_callback(on_raw_done)
+        return result
+
+    def _discard_broken(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+tool_process_pool = ToolProcessPool.from_config()
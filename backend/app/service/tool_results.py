@@ -0,0 +1,104 @@
+"""
+工具输出的大小策略：超过阈值的结果转存为 artifact，tool 消息只保留首尾预览与 artifact id。
+
+一次 500 行的 read_file、巨大的 grep 列表或 shell 日志会原样写进 tool 消息：既占 SQLite，
+又随之后每一步请求重发给模型。ToolResultPolicy：
+- 结果不超过 spill_chars 时原样返回；
+- 超过时完整内容写入 ArtifactStore（按 session 分目录），消息改为：说明 + 开头约 head_chars + 结尾约 tail_chars
+  （按行截取，行号与 read_artifact 分页一致）；
+- 只对允许使用 read_artifact 的 agent 生效（agent 的 tools 中列出 read_artifact），否则模型无法取回被省略的内容；
+  read_artifact 自身的结果不再转存。
+
+配置见 settings.yaml 的 tool_results 段（可选，缺省使用下列默认值）。
+"""
+from typing import Any, Dict, Optional
+
+from backend.infra.fileio.artifacts import ArtifactStore, split_lines
+
+READ_ARTIFACT = "read_artifact"
+DEFAULT_SPILL_CHARS = 8000
+DEFAULT_HEAD_CHARS = 2000
+DEFAULT_TAIL_CHARS = 800
+
+
+def _default_root() -> str:
+    from backend.config import DOCUMENT_ROOT
+
+    return f"{DOCUMENT_ROOT}/artifacts"
+
+
+def _fork_origin(session_id: str):
+    """分叉 session 沿父 session 查找继承的 artifact（见 ArtifactStore）。"""
+    from backend.infra.database import db
+
+    return db.get_fork_origin(session_id)
+
+
+class ToolResultPolicy:
+    def __init__(
+        self,
+        store: ArtifactStore,
+        spill_chars: int = DEFAULT_SPILL_CHARS,
+        head_chars: int = DEFAULT_HEAD_CHARS,
+        tail_chars: int = DEFAULT_TAIL_CHARS,
+    ):
+        if head_chars + tail_chars >= spill_chars:
+            raise ValueError("head_chars + tail_chars 必须小于 spill_chars")
+        self.store = store
+        self.spill_chars = spill_chars
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.spilled = 0
+        self.saved_chars = 0
+
+    @classmethod
+    def from_config(cls, settings: Optional[Dict[str, Any]] = None) -> "ToolResultPolicy":
+        """按 settings.yaml 的 tool_results 段构建（artifact_root / spill_chars / head_chars / tail_chars）。"""
+        from backend import config
+
+        settings = config.TOOL_RESULTS if settings is None else settings
+        return cls(
+            ArtifactStore(settings.get("artifact_root") or _default_root(), fork_origin=_fork_origin),
+            spill_chars=settings.get("spill_chars", DEFAULT_SPILL_CHARS),
+            head_chars=settings.get("head_chars", DEFAULT_HEAD_CHARS),
+            tail_chars=settings.get("tail_chars", DEFAULT_TAIL_CHARS),
+        )
+
+    def apply(self, session_id: str, result: str) -> str:
+        """过长的结果转存并返回预览；否则原样返回。"""
+        if len(result) <= self.spill_chars:
+            return result
+        artifact_id = self.store.put(session_id, result)
+        preview = self.preview(artifact_id, result)
+        self.spilled += 1
+        self.saved_chars += len(result) - len(preview)
+        return preview
+
+    def preview(self, artifact_id: str, result: str) -> str:
+        lines = split_lines(result)
+        head_end = self._take(lines, self.head_chars)
+        tail_start = len(lines) - self._take(reversed(lines[head_end:]), self.tail_chars)
+        parts = [
+            f"[工具输出过长（{len(result)} 字符，{len(lines)} 行），完整内容已存为 artifact {artifact_id}；"
+            f"以下为首尾预览，省略部分用 read_artifact(artifact_id=\"{artifact_id}\", start_line={head_end + 1}) 分页读取]",
+        ]
+        parts.extend(lines[:head_end])
+        if tail_start > head_end:
+            parts.append(f"…（第 {head_end + 1}-{tail_start} 行省略）…")
+        parts.extend(lines[tail_start:])
+        return "\n".join(parts)
+
+    @staticmethod
+    def _take(lines, budget: int) -> int:
+        """按顺序取行直到超出 budget 字符，返回取到的行数（至少一行）。"""
+        count = 0
+        used = 0
+        for line in lines:
+            used += len(line) + 1
+            if count and used > budget:
+                break
+            count += 1
+        return count
+
+
+tool_result_policy = ToolResultPolicy.from_config()
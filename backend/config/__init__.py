@@ -40,4 +40,16 @@ try:
             api_key=value.get("api_key")
         )
 except:
-    LLM_SETTINGS_OPTIONS = []
\ No newline at end of file
+    LLM_SETTINGS_OPTIONS = []
+
+# 可选：LLM 请求限流，按 (url, model) 配置每分钟请求数 / token 数，见 app/service/llm_scheduler
+RATE_LIMITS = default_settings.get("rate_limits") or []
+
+# 可选：长 session 的上下文压缩（llm_settings / threshold_tokens / keep_tokens），见 app/service/context_compactor
+COMPACTION = default_settings.get("compaction") or {}
+
+# 可选：过长工具输出转存为 artifact（artifact_root / spill_chars / head_chars / tail_chars），见 app/service/tool_results
+TOOL_RESULTS = default_settings.get("tool_results") or {}
+
+# 可选：cpu_bound 工具的进程池（workers / max_tasks_per_child / shm_threshold），见 app/service/tool_processes
+TOOL_PROCESSES = default_settings.get("tool_processes") or {}
@@ -1,9 +1,11 @@
 from pathlib import Path
 from .db_manager import MessageDB
+from .sharded import ShardedMessageDB
+from .codec import DEFAULT_COMPRESS_THRESHOLD
 from backend.config import DOCUMENT_ROOT
 
 db_path = Path(DOCUMENT_ROOT) / "chat_history.db"
-db = MessageDB(db_path=str(db_path))
+db = MessageDB(db_path=str(db_path), compress_threshold=DEFAULT_COMPRESS_THRESHOLD)
 __all__ = [
     "db"
 ]
\ No newline at end of file
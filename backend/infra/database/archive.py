@@ -0,0 +1,82 @@
+"""
+冷存储：把长期不活跃的 session 移出热表，写入只追加的压缩段文件。
+
+段文件格式（segment_000001.seg ...）：
+    [magic 4B = b"CAR1"][length 4B 大端][zlib(JSON record)] ...
+索引（session -> 段文件、偏移、长度）由 MessageDB 的 archived_sessions 表维护，
+本模块只负责段文件的追加与按偏移读取，不感知 SQL。
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+_MAGIC = b"CAR1"
+_HEADER = struct.Struct(">4sI")
+# 单个段文件上限，超过则滚动到下一个段
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class SegmentArchive:
+    def __init__(self, root_dir: str, segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES):
+        self.root_dir = Path(root_dir)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+
+    def _segments(self):
+        if not self.root_dir.exists():
+            return []
+        return sorted(self.root_dir.glob("segment_*.seg"))
+
+    def _current_segment(self, incoming: int) -> Path:
+        segments = self._segments()
+        if segments and segments[-1].stat().st_size + incoming <= self.segment_max_bytes:
+            return segments[-1]
+        next_no = int(segments[-1].stem.split("_", 1)[1]) + 1 if segments else 1
+        return self.root_dir / f"segment_{next_no:06d}.seg"
+
+    def append(self, record: Dict[str, Any]) -> Tuple[str, int, int]:
+        """追加一条记录并落盘，返回 (段文件名, 数据偏移, 数据长度)。"""
+        body = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"), 6)
+        with self._lock:
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+            path = self._current_segment(_HEADER.size + len(body))
+            with open(path, "ab") as f:
+                header_offset = f.tell()
+                f.write(_HEADER.pack(_MAGIC, len(body)))
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+        return path.name, header_offset + _HEADER.size, len(body)
+
+    def read(self, segment: str, offset: int, length: int) -> Dict[str, Any]:
+        """按索引读取一条记录（mmap 只读映射，不把整段读入内存）。"""
+        path = self.root_dir / segment
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, size = _HEADER.unpack(mm[offset - _HEADER.size:offset])
+            if magic != _MAGIC or size != length:
+                raise ValueError(f"归档段损坏: {segment}@{offset}")
+            body = mm[offset:offset + length]
+        return json.loads(zlib.decompress(body).decode("utf-8"))
+
+    def copy_to(self, dest_dir: str) -> int:
+        """
+        将段文件复制到 dest_dir（已存在且大小相同的跳过），返回复制的文件数。
+        段文件只追加，复制发生在数据库快照之后即可保证索引引用的数据都在副本中。
+        """
+        dest = Path(dest_dir)
+        copied = 0
+        with self._lock:
+            for path in self._segments():
+                target = dest / path.name
+                if target.exists() and target.stat().st_size == path.stat().st_size:
+                    continue
+                dest.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(path, target)
+                copied += 1
+        return copied
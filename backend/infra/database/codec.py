@@ -0,0 +1,122 @@
+"""
+payload 透明压缩：MessageDB 写入前编码，读取后解码，上层只见到 JSON 文本。
+
+行内 codec 标记：
+- TEXT 值：未压缩的 JSON（旧行与小 payload 均为此格式），原样返回。
+- BLOB 值：首字节为 codec 标记
+    b"Z" + zlib 数据
+    b"S" + dict_id（4 字节大端，0 表示无字典）+ zstd 数据
+zstd 为可选依赖（zstandard），未安装时只写 zlib；读到 zstd 行而未安装时报错。
+"""
+import struct
+import zlib
+from typing import Callable, Dict, Iterable, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+CODEC_ZLIB = b"Z"
+CODEC_ZSTD = b"S"
+
+# 默认压缩阈值（UTF-8 字节数），小 payload 压缩收益不抵开销
+DEFAULT_COMPRESS_THRESHOLD = 2048
+# 训练字典默认大小
+DEFAULT_DICT_SIZE = 64 * 1024
+
+_DICT_ID = struct.Struct(">I")
+
+
+def zstd_available() -> bool:
+    return zstandard is not None
+
+
+def train_dictionary(samples: Iterable[str], dict_size: int = DEFAULT_DICT_SIZE) -> bytes:
+    """用已有 payload 训练 zstd 字典；需要 zstandard。"""
+    if zstandard is None:
+        raise RuntimeError("zstandard 未安装，无法训练字典")
+    data = [s.encode("utf-8") for s in samples]
+    return zstandard.train_dictionary(dict_size, data).as_bytes()
+
+
+class PayloadCodec:
+    """
+    单个 MessageDB 使用的编解码器。
+    - threshold: 超过该字节数才压缩；None 表示不压缩（仍可读取已压缩行）。
+    - dict_loader: 按 dict_id 加载字典字节，用于解码历史上用其它字典压缩的行。
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[int] = DEFAULT_COMPRESS_THRESHOLD,
+        level: int = 6,
+        dict_loader: Optional[Callable[[int], Optional[bytes]]] = None,
+    ):
+        self.threshold = threshold
+        self.level = level
+        self._dict_loader = dict_loader
+        self._dicts: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self.active_dict_id = 0
+
+    # ---------- 字典 ----------
+
+    def use_dictionary(self, dict_id: int, data: bytes) -> None:
+        """设置写入时使用的 zstd 字典。"""
+        if zstandard is None:
+            return
+        self._dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+        self.active_dict_id = dict_id
+
+    def _get_dict(self, dict_id: int):
+        if dict_id == 0:
+            return None
+        d = self._dicts.get(dict_id)
+        if d is None:
+            data = self._dict_loader(dict_id) if self._dict_loader else None
+            if data is None:
+                raise ValueError(f"未找到压缩字典: {dict_id}")
+            d = zstandard.ZstdCompressionDict(data)
+            self._dicts[dict_id] = d
+        return d
+
+    # ---------- 编解码 ----------
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        """按阈值压缩；不压缩时原样返回 str（存为 TEXT）。"""
+        if self.threshold is None:
+            return text
+        raw = text.encode("utf-8")
+        if len(raw) < self.threshold:
+            return text
+        if zstandard is not None:
+            d = self._get_dict(self.active_dict_id)
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=d)
+            return CODEC_ZSTD + _DICT_ID.pack(self.active_dict_id) + compressor.compress(raw)
+        return CODEC_ZLIB + zlib.compress(raw, self.level)
+
+    def decode(self, value: Union[str, bytes]) -> str:
+        if isinstance(value, str):
+            return value
+        marker, body = value[:1], value[1:]
+        if marker == CODEC_ZLIB:
+            return zlib.decompress(body).decode("utf-8")
+        if marker == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("该行使用 zstd 压缩，但 zstandard 未安装")
+            (dict_id,) = _DICT_ID.unpack(body[:4])
+            d = self._get_dict(dict_id)
+            return zstandard.ZstdDecompressor(dict_data=d).decompress(body[4:]).decode("utf-8")
+        # 未知标记：按旧行以字节存储的 UTF-8 文本处理
+        return bytes(value).decode("utf-8")
+
+    def is_current(self, value: Union[str, bytes]) -> bool:
+        """value 是否已是当前配置下的编码形式（后台重压缩据此跳过）。"""
+        if self.threshold is None:
+            return True
+        if isinstance(value, str):
+            return len(value.encode("utf-8")) < self.threshold
+        marker = value[:1]
+        if zstandard is not None:
+            return marker == CODEC_ZSTD and _DICT_ID.unpack(value[1:5])[0] == self.active_dict_id
+        return marker == CODEC_ZLIB
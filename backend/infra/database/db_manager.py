@@ -5,45 +5,87 @@ Message 持久化：存储模型与语义模型解耦，抗 OpenAI message 协
 - SQL 只存最小索引信息（session_id, role, created_at），用于查询/排序。
 - 完整 message 以 JSON 原样存入 payload，不假设字段集合稳定。
 - 新增/变更 message 字段（如 name、multimodal、tool 扩展）无需改 schema。
+- 大字段（system prompt、read_file / load_skill 输出等）按内容哈希存入 blobs 表，
+  payload 中只保留引用，读取时还原；相同内容只存一份，按引用计数回收。
+- 超过阈值的 payload / blob 透明压缩（见 codec.py），行内带 codec 标记，旧行照常读取。
+- 长期不活跃的 session 可归档到只追加的段文件（见 archive.py），访问时透明恢复。
+- 支持在线增量备份（sqlite3 backup API），备份期间写入不受阻塞。
+- session 可写时复制地分叉：只记录父指针与分叉点，共享的历史前缀不复制。
+- 连接由有界连接池管理（见 pool.py）：写入串行走唯一写连接，读取走 mode=ro 只读连接。
+- 长 session 可压缩上下文：较早的消息由一条摘要代替（load_recall_messages），原消息保留不动。
 """
+import bisect
 import sqlite3
+import hashlib
 import json
-import threading
-from typing import List, Dict, Optional, Any
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, List, Dict, Optional, Any, Set, Tuple, Union
+
+from backend.infra.frozen import freeze
+
+from .archive import SegmentArchive
+from .codec import PayloadCodec, train_dictionary, zstd_available, DEFAULT_DICT_SIZE
+from .maintenance import MaintenanceJob
+from .migrate import migrate_messages_schema
+from .pool import ConnectionPool, DEFAULT_READERS
 
 # ---------------------------------------------------------------------------
 # 表结构（稳定、少迁移）
 # ---------------------------------------------------------------------------
-# sessions: session_id PK, created_at, agent_name
+# sessions: session_id PK, created_at, agent_name, parent_session_id, fork_message_id, compacted_upto, summary_hash
 #   - 职责：会话元数据与 agent 绑定，与 message 协议无关。
+#   - parent_session_id / fork_message_id: 分叉来源；该 session 的完整历史 =
+#     父 session 历史中 id <= fork_message_id 的部分 + 自身的 messages 行（可多级）。
+#     父 session 修改被分叉继承的行、或被删除前，先把子 session 物化为独立副本。
+#   - compacted_upto / summary_hash: 上下文压缩标记；历史中 id <= compacted_upto 的消息
+#     （开头的 system 消息除外）已由 summaries 中的摘要代替，recall 时跳过，原行保留。
 #
-# messages:
+# messages（建表语句与旧版迁移见 migrate.py）:
 #   - id: 自增主键，保证顺序。
 #   - session_id: 归属会话，索引列，用于 load_messages(session_id)。
 #   - role: 索引列，用于按角色过滤（如“最后一条 assistant”），且为 OpenAI 稳定核心字段。
 #   - created_at: 排序与时间查询。
 #   - payload: TEXT，完整 message 的 JSON；所有业务字段（content / tool_calls / model_extra / name / ...）均在此，不单独建列。
+#   - size: 写入时记录的逻辑大小（JSON 字符数，blob 按原文长度计），不解码即可估算上下文长度（recall_size）；
+#     补列前写入的旧行为 NULL，按 payload 的存储长度计。
 #
 # 不进 SQL 列的理由：content / reasoning_content / tool_calls / tool_call_id / name / 任何扩展
 # 均可能随 API 演化或厂商扩展，放入 payload 可避免后续 migration。
+#
+# blobs: 内容寻址的大字段存储
+#   - hash: 内容 sha256，主键。
+#   - data: 原始字符串。
+#   - size: data 字符数，用于统计去重效果。
+#   - refcount: 被多少处 payload 引用；归零即删除。
+#   payload 中长度 >= blob_threshold 的字符串被替换为 {"$blob": hash}，load 时还原。
+#
+# summaries: 上下文压缩的摘要缓存，hash 为被摘要内容（含模型与上一份摘要）的 sha256；
+#   相同内容（如同一前缀的多个分叉）只请求模型一次。
+#
+# checkpoints: 每个 session 当前一轮 RDAS 的进度（崩溃后 resume 用，见 app/service/checkpoint.py）
+#   - phase: request（用户消息已写入）/ stream（模型请求中）/ tools（执行工具中）/ done
+#   - message_id: 写检查点时该 session 最后一行的 id（stream 阶段中断时，其后的行即半截的 assistant 消息）
+#   - tool_calls / started / done: JSON；本轮的工具调用，及已开始、已完成的 tool_call_id
+#
+# codec_dicts: zstd 训练字典（id 被压缩行引用，只增不删）
+#
+# messages.payload / blobs.data 可能为 TEXT（未压缩）或 BLOB（首字节为 codec 标记）。
+#
+# archived_sessions: 冷存储索引；session 的 messages 行已移入段文件
+#   - segment / offset / length: 记录在段文件中的位置
+#   - message_count / last_message_at: 列表展示用
+#   sessions 行保留（agent 绑定、session id 分配不受归档影响）。
 # ---------------------------------------------------------------------------
 
 _SCHEMA_SESSIONS = """
 CREATE TABLE IF NOT EXISTS sessions (
     session_id TEXT PRIMARY KEY,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    agent_name TEXT
-)
-"""
-
-_SCHEMA_MESSAGES = """
-CREATE TABLE IF NOT EXISTS messages (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    session_id TEXT NOT NULL,
-    role TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    payload TEXT NOT NULL,
-    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+    agent_name TEXT,
+    parent_session_id TEXT,
+    fork_message_id INTEGER
 )
 """
 
@@ -58,72 +100,226 @@ CREATE TABLE IF NOT EXISTS agents (
 """
 
 
+_SCHEMA_BLOBS = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+_SCHEMA_SUMMARIES = """
+CREATE TABLE IF NOT EXISTS summaries (
+    hash TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    model TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+_SCHEMA_CHECKPOINTS = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    session_id TEXT PRIMARY KEY,
+    phase TEXT NOT NULL,
+    message_id INTEGER,
+    tool_calls TEXT,
+    started TEXT NOT NULL DEFAULT '[]',
+    done TEXT NOT NULL DEFAULT '[]',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+_SCHEMA_CODEC_DICTS = """
+CREATE TABLE IF NOT EXISTS codec_dicts (
+    dict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data BLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+_SCHEMA_ARCHIVED_SESSIONS = """
+CREATE TABLE IF NOT EXISTS archived_sessions (
+    session_id TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    last_message_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# payload 中引用 blob 的标记键：{"$blob": "<sha256>"}
+_BLOB_REF_KEY = "$blob"
+# 默认大字段阈值（字符数），超过则进入 blobs 表
+DEFAULT_BLOB_THRESHOLD = 1024
+# 在线备份默认每步复制的页数与步间让出时间（秒）
+DEFAULT_BACKUP_PAGES_PER_STEP = 256
+DEFAULT_BACKUP_SLEEP = 0.005
+
+# progress(copied_pages, total_pages)
+BackupProgress = Callable[[int, int], None]
+
+# SQLite 单条语句变量数上限较保守的取值，IN 查询按此分批
+_SQL_IN_BATCH = 500
+
+
+def _is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and _BLOB_REF_KEY in value
+
+
+def _collect_blob_refs(value: Any, refs: List[str]) -> None:
+    """递归收集 payload 中的 blob 引用（保留重复，便于按次数减引用计数）。"""
+    if _is_blob_ref(value):
+        refs.append(value[_BLOB_REF_KEY])
+    elif isinstance(value, dict):
+        for v in value.values():
+            _collect_blob_refs(v, refs)
+    elif isinstance(value, list):
+        for v in value:
+            _collect_blob_refs(v, refs)
+
+
+def _resolve_blob_refs(value: Any, blobs: Dict[str, str]) -> Any:
+    """将 payload 中的 blob 引用替换回原始字符串。"""
+    if _is_blob_ref(value):
+        return blobs[value[_BLOB_REF_KEY]]
+    if isinstance(value, dict):
+        return {k: _resolve_blob_refs(v, blobs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve_blob_refs(v, blobs) for v in value]
+    return value
+
+
 class MessageDB:
-    def __init__(self, db_path: str = "chat_history.db"):
+    def __init__(
+        self,
+        db_path: str = "chat_history.db",
+        blob_threshold: int = DEFAULT_BLOB_THRESHOLD,
+        compress_threshold: Optional[int] = None,
+        archive_dir: Optional[str] = None,
+        readers: int = DEFAULT_READERS,
+        **pool_kwargs,
+    ):
+        """
+        :param blob_threshold: 字符串字段超过该长度转存 blobs 表
+        :param compress_threshold: payload / blob 超过该字节数时压缩；None 表示不压缩
+        :param archive_dir: 冷存储段文件目录，默认与数据库同目录的 <db名>_archive/
+        :param readers: 只读连接上限；其余连接参数（mmap_size / cache_size / busy_timeout_ms / timeout）透传给 ConnectionPool
+        """
         self.db_path = db_path
-        self._local = threading.local()
+        self.blob_threshold = blob_threshold
+        self._batch_depth = 0
+        # agents 表变更的监听者（如上层的 Agent 缓存）；batch() 内的变更推迟到提交后通知
+        self._agent_listeners: List[Callable[[str], None]] = []
+        self._pending_agent_changes: List[str] = []
+        self._codec = PayloadCodec(threshold=compress_threshold, dict_loader=self._load_codec_dict)
+        if archive_dir is None:
+            archive_dir = self._archive_dir_for(db_path)
+        self._archive = SegmentArchive(archive_dir)
         self._init_db()
+        self._pool = ConnectionPool(db_path, readers=readers, **pool_kwargs)
+        self._load_latest_codec_dict()
+
+    def _write(self):
+        """借出写连接（同一线程可重入），用法：with self._write() as conn。"""
+        return self._pool.writer()
+
+    def _read(self):
+        """借出只读连接；当前线程持有写连接时复用写连接，可见未提交的写入。"""
+        return self._pool.reader()
+
+    def pool_metrics(self) -> Dict[str, Dict[str, float]]:
+        """连接池等待时间统计，见 ConnectionPool.metrics。"""
+        return self._pool.metrics()
+
+    def close(self) -> None:
+        self._pool.close()
+
+    def _commit(self, conn: sqlite3.Connection) -> None:
+        """提交当前写入；处于 batch() 块内时推迟到块结束统一提交。"""
+        if self._batch_depth == 0:
+            conn.commit()
 
-    def _get_conn(self):
-        if not hasattr(self._local, "conn"):
-            self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self._local.conn.row_factory = sqlite3.Row
-        return self._local.conn
+    @contextmanager
+    def batch(self):
+        """
+        组提交：块内（当前线程）的所有写入共享一个事务，退出时一次提交，异常则整体回滚。
+        块内持有写连接，其他线程的写入等待到块结束。可嵌套，仅最外层提交。
+        """
+        with self._write() as conn:
+            # 写连接由本线程独占，深度计数无需线程隔离
+            depth = self._batch_depth
+            self._batch_depth = depth + 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth = depth
+                if depth == 0:
+                    conn.rollback()
+                    self._pending_agent_changes.clear()
+                raise
+            self._batch_depth = depth
+            if depth == 0:
+                conn.commit()
+                changed, self._pending_agent_changes = self._pending_agent_changes, []
+                for agent_name in changed:
+                    self._notify_agent_changed(agent_name)
 
     def _init_db(self):
         with sqlite3.connect(self.db_path) as conn:
+            # 仅对新建数据库生效（须在建表前设置），使归档后可增量回收空闲页
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
             conn.execute(_SCHEMA_SESSIONS)
             conn.execute(_SCHEMA_AGENTS)
+            conn.execute(_SCHEMA_BLOBS)
+            conn.execute(_SCHEMA_CODEC_DICTS)
+            conn.execute(_SCHEMA_ARCHIVED_SESSIONS)
+            conn.execute(_SCHEMA_SUMMARIES)
+            conn.execute(_SCHEMA_CHECKPOINTS)
+            self._ensure_sessions_columns(conn)
             self._ensure_messages_schema(conn)
+            self._ensure_messages_columns(conn)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_parent ON sessions(parent_session_id)")
             conn.execute("PRAGMA journal_mode=WAL;")
             conn.commit()
 
+    @staticmethod
+    def _ensure_sessions_columns(conn: sqlite3.Connection) -> None:
+        """旧库的 sessions 表补上分叉 / 压缩相关列（ADD COLUMN 只改 schema，不重写数据）。"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)").fetchall()}
+        for name, decl in (
+            ("parent_session_id", "TEXT"),
+            ("fork_message_id", "INTEGER"),
+            ("compacted_upto", "INTEGER"),
+            ("summary_hash", "TEXT"),
+        ):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {decl}")
+
+    @staticmethod
+    def _ensure_messages_columns(conn: sqlite3.Connection) -> None:
+        """messages 表补上 size 列（旧行保持 NULL）。"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)").fetchall()}
+        if "size" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN size INTEGER")
+
     def _ensure_messages_schema(self, conn: sqlite3.Connection) -> None:
-        """若 messages 表为旧版（无 payload），则迁移到新 schema；否则跳过。"""
-        cursor = conn.execute("PRAGMA table_info(messages)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "payload" in columns:
-            return
-        if not columns:
-            conn.execute(_SCHEMA_MESSAGES)
-            return
-        # 旧表存在：按列存在情况迁移
-        conn.execute(_SCHEMA_MESSAGES.replace("messages (", "messages_new ("))
-        select_cols = ["id", "session_id", "role", "created_at", "content"]
-        if "reasoning_content" in columns:
-            select_cols.append("reasoning_content")
-        if "tool_calls_json" in columns:
-            select_cols.append("tool_calls_json")
-        if "tool_call_id" in columns:
-            select_cols.append("tool_call_id")
-        sql = "SELECT " + ", ".join(select_cols) + " FROM messages"
-        cursor = conn.execute(sql)
-        rows = cursor.fetchall()
-        for row in rows:
-            r = dict(zip(select_cols, row))
-            payload: Dict[str, Any] = {"role": r.get("role"), "content": r.get("content")}
-            if r.get("reasoning_content"):
-                payload["model_extra"] = {"reasoning_content": r["reasoning_content"]}
-            if r.get("tool_calls_json"):
-                payload["tool_calls"] = json.loads(r["tool_calls_json"])
-            if r.get("tool_call_id"):
-                payload["tool_call_id"] = r["tool_call_id"]
-            conn.execute(
-                "INSERT INTO messages_new (id, session_id, role, created_at, payload) VALUES (?, ?, ?, ?, ?)",
-                (r["id"], r["session_id"], r["role"], r.get("created_at"), json.dumps(payload, ensure_ascii=False)),
-            )
-        conn.execute("DROP TABLE messages")
-        conn.execute("ALTER TABLE messages_new RENAME TO messages")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
+        """
+        若 messages 表为旧版（无 payload），则分批迁移到新 schema；否则跳过。
+        大库建议部署前用 migrate.py 离线迁移，启动时此处即为空操作；中断的迁移会从检查点继续。
+        """
+        migrate_messages_schema(conn)
 
     # ---------- Sessions (agent binding) ----------
 
     def get_new_session_id(self) -> str:
-        cursor = self._get_conn().cursor()
-        cursor.execute("SELECT session_id FROM sessions WHERE session_id LIKE 'session_%'")
+        with self._read() as conn:
+            rows = conn.execute("SELECT session_id FROM sessions WHERE session_id LIKE 'session_%'").fetchall()
         max_num = 0
-        for row in cursor.fetchall():
+        for row in rows:
             sid = row["session_id"]
             try:
                 num = int(sid.split("_", 1)[1])
@@ -136,35 +332,36 @@ class MessageDB:
     def create_session_for_agent(self, session_id: str, agent_name: str):
         if self.get_session_agent_name(session_id) is not None:
             return
-        conn = self._get_conn()
-        conn.execute(
-            "INSERT INTO sessions (session_id, agent_name) VALUES (?, ?)",
-            (session_id, agent_name),
-        )
-        conn.commit()
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, agent_name) VALUES (?, ?)",
+                (session_id, agent_name),
+            )
+            self._commit(conn)
         agent = self.get_agent(agent_name)
         system_prompt_text = (agent.get("system_prompt_text") or "") if agent else ""
         self.append_message(session_id, {"role": "system", "content": system_prompt_text})
 
     def get_session_agent_name(self, session_id: str) -> Optional[str]:
-        cursor = self._get_conn().cursor()
-        cursor.execute("SELECT agent_name FROM sessions WHERE session_id = ?", (session_id,))
-        row = cursor.fetchone()
+        with self._read() as conn:
+            row = conn.execute("SELECT agent_name FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
         return row["agent_name"] if row is not None else None
 
     # ---------- 增量写入（协议不可知：整条 message 存 JSON）----------
 
     def append_message(self, session_id: str, msg: Dict) -> None:
-        """插入单条消息。msg 为任意 dict，原样序列化进 payload，不依赖固定字段。"""
-        conn = self._get_conn()
-        conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
-        role = msg.get("role") or ""
-        payload_json = json.dumps(msg, ensure_ascii=False)
-        conn.execute(
-            "INSERT INTO messages (session_id, role, payload) VALUES (?, ?, ?)",
-            (session_id, role, payload_json),
-        )
-        conn.commit()
+        """插入单条消息。msg 为任意 dict，原样序列化进 payload，不依赖固定字段；大字段转存 blobs。"""
+        with self._write() as conn:
+            if self._is_archived(conn, session_id):
+                self.restore_session(session_id)
+            conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
+            role = msg.get("role") or ""
+            payload, size = self._encode_message(conn, msg)
+            conn.execute(
+                "INSERT INTO messages (session_id, role, payload, size) VALUES (?, ?, ?, ?)",
+                (session_id, role, payload, size),
+            )
+            self._commit(conn)
 
     def update_last_message(
         self,
@@ -172,75 +369,954 @@ class MessageDB:
         content: Optional[str] = None,
         reasoning: Optional[str] = None,
         tool_calls: Optional[List] = None,
+        partial: bool = False,
     ) -> None:
-        """更新该 session 最后一条消息的 content / reasoning / tool_calls（用于流式结束同步）。"""
-        conn = self._get_conn()
-        cursor = conn.execute(
+        """
+        更新该 session 最后一条消息的 content / reasoning / tool_calls（用于流式结束同步）。
+        partial=True 为流式中途的进度同步：整条消息内联写入 payload，不转存 blobs
+        （内容每次都在变，转存只会留下一串用过即弃的 blob）；流结束时不带 partial 再写一次，大字段届时才转存。
+        """
+        # 读-改-写整体在写连接上完成，避免与并发写入交错
+        with self._write() as conn:
+            row = self._last_own_row(conn, session_id)
+            if row is None:
+                if self._fork_origin(conn, session_id) is not None:
+                    row = self._copy_inherited_tail(conn, session_id)
+                elif self.restore_session(session_id):
+                    row = self._last_own_row(conn, session_id)
+                if row is None:
+                    return
+            # 被子 session 继承的行不能原地修改：先把这些子 session 物化
+            self._detach_forks(conn, session_id, min_message_id=row["id"])
+            msg_id = row["id"]
+            stored: Dict[str, Any] = self._decode_payload(row["payload"])
+            old_refs: List[str] = []
+            _collect_blob_refs(stored, old_refs)
+            payload = _resolve_blob_refs(stored, self._fetch_blobs(conn, old_refs)) if old_refs else stored
+            if content is not None:
+                payload["content"] = content
+            if reasoning is not None:
+                payload.setdefault("model_extra", {})["reasoning_content"] = reasoning
+            if tool_calls is not None:
+                payload["tool_calls"] = tool_calls
+            # 先增后减：内容未变的 blob 引用计数净值为 0，不会被误删
+            new_payload, size = self._encode_message(conn, payload, inline=partial)
+            self._release_blobs(conn, old_refs)
+            conn.execute("UPDATE messages SET payload = ?, size = ? WHERE id = ?", (new_payload, size, msg_id))
+            self._commit(conn)
+
+    # ---------- 读取（还原为 API 可用的 message 列表）----------
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        """
+        按 id 顺序返回 message 列表，每项为完整 dict（含 role/content/tool_calls/model_extra 等），可直接用于 OpenAI 风格 API。
+        message 为只读的 FrozenDict，需要修改时先 thaw()。
+        """
+        with self._read() as conn:
+            rows = self._history_rows(conn, session_id)
+            # 同一读事务内取 blob，保证与消息行是同一快照
+            messages = self._decode_rows(conn, rows)
+            # 只有确实已归档才去借写连接恢复，空 session 的读取不与写入争抢
+            archived = not rows and self._is_archived(conn, session_id)
+        if archived and self.restore_session(session_id):
+            return self.load_messages(session_id)
+        return messages
+
+    def list_message_ids(self, session_id: str) -> List[int]:
+        """与 load_messages 一一对应的消息 id（含继承的前缀），用作 fork_session 的分叉点。"""
+        with self._read() as conn:
+            return [row["id"] for row in self._history_rows(conn, session_id, columns="id")]
+
+    def clear_session(self, session_id: str) -> None:
+        with self._write() as conn:
+            self._detach_forks(conn, session_id)
+            self._release_payloads(conn, "SELECT payload FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM checkpoints WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._commit(conn)
+        print(f"--- 已清理 Session: {session_id} ---")
+
+    def truncate_session(self, session_id: str, after_message_id: int) -> None:
+        """删除 session 自身 id > after_message_id 的消息（如中断留下的半截 assistant 消息）；继承这些行的分叉先物化。"""
+        with self._write() as conn:
+            self._detach_forks(conn, session_id, min_message_id=after_message_id + 1)
+            params = (session_id, after_message_id)
+            self._release_payloads(conn, "SELECT payload FROM messages WHERE session_id = ? AND id > ?", params)
+            conn.execute("DELETE FROM messages WHERE session_id = ? AND id > ?", params)
+            self._commit(conn)
+
+    # ---------- 分叉（写时复制）----------
+
+    def fork_session(
+        self,
+        src_session_id: str,
+        new_session_id: str,
+        at_message_id: Optional[int] = None,
+        agent_name: Optional[str] = None,
+    ) -> None:
+        """
+        从 src 的第 at_message_id 条（含，取自 list_message_ids；默认最后一条）分叉出 new_session_id。
+        只写一行 sessions（父指针 + 分叉点），不复制任何消息；agent_name 默认沿用 src 的 agent。
+        """
+        with self._write() as conn:
+            if self._is_archived(conn, src_session_id):
+                self.restore_session(src_session_id)
+            if conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (new_session_id,)).fetchone():
+                raise ValueError(f"session 已存在: {new_session_id}")
+            ids = [row["id"] for row in self._history_rows(conn, src_session_id, columns="id")]
+            if not ids:
+                raise ValueError(f"session 没有消息，无法分叉: {src_session_id}")
+            if at_message_id is None:
+                at_message_id = ids[-1]
+            elif at_message_id not in set(ids):
+                raise ValueError(f"消息 {at_message_id} 不在 session {src_session_id} 的历史中")
+            if agent_name is None:
+                agent_name = self.get_session_agent_name(src_session_id)
+            conn.execute(
+                "INSERT INTO sessions (session_id, agent_name, parent_session_id, fork_message_id) VALUES (?, ?, ?, ?)",
+                (new_session_id, agent_name, src_session_id, at_message_id),
+            )
+            self._commit(conn)
+
+    def get_fork_origin(self, session_id: str) -> Optional[Tuple[str, int]]:
+        """分叉来源 (parent_session_id, fork_message_id)；非分叉 session 返回 None。"""
+        with self._read() as conn:
+            return self._fork_origin(conn, session_id)
+
+    def list_forks(self, session_id: str) -> List[str]:
+        """直接从 session_id 分叉出的子 session。"""
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT session_id FROM sessions WHERE parent_session_id = ? ORDER BY session_id", (session_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def load_session_parts(self, session_id: str) -> Tuple[Optional[Tuple[str, int]], List[Dict]]:
+        """
+        返回 (分叉来源, 自身消息)。load_messages(session_id) == load_prefix(*来源) + 自身消息；
+        供 Stream_Buffer 在多个分叉间共享同一份前缀。
+        """
+        with self._read() as conn:
+            origin = self._fork_origin(conn, session_id)
+            rows = conn.execute(
+                "SELECT payload FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,)
+            ).fetchall()
+            own = self._decode_rows(conn, rows)
+            archived = origin is None and not rows and self._is_archived(conn, session_id)
+        if archived and self.restore_session(session_id):
+            return self.load_session_parts(session_id)
+        return origin, own
+
+    def load_prefix(self, session_id: str, upto_message_id: int) -> List[Dict]:
+        """session 历史中 id <= upto_message_id 的部分（即分叉点处的前缀）。"""
+        with self._read() as conn:
+            return self._decode_rows(conn, self._history_rows(conn, session_id, upto=upto_message_id))
+
+    @staticmethod
+    def _fork_origin(conn: sqlite3.Connection, session_id: str) -> Optional[Tuple[str, int]]:
+        row = conn.execute(
+            "SELECT parent_session_id, fork_message_id FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0], row[1]
+
+    def _lineage(self, conn: sqlite3.Connection, session_id: str, upto: Optional[int] = None) -> List[Tuple[str, Optional[int]]]:
+        """从根到 session_id 的 [(session, 该 session 可见的最大消息 id 或 None)]；上限沿分叉链取最小值。"""
+        chain: List[Tuple[str, Optional[int]]] = []
+        seen: Set[str] = set()
+        current: Optional[str] = session_id
+        limit = upto
+        while current is not None and current not in seen:
+            seen.add(current)
+            chain.append((current, limit))
+            origin = self._fork_origin(conn, current)
+            if origin is None:
+                break
+            current, fork_id = origin
+            limit = fork_id if limit is None else min(limit, fork_id)
+        chain.reverse()
+        return chain
+
+    def _history_rows(
+        self,
+        conn: sqlite3.Connection,
+        session_id: str,
+        upto: Optional[int] = None,
+        columns: str = "id, payload",
+    ) -> List[sqlite3.Row]:
+        """session 完整历史（含继承前缀）的 messages 行，按逻辑顺序。"""
+        rows: List[sqlite3.Row] = []
+        for sid, limit in self._lineage(conn, session_id, upto):
+            if limit is None:
+                rows += conn.execute(
+                    f"SELECT {columns} FROM messages WHERE session_id = ? ORDER BY id ASC", (sid,)
+                ).fetchall()
+            else:
+                rows += conn.execute(
+                    f"SELECT {columns} FROM messages WHERE session_id = ? AND id <= ? ORDER BY id ASC", (sid, limit)
+                ).fetchall()
+        return rows
+
+    def _decode_rows(self, conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[Dict]:
+        """解码并还原 blob；返回不可变 message（FrozenDict），上层可直接共享而无需深拷贝。"""
+        payloads = [self._decode_payload(row["payload"]) for row in rows]
+        refs: List[str] = []
+        for payload in payloads:
+            _collect_blob_refs(payload, refs)
+        if refs:
+            blobs = self._fetch_blobs(conn, refs)
+            payloads = [_resolve_blob_refs(payload, blobs) for payload in payloads]
+        return [freeze(payload) for payload in payloads]
+
+    @staticmethod
+    def _last_own_row(conn: sqlite3.Connection, session_id: str) -> Optional[sqlite3.Row]:
+        return conn.execute(
             "SELECT id, payload FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1",
             (session_id,),
+        ).fetchone()
+
+    def _copy_inherited_tail(self, conn: sqlite3.Connection, session_id: str) -> Optional[sqlite3.Row]:
+        """
+        分叉后尚无自身消息时修改"最后一条"：该行属于祖先，复制为自身的行，
+        并把分叉点前移到它之前，祖先与其他分叉看到的内容不变。
+        """
+        rows = self._history_rows(conn, session_id, columns="id, role, created_at, payload, size")
+        if not rows:
+            return None
+        tail = rows[-1]
+        # 继承了这一行的子 session 先物化，否则前移分叉点后它们会丢失该行
+        self._detach_forks(conn, session_id, min_message_id=tail["id"])
+        conn.execute("UPDATE sessions SET fork_message_id = ? WHERE session_id = ?", (tail["id"] - 1, session_id))
+        self._retain_payloads(conn, [tail["payload"]])
+        cursor = conn.execute(
+            "INSERT INTO messages (session_id, role, created_at, payload, size) VALUES (?, ?, ?, ?, ?)",
+            (session_id, tail["role"], tail["created_at"], tail["payload"], tail["size"]),
         )
-        row = cursor.fetchone()
-        if not row:
-            return
-        msg_id, payload_json = row["id"], row["payload"]
-        payload: Dict[str, Any] = json.loads(payload_json)
-        if content is not None:
-            payload["content"] = content
-        if reasoning is not None:
-            payload.setdefault("model_extra", {})["reasoning_content"] = reasoning
-        if tool_calls is not None:
-            payload["tool_calls"] = tool_calls
-        conn.execute("UPDATE messages SET payload = ? WHERE id = ?", (json.dumps(payload, ensure_ascii=False), msg_id))
-        conn.commit()
+        return conn.execute("SELECT id, payload FROM messages WHERE id = ?", (cursor.lastrowid,)).fetchone()
 
-    # ---------- 读取（还原为 API 可用的 message 列表）----------
+    def _detach_forks(self, conn: sqlite3.Connection, session_id: str, min_message_id: Optional[int] = None) -> None:
+        """物化继承了 session_id 中 id >= min_message_id 的行（None 表示全部）的直接子 session。"""
+        sql = "SELECT session_id FROM sessions WHERE parent_session_id = ?"
+        params: List[Any] = [session_id]
+        if min_message_id is not None:
+            sql += " AND fork_message_id >= ?"
+            params.append(min_message_id)
+        for row in conn.execute(sql, params).fetchall():
+            self._materialize_fork(conn, row[0])
 
-    def load_messages(self, session_id: str) -> List[Dict]:
-        """按 id 顺序返回 message 列表，每项为完整 dict（含 role/content/tool_calls/model_extra 等），可直接用于 OpenAI 风格 API。"""
-        cursor = self._get_conn().cursor()
-        cursor.execute(
-            "SELECT payload FROM messages WHERE session_id = ? ORDER BY id ASC",
+    def _materialize_fork(self, conn: sqlite3.Connection, session_id: str) -> None:
+        """
+        把分叉 session 变为独立 session：按逻辑顺序重写完整历史（继承行复制、自身行移动），
+        清除父指针，并把孙 session 的分叉点映射到新 id。
+        """
+        rows = self._history_rows(conn, session_id, columns="id, session_id, role, created_at, payload, size")
+        id_map: List[Tuple[int, int]] = []
+        inherited: List[Any] = []
+        for row in rows:
+            cursor = conn.execute(
+                "INSERT INTO messages (session_id, role, created_at, payload, size) VALUES (?, ?, ?, ?, ?)",
+                (session_id, row["role"], row["created_at"], row["payload"], row["size"]),
+            )
+            id_map.append((row["id"], cursor.lastrowid))
+            if row["session_id"] != session_id:
+                inherited.append(row["payload"])
+        self._retain_payloads(conn, inherited)
+        own_ids = [(row["id"],) for row in rows if row["session_id"] == session_id]
+        conn.executemany("DELETE FROM messages WHERE id = ?", own_ids)
+        conn.execute(
+            "UPDATE sessions SET parent_session_id = NULL, fork_message_id = NULL WHERE session_id = ?",
             (session_id,),
         )
-        return [json.loads(row["payload"]) for row in cursor.fetchall()]
+        old_ids = [old for old, _ in id_map]
+        for child, fork_id in conn.execute(
+            "SELECT session_id, fork_message_id FROM sessions WHERE parent_session_id = ?", (session_id,)
+        ).fetchall():
+            # 分叉点可能不是实际行 id（见 _copy_inherited_tail），取不超过它的最后一行
+            pos = bisect.bisect_right(old_ids, fork_id)
+            new_fork = id_map[pos - 1][1] if pos else 0
+            conn.execute("UPDATE sessions SET fork_message_id = ? WHERE session_id = ?", (new_fork, child))
 
-    def clear_session(self, session_id: str) -> None:
-        conn = self._get_conn()
-        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-        conn.commit()
-        print(f"--- 已清理 Session: {session_id} ---")
+    def _has_forks(self, conn: sqlite3.Connection, session_id: str) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM sessions WHERE parent_session_id = ? LIMIT 1", (session_id,)
+        ).fetchone() is not None
+
+    # ---------- 上下文压缩 ----------
+
+    def get_summary(self, summary_hash: str) -> Optional[str]:
+        with self._read() as conn:
+            row = conn.execute("SELECT summary FROM summaries WHERE hash = ?", (summary_hash,)).fetchone()
+        return row["summary"] if row is not None else None
+
+    def put_summary(self, summary_hash: str, summary: str, model: Optional[str] = None) -> None:
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO summaries (hash, summary, model) VALUES (?, ?, ?)",
+                (summary_hash, summary, model),
+            )
+            self._commit(conn)
+
+    def get_compaction(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """(compacted_upto, summary_hash)；未压缩返回 None。"""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT compacted_upto, summary_hash FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or row["compacted_upto"] is None:
+            return None
+        return row["compacted_upto"], row["summary_hash"]
+
+    def set_compaction(self, session_id: str, upto_message_id: int, summary_hash: str) -> None:
+        """把历史中 id <= upto_message_id 的消息标记为已由 summary_hash 的摘要代替（摘要须已 put_summary）。"""
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE sessions SET compacted_upto = ?, summary_hash = ? WHERE session_id = ?",
+                (upto_message_id, summary_hash, session_id),
+            )
+            self._commit(conn)
+
+    def load_recall_messages(self, session_id: str) -> Optional[List[Dict]]:
+        """
+        压缩后的上下文：开头的 system 消息（摘要追加在其 content 之后）+ id > compacted_upto 的消息。
+        被压缩的行不解码；session 未压缩时返回 None，调用方照常 load_messages。
+        """
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT s.compacted_upto, m.summary FROM sessions s JOIN summaries m ON m.hash = s.summary_hash "
+                "WHERE s.session_id = ? AND s.compacted_upto IS NOT NULL",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            upto, summary = row["compacted_upto"], row["summary"]
+            index = self._history_rows(conn, session_id, columns="id, role")
+            keep: List[int] = []
+            leading = True
+            for entry in index:
+                if leading and entry["role"] == "system":
+                    keep.append(entry["id"])
+                    continue
+                leading = False
+                if entry["id"] > upto:
+                    keep.append(entry["id"])
+            rows: List[sqlite3.Row] = []
+            for start in range(0, len(keep), _SQL_IN_BATCH):
+                chunk = keep[start:start + _SQL_IN_BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows += conn.execute(f"SELECT id, payload FROM messages WHERE id IN ({placeholders})", chunk).fetchall()
+            # 分叉链上的 id 单调递增，按 id 排序即逻辑顺序
+            rows.sort(key=lambda r: r["id"])
+            messages = self._decode_rows(conn, rows)
+            archived = not index and self._is_archived(conn, session_id)
+        if archived and self.restore_session(session_id):
+            return self.load_recall_messages(session_id)
+        if messages and messages[0].get("role") == "system":
+            head = dict(messages[0])
+            head["content"] = f"{head.get('content') or ''}\n\n{summary}".lstrip()
+            messages[0] = freeze(head)
+        else:
+            messages.insert(0, freeze({"role": "system", "content": summary}))
+        return messages
+
+    def recall_size(self, session_id: str) -> int:
+        """
+        load_recall_messages（未压缩时为 load_messages）所返回上下文的字符数上界估计：只读 size 列，不解码。
+        压缩后为摘要 + system 消息 + id > compacted_upto 的消息。
+        """
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT s.compacted_upto, length(m.summary) FROM sessions s JOIN summaries m ON m.hash = s.summary_hash "
+                "WHERE s.session_id = ? AND s.compacted_upto IS NOT NULL",
+                (session_id,),
+            ).fetchone()
+            upto, total = (row[0], row[1]) if row is not None else (None, 0)
+            for sid, limit in self._lineage(conn, session_id):
+                sql = "SELECT COALESCE(SUM(COALESCE(size, length(payload))), 0) FROM messages WHERE session_id = ?"
+                params: List[Any] = [sid]
+                if limit is not None:
+                    sql += " AND id <= ?"
+                    params.append(limit)
+                if upto is not None:
+                    sql += " AND (id > ? OR role = 'system')"
+                    params.append(upto)
+                total += conn.execute(sql, params).fetchone()[0]
+        return total
+
+    # ---------- 检查点 ----------
+
+    def get_checkpoint(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """{"phase", "message_id", "tool_calls", "started", "done"}；没有检查点返回 None。"""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT phase, message_id, tool_calls, started, done FROM checkpoints WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "phase": row["phase"],
+            "message_id": row["message_id"],
+            "tool_calls": json.loads(row["tool_calls"]) if row["tool_calls"] else [],
+            "started": json.loads(row["started"]),
+            "done": json.loads(row["done"]),
+        }
+
+    def set_checkpoint(self, session_id: str, phase: str, tool_calls: Optional[List[Dict]] = None) -> None:
+        """进入新阶段：记录 session 当前最后一行的 id，清空已开始 / 已完成的工具调用。"""
+        with self._write() as conn:
+            row = conn.execute("SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (session_id, phase, message_id, tool_calls, updated_at) "
+                "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                (session_id, phase, row[0], json.dumps(tool_calls, ensure_ascii=False) if tool_calls else None),
+            )
+            self._commit(conn)
+
+    def mark_tool_call(self, session_id: str, tool_call_id: str, done: bool = False) -> None:
+        """记录工具调用已开始（done=False，执行前）或已完成（done=True，结果写入后）。"""
+        column = "done" if done else "started"
+        with self._write() as conn:
+            row = conn.execute(f"SELECT {column} FROM checkpoints WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return
+            ids = json.loads(row[0])
+            if tool_call_id not in ids:
+                ids.append(tool_call_id)
+                conn.execute(
+                    f"UPDATE checkpoints SET {column} = ?, updated_at = CURRENT_TIMESTAMP WHERE session_id = ?",
+                    (json.dumps(ids), session_id),
+                )
+                self._commit(conn)
+
+    def clear_checkpoint(self, session_id: str) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE session_id = ?", (session_id,))
+            self._commit(conn)
 
     # ---------- Agents ----------
 
+    def add_agent_listener(self, listener: Callable[[str], None]) -> None:
+        """注册 agents 表变更回调：upsert_agent / delete_agent 提交后以 agent_name 调用（仅本进程内的写入）。"""
+        self._agent_listeners.append(listener)
+
+    def remove_agent_listener(self, listener: Callable[[str], None]) -> None:
+        if listener in self._agent_listeners:
+            self._agent_listeners.remove(listener)
+
+    def _notify_agent_changed(self, agent_name: str) -> None:
+        if self._batch_depth:
+            self._pending_agent_changes.append(agent_name)
+            return
+        for listener in list(self._agent_listeners):
+            listener(agent_name)
+
     def upsert_agent(self, agent_name: str, role_settings_yaml: str, system_prompt_text: str) -> None:
-        conn = self._get_conn()
-        conn.execute("""
-            INSERT OR REPLACE INTO agents (agent_name, role_settings_yaml, system_prompt_text, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        """, (agent_name, role_settings_yaml, system_prompt_text))
-        conn.commit()
+        with self._write() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO agents (agent_name, role_settings_yaml, system_prompt_text, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """, (agent_name, role_settings_yaml, system_prompt_text))
+            self._commit(conn)
+            self._notify_agent_changed(agent_name)
 
     def list_agent_names(self) -> List[str]:
-        cursor = self._get_conn().cursor()
-        cursor.execute("SELECT agent_name FROM agents")
-        return [row["agent_name"] for row in cursor.fetchall()]
+        with self._read() as conn:
+            rows = conn.execute("SELECT agent_name FROM agents").fetchall()
+        return [row["agent_name"] for row in rows]
 
     def get_agent(self, agent_name: str) -> Optional[Dict]:
-        cursor = self._get_conn().cursor()
-        cursor.execute("SELECT * FROM agents WHERE agent_name = ?", (agent_name,))
-        row = cursor.fetchone()
+        with self._read() as conn:
+            row = conn.execute("SELECT * FROM agents WHERE agent_name = ?", (agent_name,)).fetchone()
         return dict(row) if row is not None else None
 
     def delete_agent(self, agent_name: str) -> None:
-        conn = self._get_conn()
+        with self._write() as conn:
+            doomed = {
+                row[0] for row in conn.execute("SELECT session_id FROM sessions WHERE agent_name = ?", (agent_name,))
+            }
+            # 其他 agent 名下从这些 session 分叉出去的 session 先物化
+            for sid in doomed:
+                for row in conn.execute(
+                    "SELECT session_id FROM sessions WHERE parent_session_id = ?", (sid,)
+                ).fetchall():
+                    if row[0] not in doomed:
+                        self._materialize_fork(conn, row[0])
+            self._release_payloads(
+                conn,
+                "SELECT payload FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE agent_name = ?)",
+                (agent_name,),
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE agent_name = ?)",
+                (agent_name,),
+            )
+            conn.execute(
+                "DELETE FROM archived_sessions WHERE session_id IN (SELECT session_id FROM sessions WHERE agent_name = ?)",
+                (agent_name,),
+            )
+            conn.execute("DELETE FROM sessions WHERE agent_name = ?", (agent_name,))
+            conn.execute("DELETE FROM agents WHERE agent_name = ?", (agent_name,))
+            self._commit(conn)
+            self._notify_agent_changed(agent_name)
+
+    # ---------- Blobs（内容寻址去重）----------
+
+    def _externalize(self, conn: sqlite3.Connection, value: Any, moved: Optional[List[int]] = None) -> Any:
+        """
+        将 value 中长度 >= blob_threshold 的字符串写入 blobs（引用计数 +1），返回替换为引用后的副本。
+        moved 非 None 时追加被替换字符串的长度。
+        """
+        if isinstance(value, str):
+            if len(value) < self.blob_threshold:
+                return value
+            if moved is not None:
+                moved.append(len(value))
+            digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+            # 已存在时只增引用计数；编码（压缩）只在首次写入时付出
+            cursor = conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (digest,))
+            if cursor.rowcount == 0:
+                conn.execute(
+                    "INSERT INTO blobs (hash, data, size, refcount) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1",
+                    (digest, self._codec.encode(value), len(value)),
+                )
+            return {_BLOB_REF_KEY: digest}
+        if isinstance(value, dict):
+            return {k: self._externalize(conn, v, moved) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._externalize(conn, v, moved) for v in value]
+        return value
+
+    def _fetch_blobs(self, conn: sqlite3.Connection, refs: Iterable[str]) -> Dict[str, str]:
+        unique = list(set(refs))
+        blobs: Dict[str, str] = {}
+        for i in range(0, len(unique), _SQL_IN_BATCH):
+            batch = unique[i:i + _SQL_IN_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            for row in conn.execute(f"SELECT hash, data FROM blobs WHERE hash IN ({placeholders})", batch):
+                blobs[row[0]] = self._codec.decode(row[1])
+        return blobs
+
+    @staticmethod
+    def _release_blobs(conn: sqlite3.Connection, refs: List[str]) -> None:
+        """按出现次数减少引用计数，并删除归零的 blob。调用方负责 commit。"""
+        if not refs:
+            return
+        conn.executemany("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", [(h,) for h in refs])
+        touched: Set[str] = set(refs)
+        conn.executemany("DELETE FROM blobs WHERE hash = ? AND refcount <= 0", [(h,) for h in touched])
+
+    @staticmethod
+    def _retain_blobs(conn: sqlite3.Connection, refs: List[str]) -> None:
+        """按出现次数增加引用计数（行被复制时）。调用方负责 commit。"""
+        if refs:
+            conn.executemany("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", [(h,) for h in refs])
+
+    def _retain_payloads(self, conn: sqlite3.Connection, raw_payloads: List[Any]) -> None:
+        """为原样复制的 payload 行增加其 blob 引用计数。"""
+        refs: List[str] = []
+        for raw in raw_payloads:
+            _collect_blob_refs(self._decode_payload(raw), refs)
+        self._retain_blobs(conn, refs)
+
+    def _release_payloads(self, conn: sqlite3.Connection, sql: str, params: tuple) -> None:
+        """释放即将被删除的消息行所持有的 blob 引用。"""
+        refs: List[str] = []
+        for row in conn.execute(sql, params):
+            _collect_blob_refs(self._decode_payload(row[0]), refs)
+        self._release_blobs(conn, refs)
+
+    def blob_stats(self) -> Dict[str, Any]:
+        """
+        去重统计：
+        - blobs: blob 条数
+        - refs: 引用总数
+        - stored_chars: 实际存储的字符数
+        - logical_chars: 若不去重需要存储的字符数
+        - dedup_ratio: logical_chars / stored_chars
+        """
+        with self._read() as conn:
+            blobs, refs, stored, logical = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(refcount), 0), COALESCE(SUM(size), 0), COALESCE(SUM(size * refcount), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "blobs": blobs,
+            "refs": refs,
+            "stored_chars": stored,
+            "logical_chars": logical,
+            "dedup_ratio": (logical / stored) if stored else 1.0,
+        }
+
+    # ---------- 冷存储归档 ----------
+
+    @staticmethod
+    def _is_archived(conn: sqlite3.Connection, session_id: str) -> bool:
+        return conn.execute("SELECT 1 FROM archived_sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def _export_session(self, conn: sqlite3.Connection, session_id: str) -> Tuple[Optional[Dict], List[str]]:
+        """构造热表中 session 的自包含记录（blob 已还原，分叉 session 含继承的前缀），同时返回其持有的 blob 引用。"""
+        rows = self._history_rows(conn, session_id, columns="id, role, created_at, payload")
+        if not rows:
+            return None, []
+        payloads = [self._decode_payload(row["payload"]) for row in rows]
+        refs: List[str] = []
+        for payload in payloads:
+            _collect_blob_refs(payload, refs)
+        blobs = self._fetch_blobs(conn, refs) if refs else {}
+        record = {
+            "session_id": session_id,
+            "agent_name": self.get_session_agent_name(session_id),
+            "messages": [
+                {
+                    "id": row["id"],
+                    "role": row["role"],
+                    "created_at": row["created_at"],
+                    "payload": _resolve_blob_refs(payload, blobs) if refs else payload,
+                }
+                for row, payload in zip(rows, payloads)
+            ],
+        }
+        return record, refs
+
+    def _insert_session_messages(
+        self, conn: sqlite3.Connection, session_id: str, messages: List[Dict], keep_ids: bool
+    ) -> List[int]:
+        """写入记录中的消息，返回与之一一对应的新 id。"""
+        if keep_ids:
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages (id, session_id, role, created_at, payload, size) VALUES (?, ?, ?, ?, ?, ?)",
+                [(m["id"], session_id, m["role"], m["created_at"], *self._encode_message(conn, m["payload"])) for m in messages],
+            )
+            return [m["id"] for m in messages]
+        conn.executemany(
+            "INSERT INTO messages (session_id, role, created_at, payload, size) VALUES (?, ?, ?, ?, ?)",
+            [(session_id, m["role"], m["created_at"], *self._encode_message(conn, m["payload"])) for m in messages],
+        )
+        if not messages:
+            return []
+        # 自增 id 按插入顺序分配：该 session 最新的 len(messages) 行即刚写入的行
+        rows = conn.execute(
+            "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, len(messages))
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    @staticmethod
+    def _export_compaction(conn: sqlite3.Connection, session_id: str) -> Optional[Dict]:
+        row = conn.execute(
+            "SELECT s.compacted_upto, s.summary_hash, m.summary, m.model FROM sessions s "
+            "JOIN summaries m ON m.hash = s.summary_hash WHERE s.session_id = ? AND s.compacted_upto IS NOT NULL",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"compacted_upto": row[0], "summary_hash": row[1], "summary": row[2], "model": row[3]}
+
+    @staticmethod
+    def _import_compaction(
+        conn: sqlite3.Connection, session_id: str, compaction: Dict, old_ids: List[int], new_ids: List[int]
+    ) -> None:
+        """按导入后的新 id 恢复压缩标记：compacted_upto 映射为不超过它的最后一条消息的新 id。"""
+        conn.execute(
+            "INSERT OR IGNORE INTO summaries (hash, summary, model) VALUES (?, ?, ?)",
+            (compaction["summary_hash"], compaction["summary"], compaction.get("model")),
+        )
+        pos = bisect.bisect_right(old_ids, compaction["compacted_upto"])
+        upto = new_ids[pos - 1] if pos else 0
         conn.execute(
-            "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE agent_name = ?)",
-            (agent_name,),
+            "UPDATE sessions SET compacted_upto = ?, summary_hash = ? WHERE session_id = ?",
+            (upto, compaction["summary_hash"], session_id),
+        )
+
+    def export_session(self, session_id: str) -> Optional[Dict]:
+        """
+        导出 session 的自包含记录：{"session_id", "agent_name", "messages": [{id, role, created_at, payload}]}；
+        已压缩的 session 另含 "compaction": {compacted_upto, summary_hash, summary, model}。
+        已归档的 session 直接从段文件读取，不恢复到热表。
+        """
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT segment, offset, length FROM archived_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is not None:
+                record = self._archive.read(row["segment"], row["offset"], row["length"])
+                record.setdefault("agent_name", self.get_session_agent_name(session_id))
+            else:
+                record, _ = self._export_session(conn, session_id)
+            if record is not None:
+                compaction = self._export_compaction(conn, session_id)
+                if compaction is not None:
+                    record["compaction"] = compaction
+        return record
+
+    def import_session(self, record: Dict, keep_ids: bool = False) -> None:
+        """
+        导入 export_session 产出的记录，追加到该 session 末尾。
+        keep_ids=False 时重新分配 id（跨库导入避免主键冲突），顺序与 created_at 保持不变；
+        记录带有压缩标记时一并导入摘要，compacted_upto 映射到新 id。
+        """
+        session_id = record["session_id"]
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, agent_name) VALUES (?, ?)",
+                (session_id, record.get("agent_name")),
+            )
+            new_ids = self._insert_session_messages(conn, session_id, record["messages"], keep_ids)
+            if record.get("compaction"):
+                old_ids = [m["id"] for m in record["messages"]]
+                self._import_compaction(conn, session_id, record["compaction"], old_ids, new_ids)
+            self._commit(conn)
+
+    def archive_session(self, session_id: str) -> bool:
+        """
+        将 session 的全部消息写入段文件并从热表删除（sessions 行保留）。
+        记录自包含（blob 引用已还原），先落盘再删行：中途崩溃只会在段文件里留下无索引的垃圾。
+        """
+        with self._write() as conn:
+            if self._is_archived(conn, session_id):
+                return False
+            # 分叉链上的 session 共享行，不参与归档
+            if self._fork_origin(conn, session_id) is not None or self._has_forks(conn, session_id):
+                return False
+            record, refs = self._export_session(conn, session_id)
+            if record is None:
+                return False
+            messages = record["messages"]
+            segment, offset, length = self._archive.append(record)
+            conn.execute(
+                "INSERT INTO archived_sessions (session_id, segment, offset, length, message_count, last_message_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, segment, offset, length, len(messages), messages[-1]["created_at"]),
+            )
+            self._release_blobs(conn, refs)
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._commit(conn)
+        return True
+
+    def restore_session(self, session_id: str) -> bool:
+        """将归档 session 复制回热表（保留原 id 与 created_at），并删除索引；未归档时返回 False。"""
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT segment, offset, length FROM archived_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                return False
+            record = self._archive.read(row["segment"], row["offset"], row["length"])
+            self._insert_session_messages(conn, session_id, record["messages"], keep_ids=True)
+            conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+            self._commit(conn)
+        return True
+
+    def list_archived_sessions(self) -> List[Dict]:
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT a.session_id, s.agent_name, a.message_count, a.last_message_at, a.archived_at, a.segment "
+                "FROM archived_sessions a LEFT JOIN sessions s ON s.session_id = a.session_id "
+                "ORDER BY a.archived_at ASC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def archive_idle_sessions(self, idle_seconds: float, limit: Optional[int] = None, vacuum_pages: int = 1000) -> List[str]:
+        """
+        归档最后一条消息早于 idle_seconds 的 session，然后增量回收空闲页。
+        返回已归档的 session_id 列表。
+        """
+        sql = (
+            "SELECT session_id FROM messages GROUP BY session_id "
+            "HAVING MAX(created_at) < datetime('now', ?) ORDER BY MAX(created_at) ASC"
         )
-        conn.execute("DELETE FROM sessions WHERE agent_name = ?", (agent_name,))
-        conn.execute("DELETE FROM agents WHERE agent_name = ?", (agent_name,))
-        conn.commit()
+        params: List[Any] = [f"-{int(idle_seconds)} seconds"]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._read() as conn:
+            candidates = [row[0] for row in conn.execute(sql, params).fetchall()]
+        archived = [sid for sid in candidates if self.archive_session(sid)]
+        if archived:
+            self.incremental_vacuum(vacuum_pages)
+        return archived
+
+    def incremental_vacuum(self, pages: int = 1000) -> None:
+        """回收最多 pages 个空闲页；数据库未启用 auto_vacuum=INCREMENTAL 时为空操作。"""
+        with self._write() as conn:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            self._commit(conn)
+
+    def start_archive_job(self, idle_seconds: float, interval: float = 3600.0, batch: int = 100) -> MaintenanceJob:
+        """启动后台归档任务；调用方负责在退出时 shutdown()。"""
+        return MaintenanceJob(
+            lambda: self.archive_idle_sessions(idle_seconds, limit=batch),
+            interval=interval,
+            name="archive",
+        )
+
+    # ---------- 在线备份 ----------
+
+    @staticmethod
+    def _archive_dir_for(db_path: str) -> str:
+        db_file = Path(db_path)
+        return str(db_file.parent / f"{db_file.stem}_archive")
+
+    @staticmethod
+    def _run_backup(
+        source: sqlite3.Connection,
+        target: sqlite3.Connection,
+        pages_per_step: int,
+        sleep: float,
+        progress: Optional[BackupProgress],
+    ) -> None:
+        def on_step(status, remaining, total):
+            if progress is not None:
+                progress(total - remaining, total)
+            # 每步之间让出，写入方可拿到写锁
+            if remaining and sleep > 0:
+                time.sleep(sleep)
+
+        source.backup(target, pages=pages_per_step, progress=on_step)
+
+    def backup(
+        self,
+        dest: str,
+        pages_per_step: int = DEFAULT_BACKUP_PAGES_PER_STEP,
+        sleep: float = DEFAULT_BACKUP_SLEEP,
+        progress: Optional[BackupProgress] = None,
+    ) -> None:
+        """
+        在线备份到 dest（SQLite 文件），并复制归档段文件到 dest 同目录的 <名>_archive/。
+        - 源连接全程持有一个 WAL 读事务：备份得到一致快照，其他连接的写入不会让备份反复重启，
+          WAL 模式下读事务也不阻塞写入。
+        - 每步复制 pages_per_step 页后 sleep 秒，progress(已复制页数, 总页数) 报告进度。
+        """
+        source = sqlite3.connect(self.db_path, isolation_level=None)
+        target = sqlite3.connect(dest)
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            self._run_backup(source, target, pages_per_step, sleep, progress)
+            source.execute("COMMIT")
+        finally:
+            target.close()
+            source.close()
+        self._archive.copy_to(self._archive_dir_for(dest))
+
+    def restore_backup(
+        self,
+        src: str,
+        pages_per_step: int = -1,
+        sleep: float = 0.0,
+        progress: Optional[BackupProgress] = None,
+    ) -> None:
+        """
+        用 backup() 产出的文件覆盖当前数据库（含归档段文件）。
+        默认一步完成，期间其他写入会等待；调用方应在无流式写入时执行。
+        """
+        source = sqlite3.connect(src)
+        try:
+            # 直接写入池的写连接：覆盖期间其他写入在池上等待
+            with self._write() as target:
+                target.commit()
+                self._run_backup(source, target, pages_per_step, sleep, progress)
+        finally:
+            source.close()
+        self._pool.reset_readers()
+        SegmentArchive(self._archive_dir_for(src)).copy_to(str(self._archive.root_dir))
+        # 字典 id 可能随备份改变，丢弃缓存后重新加载
+        self._codec = PayloadCodec(threshold=self._codec.threshold, dict_loader=self._load_codec_dict)
+        self._load_latest_codec_dict()
+
+    # ---------- 压缩 ----------
+
+    def _encode_message(
+        self, conn: sqlite3.Connection, msg: Any, inline: bool = False
+    ) -> Tuple[Union[str, bytes], int]:
+        """
+        大字段转存 blobs 后编码（inline=True 时不转存）；
+        同时返回逻辑大小（JSON 字符数，blob 按原文长度计，见 recall_size）。
+        """
+        moved: List[int] = []
+        text = json.dumps(msg if inline else self._externalize(conn, msg, moved), ensure_ascii=False)
+        return self._codec.encode(text), len(text) + sum(moved)
+
+    def _decode_payload(self, value: Union[str, bytes]) -> Any:
+        return json.loads(self._codec.decode(value))
+
+    def _load_codec_dict(self, dict_id: int) -> Optional[bytes]:
+        with self._read() as conn:
+            row = conn.execute("SELECT data FROM codec_dicts WHERE dict_id = ?", (dict_id,)).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def _load_latest_codec_dict(self) -> None:
+        if not zstd_available():
+            return
+        with self._read() as conn:
+            row = conn.execute("SELECT dict_id, data FROM codec_dicts ORDER BY dict_id DESC LIMIT 1").fetchone()
+        if row is not None:
+            self._codec.use_dictionary(row[0], bytes(row[1]))
+
+    def train_compression_dict(self, sample_rows: int = 2000, dict_size: int = DEFAULT_DICT_SIZE) -> Optional[int]:
+        """
+        用最近的 payload 与 blob 训练 zstd 字典并设为当前写入字典，返回 dict_id。
+        未安装 zstandard 或样本不足时返回 None（继续使用 zlib / 无字典 zstd）。
+        """
+        if not zstd_available():
+            return None
+        with self._read() as conn:
+            samples = [
+                self._codec.decode(row[0])
+                for row in conn.execute("SELECT payload FROM messages ORDER BY id DESC LIMIT ?", (sample_rows,))
+            ]
+            samples += [
+                self._codec.decode(row[0])
+                for row in conn.execute("SELECT data FROM blobs ORDER BY rowid DESC LIMIT ?", (sample_rows,))
+            ]
+        if len(samples) < 8:
+            return None
+        try:
+            data = train_dictionary(samples, dict_size)
+        except Exception:
+            # 样本过少或过于单一时 zstd 训练会失败
+            return None
+        with self._write() as conn:
+            cursor = conn.execute("INSERT INTO codec_dicts (data) VALUES (?)", (data,))
+            self._commit(conn)
+        self._codec.use_dictionary(cursor.lastrowid, data)
+        return cursor.lastrowid
+
+    def recompress(self, batch_size: int = 200, max_rows: Optional[int] = None) -> int:
+        """
+        将未按当前配置编码的 messages.payload / blobs.data 重新编码（如旧的未压缩行、旧字典行）。
+        分批提交，避免长时间持有写锁；返回改写的行数。
+        """
+        rewritten = 0
+        for table, key, column in (("messages", "id", "payload"), ("blobs", "rowid", "data")):
+            last_key = 0
+            while max_rows is None or rewritten < max_rows:
+                # 每批单独借写连接，批间让出给流式写入
+                with self._write() as conn:
+                    rows = conn.execute(
+                        f"SELECT {key}, {column} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                        (last_key, batch_size),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    updates = []
+                    for row_key, value in rows:
+                        last_key = row_key
+                        if not self._codec.is_current(value):
+                            updates.append((self._codec.encode(self._codec.decode(value)), row_key))
+                    if updates:
+                        conn.executemany(f"UPDATE {table} SET {column} = ? WHERE {key} = ?", updates)
+                        self._commit(conn)
+                        rewritten += len(updates)
+        return rewritten
+
+    def start_recompression_job(self, interval: float = 600.0, batch_size: int = 200) -> MaintenanceJob:
+        """启动后台重压缩任务；调用方负责在退出时 shutdown()。"""
+        return MaintenanceJob(lambda: self.recompress(batch_size=batch_size), interval=interval, name="recompress")
 
     def self_check(self) -> None:
         def run_agent_yaml_self_check() -> None:
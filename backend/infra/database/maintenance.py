@@ -0,0 +1,46 @@
+"""
+MessageDB 后台维护任务：低频、可停止，与 Stream_Buffer 的后台 flush 线程同一模式。
+"""
+import threading
+import warnings
+from typing import Any, Callable
+
+
+class MaintenanceJob:
+    """
+    按固定间隔在守护线程中执行 task；task 抛出的异常转为 warning，不终止线程。
+    """
+
+    def __init__(self, task: Callable[[], Any], interval: float = 60.0, name: str = "maintenance"):
+        self.task = task
+        self.interval = interval
+        self.name = name
+        self.running = True
+        self._wakeup = threading.Event()
+
+        self.worker = threading.Thread(
+            target=self._loop,
+            name=name,
+            daemon=True
+            )
+        self.worker.start()
+
+    def _loop(self):
+        while self.running:
+            self._wakeup.wait(self.interval)
+            if not self.running:
+                break
+            self._wakeup.clear()
+            try:
+                self.task()
+            except Exception as e:
+                warnings.warn(f"{self.name} 执行失败: {e}", RuntimeWarning)
+
+    def trigger(self):
+        """立即执行一次（不等待间隔）。"""
+        self._wakeup.set()
+
+    def shutdown(self):
+        self.running = False
+        self._wakeup.set()
+        self.worker.join()
@@ -0,0 +1,178 @@
+"""
+messages 表旧版 schema（按列存 content / reasoning_content / tool_calls_json / tool_call_id）
+到新版（整条 message 存 payload JSON）的迁移。
+
+- 游标分批：按 id 键集分页读取，每批 executemany 写入 messages_new，内存占用与表大小无关。
+- 可恢复：每批与检查点（schema_migrations）在同一事务提交，中断后从 last_id 继续。
+- 最后一步（删旧表、改名、建索引）在单个事务内完成。
+
+只依赖标准库，可离线直接运行，部署前先迁移，服务启动时即为空操作：
+    python backend/infra/database/migrate.py path/to/chat_history.db --batch-size 5000
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+MESSAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    payload TEXT NOT NULL,
+    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+)
+"""
+
+_SCHEMA_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    migrated INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+MIGRATION_NAME = "messages_payload_v1"
+DEFAULT_BATCH_SIZE = 5000
+
+# progress(migrated_rows, total_rows)
+ProgressCallback = Callable[[int, int], None]
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _legacy_row_to_payload(r: Dict[str, Any]) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"role": r.get("role"), "content": r.get("content")}
+    if r.get("reasoning_content"):
+        payload["model_extra"] = {"reasoning_content": r["reasoning_content"]}
+    if r.get("tool_calls_json"):
+        payload["tool_calls"] = json.loads(r["tool_calls_json"])
+    if r.get("tool_call_id"):
+        payload["tool_call_id"] = r["tool_call_id"]
+    return payload
+
+
+def needs_migration(conn: sqlite3.Connection) -> bool:
+    columns = _table_columns(conn, "messages")
+    return bool(columns) and "payload" not in columns
+
+
+def migrate_messages_schema(
+    conn: sqlite3.Connection,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> int:
+    """
+    确保 messages 为新版 schema；旧表按批迁移，返回本次调用迁移的行数。
+    已是新版时为空操作；messages 不存在时直接建表。
+    """
+    conn.commit()
+    columns = _table_columns(conn, "messages")
+    if "payload" in columns:
+        return 0
+    if not columns:
+        if _table_columns(conn, "messages_new"):
+            # 兼容极端情况：旧表已删除而改名未完成
+            conn.execute("ALTER TABLE messages_new RENAME TO messages")
+        else:
+            conn.execute(MESSAGES_SCHEMA)
+        conn.commit()
+        return 0
+
+    select_cols = ["id", "session_id", "role", "created_at", "content"]
+    for optional in ("reasoning_content", "tool_calls_json", "tool_call_id"):
+        if optional in columns:
+            select_cols.append(optional)
+
+    conn.execute(_SCHEMA_MIGRATIONS)
+    conn.execute(MESSAGES_SCHEMA.replace("messages (", "messages_new ("))
+    conn.execute("INSERT OR IGNORE INTO schema_migrations (name) VALUES (?)", (MIGRATION_NAME,))
+    conn.commit()
+    last_id, migrated, total = conn.execute(
+        "SELECT last_id, migrated, total FROM schema_migrations WHERE name = ?",
+        (MIGRATION_NAME,),
+    ).fetchone()
+    if total == 0:
+        total = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        conn.execute("UPDATE schema_migrations SET total = ? WHERE name = ?", (total, MIGRATION_NAME))
+        conn.commit()
+
+    sql = "SELECT " + ", ".join(select_cols) + " FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?"
+    copied = 0
+    while True:
+        rows = conn.execute(sql, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            r = dict(zip(select_cols, row))
+            batch.append((
+                r["id"],
+                r["session_id"],
+                r["role"],
+                r.get("created_at"),
+                json.dumps(_legacy_row_to_payload(r), ensure_ascii=False),
+            ))
+        last_id = rows[-1][0]
+        # INSERT OR REPLACE：上次中断若已写入部分行但检查点未提交，不会冲突
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages_new (id, session_id, role, created_at, payload) VALUES (?, ?, ?, ?, ?)",
+            batch,
+        )
+        migrated += len(batch)
+        copied += len(batch)
+        conn.execute(
+            "UPDATE schema_migrations SET last_id = ?, migrated = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+            (last_id, migrated, MIGRATION_NAME),
+        )
+        conn.commit()
+        if progress is not None:
+            progress(migrated, total)
+
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DROP TABLE messages")
+        conn.execute("ALTER TABLE messages_new RENAME TO messages")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
+        conn.execute(
+            "UPDATE schema_migrations SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+            (MIGRATION_NAME,),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return copied
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="离线迁移 chat_history.db 的 messages 表到 payload schema")
+    parser.add_argument("db_path")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    def report(done: int, total: int) -> None:
+        pct = (done / total * 100) if total else 100.0
+        print(f"\r已迁移 {done}/{total} 行 ({pct:.1f}%)", end="", flush=True)
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        if not needs_migration(conn):
+            print("messages 已是最新 schema，无需迁移")
+            return 0
+        copied = migrate_messages_schema(conn, batch_size=args.batch_size, progress=report)
+        print(f"\n迁移完成，本次写入 {copied} 行")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+MessageDB 的有界连接池：一个写连接 + 固定上限的只读连接。
+
+- 写连接：所有写入经同一连接串行执行（进程内线程不再争抢 SQLite 写锁）；
+  同一线程可重入（batch() 内再调用写方法），其他线程等待。
+- 读连接：以 file:...?mode=ro 打开，最多 readers 个，按需创建、用完归还；
+  每次借出包在一个读事务中，多条 SELECT 看到同一快照（如消息行与其引用的 blob）。
+  已持有写连接的线程读取时直接复用写连接，可见自己尚未提交的写入。
+- 每个连接设置 mmap_size / cache_size / synchronous / busy_timeout；
+  连接数有上限，线程池再大也不会泄漏文件描述符。
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+DEFAULT_READERS = 4
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+# 负数表示 KiB：约 8MB 页缓存
+DEFAULT_CACHE_SIZE = -8192
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+
+
+class PoolTimeout(TimeoutError):
+    """等待连接超时。"""
+
+
+class _WaitStats:
+    def __init__(self):
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, contended: bool) -> None:
+        self.acquired += 1
+        if contended:
+            self.waited += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "total_wait": self.total_wait,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        db_path: str,
+        readers: int = DEFAULT_READERS,
+        mmap_size: int = DEFAULT_MMAP_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS,
+        timeout: float = 30.0,
+    ):
+        """
+        :param readers: 只读连接上限；0 表示读也走写连接
+        :param timeout: 等待连接的最长秒数，超时抛 PoolTimeout
+        """
+        self.db_path = db_path
+        self.max_readers = readers
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.timeout = timeout
+        self._writer = self._configure(sqlite3.connect(db_path, check_same_thread=False))
+        self._writer_lock = threading.RLock()
+        self._writer_owner = None
+        self._writer_depth = 0
+        self._idle: List[sqlite3.Connection] = []
+        self._opened = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._writer_stats = _WaitStats()
+        self._reader_stats = _WaitStats()
+        self._closed = False
+
+    def _configure(self, conn: sqlite3.Connection, read_only: bool = False) -> sqlite3.Connection:
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if read_only:
+            conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        # 读连接自行管理事务（BEGIN / COMMIT），关闭 sqlite3 模块的隐式事务
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        return self._configure(conn, read_only=True)
+
+    def holds_writer(self) -> bool:
+        return self._writer_owner == threading.get_ident()
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """借出写连接；同一线程可重入。提交由调用方负责。"""
+        if self.holds_writer():
+            self._writer_depth += 1
+            try:
+                yield self._writer
+            finally:
+                self._writer_depth -= 1
+            return
+        start = time.perf_counter()
+        contended = not self._writer_lock.acquire(blocking=False)
+        if contended and not self._writer_lock.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"等待写连接超过 {self.timeout}s")
+        self._writer_stats.record(time.perf_counter() - start, contended)
+        self._writer_owner = threading.get_ident()
+        self._writer_depth = 1
+        try:
+            yield self._writer
+        finally:
+            self._writer_depth = 0
+            self._writer_owner = None
+            self._writer_lock.release()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """借出只读连接（块内为同一读事务快照）；同一线程嵌套借用复用同一连接。"""
+        if self.holds_writer() or self.max_readers <= 0:
+            with self.writer() as conn:
+                yield conn
+            return
+        current = getattr(self._local, "reader", None)
+        if current is not None:
+            yield current
+            return
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            self._local.reader = None
+            self._release_reader(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        contended = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("连接池已关闭")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._opened < self.max_readers:
+                    self._opened += 1
+                    conn = None
+                    break
+                contended = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if not self._idle:
+                        raise PoolTimeout(f"等待读连接超过 {self.timeout}s")
+        if conn is None:
+            try:
+                conn = self._open_reader()
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                    self._cond.notify()
+                raise
+        self._reader_stats.record(time.perf_counter() - start, contended)
+        return conn
+
+    def _release_reader(self, conn: sqlite3.Connection) -> None:
+        with self._cond:
+            if self._closed:
+                conn.close()
+                self._opened -= 1
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def reset_readers(self) -> None:
+        """关闭空闲读连接（如数据库文件被整体替换后），下次借用时重新打开。"""
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """各类连接的借用次数、发生等待的次数、总/平均/最大等待秒数，以及读连接使用情况。"""
+        with self._cond:
+            readers = {"open": self._opened, "idle": len(self._idle), "max": self.max_readers}
+        return {"writer": self._writer_stats.as_dict(), "reader": {**self._reader_stats.as_dict(), **readers}}
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+        with self._writer_lock:
+            self._writer.close()
@@ -0,0 +1,419 @@
+"""
+多 SQLite 文件分片的消息存储：每个分片是一个独立的 MessageDB（独立写锁），
+按 session_id（或所属 agent）的哈希路由，缓解单库写锁把所有 session 的 flush 串行化。
+
+目录结构（root_dir）：
+    directory.db      分片目录：分片数/路由方式、session -> shard、agents
+    shard_000.db ...  各分片 MessageDB
+
+跨分片查询（list_agent_names / get_agent / get_new_session_id / delete_agent）走目录库；
+agents 同时复制到每个分片，使分片内 create_session_for_agent 能取到 system prompt。
+
+离线改分片数：
+    python -m backend.infra.database.sharded SRC_ROOT DST_ROOT --shards 16 [--route-by agent]
+"""
+import argparse
+import sqlite3
+import sys
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .db_manager import MessageDB, _SCHEMA_AGENTS
+from .pool import ConnectionPool
+
+ROUTE_BY_SESSION = "session"
+ROUTE_BY_AGENT = "agent"
+
+# 目录库的只读连接上限：目录查询很轻（主键查找），路由结果另有进程内缓存
+DIRECTORY_READERS = 2
+
+_SCHEMA_SHARD_META = """
+CREATE TABLE IF NOT EXISTS shard_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+_SCHEMA_SESSION_SHARDS = """
+CREATE TABLE IF NOT EXISTS session_shards (
+    session_id TEXT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    agent_name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def shard_of(key: str, shards: int) -> int:
+    """稳定哈希（跨进程一致，不受 PYTHONHASHSEED 影响）。"""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+class ShardedMessageDB:
+    """
+    实现 MessageStore 协议（load_messages / append_message / update_last_message），
+    并提供与 MessageDB 相同的 session / agent 接口，可直接替换注入 Stream_Buffer。
+    """
+
+    def __init__(self, root_dir: str, shards: int = 4, route_by: str = ROUTE_BY_SESSION, **db_kwargs):
+        if route_by not in (ROUTE_BY_SESSION, ROUTE_BY_AGENT):
+            raise ValueError(f"未知路由方式: {route_by}")
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.directory_path = str(self.root_dir / "directory.db")
+        self._route_cache: Dict[str, int] = {}
+        self._agent_listeners: List[Callable[[str], None]] = []
+        self._init_directory(shards, route_by)
+        # 目录库同样走有界连接池：写入串行，读取复用只读连接，线程再多也不会各自留下一个连接
+        self._directory = ConnectionPool(self.directory_path, readers=DIRECTORY_READERS)
+        self.shards = [
+            MessageDB(str(self.root_dir / f"shard_{i:03d}.db"), **db_kwargs)
+            for i in range(self.shard_count)
+        ]
+
+    # ---------- 目录 ----------
+
+    def _write(self):
+        """借出目录库写连接，用法：with self._write() as conn；提交由调用方负责。"""
+        return self._directory.writer()
+
+    def _read(self):
+        return self._directory.reader()
+
+    def close(self) -> None:
+        self._directory.close()
+        for shard in self.shards:
+            shard.close()
+
+    def _init_directory(self, shards: int, route_by: str) -> None:
+        with sqlite3.connect(self.directory_path) as conn:
+            conn.execute(_SCHEMA_SHARD_META)
+            conn.execute(_SCHEMA_SESSION_SHARDS)
+            conn.execute(_SCHEMA_AGENTS)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("INSERT OR IGNORE INTO shard_meta (key, value) VALUES ('shards', ?)", (str(shards),))
+            conn.execute("INSERT OR IGNORE INTO shard_meta (key, value) VALUES ('route_by', ?)", (route_by,))
+            conn.commit()
+            meta = dict(conn.execute("SELECT key, value FROM shard_meta").fetchall())
+        self.shard_count = int(meta["shards"])
+        self.route_by = meta["route_by"]
+        if self.shard_count != shards or self.route_by != route_by:
+            raise ValueError(
+                f"{self.root_dir} 已按 shards={self.shard_count}, route_by={self.route_by} 初始化；"
+                "如需改变请使用 reshard 离线迁移"
+            )
+
+    def _lookup_shard(self, session_id: str) -> Optional[int]:
+        shard = self._route_cache.get(session_id)
+        if shard is not None:
+            return shard
+        with self._read() as conn:
+            row = conn.execute("SELECT shard FROM session_shards WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._route_cache[session_id] = row["shard"]
+        return row["shard"]
+
+    def _assign_shard(self, session_id: str, agent_name: Optional[str] = None) -> int:
+        """为 session 分配分片并写入目录（幂等）。"""
+        shard = self._lookup_shard(session_id)
+        if shard is not None:
+            return shard
+        key = agent_name if (self.route_by == ROUTE_BY_AGENT and agent_name) else session_id
+        with self._write() as conn:
+            shard = shard_of(key, self.shard_count)
+            conn.execute(
+                "INSERT OR IGNORE INTO session_shards (session_id, shard, agent_name) VALUES (?, ?, ?)",
+                (session_id, shard, agent_name),
+            )
+            conn.commit()
+            # 并发分配时以先写入者为准
+            shard = conn.execute(
+                "SELECT shard FROM session_shards WHERE session_id = ?", (session_id,)
+            ).fetchone()["shard"]
+            self._route_cache[session_id] = shard
+            return shard
+
+    def shard_for(self, session_id: str) -> MessageDB:
+        return self.shards[self._assign_shard(session_id)]
+
+    # ---------- MessageStore 协议 ----------
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        shard = self._lookup_shard(session_id)
+        if shard is None:
+            return []
+        return self.shards[shard].load_messages(session_id)
+
+    def append_message(self, session_id: str, msg: Dict) -> None:
+        self.shard_for(session_id).append_message(session_id, msg)
+
+    def update_last_message(
+        self,
+        session_id: str,
+        content: Optional[str] = None,
+        reasoning: Optional[str] = None,
+        tool_calls: Optional[List] = None,
+        partial: bool = False,
+    ) -> None:
+        shard = self._lookup_shard(session_id)
+        if shard is None:
+            return
+        self.shards[shard].update_last_message(
+            session_id, content=content, reasoning=reasoning, tool_calls=tool_calls, partial=partial
+        )
+
+    def list_message_ids(self, session_id: str) -> List[int]:
+        shard = self._lookup_shard(session_id)
+        return [] if shard is None else self.shards[shard].list_message_ids(session_id)
+
+    # ---------- 分叉 ----------
+
+    def fork_session(
+        self,
+        src_session_id: str,
+        new_session_id: str,
+        at_message_id: Optional[int] = None,
+        agent_name: Optional[str] = None,
+    ) -> None:
+        """分叉 session 与源 session 放在同一分片（共享行不能跨库），不受 route_by 影响。"""
+        shard = self._lookup_shard(src_session_id)
+        if shard is None:
+            raise ValueError(f"session 没有消息，无法分叉: {src_session_id}")
+        if self._lookup_shard(new_session_id) is not None:
+            raise ValueError(f"session 已存在: {new_session_id}")
+        if agent_name is None:
+            agent_name = self.get_session_agent_name(src_session_id)
+        self.shards[shard].fork_session(src_session_id, new_session_id, at_message_id, agent_name)
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO session_shards (session_id, shard, agent_name) VALUES (?, ?, ?)",
+                (new_session_id, shard, agent_name),
+            )
+            conn.commit()
+            self._route_cache[new_session_id] = shard
+
+    def get_fork_origin(self, session_id: str) -> Optional[Tuple[str, int]]:
+        shard = self._lookup_shard(session_id)
+        return None if shard is None else self.shards[shard].get_fork_origin(session_id)
+
+    def list_forks(self, session_id: str) -> List[str]:
+        """分叉与源 session 在同一分片。"""
+        shard = self._lookup_shard(session_id)
+        return [] if shard is None else self.shards[shard].list_forks(session_id)
+
+    def load_session_parts(self, session_id: str) -> Tuple[Optional[Tuple[str, int]], List[Dict]]:
+        shard = self._lookup_shard(session_id)
+        return (None, []) if shard is None else self.shards[shard].load_session_parts(session_id)
+
+    def load_prefix(self, session_id: str, upto_message_id: int) -> List[Dict]:
+        shard = self._lookup_shard(session_id)
+        return [] if shard is None else self.shards[shard].load_prefix(session_id, upto_message_id)
+
+    # ---------- 上下文压缩（摘要按 hash 分片缓存，set_compaction 时复制到 session 所在分片）----------
+
+    def get_summary(self, summary_hash: str) -> Optional[str]:
+        for shard in self.shards:
+            summary = shard.get_summary(summary_hash)
+            if summary is not None:
+                return summary
+        return None
+
+    def put_summary(self, summary_hash: str, summary: str, model: Optional[str] = None) -> None:
+        self.shards[shard_of(summary_hash, len(self.shards))].put_summary(summary_hash, summary, model)
+
+    def get_compaction(self, session_id: str) -> Optional[Tuple[int, str]]:
+        shard = self._lookup_shard(session_id)
+        return None if shard is None else self.shards[shard].get_compaction(session_id)
+
+    def set_compaction(self, session_id: str, upto_message_id: int, summary_hash: str) -> None:
+        shard = self.shard_for(session_id)
+        # 摘要须与 session 在同一分片（load_recall_messages 在分片内 JOIN）
+        if shard.get_summary(summary_hash) is None:
+            summary = self.get_summary(summary_hash)
+            if summary is None:
+                raise KeyError(f"摘要不存在: {summary_hash}")
+            shard.put_summary(summary_hash, summary)
+        shard.set_compaction(session_id, upto_message_id, summary_hash)
+
+    def load_recall_messages(self, session_id: str) -> Optional[List[Dict]]:
+        shard = self._lookup_shard(session_id)
+        return None if shard is None else self.shards[shard].load_recall_messages(session_id)
+
+    def recall_size(self, session_id: str) -> int:
+        shard = self._lookup_shard(session_id)
+        return 0 if shard is None else self.shards[shard].recall_size(session_id)
+
+    # ---------- 检查点（与 session 同分片）----------
+
+    def truncate_session(self, session_id: str, after_message_id: int) -> None:
+        shard = self._lookup_shard(session_id)
+        if shard is not None:
+            self.shards[shard].truncate_session(session_id, after_message_id)
+
+    def get_checkpoint(self, session_id: str) -> Optional[Dict[str, Any]]:
+        shard = self._lookup_shard(session_id)
+        return None if shard is None else self.shards[shard].get_checkpoint(session_id)
+
+    def set_checkpoint(self, session_id: str, phase: str, tool_calls: Optional[List[Dict]] = None) -> None:
+        self.shard_for(session_id).set_checkpoint(session_id, phase, tool_calls)
+
+    def mark_tool_call(self, session_id: str, tool_call_id: str, done: bool = False) -> None:
+        shard = self._lookup_shard(session_id)
+        if shard is not None:
+            self.shards[shard].mark_tool_call(session_id, tool_call_id, done)
+
+    def clear_checkpoint(self, session_id: str) -> None:
+        shard = self._lookup_shard(session_id)
+        if shard is not None:
+            self.shards[shard].clear_checkpoint(session_id)
+
+    # ---------- Sessions ----------
+
+    def get_new_session_id(self) -> str:
+        with self._read() as conn:
+            rows = conn.execute("SELECT session_id FROM session_shards WHERE session_id LIKE 'session_%'").fetchall()
+        max_num = 0
+        for row in rows:
+            try:
+                max_num = max(max_num, int(row["session_id"].split("_", 1)[1]))
+            except (ValueError, IndexError):
+                continue
+        return f"session_{max_num + 1}"
+
+    def create_session_for_agent(self, session_id: str, agent_name: str):
+        if self.get_session_agent_name(session_id) is not None:
+            return
+        shard = self._assign_shard(session_id, agent_name)
+        with self._write() as conn:
+            conn.execute("UPDATE session_shards SET agent_name = ? WHERE session_id = ?", (agent_name, session_id))
+            conn.commit()
+        self.shards[shard].create_session_for_agent(session_id, agent_name)
+
+    def get_session_agent_name(self, session_id: str) -> Optional[str]:
+        with self._read() as conn:
+            row = conn.execute("SELECT agent_name FROM session_shards WHERE session_id = ?", (session_id,)).fetchone()
+        return row["agent_name"] if row is not None else None
+
+    def list_sessions(self) -> List[Dict]:
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT session_id, shard, agent_name FROM session_shards ORDER BY created_at ASC, session_id ASC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def clear_session(self, session_id: str) -> None:
+        shard = self._lookup_shard(session_id)
+        if shard is not None:
+            self.shards[shard].clear_session(session_id)
+        with self._write() as conn:
+            conn.execute("DELETE FROM session_shards WHERE session_id = ?", (session_id,))
+            conn.commit()
+        self._route_cache.pop(session_id, None)
+
+    # ---------- Agents ----------
+
+    def add_agent_listener(self, listener: Callable[[str], None]) -> None:
+        """同 MessageDB.add_agent_listener：目录库提交后通知。"""
+        self._agent_listeners.append(listener)
+
+    def remove_agent_listener(self, listener: Callable[[str], None]) -> None:
+        if listener in self._agent_listeners:
+            self._agent_listeners.remove(listener)
+
+    def _notify_agent_changed(self, agent_name: str) -> None:
+        for listener in list(self._agent_listeners):
+            listener(agent_name)
+
+    def upsert_agent(self, agent_name: str, role_settings_yaml: str, system_prompt_text: str) -> None:
+        with self._write() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO agents (agent_name, role_settings_yaml, system_prompt_text, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """, (agent_name, role_settings_yaml, system_prompt_text))
+            conn.commit()
+        for shard in self.shards:
+            shard.upsert_agent(agent_name, role_settings_yaml, system_prompt_text)
+        self._notify_agent_changed(agent_name)
+
+    def list_agent_names(self) -> List[str]:
+        with self._read() as conn:
+            rows = conn.execute("SELECT agent_name FROM agents").fetchall()
+        return [row["agent_name"] for row in rows]
+
+    def get_agent(self, agent_name: str) -> Optional[Dict]:
+        with self._read() as conn:
+            row = conn.execute("SELECT * FROM agents WHERE agent_name = ?", (agent_name,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def delete_agent(self, agent_name: str) -> None:
+        for shard in self.shards:
+            shard.delete_agent(agent_name)
+        with self._write() as conn:
+            sessions = [row[0] for row in conn.execute(
+                "SELECT session_id FROM session_shards WHERE agent_name = ?", (agent_name,)
+            ).fetchall()]
+            conn.execute("DELETE FROM session_shards WHERE agent_name = ?", (agent_name,))
+            conn.execute("DELETE FROM agents WHERE agent_name = ?", (agent_name,))
+            conn.commit()
+        for sid in sessions:
+            self._route_cache.pop(sid, None)
+        self._notify_agent_changed(agent_name)
+
+
+def reshard(src_root: str, dst_root: str, shards: int, route_by: str = ROUTE_BY_SESSION, **db_kwargs) -> int:
+    """
+    离线改分片：把 src_root 的全部 agent 与 session 复制到新建的 dst_root，返回迁移的 session 数。
+    src 只读；完成后由运维切换目录。迁移期间不得有写入。
+    """
+    src_meta = sqlite3.connect(str(Path(src_root) / "directory.db"))
+    try:
+        meta = dict(src_meta.execute("SELECT key, value FROM shard_meta").fetchall())
+    finally:
+        src_meta.close()
+    src = ShardedMessageDB(src_root, shards=int(meta["shards"]), route_by=meta["route_by"], **db_kwargs)
+    dst = ShardedMessageDB(dst_root, shards=shards, route_by=route_by, **db_kwargs)
+    try:
+        return _copy_all(src, dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _copy_all(src: ShardedMessageDB, dst: ShardedMessageDB) -> int:
+    for agent_name in src.list_agent_names():
+        agent = src.get_agent(agent_name)
+        dst.upsert_agent(agent_name, agent.get("role_settings_yaml") or "", agent.get("system_prompt_text") or "")
+    moved = 0
+    for entry in src.list_sessions():
+        session_id = entry["session_id"]
+        shard = dst._assign_shard(session_id, entry["agent_name"])
+        if entry["agent_name"]:
+            with dst._write() as conn:
+                conn.execute(
+                    "UPDATE session_shards SET agent_name = ? WHERE session_id = ?", (entry["agent_name"], session_id)
+                )
+                conn.commit()
+        record = src.shards[entry["shard"]].export_session(session_id)
+        if record is None:
+            record = {"session_id": session_id, "agent_name": entry["agent_name"], "messages": []}
+        dst.shards[shard].import_session(record, keep_ids=False)
+        moved += 1
+    return moved
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="离线改变 ShardedMessageDB 的分片数 / 路由方式")
+    parser.add_argument("src_root")
+    parser.add_argument("dst_root")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--route-by", choices=[ROUTE_BY_SESSION, ROUTE_BY_AGENT], default=ROUTE_BY_SESSION)
+    args = parser.parse_args(argv)
+    moved = reshard(args.src_root, args.dst_root, args.shards, args.route_by)
+    print(f"已迁移 {moved} 个 session 到 {args.dst_root}（{args.shards} 个分片）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,469 @@
+"""
+单写者存储服务：多进程部署（多个 uvicorn worker、批处理脚本）共用一个 chat_history.db 时，
+由一个本地守护进程独占 MessageDB，其它进程经 Unix domain socket 访问，避免争抢 SQLite 文件锁。
+
+帧格式（双向相同）：[长度 4B 大端][UTF-8 JSON]
+    请求：{"id": int, "op": str, "args": {...}}，或一帧内多个请求组成的列表（批量提交）
+    响应：{"id": int, "ok": true, "result": ...} | {"id": int, "ok": false, "error": str}
+
+服务端：每个连接一个读线程，请求进入同一队列；唯一的写线程按到达顺序取出一批
+（所有进程的请求合并），在一个事务中执行后统一提交（group commit），再逐条回复。
+客户端：实现 MessageStore 协议，可直接注入 Stream_Buffer；多线程共享一个连接，
+请求按 id 流水线化，不必等上一条回复。
+
+启动：python -m backend.infra.database.storage_service --socket /path/to/storage.sock
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db_manager import MessageDB
+
+_LENGTH = struct.Struct(">I")
+# 单帧上限，防止异常数据撑爆内存
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+# 一次组提交最多合并的请求数
+DEFAULT_MAX_BATCH = 256
+
+# 允许远程调用的 MessageDB 方法
+ALLOWED_OPS = frozenset({
+    "load_messages",
+    "append_message",
+    "update_last_message",
+    "list_message_ids",
+    "fork_session",
+    "get_fork_origin",
+    "list_forks",
+    "load_session_parts",
+    "load_prefix",
+    "truncate_session",
+    "get_summary",
+    "put_summary",
+    "get_compaction",
+    "set_compaction",
+    "load_recall_messages",
+    "recall_size",
+    "get_checkpoint",
+    "set_checkpoint",
+    "mark_tool_call",
+    "clear_checkpoint",
+    "get_new_session_id",
+    "create_session_for_agent",
+    "get_session_agent_name",
+    "clear_session",
+    "upsert_agent",
+    "list_agent_names",
+    "get_agent",
+    "delete_agent",
+})
+
+
+class StorageServiceError(RuntimeError):
+    """服务端执行请求失败。"""
+
+
+def send_frame(sock: socket.socket, obj: Any) -> None:
+    body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(body)) + body)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Any]:
+    """读取一帧；对端关闭时返回 None。"""
+    header = _recv_exact(sock, _LENGTH.size)
+    if header is None:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"帧过大: {length}")
+    body = _recv_exact(sock, length)
+    if body is None:
+        return None
+    return json.loads(body.decode("utf-8"))
+
+
+class _Peer:
+    """服务端的一个客户端连接；回复可能来自写线程，发送需加锁。"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.alive = True
+
+    def reply(self, responses: List[Dict]) -> None:
+        if not self.alive:
+            return
+        try:
+            with self.send_lock:
+                for r in responses:
+                    send_frame(self.sock, r)
+        except OSError:
+            self.alive = False
+
+
+class StorageServer:
+    def __init__(self, db: MessageDB, socket_path: str, max_batch: int = DEFAULT_MAX_BATCH):
+        self.db = db
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[Tuple[_Peer, Dict]]]" = queue.Queue()
+        self._peers: List[_Peer] = []
+        self.running = False
+        # 统计：提交次数与请求数，用于观察合并效果
+        self.commits = 0
+        self.requests = 0
+
+    def start(self) -> "StorageServer":
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen(64)
+        self.running = True
+        self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._accept_thread.start()
+        self._writer_thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.start()
+        self._writer_thread.join()
+
+    def shutdown(self) -> None:
+        self.running = False
+        self._queue.put(None)
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+        for peer in list(self._peers):
+            peer.alive = False
+            try:
+                peer.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            peer.sock.close()
+        self._writer_thread.join()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    # ---------- 连接 ----------
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                break
+            peer = _Peer(sock)
+            self._peers.append(peer)
+            threading.Thread(target=self._reader_loop, args=(peer,), daemon=True).start()
+
+    def _reader_loop(self, peer: _Peer):
+        try:
+            while self.running:
+                frame = recv_frame(peer.sock)
+                if frame is None:
+                    break
+                for request in frame if isinstance(frame, list) else [frame]:
+                    self._queue.put((peer, request))
+        except (OSError, ValueError):
+            pass
+        finally:
+            peer.alive = False
+            if peer in self._peers:
+                self._peers.remove(peer)
+            peer.sock.close()
+
+    # ---------- 单写者 + 组提交 ----------
+
+    def _dispatch(self, request: Dict) -> Any:
+        op = request.get("op")
+        if op not in ALLOWED_OPS:
+            raise StorageServiceError(f"不支持的操作: {op}")
+        return getattr(self.db, op)(**(request.get("args") or {}))
+
+    def _execute_group(self, items: List[Tuple[_Peer, Dict]]) -> List[Tuple[_Peer, Dict]]:
+        try:
+            with self.db.batch():
+                results = [(peer, {"id": req.get("id"), "ok": True, "result": self._dispatch(req)}) for peer, req in items]
+            self.commits += 1
+            return results
+        except Exception:
+            # 组内有请求失败：整组已回滚，逐条重做以隔离错误
+            results = []
+            for peer, req in items:
+                try:
+                    with self.db.batch():
+                        result = self._dispatch(req)
+                    results.append((peer, {"id": req.get("id"), "ok": True, "result": result}))
+                except Exception as e:
+                    results.append((peer, {"id": req.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}))
+                self.commits += 1
+            return results
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            items = [item]
+            # 取走此刻已到达的请求（来自所有进程），合并为一次提交
+            while len(items) < self.max_batch:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self.running = False
+                    break
+                items.append(nxt)
+            self.requests += len(items)
+            by_peer: Dict[int, Tuple[_Peer, List[Dict]]] = {}
+            for peer, response in self._execute_group(items):
+                by_peer.setdefault(id(peer), (peer, []))[1].append(response)
+            for peer, responses in by_peer.values():
+                peer.reply(responses)
+            if not self.running:
+                break
+
+
+class StorageClient:
+    """
+    MessageStore 协议的远程实现。线程安全；多个线程的请求在同一连接上流水线发送。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        error: Exception = ConnectionError("存储服务连接已关闭")
+        try:
+            while True:
+                frame = recv_frame(self._sock)
+                if frame is None:
+                    break
+                with self._pending_lock:
+                    future = self._pending.pop(frame.get("id"), None)
+                # 已被调用方取消（超时放弃）的不再设置结果
+                if future is None or not future.set_running_or_notify_cancel():
+                    continue
+                if frame.get("ok"):
+                    future.set_result(frame.get("result"))
+                else:
+                    future.set_exception(StorageServiceError(frame.get("error")))
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f"存储服务连接异常: {e}")
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def submit_many(self, calls: List[Tuple[str, Dict]]) -> List[Future]:
+        """
+        一帧发送多个请求（批量），返回与 calls 对应的 Future 列表。
+        调用方放弃等待时 cancel() 对应的 Future，其登记随之移除（迟到的回复被丢弃）。
+        """
+        requests, futures = [], []
+        with self._pending_lock:
+            for op, args in calls:
+                request_id = next(self._ids)
+                future: Future = Future()
+                self._pending[request_id] = future
+                future.add_done_callback(lambda f, request_id=request_id: f.cancelled() and self._forget(request_id))
+                requests.append({"id": request_id, "op": op, "args": args})
+                futures.append(future)
+        try:
+            with self._send_lock:
+                send_frame(self._sock, requests if len(requests) > 1 else requests[0])
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return futures
+
+    def _forget(self, request_id: int) -> None:
+        with self._pending_lock:
+            self._pending.pop(request_id, None)
+
+    def call(self, op: str, **args) -> Any:
+        future = self.submit_many([(op, args)])[0]
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    # ---------- MessageStore 协议 ----------
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        return self.call("load_messages", session_id=session_id)
+
+    def append_message(self, session_id: str, msg: Dict) -> None:
+        self.call("append_message", session_id=session_id, msg=msg)
+
+    def update_last_message(
+        self,
+        session_id: str,
+        content: Optional[str] = None,
+        reasoning: Optional[str] = None,
+        tool_calls: Optional[List] = None,
+        partial: bool = False,
+    ) -> None:
+        self.call(
+            "update_last_message",
+            session_id=session_id, content=content, reasoning=reasoning, tool_calls=tool_calls, partial=partial,
+        )
+
+    # ---------- 分叉 ----------
+
+    def list_message_ids(self, session_id: str) -> List[int]:
+        return self.call("list_message_ids", session_id=session_id)
+
+    def fork_session(
+        self,
+        src_session_id: str,
+        new_session_id: str,
+        at_message_id: Optional[int] = None,
+        agent_name: Optional[str] = None,
+    ) -> None:
+        self.call("fork_session", src_session_id=src_session_id, new_session_id=new_session_id,
+                  at_message_id=at_message_id, agent_name=agent_name)
+
+    def get_fork_origin(self, session_id: str) -> Optional[Tuple[str, int]]:
+        origin = self.call("get_fork_origin", session_id=session_id)
+        return tuple(origin) if origin is not None else None
+
+    def list_forks(self, session_id: str) -> List[str]:
+        return self.call("list_forks", session_id=session_id)
+
+    def load_session_parts(self, session_id: str) -> Tuple[Optional[Tuple[str, int]], List[Dict]]:
+        origin, own = self.call("load_session_parts", session_id=session_id)
+        return (tuple(origin) if origin is not None else None), own
+
+    def load_prefix(self, session_id: str, upto_message_id: int) -> List[Dict]:
+        return self.call("load_prefix", session_id=session_id, upto_message_id=upto_message_id)
+
+    def truncate_session(self, session_id: str, after_message_id: int) -> None:
+        self.call("truncate_session", session_id=session_id, after_message_id=after_message_id)
+
+    # ---------- 上下文压缩 ----------
+
+    def get_summary(self, summary_hash: str) -> Optional[str]:
+        return self.call("get_summary", summary_hash=summary_hash)
+
+    def put_summary(self, summary_hash: str, summary: str, model: Optional[str] = None) -> None:
+        self.call("put_summary", summary_hash=summary_hash, summary=summary, model=model)
+
+    def get_compaction(self, session_id: str) -> Optional[Tuple[int, str]]:
+        compaction = self.call("get_compaction", session_id=session_id)
+        return tuple(compaction) if compaction is not None else None
+
+    def set_compaction(self, session_id: str, upto_message_id: int, summary_hash: str) -> None:
+        self.call("set_compaction", session_id=session_id, upto_message_id=upto_message_id, summary_hash=summary_hash)
+
+    def load_recall_messages(self, session_id: str) -> Optional[List[Dict]]:
+        return self.call("load_recall_messages", session_id=session_id)
+
+    def recall_size(self, session_id: str) -> int:
+        return self.call("recall_size", session_id=session_id)
+
+    # ---------- 检查点 ----------
+
+    def get_checkpoint(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.call("get_checkpoint", session_id=session_id)
+
+    def set_checkpoint(self, session_id: str, phase: str, tool_calls: Optional[List[Dict]] = None) -> None:
+        self.call("set_checkpoint", session_id=session_id, phase=phase, tool_calls=tool_calls)
+
+    def mark_tool_call(self, session_id: str, tool_call_id: str, done: bool = False) -> None:
+        self.call("mark_tool_call", session_id=session_id, tool_call_id=tool_call_id, done=done)
+
+    def clear_checkpoint(self, session_id: str) -> None:
+        self.call("clear_checkpoint", session_id=session_id)
+
+    # ---------- Sessions / Agents ----------
+
+    def get_new_session_id(self) -> str:
+        return self.call("get_new_session_id")
+
+    def create_session_for_agent(self, session_id: str, agent_name: str):
+        self.call("create_session_for_agent", session_id=session_id, agent_name=agent_name)
+
+    def get_session_agent_name(self, session_id: str) -> Optional[str]:
+        return self.call("get_session_agent_name", session_id=session_id)
+
+    def clear_session(self, session_id: str) -> None:
+        self.call("clear_session", session_id=session_id)
+
+    def upsert_agent(self, agent_name: str, role_settings_yaml: str, system_prompt_text: str) -> None:
+        self.call("upsert_agent", agent_name=agent_name, role_settings_yaml=role_settings_yaml,
+                  system_prompt_text=system_prompt_text)
+
+    def list_agent_names(self) -> List[str]:
+        return self.call("list_agent_names")
+
+    def get_agent(self, agent_name: str) -> Optional[Dict]:
+        return self.call("get_agent", agent_name=agent_name)
+
+    def delete_agent(self, agent_name: str) -> None:
+        self.call("delete_agent", agent_name=agent_name)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="chat_history.db 单写者存储服务")
+    parser.add_argument("--socket", required=True, help="Unix domain socket 路径")
+    parser.add_argument("--db", default=None, help="数据库路径，默认使用全局 chat_history.db")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    args = parser.parse_args(argv)
+    if args.db is None:
+        from backend.infra.database import db
+    else:
+        db = MessageDB(args.db)
+    server = StorageServer(db, args.socket, max_batch=args.max_batch)
+    print(f"storage service listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
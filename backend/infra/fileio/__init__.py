@@ -1,6 +1,8 @@
+from .artifacts import ArtifactStore
 from .load_message import load_messages, save_messages
 
 __all__=[
+    "ArtifactStore",
     "load_messages",
     "save_messages"
-]
\ No newline at end of file
+]
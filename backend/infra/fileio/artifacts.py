@@ -0,0 +1,188 @@
+"""
+工具输出的 artifact 存储：过长的工具结果存为文件，消息里只留预览与 artifact id。
+
+目录结构：
+- <root>/objects/<artifact_id>.txt   内容，按内容寻址（artifact_id 为内容 sha256 的前 ARTIFACT_ID_LENGTH 位），
+  多个 session 产生相同输出时只存一份；
+- <root>/refs/<session 目录>/<artifact_id>   空文件，表示该 session 引用了这个 artifact。
+  session 目录为 session_id 本身（只含安全字符时）或其哈希，artifact_id 只接受十六进制，模型传入的 id 无法逃出目录。
+
+分叉 session 继承了父 session 的 tool 消息（其中的预览指向父 session 的 artifact）：读取时沿 fork_origin
+向上查找引用；删除 session 时把它的引用转给直接分叉出的子 session（heirs），不再被任何 session 引用的内容才删除。
+
+分页按"行"进行：超过 LINE_WIDTH 的行折成多段，每段算一行，单行巨长的输出（如压缩的 JSON）也能分页。
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+ARTIFACT_ID_LENGTH = 16
+# 分页时单行的最大字符数，超出折行
+LINE_WIDTH = 500
+DEFAULT_PAGE_LINES = 200
+DEFAULT_PAGE_CHARS = 6000
+
+_SAFE_SESSION = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+_ARTIFACT_ID = re.compile(rf"^[0-9a-f]{{{ARTIFACT_ID_LENGTH}}}$")
+
+
+def split_lines(text: str, width: int = LINE_WIDTH) -> List[str]:
+    """按换行切分，超过 width 的行折成多段（预览与分页共用，行号一致）。"""
+    lines: List[str] = []
+    for line in text.splitlines():
+        if len(line) <= width:
+            lines.append(line)
+        else:
+            lines.extend(line[i:i + width] for i in range(0, len(line), width))
+    return lines
+
+
+class ArtifactStore:
+    def __init__(self, root: str, fork_origin: Optional[Callable[[str], Optional[Tuple[str, int]]]] = None):
+        """
+        :param fork_origin: session -> (父 session, 分叉点) 或 None（如 MessageDB.get_fork_origin）；
+            None 表示不考虑分叉，只能读取 session 自己产生的 artifact
+        """
+        self.root = Path(root)
+        self.fork_origin = fork_origin
+        # 引用的增删与"无引用即删除内容"之间互斥
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # ToolContext 按值传给工具进程池时随之 pickle；锁只在本进程内有意义
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _session_dir(self, session_id: str) -> Path:
+        if _SAFE_SESSION.match(session_id) and session_id not in (".", ".."):
+            name = session_id
+        else:
+            name = "s-" + hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:24]
+        return self.root / "refs" / name
+
+    def _object(self, artifact_id: str) -> Path:
+        if not _ARTIFACT_ID.match(artifact_id or ""):
+            raise KeyError(artifact_id)
+        return self.root / "objects" / f"{artifact_id}.txt"
+
+    def _add_ref(self, session_id: str, artifact_id: str) -> None:
+        ref = self._session_dir(session_id) / artifact_id
+        ref.parent.mkdir(parents=True, exist_ok=True)
+        ref.touch()
+
+    def put(self, session_id: str, text: str) -> str:
+        """写入一个 artifact 并记录 session 的引用，返回其 id；内容相同的已存在时直接复用。"""
+        artifact_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:ARTIFACT_ID_LENGTH]
+        path = self._object(artifact_id)
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # 先写临时文件再改名：读者不会看到写了一半的内容
+                fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                        f.write(text)
+                    os.replace(tmp, path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+            self._add_ref(session_id, artifact_id)
+        return artifact_id
+
+    def owner(self, session_id: str, artifact_id: str) -> Optional[str]:
+        """session 或其分叉祖先中引用了该 artifact 的那个；都没有时返回 None。"""
+        self._object(artifact_id)
+        seen = set()
+        current: Optional[str] = session_id
+        while current is not None and current not in seen:
+            seen.add(current)
+            if (self._session_dir(current) / artifact_id).exists():
+                return current
+            origin = self.fork_origin(current) if self.fork_origin is not None else None
+            current = origin[0] if origin else None
+        return None
+
+    def read(self, session_id: str, artifact_id: str) -> str:
+        """完整内容；session（及其分叉祖先）没有该 artifact 时抛 KeyError。"""
+        if self.owner(session_id, artifact_id) is None:
+            raise KeyError(artifact_id)
+        try:
+            return self._object(artifact_id).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            raise KeyError(artifact_id) from None
+
+    def read_lines(
+        self,
+        session_id: str,
+        artifact_id: str,
+        start_line: int = 1,
+        max_lines: int = DEFAULT_PAGE_LINES,
+        max_chars: int = DEFAULT_PAGE_CHARS,
+    ) -> Dict:
+        """
+        一页内容：从 start_line（1 起）开始，不超过 max_lines 行、max_chars 字符（至少一行）。
+        返回 {"text", "start_line", "end_line", "total_lines"}；end_line < total_lines 表示还有后续。
+        """
+        lines = split_lines(self.read(session_id, artifact_id))
+        total = len(lines)
+        start = min(max(1, start_line), total + 1)
+        page: List[str] = []
+        chars = 0
+        for line in lines[start - 1:start - 1 + max(1, max_lines)]:
+            if page and chars + len(line) + 1 > max_chars:
+                break
+            page.append(line)
+            chars += len(line) + 1
+        return {"text": "\n".join(page), "start_line": start, "end_line": start + len(page) - 1, "total_lines": total}
+
+    def _refs(self, session_id: str) -> List[str]:
+        directory = self._session_dir(session_id)
+        if not directory.is_dir():
+            return []
+        return sorted(path.name for path in directory.iterdir() if _ARTIFACT_ID.match(path.name))
+
+    def list(self, session_id: str) -> List[Dict]:
+        """session 自己产生的 artifact（不含从分叉祖先继承的）。"""
+        result = []
+        for artifact_id in self._refs(session_id):
+            path = self._object(artifact_id)
+            if path.exists():
+                result.append({"artifact_id": artifact_id, "size": path.stat().st_size})
+        return result
+
+    def size(self, session_id: Optional[str] = None) -> int:
+        """session（None 为全部，相同内容只计一次）的 artifact 字节数。"""
+        if session_id is not None:
+            return sum(item["size"] for item in self.list(session_id))
+        directory = self.root / "objects"
+        if not directory.is_dir():
+            return 0
+        return sum(path.stat().st_size for path in directory.glob("*.txt"))
+
+    def delete_session(self, session_id: str, heirs: Iterable[str] = ()) -> None:
+        """
+        删除 session 的引用；heirs（直接分叉出的子 session）接过这些引用，其继承的预览仍可读取。
+        不再被任何 session 引用的内容随之删除。
+        """
+        heirs = list(heirs)
+        with self._lock:
+            artifact_ids = self._refs(session_id)
+            for heir in heirs:
+                for artifact_id in artifact_ids:
+                    self._add_ref(heir, artifact_id)
+            shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+            refs_root = self.root / "refs"
+            for artifact_id in artifact_ids:
+                if not any(refs_root.glob(f"*/{artifact_id}")):
+                    self._object(artifact_id).unlink(missing_ok=True)
@@ -1,8 +1,9 @@
-from .toolmanager import ToolManager
+from .toolmanager import ToolManager, ToolMetadata
 
 tool_manager = ToolManager()
 
 __all__ = ["tool_manager",
            "ToolManager",
+           "ToolMetadata",
            ]
            
\ No newline at end of file
@@ -4,7 +4,7 @@
 - skills 通过 SkillsProvider 注入，测试时可替换为 Mock，无需依赖 app/skills_manager。
 """
 from pathlib import Path
-from typing import Optional, Protocol
+from typing import Dict, Optional, Protocol
 
 from backend.config import DOCUMENT_ROOT
 
@@ -19,12 +19,19 @@ class SkillsProvider(Protocol):
     def list_skill_assets(self, skill_name: str): ...
 
 
+class ArtifactReader(Protocol):
+    """artifact 存储协议（见 infra/fileio/artifacts.py）：read_artifact 工具分页读取过长的工具输出。"""
+
+    def read_lines(self, session_id: str, artifact_id: str, start_line: int = 1, max_lines: int = 200) -> Dict: ...
+
+
 class ToolContext:
     """
     单次工具执行的上下文。
     - workspace_root: 该 Agent 允许操作的工作目录，相对路径在此下解析。
     - agent_id / session_id: 用于权限与审计。
     - skills_provider: 可选，技能类工具使用；未提供时技能类工具可返回提示或跳过。
+    - artifact_store: 可选，过长工具输出的存储，read_artifact 使用。
     """
 
     def __init__(
@@ -33,11 +40,13 @@ class ToolContext:
         agent_id: str = "",
         session_id: str = "",
         skills_provider: Optional[SkillsProvider] = None,
+        artifact_store: Optional[ArtifactReader] = None,
     ):
         self.workspace_root = Path(workspace_root or DOCUMENT_ROOT).resolve()
         self.agent_id = agent_id
         self.session_id = session_id
         self.skills_provider = skills_provider
+        self.artifact_store = artifact_store
 
     def resolve_path(self, path_str: str) -> Path:
         """
@@ -22,6 +22,7 @@ tools_list = [
     "load_skill_asset",
     "get_skill_script_path",
     "list_skill_assets",
+    "read_artifact",
 ]
 # read_file 行数差距阈值，超过则只返回前 MAX_READ_LINES 行并提示
 MAX_READ_LINES = 500
@@ -37,7 +38,8 @@ GREP_CONTEXT_LINES = 2
             "city": {"type": "string", "description": "城市名称，如北京、上海"}
         },
         "required": ["city"]
-    }
+    },
+    read_only=True,
 )
 def get_weather(ctx: ToolContext, city: str):
     return f"{city}今天晴天"
@@ -52,7 +54,8 @@ def get_weather(ctx: ToolContext, city: str):
             "skill_name": {"type": "string", "description": "技能名称，与技能目录名一致，如 data-analysis"}
         },
         "required": ["skill_name"]
-    }
+    },
+    read_only=True,
 )
 def load_skill(ctx: ToolContext, skill_name: str) -> str:
     if ctx.skills_provider is None:
@@ -70,7 +73,9 @@ def load_skill(ctx: ToolContext, skill_name: str) -> str:
             "n": {"type": "integer", "description": "返回条数，默认 5"}
         },
         "required": ["query"]
-    }
+    },
+    read_only=True,
+    cpu_bound=True,
 )
 def search_skills(ctx: ToolContext, query: str, n: int = 5):
     if ctx.skills_provider is None:
@@ -88,7 +93,9 @@ def search_skills(ctx: ToolContext, query: str, n: int = 5):
             "relative_path": {"type": "string", "description": "相对路径，如 references/REFERENCE.md"}
         },
         "required": ["skill_name", "relative_path"]
-    }
+    },
+    read_only=True,
+    io_bound=True,
 )
 def load_skill_asset(ctx: ToolContext, skill_name: str, relative_path: str) -> str:
     if ctx.skills_provider is None:
@@ -106,7 +113,8 @@ def load_skill_asset(ctx: ToolContext, skill_name: str, relative_path: str) -> s
             "script_name": {"type": "string", "description": "脚本文件名，如 compare.py"}
         },
         "required": ["skill_name", "script_name"]
-    }
+    },
+    read_only=True,
 )
 def get_skill_script_path(ctx: ToolContext, skill_name: str, script_name: str) -> str:
     if ctx.skills_provider is None:
@@ -123,7 +131,9 @@ def get_skill_script_path(ctx: ToolContext, skill_name: str, script_name: str) -
             "skill_name": {"type": "string", "description": "技能名称"}
         },
         "required": ["skill_name"]
-    }
+    },
+    read_only=True,
+    io_bound=True,
 )
 def list_skill_assets(ctx: ToolContext, skill_name: str):
     if ctx.skills_provider is None:
@@ -131,6 +141,35 @@ def list_skill_assets(ctx: ToolContext, skill_name: str):
     return ctx.skills_provider.list_skill_assets(skill_name)
 
 
+@tool_manager.register(
+    name="read_artifact",
+    description="分页读取被转存为 artifact 的过长工具输出。工具结果中给出 artifact_id 与建议的起始行，"
+                "每次返回一页并提示下一页的 start_line。",
+    parameters={
+        "type": "object",
+        "properties": {
+            "artifact_id": {"type": "string", "description": "工具结果中给出的 artifact id"},
+            "start_line": {"type": "integer", "description": "起始行（从 1 开始），默认 1"},
+            "max_lines": {"type": "integer", "description": "本页最多行数，默认 200"}
+        },
+        "required": ["artifact_id"]
+    },
+    read_only=True,
+    io_bound=True,
+)
+def read_artifact(ctx: ToolContext, artifact_id: str, start_line: int = 1, max_lines: int = 200) -> str:
+    if ctx.artifact_store is None:
+        return "[artifacts not available in this context]"
+    try:
+        page = ctx.artifact_store.read_lines(ctx.session_id, artifact_id, start_line, max_lines)
+    except KeyError:
+        return f"[artifact not found] {artifact_id}"
+    header = f"[artifact {artifact_id} 第 {page['start_line']}-{page['end_line']} 行，共 {page['total_lines']} 行"
+    if page["end_line"] < page["total_lines"]:
+        header += f"；下一页 start_line={page['end_line'] + 1}"
+    return f"{header}]\n{page['text']}"
+
+
 @tool_manager.register(
     name="list_directory",
     description="列出指定路径下的所有文件和文件夹",
@@ -141,7 +180,9 @@ def list_skill_assets(ctx: ToolContext, skill_name: str):
             "depth": {"type": "integer", "description": "深度,-1为所有"}
         },
         "required": ["path", "depth"]
-    }
+    },
+    read_only=True,
+    io_bound=True,
 )
 def list_directory(ctx: ToolContext, path: str, depth: int) -> list:
     """
@@ -188,7 +229,9 @@ def list_directory(ctx: ToolContext, path: str, depth: int) -> list:
             "module_depth": {"type": "integer", "description": "模块的深度,正整数,0为top，1包含top的子类或方法，以此类推"}
         },
         "required": ["file_path", "module_depth"]
-    }
+    },
+    read_only=True,
+    cpu_bound=True,
 )
 def list_modules(ctx: ToolContext, file_path: str, module_depth: int) -> list:
     """
@@ -232,7 +275,9 @@ def list_modules(ctx: ToolContext, file_path: str, module_depth: int) -> list:
             "end_lines": {"type": "integer", "description": "结束行数"}
         },
         "required": ["path", "start_lines", "end_lines"]
-    }
+    },
+    read_only=True,
+    io_bound=True,
 )
 def read_file(ctx: ToolContext, path: str, start_lines: int, end_lines: int) -> str:
     """
@@ -271,7 +316,9 @@ def read_file(ctx: ToolContext, path: str, start_lines: int, end_lines: int) ->
             "module_name": {"type": "string", "description": "要读取的类或函数名称"}
         },
         "required": ["path", "module_name"]
-    }
+    },
+    read_only=True,
+    cpu_bound=True,
 )
 def read_module(ctx: ToolContext, path: str, module_name: str) -> str:
     """
@@ -348,7 +395,9 @@ def read_module(ctx: ToolContext, path: str, module_name: str) -> str:
             "regex": {"type": "string", "description": "要搜索的正则表达式"}
         },
         "required": ["file_path", "regex"]
-    }
+    },
+    read_only=True,
+    io_bound=True,
 )
 def grep(ctx: ToolContext, file_path: str, regex: str) -> list:
     """
@@ -396,7 +445,8 @@ def grep(ctx: ToolContext, file_path: str, regex: str) -> list:
             "allow_fuzzy": {"type": "boolean", "description": "是否允许模糊搜索"}
         },
         "required": ["file_path", "search_block", "replace_block", "occurence", "allow_fuzzy"]
-    }
+    },
+    cpu_bound=True,
 )   
 def apply_diff(
     ctx: ToolContext,
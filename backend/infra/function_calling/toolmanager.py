@@ -1,22 +1,73 @@
+import inspect
 import warnings
-from typing import Callable, Dict, List
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
 
-# 约定：注册的 callable 签名为 (ctx: ToolContext, **kwargs) -> Any，便于与外界解耦、可插拔测试
-# 执行层负责构建 ToolContext 并传入，工具内部不依赖全局实例
+# 约定：注册的 callable 签名为 (ctx: ToolContext, **kwargs) -> Any，也可以是 async def 协程函数，
+# 便于与外界解耦、可插拔测试；执行层（app/service/tool_executor）负责构建 ToolContext 并传入，工具内部不依赖全局实例
+
+
+@dataclass(frozen=True)
+class ToolMetadata:
+    """
+        工具的调度信息，ToolExecutor 据此决定在哪里、以何种并发方式执行
+        :param is_async: 工具为协程函数，在共享事件循环上执行
+        :param io_bound: 同步工具以 IO 为主，卸载到有界线程池，可与其他 IO 工具重叠
+        :param cpu_bound: 同步工具以计算为主，不占用 IO 线程池
+        :param read_only: 不修改任何状态（隐含 idempotent），可推测执行、同一步内可与其他只读调用并发
+        :param idempotent: 相同参数重复执行无额外副作用
+        :param timeout: 单次执行的超时秒数，None 不限
+    """
+    is_async: bool = False
+    io_bound: bool = False
+    cpu_bound: bool = False
+    read_only: bool = False
+    idempotent: bool = False
+    timeout: Optional[float] = None
+
+
+DEFAULT_METADATA = ToolMetadata()
 
 
 class ToolManager:
     def __init__(self):
         self._registry: Dict[str, Callable] = {}
         self._schemas: Dict[str, dict] = {}
+        self._metadata: Dict[str, ToolMetadata] = {}
 
-    def register(self, name: str, description: str, parameters: dict):
+    def register(
+        self,
+        name: str,
+        description: str,
+        parameters: dict,
+        idempotent: bool = False,
+        read_only: bool = False,
+        io_bound: bool = False,
+        cpu_bound: bool = False,
+        timeout: Optional[float] = None,
+    ):
         """
-        注册工具：func 签名为 (ctx: ToolContext, **kwargs)，由执行层注入 ctx。
+        注册工具：func 签名为 (ctx: ToolContext, **kwargs)，由执行层注入 ctx；func 可以是 async def。
+        idempotent=True 表示以相同参数重复执行无额外副作用；
+        进程在其执行中途退出后，resume 会直接重新执行，否则只告知模型该调用被中断。
+        read_only=True 表示工具不修改任何状态（隐含 idempotent）：开启推测执行时，参数 JSON 一完整即可在模型
+        仍在输出时提前执行，结果作废也无副作用。
+        io_bound / cpu_bound / timeout 见 ToolMetadata，由 ToolExecutor 使用。
         """
+        if io_bound and cpu_bound:
+            raise ValueError(f"Tool '{name}' cannot be both io_bound and cpu_bound.")
+        idempotent = idempotent or read_only
 
         def decorator(func: Callable):
             self._registry[name] = func
+            self._metadata[name] = ToolMetadata(
+                is_async=inspect.iscoroutinefunction(func),
+                io_bound=io_bound,
+                cpu_bound=cpu_bound,
+                read_only=read_only,
+                idempotent=idempotent,
+                timeout=timeout,
+            )
             self._schemas[name] = {
                 "type": "function",
                 "function": {
@@ -29,6 +80,16 @@ class ToolManager:
 
         return decorator
 
+    def is_idempotent(self, name: str) -> bool:
+        return self.metadata(name).idempotent
+
+    def is_read_only(self, name: str) -> bool:
+        return self.metadata(name).read_only
+
+    def metadata(self, name: str) -> ToolMetadata:
+        """已注册工具的调度信息；未注册的名称返回默认值（同步、无超时）。"""
+        return self._metadata.get(name, DEFAULT_METADATA)
+
     def get_payload_components(self, tool_names: List[str],strict = False):
         """
         根据名称列表获取 tools 定义和 registry
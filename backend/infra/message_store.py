@@ -2,7 +2,7 @@
 消息存储抽象：infra 内仅依赖此协议，不互相 import 具体实现。
 上层（app）负责创建具体实现（如 MessageDB）并注入到 Stream_Buffer 等。
 """
-from typing import Dict, List, Optional, Protocol
+from typing import Dict, List, Optional, Protocol, Tuple
 
 
 class MessageStore(Protocol):
@@ -22,6 +22,63 @@ class MessageStore(Protocol):
         content: Optional[str] = None,
         reasoning: Optional[str] = None,
         tool_calls: Optional[List] = None,
+        partial: bool = False,
     ) -> None:
-        """更新该 session 最后一条消息的 content / reasoning / tool_calls。"""
+        """
+        更新该 session 最后一条消息的 content / reasoning / tool_calls。
+        partial=True 表示流式中途的进度同步，之后还会有一次最终更新；存储可据此推迟昂贵的整理（如大字段去重）。
+        """
+        ...
+
+
+class ForkableMessageStore(MessageStore, Protocol):
+    """
+    可选扩展：支持写时复制分叉的存储（如 MessageDB）。
+    实现后 Stream_Buffer 会在多个分叉 session 之间共享同一份前缀，而不是各自加载一份。
+    """
+
+    def load_session_parts(self, session_id: str) -> Tuple[Optional[Tuple[str, int]], List[Dict]]:
+        """返回 (分叉来源 (parent_session_id, fork_message_id) 或 None, 自身消息)。"""
+        ...
+
+    def load_prefix(self, session_id: str, upto_message_id: int) -> List[Dict]:
+        """session 历史中 id <= upto_message_id 的部分。"""
+        ...
+
+    def list_forks(self, session_id: str) -> List[str]:
+        """直接从 session_id 分叉出的子 session。"""
+        ...
+
+
+class CompactingMessageStore(MessageStore, Protocol):
+    """
+    可选扩展：支持上下文压缩的存储（如 MessageDB）。
+    较早的消息由一条摘要代替，原消息保留；Stream_Buffer 加载 session 时优先使用压缩后的上下文。
+    """
+
+    def load_recall_messages(self, session_id: str) -> Optional[List[Dict]]:
+        """压缩后的上下文（system 消息附带摘要 + 未压缩的消息）；未压缩返回 None。"""
+        ...
+
+
+class CheckpointingMessageStore(MessageStore, Protocol):
+    """
+    可选扩展：记录每轮 RDAS 进度的存储（如 MessageDB）。
+    进程在模型请求或工具执行中途退出后，resume 据此跳过已完成的模型请求、只补执行未完成的工具调用。
+    """
+
+    def get_checkpoint(self, session_id: str) -> Optional[Dict]:
+        """{"phase", "message_id", "tool_calls", "started", "done"}；没有检查点返回 None。"""
+        ...
+
+    def set_checkpoint(self, session_id: str, phase: str, tool_calls: Optional[List[Dict]] = None) -> None:
+        """进入新阶段，message_id 记为该 session 当前最后一行。"""
+        ...
+
+    def mark_tool_call(self, session_id: str, tool_call_id: str, done: bool = False) -> None:
+        """记录工具调用已开始 / 已完成。"""
+        ...
+
+    def truncate_session(self, session_id: str, after_message_id: int) -> None:
+        """删除 id > after_message_id 的消息。"""
         ...
@@ -0,0 +1,254 @@
+"""
+每个 session 的广播通道：Stream_Buffer 把 reasoning / content / 工具事件发布到有界环形缓冲，
+任意多个订阅者按各自的游标读取，可中途加入、从指定 offset 重放。
+
+- 生产者（读模型流的线程）只做 append + 通知，从不等待订阅者。
+- 订阅者落后时：
+    policy="drop"      游标已被覆盖则收到一条 lagged 事件后结束；
+    policy="coalesce"  积压超过 max_lag 时把连续的文本事件合并为一条；游标已被覆盖时
+                       收到一条 resync 事件（本轮累计的完整文本与工具事件），然后从最新位置继续。
+- 同时支持线程（get / for 循环）与 asyncio（aget / async for）两种消费方式。
+
+事件为 dict：{"offset": int, "type": str, "data": Any, "ts": float}
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+DEFAULT_CAPACITY = 1024
+
+POLICY_DROP = "drop"
+POLICY_COALESCE = "coalesce"
+
+# 文本增量事件：可合并，且按轮累计用于 resync
+TEXT_EVENTS = ("reasoning", "content")
+# 新一轮 stream 的起点，resync 累计从此处重置
+EVENT_START = "start"
+EVENT_LAGGED = "lagged"
+EVENT_RESYNC = "resync"
+
+
+class BroadcastChannel:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._ring: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self._head = 0
+        self._turn_start: Optional[int] = None
+        self._turn_text: Dict[str, List[str]] = {t: [] for t in TEXT_EVENTS}
+        self._turn_events: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+        self._async_waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        # 订阅者只弱引用：未 close 就被丢弃的订阅不会让通道一直被视为在用
+        self._subscriptions: "weakref.WeakSet[Subscription]" = weakref.WeakSet()
+        self.last_activity = time.monotonic()
+        self.closed = False
+
+    @property
+    def head(self) -> int:
+        """下一条事件的 offset。"""
+        return self._head
+
+    @property
+    def first_offset(self) -> int:
+        """环形缓冲中最早仍可读的 offset。"""
+        return self._head - len(self._ring)
+
+    @property
+    def idle(self) -> bool:
+        """没有未结束的订阅者（可以释放，稍后加入者只损失重放）。"""
+        with self._cond:
+            subscriptions = list(self._subscriptions)
+        return not any(not sub.finished for sub in subscriptions)
+
+    def publish(self, event_type: str, data: Any = None) -> int:
+        """发布事件并返回其 offset；通道关闭后静默丢弃（返回 -1）。"""
+        with self._cond:
+            if self.closed:
+                return -1
+            offset = self._head
+            event = {"offset": offset, "type": event_type, "data": data, "ts": time.time()}
+            self._ring.append(event)
+            self._head += 1
+            self.last_activity = time.monotonic()
+            if event_type == EVENT_START:
+                self._turn_start = offset
+                self._turn_text = {t: [] for t in TEXT_EVENTS}
+                self._turn_events = [event]
+            elif event_type in TEXT_EVENTS:
+                self._turn_text[event_type].append(data)
+            else:
+                self._turn_events.append(event)
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        self._wake_async(waiters)
+        return offset
+
+    def close(self) -> None:
+        """关闭通道：订阅者读完剩余事件后结束。"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        self._wake_async(waiters)
+
+    @staticmethod
+    def _wake_async(waiters) -> None:
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def subscribe(
+        self,
+        offset: Optional[int] = None,
+        policy: str = POLICY_COALESCE,
+        max_lag: Optional[int] = None,
+    ) -> "Subscription":
+        """
+        :param offset: 从该 offset 开始重放；None 表示从当前这一轮 stream 的起点（无进行中的轮次则从最新位置）
+        :param policy: 落后时的处理方式，drop / coalesce
+        :param max_lag: coalesce 模式下积压超过该条数即合并文本事件，默认 capacity // 4
+        """
+        if policy not in (POLICY_DROP, POLICY_COALESCE):
+            raise ValueError(f"未知策略: {policy}")
+        with self._cond:
+            if offset is None:
+                offset = self._turn_start if self._turn_start is not None else self._head
+            subscription = Subscription(self, offset, policy, max_lag if max_lag is not None else max(1, self.capacity // 4))
+            self._subscriptions.add(subscription)
+            self.last_activity = time.monotonic()
+        return subscription
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """本轮累计状态（调用方持有锁）。"""
+        return {
+            "reasoning": "".join(self._turn_text["reasoning"]),
+            "content": "".join(self._turn_text["content"]),
+            "events": list(self._turn_events),
+        }
+
+
+def _coalesce(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """合并相邻的同类文本事件；合并后 offset 取最后一条。"""
+    merged: List[Dict[str, Any]] = []
+    for event in events:
+        last = merged[-1] if merged else None
+        if last is not None and event["type"] in TEXT_EVENTS and last["type"] == event["type"]:
+            merged[-1] = {**event, "data": last["data"] + event["data"]}
+        else:
+            merged.append(event)
+    return merged
+
+
+class Subscription:
+    def __init__(self, channel: BroadcastChannel, offset: int, policy: str, max_lag: int):
+        self._channel = channel
+        self.cursor = offset
+        self.policy = policy
+        self.max_lag = max_lag
+        self.dropped = False
+        self._cancelled = False
+        # 统计：合并掉的事件数、resync 次数
+        self.coalesced = 0
+        self.resyncs = 0
+        self._pending: Deque[Dict[str, Any]] = deque()
+
+    @property
+    def finished(self) -> bool:
+        """已被丢弃 / 取消，或通道已关闭且事件已读完。"""
+        ch = self._channel
+        return self.dropped or self._cancelled or (ch.closed and self.cursor >= ch.head)
+
+    def close(self) -> None:
+        """取消订阅；唤醒阻塞在 get / aget 上的消费者。"""
+        self._cancelled = True
+        ch = self._channel
+        with ch._cond:
+            ch._subscriptions.discard(self)
+            ch.last_activity = time.monotonic()
+            ch._cond.notify_all()
+            waiters = list(ch._async_waiters)
+        ch._wake_async(waiters)
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """非阻塞读取当前可读的事件（已按策略处理落后）。"""
+        if self.dropped or self._cancelled:
+            return []
+        ch = self._channel
+        with ch._cond:
+            head, first = ch.head, ch.first_offset
+            if self.cursor < first:
+                if self.policy == POLICY_DROP:
+                    self.dropped = True
+                    return [{"offset": self.cursor, "type": EVENT_LAGGED, "data": {"missed_until": first}, "ts": time.time()}]
+                self.resyncs += 1
+                self.cursor = head
+                return [{"offset": head - 1, "type": EVENT_RESYNC, "data": ch._snapshot(), "ts": time.time()}]
+            if self.cursor >= head:
+                return []
+            start = self.cursor - first
+            events = [ch._ring[i] for i in range(start, len(ch._ring))]
+            self.cursor = head
+        if self.policy == POLICY_COALESCE and len(events) > self.max_lag:
+            merged = _coalesce(events)
+            self.coalesced += len(events) - len(merged)
+            return merged
+        return events
+
+    def get(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """阻塞直到有事件、订阅结束或超时；结束 / 超时返回 []。"""
+        ch = self._channel
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events = self.poll()
+            if events or self.finished:
+                return events
+            with ch._cond:
+                if self.cursor < ch.head or ch.closed:
+                    continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                ch._cond.wait(remaining)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        while not self.finished:
+            for event in self.get():
+                yield event
+
+    async def aget(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """asyncio 版本的 get；不占用线程。"""
+        ch = self._channel
+        loop = asyncio.get_running_loop()
+        while True:
+            events = self.poll()
+            if events or self.finished:
+                return events
+            waiter = (loop, asyncio.Event())
+            with ch._cond:
+                ch._async_waiters.add(waiter)
+            try:
+                # 注册后再检查一次，避免错过注册前的通知
+                if self._channel.head > self.cursor or ch.closed:
+                    continue
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            finally:
+                with ch._cond:
+                    ch._async_waiters.discard(waiter)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        while not self._pending:
+            if self.finished:
+                raise StopAsyncIteration
+            self._pending.extend(await self.aget())
+        return self._pending.popleft()
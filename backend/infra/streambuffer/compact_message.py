@@ -0,0 +1,140 @@
+"""
+Stream_Buffer 内存中历史消息的紧凑表示。
+
+大量在线 session 时，每条消息一个 dict（外加常为空的 model_extra dict）的固定开销占了 RSS 的大头。
+CompactMessage 用 __slots__ 存 OpenAI message 的常见字段：
+- role 经 sys.intern，全进程共享同一字符串对象；
+- 缺省字段不占对象，空的 model_extra / tool_calls 共用同一个只读单例；
+- 非空 model_extra 存为扁平 tuple，tool_calls 存为紧凑 JSON 字符串，访问时才还原为只读 dict / list
+  （省掉每条消息 1~4 个嵌套容器，代价是 create() 边界每轮还原一次）；
+- 罕见字段（name 以外的厂商扩展等）收进一个 extra dict，多数消息为 None。
+对外实现只读 Mapping（m["content"] / m.get(...) / == dict 照常可用），
+只在 client.chat.completions.create 边界经 to_openai_messages() 转为 dict。
+"""
+import json
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List
+
+from backend.infra.frozen import FrozenDict, FrozenList, freeze
+
+_EMPTY_DICT = FrozenDict()
+_EMPTY_LIST = FrozenList()
+
+_FIELDS = ("role", "content", "tool_calls", "tool_call_id", "name", "model_extra")
+_PLAIN_FIELDS = frozenset({"content", "tool_call_id", "name"})
+
+
+class _Packed(str):
+    """tool_calls 的紧凑 JSON 编码，区别于普通字符串值。"""
+    __slots__ = ()
+
+
+class _Pairs(tuple):
+    """model_extra 的扁平 (k1, v1, k2, v2, ...) 表示：一个 tuple 代替 dict。"""
+    __slots__ = ()
+
+
+def _pack_model_extra(value: Any) -> Any:
+    if isinstance(value, dict):
+        if not value:
+            return _EMPTY_DICT
+        flat = []
+        for k, v in value.items():
+            flat.append(k)
+            flat.append(freeze(v))
+        return _Pairs(flat)
+    return freeze(value)
+
+
+def _pack_tool_calls(value: Any) -> Any:
+    if isinstance(value, list):
+        if not value:
+            return _EMPTY_LIST
+        return _Packed(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+    return freeze(value)
+
+
+def _unpack(value: Any) -> Any:
+    kind = type(value)
+    if kind is _Pairs:
+        return FrozenDict(zip(value[::2], value[1::2]))
+    if kind is _Packed:
+        return freeze(json.loads(value))
+    return value
+
+
+class CompactMessage(Mapping):
+    """
+    未赋值的 slot 即表示消息中没有该键（区别于显式的 None，如 tool_calls 消息的 "content": None）。
+    """
+    __slots__ = _FIELDS + ("extra",)
+
+    def __init__(self, msg: Dict[str, Any]):
+        setattr_ = object.__setattr__
+        extra = None
+        for key, value in msg.items():
+            if key in _PLAIN_FIELDS:
+                setattr_(self, key, freeze(value))
+            elif key == "role":
+                setattr_(self, "role", sys.intern(value) if type(value) is str else value)
+            elif key == "model_extra":
+                setattr_(self, key, _pack_model_extra(value))
+            elif key == "tool_calls":
+                setattr_(self, key, _pack_tool_calls(value))
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = freeze(value)
+        setattr_(self, "extra", FrozenDict(extra) if extra else None)
+
+    def __setattr__(self, name, value):
+        raise TypeError("CompactMessage 不可修改；需要修改请先 to_dict()")
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELDS:
+            try:
+                return _unpack(getattr(self, key))
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for field in _FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return CompactMessage, (self.to_dict(),)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """OpenAI 形状的 dict；嵌套值为只读的 FrozenDict / FrozenList（仍是 dict / list，可直接序列化）。"""
+        return {key: self[key] for key in self}
+
+    def __repr__(self) -> str:
+        return f"CompactMessage({self.to_dict()!r})"
+
+
+def compact(msg: Any) -> Any:
+    """dict -> CompactMessage；已是 CompactMessage 时原样返回。"""
+    if isinstance(msg, CompactMessage) or not isinstance(msg, dict):
+        return msg
+    return CompactMessage(msg)
+
+
+def to_openai_messages(messages: Iterable[Any]) -> List[Dict[str, Any]]:
+    """create() 边界的转换：CompactMessage 展开为 dict，其余（如进行中的 assistant dict）原样传入。"""
+    return [m.to_dict() if isinstance(m, CompactMessage) else m for m in messages]
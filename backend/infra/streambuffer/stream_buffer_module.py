@@ -1,23 +1,129 @@
-import copy
 import time
 import threading
 import warnings
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union, overload
 
+from backend.infra.frozen import freeze
 from backend.infra.message_store import MessageStore
+from backend.infra.streambuffer.channel import BroadcastChannel, DEFAULT_CAPACITY, EVENT_START
+from backend.infra.streambuffer.compact_message import CompactMessage, compact
+
+
+class PrefixCache:
+    """
+    分叉 session 的共享前缀缓存（LRU）：key 为 (parent_session_id, fork_message_id)，
+    value 为只读元组。同一分叉点派生的多个 session 共享同一批 message 对象，只加载一次。
+    前缀中的 message 为只读的 CompactMessage，不会被修改：流式写入只作用于 start_stream 新追加的占位消息。
+    """
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Dict, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(store: MessageStore) -> bool:
+        """store 是否实现 ForkableMessageStore（按类型判断，mock 的动态属性不算）。"""
+        return callable(getattr(type(store), "load_session_parts", None))
+
+    def load(self, session_path: str, store: MessageStore) -> Tuple[Tuple[Dict, ...], List[Dict]]:
+        """返回 (共享前缀, 自身消息)。"""
+        origin, own = store.load_session_parts(session_path)
+        if origin is None:
+            return (), own
+        key = (origin[0], origin[1])
+        with self._lock:
+            prefix = self._entries.get(key)
+            if prefix is not None:
+                self._entries.move_to_end(key)
+        if prefix is None:
+            prefix = tuple(compact(m) for m in store.load_prefix(*key))
+            with self._lock:
+                self._entries[key] = prefix
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return prefix, own
+
+    def invalidate(self, session_path: str) -> None:
+        """session_path 的尾部被改写后丢弃以它为父的前缀（存储层已把受影响的分叉物化）。"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session_path]:
+                del self._entries[key]
+
+
+class MessagesView(Sequence):
+    """
+    SessionState 消息列表的只读快照：共享底层列表的前 length 条（均为只读消息，且列表只追加），
+    再加上快照时刻冻结的进行中消息。创建为 O(1)（外加最后一条的复制）。
+    """
+
+    __slots__ = ("_base", "_length", "_tail")
+
+    def __init__(self, base: List[Dict], length: int, tail: Optional[Dict] = None):
+        self._base = base
+        self._length = length
+        self._tail = tail
+
+    def __len__(self) -> int:
+        return self._length + (self._tail is not None)
+
+    @overload
+    def __getitem__(self, index: int) -> Dict: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Dict]: ...
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("MessagesView index out of range")
+        if index == self._length:
+            return self._tail
+        return self._base[index]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(self._length):
+            yield self._base[i]
+        if self._tail is not None:
+            yield self._tail
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, tuple, MessagesView)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MessagesView({list(self)!r})"
 
 
 class SessionState:
     """
     单个 session 的完整状态；消息从注入的 message_store 加载，不依赖具体 DB。
+    历史消息为只读的 CompactMessage（__slots__，见 compact_message.py），分叉间经 PrefixCache 共享；
+    只有 start_stream 追加的进行中 assistant 消息是可变 dict。
+    store 支持上下文压缩（CompactingMessageStore）且该 session 已压缩时，只加载摘要与未压缩的消息。
     """
-    def __init__(self, session_path: str, message_store: MessageStore):
+    def __init__(self, session_path: str, message_store: MessageStore, prefix_cache: Optional[PrefixCache] = None):
         self.session_path = session_path
         self._store = message_store
         try:
-            raw_data = message_store.load_messages(session_path)
-            # 使用深拷贝，确保即便 store 返回了共享对象，内存也是隔离的
-            self.messages = copy.deepcopy(raw_data) if raw_data else []
+            load_recall = getattr(type(message_store), "load_recall_messages", None)
+            recalled = load_recall(message_store, session_path) if callable(load_recall) else None
+            if recalled is not None:
+                self.messages = [compact(m) for m in recalled]
+            elif prefix_cache is not None and prefix_cache.supports(message_store):
+                prefix, own = prefix_cache.load(session_path, message_store)
+                # 前缀与其他分叉共享，自身消息转为紧凑只读表示
+                self.messages = list(prefix) + [compact(m) for m in own]
+            else:
+                raw_data = message_store.load_messages(session_path)
+                # 转为只读紧凑表示而非深拷贝：内存隔离由不可变性保证，store 的 FrozenDict 嵌套值直接复用
+                self.messages = [compact(m) for m in raw_data] if raw_data else []
         except FileNotFoundError:
             self.messages = []
         self.dirty = False
@@ -45,9 +151,12 @@ class SessionState:
     def mark_dirty(self):
         self.dirty = True
 
-    def snapshot_messages(self) -> List[Dict]:
-        import copy
-        return copy.deepcopy(self.messages)
+    def snapshot_messages(self) -> MessagesView:
+        """只读快照；调用方需持有 self.lock 以免与流式写入交错。"""
+        n = len(self.messages)
+        if n and not isinstance(self.messages[-1], CompactMessage):
+            return MessagesView(self.messages, n - 1, compact(freeze(self.messages[-1])))
+        return MessagesView(self.messages, n)
 
 
 class Stream_Buffer:
@@ -56,12 +165,25 @@ class Stream_Buffer:
     - 路由 session -> SessionState
     - 提供 stream 生命周期 API
     - 后台低频 flush
+    - 每个 session 一个广播通道（见 channel.py），供多个观察者旁路订阅流式事件；
+      没有订阅者且 channel_ttl 秒内没有新事件的通道由后台线程释放（本轮结束后只保留一段重放窗口）
     消息持久化通过注入的 message_store 完成，不依赖 infra 内其他模块。
     """
 
-    def __init__(self, message_store: MessageStore, flush_interval: float = 0.5):
+    def __init__(
+        self,
+        message_store: MessageStore,
+        flush_interval: float = 0.5,
+        prefix_cache_size: int = 32,
+        channel_capacity: int = DEFAULT_CAPACITY,
+        channel_ttl: float = 60.0,
+    ):
         self._message_store = message_store
         self.sessions: Dict[str, SessionState] = {}
+        self.prefix_cache = PrefixCache(prefix_cache_size)
+        self.channel_capacity = channel_capacity
+        self.channels: Dict[str, BroadcastChannel] = {}
+        self.channel_ttl = channel_ttl
         self.flush_interval = flush_interval
 
         self.global_lock = threading.Lock()
@@ -73,6 +195,56 @@ class Stream_Buffer:
             )
         self.worker.start()
 
+    # ---------- 广播 ----------
+
+    def channel(self, session_path: str) -> BroadcastChannel:
+        """获取（必要时创建）session 的广播通道；订阅用 channel(...).subscribe(...)。"""
+        with self.global_lock:
+            ch = self.channels.get(session_path)
+            if ch is None or ch.closed:
+                ch = BroadcastChannel(self.channel_capacity)
+                self.channels[session_path] = ch
+            # 取到通道到订阅之间不会被当作空闲释放
+            ch.last_activity = time.monotonic()
+            return ch
+
+    def publish(self, session_path: str, event_type: str, data=None) -> int:
+        """
+        向 session 的通道发布事件；无人订阅也会进入环形缓冲，供稍后加入者重放。
+        通道不存在时只有新一轮的 start 会创建它（中途加入者需要重放本轮），其余事件直接丢弃（返回 -1）。
+        """
+        ch = self.channels.get(session_path)
+        if ch is None:
+            if event_type != EVENT_START:
+                return -1
+            ch = self.channel(session_path)
+        return ch.publish(event_type, data)
+
+    def release_idle_channels(self) -> int:
+        """释放没有订阅者、且 channel_ttl 秒内没有事件的通道，返回释放的个数。"""
+        deadline = time.monotonic() - self.channel_ttl
+        with self.global_lock:
+            candidates = [(path, ch) for path, ch in self.channels.items() if ch.last_activity <= deadline]
+        released = 0
+        for path, ch in candidates:
+            if not ch.idle:
+                continue
+            with self.global_lock:
+                # 期间可能已被替换或有了新事件
+                if self.channels.get(path) is not ch or ch.last_activity > deadline:
+                    continue
+                del self.channels[path]
+            ch.close()
+            released += 1
+        return released
+
+    def close_channel(self, session_path: str) -> None:
+        """结束 session 的广播：订阅者读完剩余事件后退出，通道随之释放。"""
+        with self.global_lock:
+            ch = self.channels.pop(session_path, None)
+        if ch is not None:
+            ch.close()
+
     # ---------- 生命周期 ----------
 
     def start_stream(self, session_path: str) -> Dict:
@@ -85,7 +257,7 @@ class Stream_Buffer:
             state = self.sessions.get(session_path)
             if not state:
                 # 初始化内存 session
-                state = SessionState(session_path, self._message_store)
+                state = SessionState(session_path, self._message_store, self.prefix_cache)
                 self.sessions[session_path] = state
 
             assistant_message = {
@@ -97,7 +269,8 @@ class Stream_Buffer:
                 state.add_message(assistant_message)
                 self._message_store.append_message(session_path, assistant_message)
 
-            return assistant_message
+        self.publish(session_path, "start")
+        return assistant_message
 
 
     def end_stream(self, session_path: str, tool_calls: Optional[List[Dict]] = None):
@@ -115,6 +288,16 @@ class Stream_Buffer:
                 reasoning=last_msg.get("model_extra", {}).get("reasoning_content"),
                 tool_calls=tool_calls
             )
+        self.prefix_cache.invalidate(session_path)
+        if tool_calls:
+            self.publish(session_path, "tool_calls", tool_calls)
+        self.publish(session_path, "end")
+
+    def discard(self, session_path: str) -> None:
+        """丢弃 session 的内存状态（不写回存储），如中断的流在存储中被截断、需重新从存储加载时。"""
+        with self.global_lock:
+            self.sessions.pop(session_path, None)
+        self.prefix_cache.invalidate(session_path)
 
     # ---------- 增量写入 ----------
 
@@ -125,6 +308,7 @@ class Stream_Buffer:
         with state.lock:
             state.append_content(chunk)
             state.mark_dirty()
+        self.publish(session_path, "content", chunk)
 
     def append_reasoning(self, session_path: str, chunk: str):
         state = self.sessions.get(session_path)
@@ -133,6 +317,7 @@ class Stream_Buffer:
         with state.lock:
             state.append_reasoning(chunk)
             state.mark_dirty()
+        self.publish(session_path, "reasoning", chunk)
 
     def append_message(self, session_path: str, message: Dict):
         # 1. 尝试获取内存状态
@@ -147,9 +332,11 @@ class Stream_Buffer:
                     content=last_msg.get("content"),
                     reasoning=last_msg.get("model_extra", {}).get("reasoning_content")
                 )
+            self.prefix_cache.invalidate(session_path)
             with self.global_lock:
                 self.sessions.pop(session_path, None)
         self._message_store.append_message(session_path, message)
+        self.publish(session_path, "message", message)
 
     # ---------- 读取 ----------
 
@@ -195,6 +382,7 @@ class Stream_Buffer:
     def _flush_loop(self):
         while self.running:
             time.sleep(0.1)
+            self.release_idle_channels()
             with self.global_lock:
                 states = list(self.sessions.values())
 
@@ -225,7 +413,10 @@ class Stream_Buffer:
 
                     # 增量同步：更新存储中该 Session 的最后一条记录
                     # 这样即便用户没流完，存储里也能看到当前进度
-                    self._message_store.update_last_message(session_id, content=content, reasoning=reasoning)
+                    self._message_store.update_last_message(
+                        session_id, content=content, reasoning=reasoning, partial=True
+                    )
+                    self.prefix_cache.invalidate(session_id)
 
     def shutdown(self):
         self.running = False
@@ -1,8 +1,27 @@
 """
     这个接口定义了在UI中如何去与Agent进行对话, 如开始对话、继续对话、删除结束对话
 """
+import threading
+import warnings
+from typing import Callable, Optional, Tuple
+
+from backend.app.agent import basic_agent
+from backend.app.agent_registry import agent_registry
+from backend.app.global_resource import stream_buffer
+from backend.app.service.checkpoint import PHASE_REQUEST, resume_session
+from backend.app.service.context_compactor import ContextCompactor, context_compactor
+from backend.app.service.llm_scheduler import PRIORITY_INTERACTIVE, scheduling
+from backend.app.service.request_display_action_and_save import request_display_action_and_save
+from backend.app.service.tool_results import tool_result_policy
 from backend.infra.database import db
-from typing import Tuple
+
+# 一轮对话结束（含取消与异常）时在 session 广播通道上发布的事件，SSE 据此结束响应
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+
+# get_new_session_id 与建 session 不是原子的：并发请求（HTTP 服务）在此串行，避免拿到同一个 id
+_new_session_lock = threading.Lock()
+
 
 def start_chat(agent_name: str)->Tuple[str, str]:
     """
@@ -10,20 +29,124 @@ def start_chat(agent_name: str)->Tuple[str, str]:
         用户需要指定一个Agent, 并输入请求，
         程序向db发送一个创建会话的请求,并返回会话id
     """
-    session_id = db.get_new_session_id() # 获取一个之前没有使用过的会话id
-    db.create_session_for_agent(session_id, agent_name) # 创建一个会话，并绑定到指定的Agent
+    with _new_session_lock:
+        session_id = db.get_new_session_id() # 获取一个之前没有使用过的会话id
+        db.create_session_for_agent(session_id, agent_name) # 创建一个会话，并绑定到指定的Agent
     # 从Agent配置构建Agent
-    
+
     return session_id, f"Session {session_id}"
 
-def continue_chat(session_id: str):
+
+def load_agent(agent_name: str) -> basic_agent:
+    """
+        从 agents 表取 Agent（经 agent_registry 缓存，定义变更后自动重建）
+    """
+    return agent_registry.get(agent_name)
+
+
+def continue_chat(
+    session_id: str,
+    text: str,
+    token: Optional[Callable[[str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    agent_loader: Callable[[str], basic_agent] = load_agent,
+    priority: int = PRIORITY_INTERACTIVE,
+    compactor: Optional[ContextCompactor] = context_compactor,
+) -> bool:
     """
         这个接口用于继续一次对话
+        写入用户消息后循环执行 RDAS，直到模型给出最终答案或 cancel 被置位；
+        过程中的 reasoning / content / 工具事件经 stream_buffer 的广播通道发布，结束时发布 done 事件
+        priority 为模型请求在 llm_scheduler 中的排队优先级（批处理用 PRIORITY_BATCH），同一 agent 的请求公平排队
+        compactor 每一步请求前检查上下文长度，超过阈值时把较早的消息压缩为摘要；None 不压缩
+        每一步的进度写入检查点，进程中途退出后可用 resume_chat 继续
+        返回 True 表示正常完成，False 表示被取消
     """
-    pass
+    def begin(agent: basic_agent, agent_context: dict) -> bool:
+        stream_buffer.append_message(session_id, {"role": "user", "content": text})
+        db.set_checkpoint(session_id, PHASE_REQUEST)
+        return False
+
+    return _run_chat(session_id, begin, token, cancel, agent_loader, priority, compactor)
+
+
+def resume_chat(
+    session_id: str,
+    token: Optional[Callable[[str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    agent_loader: Callable[[str], basic_agent] = load_agent,
+    priority: int = PRIORITY_INTERACTIVE,
+    compactor: Optional[ContextCompactor] = context_compactor,
+) -> bool:
+    """
+        从检查点继续被中断的一轮对话（进程在模型请求或工具执行中途退出）：
+        删除半截的 assistant 消息、补执行未完成的工具调用（非幂等工具不重复执行），再继续 RDAS 循环；
+        该轮已完成时不请求模型。参数与返回值同 continue_chat
+    """
+    def begin(agent: basic_agent, agent_context: dict) -> bool:
+        return resume_session(session_id, db, stream_buffer, agent.get_payload(), agent_context,
+                              write=token or (lambda t: None))
+
+    return _run_chat(session_id, begin, token, cancel, agent_loader, priority, compactor)
+
+
+def _run_chat(
+    session_id: str,
+    begin: Callable[[basic_agent, dict], bool],
+    token: Optional[Callable[[str], None]],
+    cancel: Optional[threading.Event],
+    agent_loader: Callable[[str], basic_agent],
+    priority: int,
+    compactor: Optional[ContextCompactor],
+) -> bool:
+    """begin 准备本轮（写入用户消息或按检查点修复），返回 True 表示无需再请求模型。"""
+    agent_name = db.get_session_agent_name(session_id)
+    if agent_name is None:
+        raise KeyError(f"Session 不存在: {session_id}")
+    failed = False
+    try:
+        agent = agent_loader(agent_name)
+        agent_context = agent._agent_context()
+        finished = begin(agent, agent_context)
+        with scheduling(priority, agent.name):
+            while not finished and not (cancel is not None and cancel.is_set()):
+                if compactor is not None:
+                    _maybe_compact(compactor, session_id)
+                finished = request_display_action_and_save(
+                    client=agent.client,
+                    session_id=session_id,
+                    model_settings=agent.get_payload(),
+                    token=token or (lambda t: None),
+                    agent_context=agent_context,
+                    token_coalesce=agent.token_coalesce,
+                    cancel=cancel,
+                    checkpoint_store=db,
+                    speculative_tools=agent.speculative_tools,
+                )
+    except Exception as e:
+        failed = True
+        stream_buffer.publish(session_id, EVENT_ERROR, {"message": str(e)})
+        raise
+    finally:
+        cancelled = cancel is not None and cancel.is_set()
+        stream_buffer.publish(session_id, EVENT_DONE, {"cancelled": cancelled, "failed": failed})
+    return not cancelled
+
+
+def _maybe_compact(compactor: ContextCompactor, session_id: str) -> None:
+    """压缩失败（摘要模型不可用、返回空内容等）只告警，本轮用未压缩的历史继续。"""
+    try:
+        compactor.maybe_compact(session_id)
+    except Exception as e:
+        warnings.warn(f"Session {session_id} 上下文压缩失败: {e}", RuntimeWarning)
+
 
 def delete_chat(session_id: str):
     """
         这个接口用于删除一次对话
     """
-    pass
\ No newline at end of file
+    # 分叉出的 session 继承了本 session 的工具结果预览，接过其 artifact 引用
+    forks = db.list_forks(session_id)
+    db.clear_session(session_id)
+    tool_result_policy.store.delete_session(session_id, heirs=forks)
+    stream_buffer.close_channel(session_id)
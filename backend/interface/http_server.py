@@ -0,0 +1,252 @@
+"""
+    HTTP 服务：开始 / 继续对话，并以 SSE 推送 RDAS 的 reasoning、content、工具事件
+
+    - 每轮对话（continue_chat 的 RDAS 循环，内部是同步的 openai 流）在有界线程池中执行，
+      超出 max_workers 的轮次排队，线程数不随客户端数量增长；
+    - SSE 响应是 asyncio 协程，经 stream_buffer 广播通道的异步订阅读取事件，不占用线程；
+    - 以流式方式发起的一轮（POST .../messages?stream=true），客户端断开即置位取消信号，
+      RDAS 关闭模型流并保存已收到的内容；旁路观察（GET .../events）断开只退订，不影响该轮。
+
+    启动：python -m backend.interface.http_server --host 127.0.0.1 --port 8000
+"""
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from backend.app.global_resource import stream_buffer
+from backend.app.service.tool_processes import tool_process_pool
+from backend.infra.database import db
+from backend.infra.streambuffer.channel import POLICY_COALESCE, Subscription
+from backend.interface import chat
+
+DEFAULT_MAX_WORKERS = 32
+# 无事件时发送 SSE 注释行的间隔：保持连接，并让服务端及时发现已断开的客户端
+KEEPALIVE_INTERVAL = 15.0
+
+
+class StartChatRequest(BaseModel):
+    agent_name: str
+    text: Optional[str] = None
+
+
+class MessageRequest(BaseModel):
+    text: str
+
+
+class ChatService:
+    """
+        管理进行中的对话轮次：session -> 取消信号；同一 session 同时只允许一轮
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        agent_loader: Callable = chat.load_agent,
+        keepalive: float = KEEPALIVE_INTERVAL,
+    ):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-turn")
+        self.agent_loader = agent_loader
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._turns: Dict[str, threading.Event] = {}
+
+    def is_running(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._turns
+
+    def submit(self, session_id: str, text: str) -> threading.Event:
+        """提交一轮对话，返回其取消信号；该 session 已有进行中的轮次时抛 RuntimeError。"""
+        cancel = threading.Event()
+        with self._lock:
+            if session_id in self._turns:
+                raise RuntimeError(f"Session {session_id} 已有进行中的对话")
+            self._turns[session_id] = cancel
+        try:
+            self.executor.submit(self._run_turn, session_id, text, cancel)
+        except RuntimeError:
+            with self._lock:
+                self._turns.pop(session_id, None)
+            raise
+        return cancel
+
+    def cancel(self, session_id: str) -> bool:
+        with self._lock:
+            cancel = self._turns.get(session_id)
+        if cancel is None:
+            return False
+        cancel.set()
+        return True
+
+    def _run_turn(self, session_id: str, text: str, cancel: threading.Event) -> None:
+        try:
+            chat.continue_chat(session_id, text, cancel=cancel, agent_loader=self.agent_loader)
+        except Exception:
+            # 错误已作为 error 事件发布给订阅者
+            pass
+        finally:
+            with self._lock:
+                self._turns.pop(session_id, None)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            turns = list(self._turns.values())
+        for cancel in turns:
+            cancel.set()
+        self.executor.shutdown(wait=True)
+
+
+def _format_sse(event: Dict) -> str:
+    data = json.dumps(event["data"], ensure_ascii=False, default=str)
+    return f"id: {event['offset']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def _event_stream(
+    subscription: Subscription,
+    keepalive: float,
+    follow: bool = False,
+    cancel: Optional[threading.Event] = None,
+) -> AsyncIterator[str]:
+    """
+        订阅 -> SSE 文本；follow=False 时读到本轮 done 即结束
+        客户端断开时 Starlette 取消该生成器：退订，若持有取消信号则中止该轮
+    """
+    try:
+        while not subscription.finished:
+            events = await subscription.aget(timeout=keepalive)
+            if not events:
+                if not subscription.finished:
+                    yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield _format_sse(event)
+                if event["type"] == chat.EVENT_DONE and not follow:
+                    return
+    finally:
+        subscription.close()
+        if cancel is not None:
+            cancel.set()
+
+
+def _sse_response(body: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def create_app(service: Optional[ChatService] = None) -> FastAPI:
+    service = service or ChatService()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        service.shutdown()
+
+    app = FastAPI(title="CAOTAI", lifespan=lifespan)
+    app.state.chat_service = service
+
+    def _require_session(session_id: str) -> None:
+        # 同步的 SQLite 查询：async 路由中须经 run_in_threadpool 调用，不阻塞事件循环
+        if db.get_session_agent_name(session_id) is None:
+            raise HTTPException(status_code=404, detail=f"Session 不存在: {session_id}")
+
+    def _start_turn(session_id: str, text: str) -> threading.Event:
+        try:
+            return service.submit(session_id, text)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    @app.post("/chats")
+    def start_chat(body: StartChatRequest) -> Dict:
+        if db.get_agent(body.agent_name) is None:
+            raise HTTPException(status_code=404, detail=f"Agent 不存在: {body.agent_name}")
+        session_id, title = chat.start_chat(body.agent_name)
+        offset = stream_buffer.channel(session_id).head
+        if body.text:
+            _start_turn(session_id, body.text)
+        return {"session_id": session_id, "title": title, "offset": offset}
+
+    @app.post("/chats/{session_id}/messages")
+    async def continue_chat(session_id: str, body: MessageRequest, stream: bool = False):
+        """
+            stream=false：提交后立即返回 offset，客户端用 GET .../events?offset= 订阅；
+            stream=true：直接以 SSE 返回本轮事件，断开即取消本轮
+        """
+        await run_in_threadpool(_require_session, session_id)
+        # 先订阅再提交，不会错过本轮的第一条事件
+        channel = stream_buffer.channel(session_id)
+        subscription = channel.subscribe(offset=channel.head)
+        offset = subscription.cursor
+        try:
+            cancel = _start_turn(session_id, body.text)
+        except HTTPException:
+            subscription.close()
+            raise
+        if not stream:
+            subscription.close()
+            return {"session_id": session_id, "offset": offset}
+        return _sse_response(_event_stream(subscription, service.keepalive, cancel=cancel))
+
+    @app.get("/chats/{session_id}/events")
+    async def events(
+        session_id: str,
+        request: Request,
+        offset: Optional[int] = None,
+        policy: str = POLICY_COALESCE,
+        follow: bool = False,
+    ):
+        """
+            旁路订阅 session 的事件：offset 缺省时从当前轮起点重放；支持 Last-Event-ID 断点续传
+        """
+        await run_in_threadpool(_require_session, session_id)
+        last_event_id = request.headers.get("last-event-id")
+        if offset is None and last_event_id is not None and last_event_id.isdigit():
+            offset = int(last_event_id) + 1
+        try:
+            subscription = stream_buffer.channel(session_id).subscribe(offset=offset, policy=policy)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return _sse_response(_event_stream(subscription, service.keepalive, follow=follow))
+
+    @app.post("/chats/{session_id}/cancel")
+    def cancel_chat(session_id: str) -> Dict:
+        return {"session_id": session_id, "cancelled": service.cancel(session_id)}
+
+    @app.delete("/chats/{session_id}")
+    def delete_chat(session_id: str) -> Dict:
+        _require_session(session_id)
+        if service.is_running(session_id):
+            raise HTTPException(status_code=409, detail=f"Session {session_id} 有进行中的对话")
+        chat.delete_chat(session_id)
+        return {"session_id": session_id, "deleted": True}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发执行的对话轮次上限")
+    args = parser.parse_args()
+    # cpu_bound 工具的 worker 进程在接收请求前拉起，首个调用不承担进程启动开销
+    tool_process_pool.start()
+    try:
+        uvicorn.run(create_app(ChatService(max_workers=args.workers)), host=args.host, port=args.port)
+    finally:
+        tool_process_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
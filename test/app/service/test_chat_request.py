@@ -0,0 +1,71 @@
+import json
+from unittest.mock import MagicMock
+
+import httpx2
+import pytest
+from openai import OpenAI
+
+from backend.app.service.chat_request import create_chat_stream, encode_json
+from backend.infra.frozen import freeze
+from backend.infra.streambuffer.compact_message import compact
+
+TOOLS = [{"type": "function", "function": {"name": "read_file", "description": "读取文件",
+                                            "parameters": {"type": "object", "properties": {}, "required": []}}}]
+
+_SSE = (
+    'data: {"id":"c","object":"chat.completion.chunk","created":0,"model":"m",'
+    '"choices":[{"index":0,"delta":{"content":"hi"},"finish_reason":"stop"}]}\n\n'
+    "data: [DONE]\n\n"
+)
+
+
+@pytest.fixture
+def captured():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx2.Response(200, headers={"Content-Type": "text/event-stream"}, content=_SSE.encode())
+
+    client = OpenAI(api_key="sk-test", base_url="http://llm.local/v1",
+                    http_client=httpx2.Client(transport=httpx2.MockTransport(handler)))
+    return client, requests
+
+
+def _settings():
+    return freeze({"model": "m", "tools": TOOLS, "tools_json": encode_json(TOOLS)})
+
+
+def test_encode_json_matches_plain_json():
+    messages = [compact({"role": "user", "content": "你好"})]
+    assert json.loads(encode_json({"messages": messages, "tools": TOOLS})) == {
+        "messages": [{"role": "user", "content": "你好"}], "tools": TOOLS,
+    }
+    assert "你好".encode() in encode_json(messages)
+
+
+def test_openai_client_goes_through_create(captured):
+    client, requests = captured
+    messages = [compact({"role": "user", "content": "hi"}), {"role": "assistant", "content": None}]
+    stream = create_chat_stream(client, _settings(), messages, temperature=0.5,
+                                extra_headers={"X-Test": "1"}, extra_body={"top_k": 3})
+    assert [c.choices[0].delta.content for c in stream] == ["hi"]
+
+    request = requests[0]
+    assert request.url.path == "/v1/chat/completions"
+    assert request.headers["authorization"] == "Bearer sk-test"
+    assert request.headers["x-test"] == "1"
+    assert json.loads(request.content) == {
+        "model": "m", "messages": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": None}],
+        "stream": True, "temperature": 0.5, "top_k": 3, "tools": TOOLS,
+    }
+
+
+def test_other_clients_use_create():
+    client = MagicMock()
+    settings = _settings()
+    create_chat_stream(client, settings, [compact({"role": "user", "content": "hi"})])
+    kwargs = client.chat.completions.create.call_args.kwargs
+    assert kwargs["tools"] is settings["tools"]
+    assert kwargs["messages"] == [{"role": "user", "content": "hi"}]
+    assert kwargs["stream"] is True
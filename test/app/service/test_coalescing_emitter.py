@@ -0,0 +1,110 @@
+import threading
+import time
+
+from backend.app.service.coalescing_emitter import CoalescingEmitter
+
+
+class _Sink:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, text):
+        with self.lock:
+            self.calls.append(text)
+
+    @property
+    def text(self):
+        return "".join(self.calls)
+
+
+def test_batches_until_size_threshold():
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink, max_bytes=8, max_delay=10)
+    for ch in "abcdefghij":
+        emitter.content(ch)
+    assert sink.calls == ["abcdefgh"]
+    emitter.close()
+    assert sink.calls == ["abcdefgh", "ij"]
+
+
+def test_size_counts_utf8_bytes():
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink, max_bytes=6, max_delay=10)
+    emitter.content("你")
+    assert sink.calls == []
+    emitter.content("好")
+    assert sink.calls == ["你好"]
+    emitter.close()
+
+
+def test_time_threshold_flushes_stalled_stream():
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink, max_bytes=1024, max_delay=0.02)
+    emitter.content("a")
+    emitter.content("b")
+    deadline = time.monotonic() + 2
+    while not sink.calls and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert sink.calls == ["ab"]
+    emitter.close()
+
+
+def test_think_framing():
+    sink = _Sink()
+    with CoalescingEmitter(sink) as emitter:
+        emitter.reasoning("let me ")
+        emitter.reasoning("think")
+        emitter.content("answer")
+        # 闭合后的思考内容不再展示
+        emitter.reasoning("late")
+    assert sink.text == "<think>let me think</think>\nanswer"
+
+
+def test_think_closed_by_tool_calls_and_on_close():
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink)
+    emitter.reasoning("plan")
+    emitter.tool_calls()
+    emitter.write("tool result")
+    assert sink.text == "<think>plan</think>\ntool result"
+
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink)
+    emitter.reasoning("unfinished")
+    emitter.close()
+    assert sink.text == "<think>unfinished</think>\n"
+
+
+def test_write_flushes_buffer_in_order():
+    sink = _Sink()
+    emitter = CoalescingEmitter(sink, max_bytes=1024, max_delay=10)
+    emitter.content("partial")
+    emitter.write("\n")
+    assert sink.calls == ["partial\n"]
+    emitter.close()
+
+
+def test_passthrough_matches_per_delta_calls():
+    sink = _Sink()
+    emitter = CoalescingEmitter.from_config(sink, False)
+    emitter.reasoning("r")
+    emitter.content("a")
+    emitter.content("b")
+    emitter.close()
+    assert sink.calls == ["<think>r", "</think>\na", "b"]
+    assert emitter._timer is None
+
+
+def test_from_config_dict():
+    emitter = CoalescingEmitter.from_config(_Sink(), {"max_bytes": 16, "max_delay": 0.5})
+    assert (emitter.max_bytes, emitter.max_delay, emitter.passthrough) == (16, 0.5, False)
+
+
+def test_timer_thread_exits_on_close():
+    emitter = CoalescingEmitter(_Sink(), max_bytes=1024, max_delay=5)
+    emitter.content("x")
+    timer = emitter._timer
+    assert timer is not None and timer.is_alive()
+    emitter.close()
+    assert not timer.is_alive()
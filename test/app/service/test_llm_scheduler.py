@@ -0,0 +1,186 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import httpx2
+import pytest
+from openai import RateLimitError
+
+from backend.app.service.llm_scheduler import (
+    DEFAULT_COMPLETION_TOKENS,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    LLMScheduler,
+    RateLimitTimeout,
+    ScheduledClient,
+    TokenBucket,
+    estimate_tokens,
+    scheduling,
+)
+from backend.infra.streambuffer.compact_message import compact
+
+URL = "http://llm.local/v1"
+
+
+def test_token_bucket_refill_and_debt():
+    bucket = TokenBucket(per_minute=60, burst=2, now=0.0)
+    assert bucket.delay(2, 0.0) == 0
+    bucket.take(2, 0.0)
+    assert bucket.delay(1, 0.0) == pytest.approx(1.0)
+    assert bucket.delay(1, 0.5) == pytest.approx(0.5)
+    # 超过容量的请求按容量计：桶满即放行，之后欠账
+    assert bucket.delay(10, 2.0) == 0
+    bucket.take(10, 2.0)
+    assert bucket.delay(1, 2.0) == pytest.approx(9.0)
+    bucket.adjust(-100)
+    assert bucket.tokens == 2
+
+
+def test_estimate_tokens_reads_compact_tool_calls_without_unpacking():
+    tool_calls = [{"id": "c", "type": "function", "function": {"name": "f", "arguments": "{\"a\": 1}"}}]
+    plain = [{"role": "user", "content": "x" * 100}, {"role": "assistant", "content": None, "tool_calls": tool_calls}]
+    packed = [compact(m) for m in plain]
+    assert estimate_tokens(packed) == estimate_tokens(plain)
+    assert estimate_tokens(plain, max_tokens=0) > 50
+    assert estimate_tokens([], b"x" * 400, max_tokens=10) == 110
+
+
+def test_unlimited_lane_does_not_queue():
+    scheduler = LLMScheduler()
+    assert scheduler.acquire(URL, "m", 100) == 0.0
+    lane = scheduler.metrics()["lanes"]["m@" + URL]
+    assert lane["acquired"] == 1 and lane["waited"] == 0
+
+
+def test_rpm_limit_spaces_requests():
+    scheduler = LLMScheduler([{"url": URL + "/", "model": "m", "rpm": 1200, "rpm_burst": 1}])
+    start = time.perf_counter()
+    for _ in range(5):
+        scheduler.acquire(URL, "m", 1)
+    # 1200 rpm = 每 50ms 一个，首个立即放行
+    assert time.perf_counter() - start >= 0.19
+    metrics = scheduler.metrics()["lanes"]["m@" + URL]
+    assert metrics["acquired"] == 5 and metrics["waited"] == 4
+    assert metrics["max_wait"] > 0.03
+
+
+def test_tpm_limit_and_refund():
+    scheduler = LLMScheduler([{"url": URL, "tpm": 6000, "tpm_burst": 100}])
+    scheduler.acquire(URL, "any-model", 100)
+    # 实际只用了 10 个 token，退还 90 后立即可再取 90
+    scheduler.adjust(URL, "any-model", -90)
+    assert scheduler.acquire(URL, "any-model", 90, timeout=0.01) < 0.01
+    with pytest.raises(RateLimitTimeout):
+        scheduler.acquire(URL, "any-model", 100, timeout=0.05)
+    assert scheduler.queued(URL, "any-model") == 0
+
+
+def _enqueue_in_order(scheduler, order, specs):
+    """按顺序逐个入队（等前一个确实排上队再放下一个），记录出队顺序。"""
+    threads = []
+    for name, priority, agent in specs:
+        queued = scheduler.queued(URL, "m")
+        t = threading.Thread(target=lambda n=name, p=priority, a=agent: (
+            scheduler.acquire(URL, "m", 1, priority=p, agent_id=a), order.append(n)))
+        t.start()
+        threads.append(t)
+        deadline = time.time() + 2
+        while scheduler.queued(URL, "m") == queued and time.time() < deadline:
+            time.sleep(0.002)
+    return threads
+
+
+def test_interactive_requests_jump_batch_queue():
+    scheduler = LLMScheduler([{"url": URL, "model": "m", "rpm": 600, "rpm_burst": 1}])
+    scheduler.acquire(URL, "m", 1)
+    order = []
+    threads = _enqueue_in_order(scheduler, order, [
+        ("batch-1", PRIORITY_BATCH, "b"),
+        ("batch-2", PRIORITY_BATCH, "b"),
+        ("chat-1", PRIORITY_INTERACTIVE, "c"),
+    ])
+    for t in threads:
+        t.join(5)
+    assert order == ["chat-1", "batch-1", "batch-2"]
+    priorities = scheduler.metrics()["priorities"]
+    assert priorities[str(PRIORITY_BATCH)]["acquired"] == 2
+    assert priorities[str(PRIORITY_BATCH)]["max_wait"] > priorities[str(PRIORITY_INTERACTIVE)]["max_wait"]
+
+
+def test_agents_share_lane_fairly():
+    scheduler = LLMScheduler([{"url": URL, "model": "m", "rpm": 1200, "rpm_burst": 1}])
+    scheduler.acquire(URL, "m", 1)
+    order = []
+    # agent a 一次压入 4 个请求，b 随后只发 1 个：b 不必等 a 全部完成
+    threads = _enqueue_in_order(scheduler, order, [(f"a{i}", 0, "a") for i in range(4)] + [("b0", 0, "b")])
+    for t in threads:
+        t.join(5)
+    assert order.index("b0") <= 1
+    assert [n for n in order if n.startswith("a")] == ["a0", "a1", "a2", "a3"]
+
+
+def test_scheduling_context_sets_priority_and_agent():
+    scheduler = LLMScheduler()
+    with scheduling(PRIORITY_BATCH, "agent-x"):
+        scheduler.acquire(URL, "m", 1)
+    scheduler.acquire(URL, "m", 1)
+    priorities = scheduler.metrics()["priorities"]
+    assert priorities[str(PRIORITY_BATCH)]["acquired"] == 1
+    assert priorities[str(PRIORITY_INTERACTIVE)]["acquired"] == 1
+
+
+def _chunk(content):
+    delta = SimpleNamespace(content=content, reasoning_content=None, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def test_scheduled_client_settles_actual_usage():
+    scheduler = LLMScheduler([{"url": URL, "model": "m", "tpm": 60000, "tpm_burst": 10000}])
+    inner = MagicMock()
+    inner.chat.completions.create.return_value = iter([_chunk("ab" * 50)])
+    client = ScheduledClient(inner, scheduler, URL)
+    messages = [{"role": "user", "content": "hi"}]
+    stream = client.chat.completions.create(model="m", messages=messages, stream=True)
+    reserved = estimate_tokens(messages)
+    assert scheduler._lane(URL, "m").tpm.tokens == pytest.approx(10000 - reserved, abs=5)
+    list(stream)
+    # 预留的输出退还，只扣输入预估 + 实际输出（100 字符 ≈ 50 token）
+    used = reserved - DEFAULT_COMPLETION_TOKENS + 50
+    assert scheduler._lane(URL, "m").tpm.tokens == pytest.approx(10000 - used, abs=5)
+
+
+def test_rate_limit_error_pauses_lane():
+    scheduler = LLMScheduler()
+    inner = MagicMock()
+    response = httpx2.Response(429, headers={"retry-after": "0.2"}, request=httpx2.Request("POST", URL))
+    inner.chat.completions.create.side_effect = RateLimitError("slow down", response=response, body=None)
+    client = ScheduledClient(inner, scheduler, URL)
+    with pytest.raises(RateLimitError):
+        client.chat.completions.create(model="m", messages=[], stream=True)
+    waited = scheduler.acquire(URL, "m", 1)
+    assert 0.1 < waited < 1.0
+
+
+def test_failed_request_refunds_reservation():
+    scheduler = LLMScheduler([{"url": URL, "model": "m", "tpm": 60000, "tpm_burst": 10000}])
+    inner = MagicMock()
+    inner.chat.completions.create.side_effect = ConnectionError("refused")
+    client = ScheduledClient(inner, scheduler, URL)
+    with pytest.raises(ConnectionError):
+        client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}], stream=True)
+    assert scheduler._lane(URL, "m").tpm.tokens == pytest.approx(10000, abs=5)
+
+
+def test_stream_closed_without_iterating_settles():
+    scheduler = LLMScheduler([{"url": URL, "model": "m", "tpm": 60000, "tpm_burst": 10000}])
+    inner = MagicMock()
+    client = ScheduledClient(inner, scheduler, URL)
+    messages = [{"role": "user", "content": "hi"}]
+    stream = client.chat.completions.create(model="m", messages=messages, stream=True)
+    stream.close()
+    stream.close()
+    inner.chat.completions.create.return_value.close.assert_called()
+    # 没有输出：退还为输出预留的部分，只扣输入预估
+    used = estimate_tokens(messages) - DEFAULT_COMPLETION_TOKENS
+    assert scheduler._lane(URL, "m").tpm.tokens == pytest.approx(10000 - used, abs=5)
@@ -0,0 +1,239 @@
+import threading
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+import backend.app.service.request_display_action_and_save as rdas
+from backend.app.service.speculative_tools import JsonObjectScanner, SpeculativeTools
+from backend.app.service.tool_execution import ToolEnvironment
+from backend.app.service.tool_results import READ_ARTIFACT, ToolResultPolicy
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.fileio.artifacts import ArtifactStore
+from backend.infra.function_calling.toolmanager import ToolManager
+from backend.infra.streambuffer import Stream_Buffer
+
+
+def _feed(text, pieces=1):
+    scanner = JsonObjectScanner()
+    step = max(1, len(text) // pieces)
+    results = [scanner.feed(text[i:i + step]) for i in range(0, len(text), step)]
+    return results[-1], scanner
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": 1}',
+    '  {"path": "a}b{c", "n": [1, {"x": 2}]}  ',
+    '{"q": "say \\"}\\" now"}',
+    '{}',
+])
+def test_scanner_detects_complete_object(text):
+    for pieces in (1, 3, len(text)):
+        assert _feed(text, pieces)[0] is True
+
+
+def test_scanner_incomplete_and_invalid():
+    assert _feed('{"a": [1, 2')[0] is False
+    assert _feed('{"a": "}"')[0] is False
+    done, scanner = _feed('[1, 2]')
+    assert done is False and scanner.invalid
+    done, scanner = _feed('{"a": 1}{"a": 2}')
+    assert done is False and scanner.invalid
+
+
+def test_tool_manager_read_only_implies_idempotent():
+    manager = ToolManager()
+    manager.register("r", "", {}, read_only=True)(lambda ctx: None)
+    manager.register("w", "", {})(lambda ctx: None)
+    assert manager.is_read_only("r") and manager.is_idempotent("r")
+    assert not manager.is_read_only("w") and not manager.is_idempotent("w")
+
+
+def _chunk(delta, finish=None):
+    return ChatCompletionChunk.model_validate({
+        "id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+        "choices": [{"index": 0, "delta": {"reasoning_content": None, **delta}, "finish_reason": finish}],
+    })
+
+
+def _call(index, name=None, arguments="", call_id=None):
+    function = {"arguments": arguments}
+    if name:
+        function["name"] = name
+    return {"tool_calls": [{"index": index, "id": call_id, "type": "function", "function": function}]}
+
+
+class _ScriptedClient:
+    """按脚本产出 chunk；脚本项为 callable 时调用它（用于在流中途等待 / 观察）。"""
+
+    def __init__(self, script):
+        self.script = script
+
+    def create_chat_stream(self, model_settings, messages, **kwargs):
+        for item in self.script:
+            if callable(item):
+                item()
+            else:
+                yield item
+
+
+class _Tools:
+    def __init__(self):
+        self.log = []
+        self.started = threading.Event()
+
+    def lookup(self, ctx, key):
+        self.log.append(("lookup", key))
+        self.started.set()
+        return f"value:{key}"
+
+    def write(self, ctx, key):
+        self.log.append(("write", key))
+        self.started.set()
+        return "ok"
+
+
+@pytest.fixture
+def buffer(tmp_path, monkeypatch):
+    db = MessageDB(str(tmp_path / "chat.db"))
+    buffer = Stream_Buffer(message_store=db, flush_interval=0.05)
+    monkeypatch.setattr(rdas, "stream_buffer", buffer)
+    yield db
+    buffer.shutdown()
+    db.close()
+
+
+def _settings(tools):
+    return {"model": "m", "tools": [], "tool_registry": {"lookup": tools.lookup, "write": tools.write}}
+
+
+def _run(client, tools, speculative, monkeypatch):
+    monkeypatch.setattr(
+        "backend.app.service.speculative_tools.tool_manager.is_read_only", lambda name: name == "lookup"
+    )
+    return rdas.request_display_action_and_save(
+        client, "s", _settings(tools), lambda t: None, token_coalesce=False, speculative_tools=speculative
+    )
+
+
+def test_read_only_tool_runs_while_stream_continues(buffer, monkeypatch):
+    tools = _Tools()
+    seen_during_stream = []
+    client = _ScriptedClient([
+        _chunk(_call(0, "lookup", '{"key": ', "call_a")),
+        _chunk(_call(0, arguments='"a"}')),
+        lambda: seen_during_stream.append(tools.started.wait(2)),
+        _chunk(_call(1, "write", '{"key": "b"}', "call_b")),
+        _chunk({"content": "稍等"}, finish="tool_calls"),
+    ])
+    assert _run(client, tools, True, monkeypatch) is False
+    assert seen_during_stream == [True]
+    # 只读工具只执行一次；写工具不推测，流结束后才执行
+    assert tools.log == [("lookup", "a"), ("write", "b")]
+    results = [m for m in buffer.load_messages("s") if m["role"] == "tool"]
+    assert [(m["tool_call_id"], m["content"]) for m in results] == [("call_a", "value:a"), ("call_b", "ok")]
+
+
+def test_speculation_is_opt_in(buffer, monkeypatch):
+    tools = _Tools()
+    seen_during_stream = []
+    client = _ScriptedClient([
+        _chunk(_call(0, "lookup", '{"key": "a"}', "call_a")),
+        lambda: seen_during_stream.append(tools.started.is_set()),
+        _chunk({}, finish="tool_calls"),
+    ])
+    _run(client, tools, False, monkeypatch)
+    assert seen_during_stream == [False]
+    assert tools.log == [("lookup", "a")]
+
+
+def test_changed_arguments_discard_speculation():
+    tools = _Tools()
+    env = ToolEnvironment("s", _settings(tools))
+    speculation = SpeculativeTools(env, is_read_only=lambda name: name == "lookup")
+    call = {"id": "c", "function": {"name": "lookup", "arguments": '{"key": "a"}'}}
+    speculation.feed(0, call, call["function"]["arguments"])
+    assert speculation.started == 1
+    changed = {"id": "c", "function": {"name": "lookup", "arguments": '{"key": "z"}'}}
+    assert speculation.take(0, changed) is None
+    assert speculation.discarded == 1
+
+    # 闭合后又收到非空白片段：推测作废，流结束时照常执行
+    call = {"id": "d", "function": {"name": "lookup", "arguments": '{"key": "b"}'}}
+    speculation.feed(1, call, call["function"]["arguments"])
+    call["function"]["arguments"] += ', "extra": 1}'
+    speculation.feed(1, call, ', "extra": 1}')
+    assert speculation.take(1, call) is None
+    assert speculation.discarded == 2 and speculation.used == 0
+
+
+def test_cancel_discards_speculation(buffer, monkeypatch):
+    tools = _Tools()
+    cancel = threading.Event()
+    client = _ScriptedClient([
+        _chunk(_call(0, "lookup", '{"key": "a"}', "call_a")),
+        cancel.set,
+        _chunk({"content": "x"}),
+    ])
+    monkeypatch.setattr(
+        "backend.app.service.speculative_tools.tool_manager.is_read_only", lambda name: name == "lookup"
+    )
+    assert rdas.request_display_action_and_save(
+        client, "s", _settings(tools), lambda t: None, cancel=cancel, speculative_tools=True
+    ) is True
+    assert [m for m in buffer.load_messages("s") if m["role"] == "tool"] == []
+
+
+class _StreamError(Exception):
+    pass
+
+
+def test_stream_error_discards_speculation_and_flushes(buffer, monkeypatch):
+    tools = _Tools()
+    received = []
+
+    def fail():
+        raise _StreamError()
+
+    client = _ScriptedClient([
+        _chunk({"content": "部分"}),
+        _chunk(_call(0, "lookup", '{"key": "a"}', "call_a")),
+        fail,
+    ])
+    monkeypatch.setattr(
+        "backend.app.service.speculative_tools.tool_manager.is_read_only", lambda name: name == "lookup"
+    )
+    discarded = []
+    discard_all = SpeculativeTools.discard_all
+    monkeypatch.setattr(SpeculativeTools, "discard_all", lambda self: (discarded.append(self), discard_all(self)))
+    with pytest.raises(_StreamError):
+        rdas.request_display_action_and_save(
+            client, "s", _settings(tools), received.append, token_coalesce={"max_bytes": 1024, "max_delay": 10},
+            speculative_tools=True,
+        )
+    assert len(discarded) == 1
+    assert discarded[0].started == 1 and discarded[0].discarded == 1 and discarded[0].used == 0
+    assert "".join(received) == "部分"
+
+
+def test_discarded_speculation_leaves_no_artifact(tmp_path):
+    big = "line\n" * 5000
+
+    def lookup(ctx, key):
+        return big
+
+    policy = ToolResultPolicy(ArtifactStore(str(tmp_path / "artifacts")), spill_chars=1000, head_chars=200, tail_chars=100)
+    settings = {"model": "m", "tools": [], "tool_registry": {"lookup": lookup, READ_ARTIFACT: lambda ctx: ""}}
+    env = ToolEnvironment("s", settings, result_policy=policy)
+    speculation = SpeculativeTools(env, is_read_only=lambda name: name == "lookup")
+
+    call = {"id": "c", "function": {"name": "lookup", "arguments": '{"key": "a"}'}}
+    speculation.feed(0, call, call["function"]["arguments"])
+    speculation._calls[0].future.result(2)
+    changed = {"id": "c", "function": {"name": "lookup", "arguments": '{"key": "z"}'}}
+    assert speculation.take(0, changed) is None
+    assert policy.store.list("s") == []
+
+    speculation.feed(1, call, call["function"]["arguments"])
+    preview = speculation.take(1, call)
+    assert "read_artifact" in preview
+    assert len(policy.store.list("s")) == 1
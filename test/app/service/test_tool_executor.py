@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.app.service.tool_execution import ToolEnvironment, execute_tool_calls
+from backend.app.service.tool_executor import ToolExecutor
+from backend.infra.function_calling.toolmanager import ToolManager
+
+
+class _Buffer:
+    def __init__(self):
+        self.messages = []
+
+    def append_message(self, session_id, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def manager():
+    return ToolManager()
+
+
+@pytest.fixture
+def executor(manager):
+    executor = ToolExecutor(max_workers=4, metadata=manager.metadata)
+    yield executor
+    executor.shutdown()
+
+
+def _env(manager, executor, *names):
+    registry = {name: manager._registry[name] for name in names}
+    return ToolEnvironment("s", {"tool_registry": registry}, {"workspace_root": "."}, executor=executor)
+
+
+def _call(name, call_id="c", arguments="{}"):
+    return {"id": call_id, "function": {"name": name, "arguments": arguments}}
+
+
+def test_metadata(manager):
+    @manager.register("fetch", "", {}, read_only=True, timeout=3)
+    async def fetch(ctx):
+        return "x"
+
+    manager.register("crunch", "", {}, cpu_bound=True)(lambda ctx: None)
+    meta = manager.metadata("fetch")
+    assert meta.is_async and meta.read_only and meta.idempotent and meta.timeout == 3
+    assert manager.metadata("crunch").cpu_bound and not manager.metadata("crunch").is_async
+    assert manager.metadata("missing").timeout is None
+    with pytest.raises(ValueError):
+        manager.register("both", "", {}, io_bound=True, cpu_bound=True)
+
+
+def test_sync_tool_unchanged_and_async_tool_runs_on_loop(manager, executor):
+    threads = []
+
+    @manager.register("sync", "", {})
+    def sync_tool(ctx, n=1):
+        threads.append(threading.current_thread())
+        return {"n": n}
+
+    @manager.register("aio", "", {})
+    async def aio(ctx, n=1):
+        await asyncio.sleep(0)
+        return n * 2
+
+    env = _env(manager, executor, "sync", "aio")
+    assert env.run(_call("sync", arguments='{"n": 2}')) == '{\n  "n": 2\n}'
+    assert threads == [threading.current_thread()]
+    assert env.run(_call("aio", arguments='{"n": 2}')) == "4"
+
+
+def test_timeouts(manager, executor):
+    @manager.register("slow_async", "", {}, timeout=0.05)
+    async def slow_async(ctx):
+        await asyncio.sleep(5)
+
+    manager.register("slow_sync", "", {}, timeout=0.05)(lambda ctx: time.sleep(0.5))
+    env = _env(manager, executor, "slow_async", "slow_sync")
+    assert env.run(_call("slow_async")).startswith("[tool timeout]")
+    assert env.run(_call("slow_sync")).startswith("[tool timeout]")
+
+
+def test_arun_offloads_sync_tools(manager, executor):
+    manager.register("block", "", {})(lambda ctx: time.sleep(0.2) or "done")
+    env = _env(manager, executor, "block")
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        result = await env.arun(_call("block"))
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(main())
+    assert result == "done" and ticks > 5
+
+
+def test_read_only_io_calls_overlap_and_keep_order(manager, executor):
+    barrier = threading.Barrier(2, timeout=2)
+    log = []
+
+    def wait_for_peer(ctx, key):
+        barrier.wait()
+        return key
+
+    manager.register("fetch", "", {}, read_only=True, io_bound=True)(wait_for_peer)
+
+    @manager.register("store", "", {})
+    def store(ctx, key):
+        log.append(key)
+        return "ok"
+
+    env = _env(manager, executor, "fetch", "store")
+    calls = [
+        _call("fetch", "a", '{"key": "a"}'), _call("fetch", "b", '{"key": "b"}'),
+        _call("store", "c", '{"key": "c"}'),
+        _call("fetch", "d", '{"key": "d"}'), _call("fetch", "e", '{"key": "e"}'),
+    ]
+    buffer = _Buffer()
+    # 两个 fetch 不并发时 barrier 超时，结果为错误文本
+    execute_tool_calls(buffer, "s", calls, env, lambda text: None)
+    assert [(m["tool_call_id"], m["content"]) for m in buffer.messages] == [
+        ("a", "a"), ("b", "b"), ("c", "ok"), ("d", "d"), ("e", "e"),
+    ]
+    assert log == ["c"]
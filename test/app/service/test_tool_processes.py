@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from backend.app.service.tool_execution import ToolEnvironment
+from backend.app.service.tool_executor import ToolExecutor
+from backend.app.service.tool_processes import ToolNotPicklable, ToolProcessPool
+from backend.infra.function_calling.context import ToolContext
+from backend.infra.function_calling.register_tool import list_modules
+from backend.infra.function_calling.toolmanager import ToolManager
+
+
+def _pid(ctx):
+    return os.getpid()
+
+
+def _context(ctx):
+    return str(ctx.workspace_root), ctx.session_id
+
+
+def _big(ctx, n):
+    return "x" * n
+
+
+@pytest.fixture
+def pool():
+    pool = ToolProcessPool(workers=1, max_tasks_per_child=2, shm_threshold=1024)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_runs_in_worker_with_context_by_value(pool, tmp_path):
+    (tmp_path / "m.py").write_text("class A:\n    def f(self): pass\n\ndef g(): pass\n", encoding="utf-8")
+    ctx = ToolContext(workspace_root=tmp_path, session_id="s1")
+    assert pool.submit(_pid, ctx, {}).result(10) != os.getpid()
+    assert pool.submit(_context, ctx, {}).result(10) == (str(tmp_path.resolve()), "s1")
+    assert pool.submit(list_modules, ctx, {"file_path": "m.py", "module_depth": 1}).result(10) == ["A.f"]
+
+
+def test_large_result_via_shared_memory(pool):
+    ctx = ToolContext(workspace_root=".")
+    assert pool.submit(_big, ctx, {"n": 10}).result(10) == "x" * 10
+    assert pool.submit(_big, ctx, {"n": 1 << 20}).result(10) == "x" * (1 << 20)
+
+
+def test_workers_are_recycled(pool):
+    ctx = ToolContext(workspace_root=".")
+    pids = [pool.submit(_pid, ctx, {}).result(10) for _ in range(4)]
+    # max_tasks_per_child=2：start() 的预热任务也计数，4 次调用至少换过一次进程
+    assert len(set(pids)) >= 2
+
+
+def test_unpicklable_falls_back_in_process(pool):
+    ctx = ToolContext(workspace_root=".")
+    with pytest.raises(ToolNotPicklable):
+        pool.submit(lambda ctx: 1, ctx, {})
+
+    manager = ToolManager()
+    manager.register("pid", "", {}, cpu_bound=True)(_pid)
+    manager.register("local", "", {}, cpu_bound=True)(lambda ctx: os.getpid())
+    executor = ToolExecutor(metadata=manager.metadata, processes=pool)
+    registry = {"pid": _pid, "local": manager._registry["local"]}
+    env = ToolEnvironment("s", {"tool_registry": registry}, {"workspace_root": "."}, executor=executor)
+    assert env.run({"id": "a", "function": {"name": "pid", "arguments": "{}"}}) != str(os.getpid())
+    assert env.run({"id": "b", "function": {"name": "local", "arguments": "{}"}}) == str(os.getpid())
+    executor.shutdown()
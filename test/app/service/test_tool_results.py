@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from backend.app.service.tool_execution import ToolEnvironment
+from backend.app.service.tool_results import ToolResultPolicy
+from backend.infra.fileio.artifacts import ArtifactStore
+from backend.infra.function_calling.register_tool import read_artifact
+
+BIG = "\n".join(f"row {i:04d} " + "." * 40 for i in range(1, 501))
+
+
+@pytest.fixture
+def policy(tmp_path):
+    return ToolResultPolicy(ArtifactStore(str(tmp_path)), spill_chars=2000, head_chars=300, tail_chars=200)
+
+
+def _call(name, **arguments):
+    return {"id": "c", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+def _env(policy, tools):
+    registry = {"big": lambda ctx: BIG, "small": lambda ctx: "ok", "read_artifact": read_artifact}
+    return ToolEnvironment(
+        "s", {"tool_registry": registry}, {"allowed_tools": tools, "workspace_root": "."}, result_policy=policy
+    )
+
+
+def test_large_result_spills_with_preview(policy):
+    env = _env(policy, ["big", "small", "read_artifact"])
+    assert env.run(_call("small")) == "ok"
+    preview = env.run(_call("big"))
+    assert len(preview) < 1000 and policy.spilled == 1
+    assert "row 0001" in preview and "row 0500" in preview and "row 0250" not in preview
+    artifact_id = policy.store.list("s")[0]["artifact_id"]
+    assert policy.store.read("s", artifact_id) == BIG
+    assert f'read_artifact(artifact_id="{artifact_id}", start_line=' in preview
+
+
+def test_read_artifact_pages_are_not_spilled(policy):
+    env = _env(policy, ["big", "read_artifact"])
+    env.run(_call("big"))
+    artifact_id = policy.store.list("s")[0]["artifact_id"]
+    page = env.run(_call("read_artifact", artifact_id=artifact_id, start_line=250, max_lines=100))
+    assert page.startswith(f"[artifact {artifact_id} 第 250-349 行，共 500 行；下一页 start_line=350]")
+    assert "row 0250" in page and "row 0349" in page and policy.spilled == 1
+    assert env.run(_call("read_artifact", artifact_id="0" * 16)).startswith("[artifact not found]")
+
+
+def test_no_spill_without_read_artifact(policy):
+    # agent 不能使用 read_artifact 时模型取不回被省略的内容：原样返回
+    env = _env(policy, ["big"])
+    assert env.run(_call("big")) == BIG
+    assert policy.spilled == 0 and policy.store.size() == 0
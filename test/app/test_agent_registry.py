@@ -0,0 +1,127 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from backend.app.agent_registry import AgentRegistry, resolve_llm_settings
+from backend.app.service.endpoint_router import RoutedClient
+from backend.config import DEFAULT_MODEL
+from backend.infra.database.db_manager import MessageDB
+
+
+def _yaml(url="http://a.local/v1", key="k1", soul="s"):
+    return f"soul: {soul}\ntools: []\nllm_settings:\n  model: m\n  url: {url}\n  api_key: {key}\n"
+
+
+@pytest.fixture
+def db(tmp_path):
+    store = MessageDB(str(tmp_path / "agents.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def registry(db):
+    factory = MagicMock(side_effect=lambda **kwargs: MagicMock(name=f"client{kwargs}"))
+    reg = AgentRegistry(db, client_factory=factory)
+    reg.factory = factory
+    yield reg
+    reg.close()
+
+
+def test_agent_is_built_once(db, registry):
+    db.upsert_agent("a", _yaml(), "prompt")
+    first = registry.get("a")
+    assert registry.get("a") is first
+    assert registry.builds == 1
+    assert first.soul == "s"
+
+
+def test_clients_shared_per_endpoint(db, registry):
+    db.upsert_agent("a", _yaml(soul="x"), "")
+    db.upsert_agent("b", _yaml(soul="y"), "")
+    db.upsert_agent("c", _yaml(key="k2"), "")
+    a, b, c = registry.get("a"), registry.get("b"), registry.get("c")
+    assert a is not b
+    assert a.client is b.client
+    assert c.client is not a.client
+    assert registry.factory.call_count == 2
+
+
+def test_routed_agents_share_router(db, registry):
+    db.upsert_agent("a", "soul: x\ntools: []\nllm_settings: routed\n", "")
+    db.upsert_agent("b", "soul: y\ntools: []\nllm_settings: routed\n", "")
+    a, b = registry.get("a"), registry.get("b")
+    assert isinstance(a.client, RoutedClient)
+    assert a.client is b.client
+    assert "default" in a.client.router.endpoints
+    # 路由器的底层客户端关闭 SDK 自身的重试
+    assert all(call.kwargs["max_retries"] == 0 for call in registry.factory.call_args_list)
+
+
+def test_upsert_and_delete_invalidate(db, registry):
+    db.upsert_agent("a", _yaml(soul="old"), "")
+    old = registry.get("a")
+    db.upsert_agent("a", _yaml(soul="new"), "")
+    new = registry.get("a")
+    assert new is not old and new.soul == "new"
+    db.delete_agent("a")
+    with pytest.raises(KeyError):
+        registry.get("a")
+
+
+def test_batch_notifies_after_commit(db, registry):
+    db.upsert_agent("a", _yaml(soul="old"), "")
+    registry.get("a")
+    seen = []
+    db.add_agent_listener(seen.append)
+    with db.batch():
+        db.upsert_agent("a", _yaml(soul="new"), "")
+        assert seen == []
+    assert seen == ["a"]
+    assert registry.get("a").soul == "new"
+
+
+def test_verify_mode_without_listeners(db):
+    store = MagicMock(spec=["get_agent"])
+    store.get_agent.side_effect = db.get_agent
+    reg = AgentRegistry(store, client_factory=MagicMock())
+    assert reg.verify
+    db.upsert_agent("a", _yaml(soul="old"), "")
+    first = reg.get("a")
+    assert reg.get("a") is first
+    db.upsert_agent("a", _yaml(soul="new"), "")
+    assert reg.get("a").soul == "new"
+
+
+def test_invalidation_during_build_not_cached(db, registry):
+    db.upsert_agent("a", _yaml(soul="old"), "")
+    original = registry.build
+
+    def racing_build(name, row):
+        agent = original(name, row)
+        db.upsert_agent("a", _yaml(soul="new"), "")
+        return agent
+
+    registry.build = racing_build
+    assert registry.get("a").soul == "old"
+    registry.build = original
+    assert registry.get("a").soul == "new"
+
+
+def test_concurrent_get(db, registry):
+    db.upsert_agent("a", _yaml(), "")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("a"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8
+    assert registry.get("a") in results
+
+
+def test_resolve_llm_settings_default():
+    assert resolve_llm_settings("default").model == DEFAULT_MODEL
+    assert resolve_llm_settings(None).model == DEFAULT_MODEL
+    assert resolve_llm_settings({"model": "x", "url": "u", "api_key": "k"}).model == "x"
@@ -0,0 +1,163 @@
+"""
+HTTP 服务压测：本地 mock LLM + uvicorn 中的 FastAPI 服务，N 个客户端同时发起流式对话（POST ...?stream=true）
+并读取 SSE 直到 done。报告吞吐、首个 content 事件延迟（TTFC）、整轮耗时与进程线程数峰值。
+客户端用 asyncio 原生连接实现，不额外占用线程，线程数峰值即服务端（线程池 + 框架）的占用；
+mock LLM 运行在独立进程，不与服务争抢 GIL。
+用法：python test/benchmark/bench_chat_service.py [--clients 200] [--workers 32] [--chunks 100] [--delay 0.005]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "test" / "interface"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+import uvicorn  # noqa: E402
+
+import backend.app.service.request_display_action_and_save as rdas  # noqa: E402
+import backend.interface.chat as chat  # noqa: E402
+import backend.interface.http_server as http_server  # noqa: E402
+from backend.app.agent_registry import AgentRegistry  # noqa: E402
+from backend.infra.database.db_manager import MessageDB  # noqa: E402
+from backend.infra.streambuffer import Stream_Buffer  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+
+
+def _free_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _serve_mock(port: int, chunks: int, delay: float) -> None:
+    MockLLM(port=port, reasoning="嗯" * 10, content="好" * chunks, chunk_chars=1, delay=delay).server.serve_forever()
+
+
+async def _request(port, method, path, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = json.dumps(body).encode()
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    return reader, writer
+
+
+async def _json(port, method, path, body):
+    reader, writer = await _request(port, method, path, body)
+    raw = await reader.read()
+    writer.close()
+    return json.loads(raw.split(b"\r\n\r\n", 1)[1])
+
+
+async def _client(port, results):
+    session = await _json(port, "POST", "/chats", {"agent_name": "bench_agent"})
+    start = time.perf_counter()
+    reader, writer = await _request(port, "POST", f"/chats/{session['session_id']}/messages?stream=true", {"text": "hi"})
+    first_content = None
+    events = 0
+    event_type = None
+    async for line in reader:
+        line = line.strip()
+        if line.startswith(b"event: "):
+            event_type = line[7:].decode()
+            events += 1
+            if event_type == "content" and first_content is None:
+                first_content = time.perf_counter() - start
+            if event_type == "done":
+                break
+    writer.close()
+    results.append((first_content, time.perf_counter() - start, events))
+
+
+async def _run_clients(port, clients, results, peak):
+    async def sample():
+        while True:
+            peak[0] = max(peak[0], threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    await asyncio.gather(*(_client(port, results) for _ in range(clients)))
+    sampler.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--chunks", type=int, default=100, help="每轮 content 的 delta 数")
+    parser.add_argument("--delay", type=float, default=0.005, help="mock LLM 的 delta 间隔（秒）")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db = MessageDB(str(Path(tmp.name) / "bench.db"))
+    buffer = Stream_Buffer(message_store=db)
+    chat.db = http_server.db = db
+    chat.stream_buffer = http_server.stream_buffer = rdas.stream_buffer = buffer
+    chat.agent_registry = AgentRegistry(db)
+
+    llm_port = _free_port()
+    llm = multiprocessing.Process(target=_serve_mock, args=(llm_port, args.chunks, args.delay), daemon=True)
+    llm.start()
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", llm_port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    db.upsert_agent(
+        "bench_agent",
+        f"soul: bench\nllm_settings:\n  model: mock\n  url: http://127.0.0.1:{llm_port}/v1\n  api_key: x\n"
+        "token_coalesce: false\n",
+        "",
+    )
+    port = _free_port()
+    service = http_server.ChatService(max_workers=args.workers)
+    server = uvicorn.Server(uvicorn.Config(http_server.create_app(service), host="127.0.0.1", port=port,
+                                           log_level="error", backlog=4096))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    results, peak = [], [threading.active_count()]
+    baseline = threading.active_count()
+    start = time.perf_counter()
+    asyncio.run(_run_clients(port, args.clients, results, peak))
+    elapsed = time.perf_counter() - start
+
+    server.should_exit = True
+    thread.join()
+    llm.terminate()
+    buffer.shutdown()
+    db.close()
+
+    ttfc = sorted(r[0] for r in results if r[0] is not None)
+    total = sorted(r[1] for r in results)
+    pct = lambda xs, q: xs[min(len(xs) - 1, int(q * len(xs)))] * 1000  # noqa: E731
+    ideal = (10 + args.chunks) * args.delay
+    print(f"{args.clients} clients, {args.workers} turn workers, {10 + args.chunks} deltas/turn "
+          f"(~{ideal * 1000:.0f} ms/turn at the mock's pace)")
+    print(f"completed {len(results)} turns in {elapsed:.2f} s -> {len(results) / elapsed:.1f} turns/s, "
+          f"{sum(r[2] for r in results) / elapsed:.0f} SSE events/s")
+    print(f"TTFC p50 {pct(ttfc, 0.5):.0f} ms p99 {pct(ttfc, 0.99):.0f} ms | "
+          f"turn p50 {pct(total, 0.5):.0f} ms p99 {pct(total, 0.99):.0f} ms | mean {statistics.mean(total) * 1000:.0f} ms")
+    print(f"threads: {baseline} before, peak {peak[0]} during the run")
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+内存中消息表示的占用：每 10 万条消息，dict（旧：SessionState 深拷贝出的普通 dict）/ FrozenDict（存储层返回）/
+CompactMessage（Stream_Buffer 内存表示）的容器开销。字符串内容三者共享，单独列出。
+用法：python test/benchmark/bench_message_memory.py [--messages 100000]
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.infra.frozen import freeze  # noqa: E402
+from backend.infra.streambuffer.compact_message import compact  # noqa: E402
+
+
+def _messages(n: int, rng: random.Random):
+    """模拟 load_messages 的结果（json 解码，字符串各自独立）：user / assistant(+tool_calls) / tool 混合。"""
+    raw = []
+    for i in range(n):
+        kind = i % 4
+        if kind == 0:
+            raw.append({"role": "user", "content": f"question {i}"})
+        elif kind == 1:
+            raw.append({"role": "assistant", "content": None, "model_extra": {"reasoning_content": ""},
+                        "tool_calls": [{"id": f"c{i}", "type": "function",
+                                        "function": {"name": "read_file", "arguments": "{}"}}]})
+        elif kind == 2:
+            raw.append({"role": "tool", "content": f"result {rng.random()}", "tool_call_id": f"c{i - 1}"})
+        else:
+            raw.append({"role": "assistant", "content": f"answer {i}", "model_extra": {}})
+    return json.loads(json.dumps(raw))
+
+
+def measure(label: str, build, source, n: int) -> None:
+    tracemalloc.start()
+    held = build(source)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>15}: {current / 1e6 * 100_000 / n:8.2f} MB / 100k messages")
+    del held
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.messages
+    source = _messages(n, random.Random(0))
+    content = sum(sys.getsizeof(m.get("content") or "") for m in source)
+    print(f"string content (shared by all representations): {content / 1e6 * 100_000 / n:.2f} MB / 100k messages")
+    # 旧实现：SessionState 对 load_messages 结果整体深拷贝（字符串不复制，容器全部复制）
+    measure("dict (deepcopy)", copy.deepcopy, source, n)
+    measure("FrozenDict", lambda s: [freeze(m) for m in s], source, n)
+    # 存储层的 FrozenDict 转换后即丢弃，只有被 CompactMessage 引用的嵌套值（tool_calls 等）计入
+    measure("CompactMessage", lambda s: [compact(freeze(m)) for m in s], source, n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+payload 压缩基准：对比不压缩 / 压缩时的读写吞吐与磁盘占用。
+用法：python test/benchmark/bench_payload_compression.py [--messages 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.infra.database.codec import DEFAULT_COMPRESS_THRESHOLD, zstd_available  # noqa: E402
+from backend.infra.database.db_manager import MessageDB  # noqa: E402
+
+_WORDS = ["def", "return", "self", "import", "error", "line", "value", "for", "in", "if", "None", "path", "session"]
+
+
+def _tool_output(rng: random.Random) -> str:
+    """模拟 read_file / grep / shell 输出：词表有限、行结构重复。"""
+    return "\n".join(" ".join(rng.choice(_WORDS) for _ in range(12)) for _ in range(150))
+
+
+def run(label: str, compress_threshold, outputs, workdir: str) -> None:
+    path = os.path.join(workdir, f"{label}.db")
+    # 关闭 blob 去重，只衡量压缩本身
+    db = MessageDB(path, blob_threshold=10**12, compress_threshold=compress_threshold)
+    if compress_threshold is not None:
+        db.train_compression_dict()
+    start = time.perf_counter()
+    for i, out in enumerate(outputs):
+        db.append_message(f"s{i % 20}", {"role": "tool", "content": out, "tool_call_id": f"c{i}"})
+    write_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = sum(len(db.load_messages(f"s{s}")) for s in range(20))
+    read_s = time.perf_counter() - start
+
+    with db._write() as conn:
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    size_mb = os.path.getsize(path) / 1e6
+    print(f"{label:>6}: write {len(outputs) / write_s:8.0f} msg/s | read {loaded / read_s:8.0f} msg/s | size {size_mb:6.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    distinct = [_tool_output(rng) for _ in range(200)]
+    outputs = [distinct[i % len(distinct)] for i in range(args.messages)]
+    print(f"zstd available: {zstd_available()}")
+    with tempfile.TemporaryDirectory() as workdir:
+        run("none", None, outputs, workdir)
+        run("codec", DEFAULT_COMPRESS_THRESHOLD, outputs, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+离线回放 RDAS：先从本地 mock LLM（带每 chunk 延迟）录制 N 个 session（工具调用 + 回答，各 2 步），
+再用 ReplayClient 全速回放同样的 session，只剩存储（Stream_Buffer + MessageDB）与工具执行的开销。
+报告录制 / 回放的每秒步数与 cassette 文件大小。
+用法：python test/benchmark/bench_rdas_replay.py [--sessions 50] [--chunks 200] [--delay 0.002]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "test" / "interface"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from openai import OpenAI  # noqa: E402
+
+import backend.app.service.request_display_action_and_save as rdas  # noqa: E402
+from backend.app.service.cassette import Cassette, RecordingClient, ReplayClient  # noqa: E402
+from backend.infra.database.db_manager import MessageDB  # noqa: E402
+from backend.infra.streambuffer import Stream_Buffer  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+
+TOOLS = [{"type": "function", "function": {
+    "name": "echo", "description": "echo", "parameters": {"type": "object", "properties": {"text": {"type": "string"}}},
+}}]
+SETTINGS = {"model": "mock", "tools": TOOLS, "tool_registry": {"echo": lambda ctx, text="": text * 50}}
+
+
+def run(client, db, sessions):
+    steps = 0
+    start = time.perf_counter()
+    for i in range(sessions):
+        session_id = f"s{i}"
+        db.append_message(session_id, {"role": "system", "content": "bench"})
+        db.append_message(session_id, {"role": "user", "content": f'/tool echo {{"text": "step {i} "}}'})
+        done = False
+        while not done:
+            done = rdas.request_display_action_and_save(client, session_id, SETTINGS, lambda _: None)
+            steps += 1
+    return steps, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.cassette.gz")
+        results = {}
+        for phase in ("record", "replay"):
+            db = MessageDB(os.path.join(tmp, f"{phase}.db"))
+            buffer = Stream_Buffer(message_store=db)
+            rdas.stream_buffer = buffer
+            try:
+                if phase == "record":
+                    with MockLLM(reasoning="想" * 20, content="答" * args.chunks, chunk_chars=1,
+                                 delay=args.delay) as llm:
+                        client = RecordingClient(OpenAI(api_key="sk-bench", base_url=llm.base_url), Cassette(path))
+                        results[phase] = run(client, db, args.sessions)
+                    client.cassette.save()
+                else:
+                    results[phase] = run(ReplayClient(Cassette(path)), db, args.sessions)
+            finally:
+                buffer.shutdown()
+                db.close()
+        size = os.path.getsize(path)
+
+    print(f"{args.sessions} sessions, {args.chunks} content chunks/answer, mock delay {args.delay * 1000:.1f}ms/chunk")
+    for phase, (steps, elapsed) in results.items():
+        print(f"{phase:>7}: {steps} steps in {elapsed:.2f}s  ({steps / elapsed:.1f} steps/s)")
+    print(f"cassette: {size / 1024:.1f} KiB ({size / results['record'][0]:.0f} B/step)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+每轮 RDAS 请求的客户端开销：14 个工具、30 轮（约 90 条消息）的历史，HTTP 层用内存 MockTransport（不计网络）。
+- baseline：每轮 ModelSettings.to_payload()（model_dump）+ chat.completions.create（逐参数 TypedDict 转换 + json.dumps）
+- cached：get_payload() 缓存 + create_chat_stream（同样经 chat.completions.create，省掉每轮的 payload 重建）
+用法：python test/benchmark/bench_request_payload.py [--requests 200] [--turns 30]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import httpx2  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+from backend.app.agent import basic_agent  # noqa: E402
+from backend.app.service.chat_request import create_chat_stream  # noqa: E402
+from backend.domain.predefined.property import LLMSettingsProperty  # noqa: E402
+from backend.infra.function_calling.register_tool import tools_list  # noqa: E402
+from backend.infra.streambuffer.compact_message import compact, to_openai_messages  # noqa: E402
+
+_SSE = (
+    b'data: {"id":"c","object":"chat.completion.chunk","created":0,"model":"m",'
+    b'"choices":[{"index":0,"delta":{"content":"ok"},"finish_reason":"stop"}]}\n\ndata: [DONE]\n\n'
+)
+
+
+def _client():
+    transport = httpx2.MockTransport(
+        lambda request: httpx2.Response(200, headers={"Content-Type": "text/event-stream"}, content=_SSE)
+    )
+    return OpenAI(api_key="sk-bench", base_url="http://llm.local/v1", http_client=httpx2.Client(transport=transport))
+
+
+def _history(turns):
+    messages = [{"role": "system", "content": "You are a coding agent. " * 20}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"step {i}: please continue the refactor"})
+        messages.append({"role": "assistant", "content": None, "model_extra": {"reasoning_content": "thinking " * 30},
+                         "tool_calls": [{"id": f"c{i}", "type": "function",
+                                         "function": {"name": "read_file", "arguments": f'{{"path": "f{i}.py"}}'}}]})
+        messages.append({"role": "tool", "tool_call_id": f"c{i}", "content": "def f():\n    return 1\n" * 40})
+    return [compact(m) for m in messages]
+
+
+def baseline(agent, client, messages):
+    settings = agent.model_settings.to_payload()
+    stream = client.chat.completions.create(model=settings["model"], messages=to_openai_messages(messages),
+                                            tools=settings["tools"], stream=True)
+    for _ in stream:
+        pass
+
+
+def cached(agent, client, messages):
+    stream = create_chat_stream(client, agent.get_payload(), messages)
+    for _ in stream:
+        pass
+
+
+def measure(label, fn, agent, client, messages, n):
+    fn(agent, client, messages)  # 预热
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(agent, client, messages)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>9}: {elapsed / n * 1000:7.3f} ms/request")
+    return elapsed / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=30)
+    args = parser.parse_args()
+    client = _client()
+    agent = basic_agent(name="bench", description="", skills=[], rules=[], soul="", tools=tools_list,
+                        llm_settings=LLMSettingsProperty(model="m", url="http://llm.local/v1", api_key="sk-bench"),
+                        client=client)
+    messages = _history(args.turns)
+    print(f"{len(agent.get_payload()['tools'])} tools ({len(agent.get_payload()['tools_json'])} bytes), "
+          f"{len(messages)} messages")
+    base = measure("baseline", baseline, agent, client, messages, args.requests)
+    fast = measure("cached", cached, agent, client, messages, args.requests)
+    print(f"speedup: {base / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+SessionState 基准：2,000 条消息（含大量大体积工具输出）的 session，
+对比旧实现（加载深拷贝 + 快照深拷贝）与结构共享（冻结共享 + O(1) 快照视图）的耗时与内存分配。
+用法：python test/benchmark/bench_session_state.py [--messages 2000] [--turns 20]
+"""
+import argparse
+import copy
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.infra.frozen import freeze  # noqa: E402
+from backend.infra.streambuffer.stream_buffer_module import SessionState  # noqa: E402
+
+
+class _Store:
+    """模拟存储 / 缓存层：每次返回同一批（已冻结的）message 对象。"""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def load_messages(self, session_id):
+        return self.messages
+
+
+class _DeepCopyState:
+    """旧实现：加载与快照都整体深拷贝。"""
+
+    def __init__(self, store, session_id):
+        self.messages = copy.deepcopy(store.load_messages(session_id))
+
+    def snapshot_messages(self):
+        return copy.deepcopy(self.messages)
+
+
+def _history(n: int, rng: random.Random):
+    messages = [{"role": "system", "content": "You are a helpful agent. " * 40}]
+    for i in range(n - 1):
+        kind = i % 4
+        if kind == 0:
+            messages.append({"role": "user", "content": f"step {i}: " + "please continue " * rng.randint(2, 20)})
+        elif kind == 1:
+            messages.append({
+                "role": "assistant",
+                "content": None,
+                "model_extra": {"reasoning_content": "thinking " * rng.randint(10, 60)},
+                "tool_calls": [{"id": f"c{i}", "type": "function",
+                                "function": {"name": "read_file", "arguments": f'{{"path": "f{i}.py"}}'}}],
+            })
+        elif kind == 2:
+            # 大体积工具输出（read_file / grep 结果）
+            messages.append({"role": "tool", "tool_call_id": f"c{i - 1}",
+                             "content": "".join(rng.choice("abcdefgh \n") for _ in range(rng.randint(4000, 16000)))})
+        else:
+            messages.append({"role": "assistant", "content": "ok " * rng.randint(5, 50), "model_extra": {}})
+    return messages
+
+
+def _turn(make_state, store) -> None:
+    state = make_state(store)
+    state.messages.append({"role": "assistant", "content": "", "model_extra": {"reasoning_content": ""}})
+    state.snapshot_messages()
+
+
+def measure(label: str, make_state, store, turns: int) -> None:
+    start = time.perf_counter()
+    for _ in range(turns):
+        _turn(make_state, store)
+    elapsed = time.perf_counter() - start
+    # 内存单独测一轮：tracemalloc 本身会显著拖慢分配密集的代码
+    tracemalloc.start()
+    _turn(make_state, store)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>10}: {elapsed / turns * 1000:8.2f} ms/turn | peak alloc {peak / 1e6:8.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+    history = _history(args.messages, random.Random(0))
+    size_mb = sum(len(m.get("content") or "") for m in history) / 1e6
+    print(f"{args.messages} messages, ~{size_mb:.1f} MB of content")
+    measure("deepcopy", lambda s: _DeepCopyState(s, "s"), _Store(history), args.turns)
+    measure("shared", lambda s: SessionState("s", s), _Store([freeze(m) for m in history]), args.turns)
+
+
+if __name__ == "__main__":
+    main()
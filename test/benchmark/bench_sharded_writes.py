@@ -0,0 +1,57 @@
+"""
+分片写入基准：并发写线程在 1 / 4 / 16 个分片下的 append_message 吞吐。
+用法：python test/benchmark/bench_sharded_writes.py [--writers 16] [--seconds 3]
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.infra.database.sharded import ShardedMessageDB  # noqa: E402
+
+
+def run(shards: int, writers: int, seconds: float) -> float:
+    with tempfile.TemporaryDirectory() as root:
+        db = ShardedMessageDB(root, shards=shards)
+        stop = threading.Event()
+        counts = [0] * writers
+
+        def writer(k: int):
+            i = 0
+            while not stop.is_set():
+                # 每个写线程轮换多个 session，模拟多会话 flush
+                sid = f"w{k}_s{i % 8}"
+                db.append_message(sid, {"role": "assistant", "content": f"chunk {i}"})
+                db.update_last_message(sid, content=f"chunk {i} done")
+                i += 1
+            counts[k] = i
+
+        threads = [threading.Thread(target=writer, args=(k,)) for k in range(writers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    for shards in (1, 4, 16):
+        rate = run(shards, args.writers, args.seconds)
+        print(f"shards={shards:>2} writers={args.writers}: {rate:8.0f} append+update/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+token 回调合并基准：模拟模型以 1~3 字符的 delta 流式输出，UI 回调为一次 os.write（等价 print(..., flush=True)）。
+对比逐 delta 回调与 CoalescingEmitter 的写系统调用次数、回调耗时，以及每个 delta 从到达到写出的延迟。
+- burst：delta 不间断到达（网络积压 / 本地快模型），看吞吐与系统调用；
+- paced：按 --rate 个 delta/秒到达（典型在线模型），看感知延迟。
+用法：python test/benchmark/bench_token_emitter.py [--deltas 20000] [--rate 300]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.app.service.coalescing_emitter import CoalescingEmitter  # noqa: E402
+
+
+class _Writer:
+    """UI 回调：每次一次 write 系统调用；记录写出时刻以计算延迟。"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.syscalls = 0
+        self.written = 0
+        self.emitted_at = []  # (累计写出字符数, 时刻)
+
+    def __call__(self, text):
+        os.write(self.fd, text.encode("utf-8"))
+        self.syscalls += 1
+        self.written += len(text)
+        self.emitted_at.append((self.written, time.perf_counter()))
+
+
+def _deltas(n, rng):
+    alphabet = "abcdefghij 你好，。\n"
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(n)]
+
+
+def _latencies(arrivals, writer):
+    """arrivals: (该 delta 结束时的累计字符数, 到达时刻)；找到第一次覆盖它的写出。"""
+    out, j = [], 0
+    emitted = writer.emitted_at
+    for end, t in arrivals:
+        while emitted[j][0] < end:
+            j += 1
+        out.append(emitted[j][1] - t)
+    return out
+
+
+def run(label, deltas, make_emitter, rate, fd):
+    writer = _Writer(fd)
+    emitter = make_emitter(writer)
+    interval = 1.0 / rate if rate else 0.0
+    arrivals, total = [], 0
+    start = time.perf_counter()
+    next_at = start
+    for d in deltas:
+        if interval:
+            next_at += interval
+            while time.perf_counter() < next_at:
+                pass
+        total += len(d)
+        arrivals.append((total, time.perf_counter()))
+        emitter.content(d)
+    emitter.close()
+    elapsed = time.perf_counter() - start
+    lat = sorted(_latencies(arrivals, writer))
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000  # noqa: E731
+    print(f"{label:>24}: {writer.syscalls:7d} writes | {writer.syscalls / elapsed:10.0f} writes/s | "
+          f"{len(deltas) / elapsed:10.0f} deltas/s | latency p50 {p(0.5):6.2f} ms p99 {p(0.99):6.2f} ms "
+          f"max {lat[-1] * 1000:6.2f} ms | mean {statistics.mean(lat) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deltas", type=int, default=20000)
+    parser.add_argument("--rate", type=int, default=300)
+    args = parser.parse_args()
+    deltas = _deltas(args.deltas, random.Random(0))
+    fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        configs = [
+            ("per-delta", lambda w: CoalescingEmitter.from_config(w, False)),
+            ("coalesce 64B/16ms", lambda w: CoalescingEmitter(w)),
+            ("coalesce 256B/50ms", lambda w: CoalescingEmitter(w, max_bytes=256, max_delay=0.05)),
+        ]
+        print(f"burst: {args.deltas} deltas")
+        for label, make in configs:
+            run(label, deltas, make, 0, fd)
+        paced = deltas[: max(1, args.rate * 3)]
+        print(f"paced: {len(paced)} deltas at {args.rate}/s")
+        for label, make in configs:
+            run(label, paced, make, args.rate, fd)
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    main()
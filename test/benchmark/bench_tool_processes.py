@@ -0,0 +1,137 @@
+"""
+CPU 密集工具对流式输出的影响：一个 session 从本地 mock LLM（每 chunk 固定延迟）流式输出，
+同时若干线程反复调用 list_modules / read_module 解析一个大的 Python 文件（AST）。
+分别在无负载、工具在进程内执行、工具在进程池中执行三种情况下，报告流式线程相邻两个 token 回调的间隔
+（p50 / p99 / max）与工具吞吐。
+用法：python test/benchmark/bench_tool_processes.py [--chunks 200] [--delay 0.005] [--load-threads 2] [--workers 4] [--classes 100]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "test" / "interface"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from openai import OpenAI  # noqa: E402
+
+import backend.app.service.request_display_action_and_save as rdas  # noqa: E402
+from backend.app.service.tool_execution import ToolEnvironment  # noqa: E402
+from backend.app.service.tool_executor import ToolExecutor  # noqa: E402
+from backend.app.service.tool_processes import ToolProcessPool  # noqa: E402
+from backend.infra.database.db_manager import MessageDB  # noqa: E402
+from backend.infra.function_calling import tool_manager  # noqa: E402
+from backend.infra.streambuffer import Stream_Buffer  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+
+_, REGISTRY = tool_manager.get_payload_components(["list_modules", "read_module"])
+
+
+def write_module(path, classes):
+    lines = []
+    for c in range(classes):
+        lines.append(f"class Handler{c}:")
+        for m in range(20):
+            lines.append(f"    def method_{m}(self, request, *args, **kwargs):")
+            lines.append(f"        return [x * {m} for x in range(len(request.args)) if x % {c + 2}]")
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def load(env, stop, counter):
+    calls = [
+        {"id": "a", "function": {"name": "list_modules", "arguments": json.dumps(
+            {"file_path": "big.py", "module_depth": 1})}},
+        {"id": "b", "function": {"name": "read_module", "arguments": json.dumps(
+            {"path": "big.py", "module_name": "Handler7.method_3"})}},
+    ]
+    i = 0
+    while not stop.is_set():
+        env.run(calls[i % 2])
+        i += 1
+        counter.append(1)
+
+
+def measure(llm, db, executor, workspace, args):
+    stop = threading.Event()
+    counter = []
+    threads = []
+    if executor is not None:
+        agent_context = {"workspace_root": str(workspace), "allowed_tools": list(REGISTRY)}
+        for _ in range(args.load_threads):
+            env = ToolEnvironment("load", {"tool_registry": REGISTRY}, agent_context, executor=executor)
+            threads.append(threading.Thread(target=load, args=(env, stop, counter), daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+
+    stamps = []
+    session_id = f"s{time.perf_counter_ns()}"
+    db.append_message(session_id, {"role": "user", "content": "hi"})
+    client = OpenAI(api_key="sk-bench", base_url=llm.base_url)
+    start = time.perf_counter()
+    rdas.request_display_action_and_save(
+        client, session_id, {"model": "mock", "tools": []}, lambda _: stamps.append(time.perf_counter()),
+        token_coalesce=False,
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    gaps = [(b - a) * 1000 for a, b in zip(stamps, stamps[1:])]
+    return gaps, elapsed, len(counter) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.005)
+    parser.add_argument("--load-threads", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--classes", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = Path(tmp)
+        write_module(workspace / "big.py", args.classes)
+        db = MessageDB(os.path.join(tmp, "bench.db"))
+        buffer = Stream_Buffer(message_store=db)
+        rdas.stream_buffer = buffer
+        pool = ToolProcessPool(workers=args.workers)
+        pool.start()
+        modes = {
+            "idle": None,
+            "in-process": ToolExecutor(processes=ToolProcessPool(workers=0)),
+            "process pool": ToolExecutor(processes=pool),
+        }
+        results = {}
+        try:
+            with MockLLM(reasoning="", content="答" * args.chunks, chunk_chars=1, delay=args.delay) as llm:
+                for name, executor in modes.items():
+                    results[name] = measure(llm, db, executor, workspace, args)
+        finally:
+            pool.shutdown()
+            buffer.shutdown()
+            db.close()
+
+    size = (args.classes * 41) // 1000
+    print(f"{args.chunks} chunks at {args.delay * 1000:.1f}ms/chunk; load: {args.load_threads} threads parsing "
+          f"a ~{size}k-line module; pool: {args.workers} workers, {os.cpu_count()} CPUs")
+    for name, (gaps, elapsed, rate) in results.items():
+        print(f"{name:>12}: stream {elapsed:.2f}s, token gap p50 {percentile(gaps, 0.5):.1f}ms "
+              f"p99 {percentile(gaps, 0.99):.1f}ms max {max(gaps):.1f}ms, tools {rate:.1f} calls/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+过长工具输出转存 artifact 的收益：先从本地 mock LLM 录制 N 个 session（每个 session 多轮，每轮 read_file 读一个
+几百行的文件再回答），再用 ReplayClient 回放两遍——不转存 / 转存（agent 允许 read_artifact）。
+报告发给模型的 token 预估（每次请求的 estimate_tokens 之和）与存储字节数（SQLite 文件 + artifact 文件）。
+用法：python test/benchmark/bench_tool_result_spill.py [--sessions 20] [--turns 4] [--lines 400]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "test" / "interface"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from openai import OpenAI  # noqa: E402
+
+import backend.app.service.request_display_action_and_save as rdas  # noqa: E402
+import backend.app.service.tool_execution as tool_execution  # noqa: E402
+from backend.app.service.cassette import Cassette, RecordingClient, ReplayClient  # noqa: E402
+from backend.app.service.llm_scheduler import estimate_tokens  # noqa: E402
+from backend.app.service.tool_results import ToolResultPolicy  # noqa: E402
+from backend.infra.database.db_manager import MessageDB  # noqa: E402
+from backend.infra.fileio.artifacts import ArtifactStore  # noqa: E402
+from backend.infra.function_calling import tool_manager  # noqa: E402
+from backend.infra.streambuffer import Stream_Buffer  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+
+TOOLS, REGISTRY = tool_manager.get_payload_components(["read_file", "read_artifact"])
+SETTINGS = {"model": "mock", "tools": TOOLS, "tool_registry": REGISTRY}
+
+
+class TokenCounter:
+    """chat_request.create_chat_stream 扩展点：累计每次请求发出的 token 预估。"""
+
+    def __init__(self, client):
+        self.client = client
+        self.tokens = 0
+        self.requests = 0
+
+    def create_chat_stream(self, model_settings, messages, **kwargs):
+        messages = list(messages)
+        self.tokens += estimate_tokens(messages, max_tokens=0)
+        self.requests += 1
+        return self.client.create_chat_stream(model_settings, messages, **kwargs)
+
+
+def write_files(workspace, count, lines):
+    for k in range(count):
+        text = "\n".join(f"{k:02d}:{i:04d}  def handler_{i}(request): return render(request, 'page_{i}.html')"
+                         for i in range(1, lines + 1))
+        (workspace / f"f{k}.txt").write_text(text, encoding="utf-8")
+
+
+def run(client, db, args, agent_context):
+    for s in range(args.sessions):
+        session_id = f"s{s}"
+        db.append_message(session_id, {"role": "system", "content": "bench"})
+        for turn in range(args.turns):
+            arguments = {"path": f"f{turn}.txt", "start_lines": 1, "end_lines": args.lines}
+            db.append_message(session_id, {"role": "user", "content": f"/tool read_file {json.dumps(arguments)}"})
+            done = False
+            while not done:
+                done = rdas.request_display_action_and_save(
+                    client, session_id, SETTINGS, lambda _: None, agent_context=agent_context
+                )
+
+
+def db_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=400)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = Path(tmp) / "workspace"
+        workspace.mkdir()
+        write_files(workspace, args.turns, args.lines)
+        cassette_path = os.path.join(tmp, "spill.cassette.gz")
+        results = {}
+        for phase in ("record", "off", "on"):
+            allowed = ["read_file", "read_artifact"] if phase == "on" else ["read_file"]
+            agent_context = {"allowed_tools": allowed, "workspace_root": str(workspace)}
+            store = ArtifactStore(os.path.join(tmp, f"artifacts-{phase}"))
+            tool_execution.tool_result_policy = ToolResultPolicy(store)
+            db_path = os.path.join(tmp, f"{phase}.db")
+            db = MessageDB(db_path)
+            buffer = Stream_Buffer(message_store=db)
+            rdas.stream_buffer = buffer
+            try:
+                if phase == "record":
+                    with MockLLM(reasoning="想" * 20, content="已读取。", chunk_chars=4) as llm:
+                        recorder = RecordingClient(OpenAI(api_key="sk-bench", base_url=llm.base_url),
+                                                   Cassette(cassette_path))
+                        run(recorder, db, args, agent_context)
+                    recorder.cassette.save()
+                    continue
+                # 转存后请求内容变化，按录制顺序回放（每轮的回答与录制时相同）
+                counter = TokenCounter(ReplayClient(Cassette(cassette_path), on_miss="sequential"))
+                run(counter, db, args, agent_context)
+            finally:
+                buffer.shutdown()
+                db.close()
+            results[phase] = (counter.requests, counter.tokens, db_bytes(db_path), store.size())
+
+    print(f"{args.sessions} sessions x {args.turns} turns, read_file of {args.lines} lines per turn")
+    for phase, (requests, tokens, database, artifacts) in results.items():
+        print(f"spill {phase:>3}: {requests} requests, {tokens} tokens sent ({tokens / requests:.0f}/request), "
+              f"db {database / 1024:.0f} KiB + artifacts {artifacts / 1024:.0f} KiB")
+    off, on = results["off"], results["on"]
+    print(f"tokens sent -{1 - on[1] / off[1]:.1%}, db bytes -{1 - on[2] / off[2]:.1%}")
+
+
+if __name__ == "__main__":
+    main()
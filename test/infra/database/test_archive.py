@@ -0,0 +1,91 @@
+"""
+MessageDB 冷存储归档：段文件写入、透明恢复、列表与增量回收。
+"""
+from backend.infra.database import MessageDB
+
+
+def _db(tmp_path):
+    return MessageDB(str(tmp_path / "hot.db"), blob_threshold=64, compress_threshold=128)
+
+
+def _fill(db, session_id, n=5):
+    msgs = [{"role": "system", "content": "S" * 200}]
+    msgs += [{"role": "user", "content": f"{session_id}-{i}"} for i in range(n)]
+    for m in msgs:
+        db.append_message(session_id, m)
+    return msgs
+
+
+def _age(db, session_id, days=30):
+    with db._write() as conn:
+        conn.execute(
+            "UPDATE messages SET created_at = datetime('now', ?) WHERE session_id = ?",
+            (f"-{days} days", session_id),
+        )
+        conn.commit()
+
+
+def test_archive_and_transparent_restore(tmp_path):
+    db = _db(tmp_path)
+    db.upsert_agent("a", "", "")
+    db.create_session_for_agent("old", "a")
+    msgs = [{"role": "system", "content": ""}] + _fill(db, "old")
+
+    assert db.archive_session("old") is True
+    with db._read() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+    assert db.blob_stats()["blobs"] == 0
+    assert db.get_session_agent_name("old") == "a"
+    assert [s["session_id"] for s in db.list_archived_sessions()] == ["old"]
+    assert list((tmp_path / "hot_archive").glob("segment_*.seg"))
+
+    # 访问即恢复
+    assert db.load_messages("old") == msgs
+    assert db.list_archived_sessions() == []
+    assert db.blob_stats()["refs"] == 1
+
+
+def test_archive_idle_sessions_only(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "idle")
+    _fill(db, "active")
+    _age(db, "idle")
+
+    assert db.archive_idle_sessions(idle_seconds=7 * 24 * 3600) == ["idle"]
+    assert db.load_messages("active")
+    assert {s["session_id"] for s in db.list_archived_sessions()} == {"idle"}
+
+
+def test_append_to_archived_session_keeps_order(tmp_path):
+    db = _db(tmp_path)
+    msgs = _fill(db, "s", n=3)
+    db.archive_session("s")
+    db.append_message("s", {"role": "user", "content": "again"})
+    assert db.load_messages("s") == msgs + [{"role": "user", "content": "again"}]
+
+
+def test_update_last_message_on_archived_session(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "s", n=1)
+    db.archive_session("s")
+    db.update_last_message("s", content="edited")
+    assert db.load_messages("s")[-1]["content"] == "edited"
+
+
+def test_clear_archived_session(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "s")
+    db.archive_session("s")
+    db.clear_session("s")
+    assert db.list_archived_sessions() == []
+    assert db.load_messages("s") == []
+
+
+def test_many_sessions_share_segments(tmp_path):
+    db = _db(tmp_path)
+    expected = {f"s{i}": _fill(db, f"s{i}", n=i) for i in range(10)}
+    for sid in expected:
+        db.archive_session(sid)
+    db.incremental_vacuum()
+    for sid, msgs in expected.items():
+        assert db.load_messages(sid) == msgs
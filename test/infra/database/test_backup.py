@@ -0,0 +1,96 @@
+"""
+MessageDB 在线备份：并发大量 append_message 时备份一致，且写入延迟不被长时间阻塞。
+"""
+import threading
+import time
+
+from backend.infra.database import MessageDB
+
+
+def _p99(samples):
+    samples = sorted(samples)
+    return samples[int(len(samples) * 0.99) - 1]
+
+
+def _write_latencies(db, session_id, stop, out):
+    i = 0
+    while not stop.is_set():
+        t = time.perf_counter()
+        db.append_message(session_id, {"role": "user", "content": f"{session_id}-{i}"})
+        out.append(time.perf_counter() - t)
+        i += 1
+
+
+def _run_writers(db, prefix, action, n=4):
+    stop = threading.Event()
+    latencies = [[] for _ in range(n)]
+    writers = [
+        threading.Thread(target=_write_latencies, args=(db, f"{prefix}{k}", stop, latencies[k]))
+        for k in range(n)
+    ]
+    for w in writers:
+        w.start()
+    try:
+        action()
+    finally:
+        stop.set()
+        for w in writers:
+            w.join()
+    return [x for lat in latencies for x in lat]
+
+
+def test_backup_concurrent_with_appends(tmp_path):
+    db = MessageDB(str(tmp_path / "live.db"), blob_threshold=10**9)
+    # 预填充，使备份需要多步完成
+    for i in range(3000):
+        db.append_message(f"seed{i % 10}", {"role": "tool", "content": f"{i} " + "x" * 500})
+
+    # 基线：同样 4 个写线程、无备份时的写延迟
+    baseline = _run_writers(db, "base", lambda: time.sleep(0.3))
+    steps = []
+    dest = str(tmp_path / "backup.db")
+    during = _run_writers(
+        db, "w",
+        lambda: db.backup(dest, pages_per_step=16, sleep=0.001, progress=lambda done, total: steps.append((done, total))),
+    )
+
+    assert len(steps) > 1
+    assert steps[-1][0] == steps[-1][1]
+
+    # 完整性：种子数据完整，并发写入的每个 session 在备份中都是实时数据的前缀
+    snapshot = MessageDB(dest, blob_threshold=10**9)
+    for s in range(10):
+        assert snapshot.load_messages(f"seed{s}") == db.load_messages(f"seed{s}")
+    for k in range(4):
+        live = db.load_messages(f"w{k}")
+        backed = snapshot.load_messages(f"w{k}")
+        assert backed == live[:len(backed)]
+    with snapshot._read() as conn:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    assert integrity == "ok"
+
+    # 备份按步进行、步间让出写锁：写延迟的 p99 与无备份时同一量级（下限 20ms 吸收调度抖动），
+    # 且写入从未被整库备份长时间阻塞
+    assert _p99(during) < max(5 * _p99(baseline), 0.02)
+    assert max(during) < 1.0
+
+
+def test_restore_backup(tmp_path):
+    db = MessageDB(str(tmp_path / "live.db"), blob_threshold=64, compress_threshold=128)
+    msgs = [{"role": "user", "content": "x" * 300}, {"role": "assistant", "content": "ok"}]
+    for m in msgs:
+        db.append_message("s", m)
+    db.append_message("cold", {"role": "user", "content": "archived"})
+    db.archive_session("cold")
+
+    dest = str(tmp_path / "bk" / "snap.db")
+    (tmp_path / "bk").mkdir()
+    db.backup(dest)
+    assert list((tmp_path / "bk" / "snap_archive").glob("segment_*.seg"))
+
+    db.clear_session("s")
+    db.append_message("s", {"role": "user", "content": "after backup"})
+    db.restore_backup(dest)
+
+    assert db.load_messages("s") == msgs
+    assert db.load_messages("cold") == [{"role": "user", "content": "archived"}]
@@ -0,0 +1,103 @@
+"""
+MessageDB 大字段内容寻址去重：blobs 表 + 引用计数。
+"""
+from backend.infra.database import MessageDB
+
+
+def _db(tmp_path, threshold=32):
+    return MessageDB(str(tmp_path / "dedup.db"), blob_threshold=threshold)
+
+
+def test_large_fields_roundtrip_and_dedup(tmp_path):
+    db = _db(tmp_path)
+    big = "x" * 200
+    db.append_message("s1", {"role": "system", "content": big})
+    db.append_message("s1", {"role": "tool", "content": big, "tool_call_id": "c1"})
+    db.append_message("s2", {"role": "system", "content": big})
+    db.append_message("s1", {"role": "user", "content": "short"})
+
+    assert db.load_messages("s1") == [
+        {"role": "system", "content": big},
+        {"role": "tool", "content": big, "tool_call_id": "c1"},
+        {"role": "user", "content": "short"},
+    ]
+    stats = db.blob_stats()
+    assert stats["blobs"] == 1
+    assert stats["refs"] == 3
+    assert stats["dedup_ratio"] == 3.0
+
+    # 行内只保留引用
+    with db._read() as conn:
+        row = conn.execute("SELECT payload FROM messages ORDER BY id LIMIT 1").fetchone()
+    assert big not in row["payload"]
+
+
+def test_nested_fields_are_externalized(tmp_path):
+    db = _db(tmp_path)
+    reasoning = "r" * 100
+    args = '{"content": "' + "a" * 100 + '"}'
+    msg = {
+        "role": "assistant",
+        "content": None,
+        "model_extra": {"reasoning_content": reasoning},
+        "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "create_file", "arguments": args}}],
+    }
+    db.append_message("s", msg)
+    assert db.load_messages("s") == [msg]
+    assert db.blob_stats()["blobs"] == 2
+
+
+def test_update_last_message_keeps_refcount_consistent(tmp_path):
+    db = _db(tmp_path)
+    big = "y" * 100
+    db.append_message("s", {"role": "system", "content": big})
+    db.append_message("s", {"role": "assistant", "content": big, "model_extra": {"reasoning_content": ""}})
+
+    # 内容不变：引用计数不应漂移
+    db.update_last_message("s", content=big, reasoning="")
+    assert db.blob_stats()["refs"] == 2
+
+    # 内容变化：旧引用释放，新内容入库
+    db.update_last_message("s", content="z" * 100)
+    stats = db.blob_stats()
+    assert stats["blobs"] == 2
+    assert stats["refs"] == 2
+    assert db.load_messages("s")[-1]["content"] == "z" * 100
+
+
+def test_streaming_flushes_do_not_create_blobs(tmp_path):
+    db = _db(tmp_path)
+    db.append_message("s", {"role": "assistant", "content": None, "model_extra": {"reasoning_content": ""}})
+    content = ""
+    for i in range(5):
+        content += f"chunk {i} " * 20
+        db.update_last_message("s", content=content, reasoning="", partial=True)
+        assert db.blob_stats()["blobs"] == 0
+        assert db.load_messages("s")[-1]["content"] == content
+
+    # 流结束的最终更新才转存
+    db.update_last_message("s", content=content, reasoning="")
+    stats = db.blob_stats()
+    assert stats["blobs"] == 1
+    assert stats["refs"] == 1
+    assert db.load_messages("s")[-1]["content"] == content
+    assert db.recall_size("s") >= len(content)
+
+
+def test_clear_session_and_delete_agent_release_blobs(tmp_path):
+    db = _db(tmp_path)
+    big = "q" * 100
+    db.upsert_agent("a", "", big)
+    db.create_session_for_agent("s1", "a")
+    db.create_session_for_agent("s2", "a")
+    db.append_message("other", {"role": "tool", "content": big})
+    assert db.blob_stats()["refs"] == 3
+
+    db.clear_session("s1")
+    assert db.blob_stats()["refs"] == 2
+
+    db.delete_agent("a")
+    assert db.blob_stats()["refs"] == 1
+
+    db.clear_session("other")
+    assert db.blob_stats()["blobs"] == 0
@@ -0,0 +1,68 @@
+import pytest
+
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.database.sharded import ShardedMessageDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    store = MessageDB(str(tmp_path / "chat.db"))
+    yield store
+    store.close()
+
+
+def test_checkpoint_phases_and_tool_marks(db):
+    assert db.get_checkpoint("s") is None
+    db.append_message("s", {"role": "user", "content": "hi"})
+    last = db.list_message_ids("s")[-1]
+    calls = [{"id": "a", "type": "function", "function": {"name": "f", "arguments": "{}"}}]
+    db.set_checkpoint("s", "tools", tool_calls=calls)
+    db.mark_tool_call("s", "a")
+    db.mark_tool_call("s", "a")
+    db.mark_tool_call("s", "a", done=True)
+    assert db.get_checkpoint("s") == {
+        "phase": "tools", "message_id": last, "tool_calls": calls, "started": ["a"], "done": ["a"],
+    }
+    # 进入新阶段时清空工具进度
+    db.set_checkpoint("s", "stream")
+    checkpoint = db.get_checkpoint("s")
+    assert checkpoint["phase"] == "stream" and checkpoint["started"] == [] and checkpoint["tool_calls"] == []
+    db.clear_checkpoint("s")
+    assert db.get_checkpoint("s") is None
+    # 没有检查点时标记为空操作
+    db.mark_tool_call("s", "a")
+    assert db.get_checkpoint("s") is None
+
+
+def test_truncate_session_keeps_forked_children(db):
+    for i in range(3):
+        db.append_message("s", {"role": "user", "content": f"m{i}" + "x" * 2000})
+    ids = db.list_message_ids("s")
+    db.fork_session("s", "child")
+    db.truncate_session("s", ids[0])
+    assert [m["content"][:2] for m in db.load_messages("s")] == ["m0"]
+    # 继承了被删行的分叉先物化，内容（含转存到 blobs 的大字段）不变
+    assert [m["content"][:2] for m in db.load_messages("child")] == ["m0", "m1", "m2"]
+    assert db.load_messages("child")[2]["content"].endswith("x" * 2000)
+
+
+def test_clear_session_drops_checkpoint(db):
+    db.append_message("s", {"role": "user", "content": "hi"})
+    db.set_checkpoint("s", "request")
+    db.clear_session("s")
+    assert db.get_checkpoint("s") is None
+
+
+def test_sharded_checkpoint_follows_session(tmp_path):
+    store = ShardedMessageDB(str(tmp_path / "shards"), shards=4)
+    try:
+        store.append_message("s", {"role": "user", "content": "hi"})
+        store.set_checkpoint("s", "stream")
+        store.append_message("s", {"role": "assistant", "content": "半截"})
+        checkpoint = store.get_checkpoint("s")
+        store.truncate_session("s", checkpoint["message_id"])
+        assert [m["role"] for m in store.load_messages("s")] == ["user"]
+        assert store.shard_for("s").get_checkpoint("s")["phase"] == "stream"
+    finally:
+        for shard in store.shards:
+            shard.close()
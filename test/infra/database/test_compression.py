@@ -0,0 +1,95 @@
+"""
+MessageDB payload 透明压缩：codec 标记、旧行兼容、后台重压缩。
+"""
+import json
+import zlib
+
+from backend.infra.database import MessageDB
+from backend.infra.database.codec import CODEC_ZLIB, PayloadCodec
+
+
+def _big_tool_msg(i=0):
+    return {"role": "tool", "content": f"line {i}\n" * 400, "tool_call_id": f"c{i}"}
+
+
+def test_codec_roundtrip_and_threshold():
+    codec = PayloadCodec(threshold=64)
+    assert codec.encode("short") == "short"
+    text = "重复内容" * 100
+    encoded = codec.encode(text)
+    assert isinstance(encoded, bytes)
+    assert codec.decode(encoded) == text
+    assert codec.is_current(encoded)
+    assert not codec.is_current(text)
+
+
+def test_compressed_rows_roundtrip(tmp_path):
+    db = MessageDB(str(tmp_path / "c.db"), blob_threshold=10**9, compress_threshold=256)
+    msg = _big_tool_msg()
+    db.append_message("s", {"role": "user", "content": "hi"})
+    db.append_message("s", msg)
+    assert db.load_messages("s") == [{"role": "user", "content": "hi"}, msg]
+
+    with db._read() as conn:
+        rows = conn.execute("SELECT typeof(payload) FROM messages ORDER BY id").fetchall()
+    assert [r[0] for r in rows] == ["text", "blob"]
+
+    db.update_last_message("s", content="done")
+    assert db.load_messages("s")[-1]["content"] == "done"
+
+
+def test_blobs_are_compressed(tmp_path):
+    db = MessageDB(str(tmp_path / "c.db"), blob_threshold=100, compress_threshold=256)
+    msg = _big_tool_msg()
+    db.append_message("a", msg)
+    db.append_message("b", msg)
+    assert db.load_messages("b") == [msg]
+    with db._read() as conn:
+        row = conn.execute("SELECT typeof(data) FROM blobs").fetchone()
+    assert row[0] == "blob"
+
+
+def test_old_rows_still_read_and_recompress(tmp_path):
+    path = str(tmp_path / "c.db")
+    plain = MessageDB(path, blob_threshold=10**9)
+    msgs = [_big_tool_msg(i) for i in range(5)]
+    for m in msgs:
+        plain.append_message("s", m)
+
+    db = MessageDB(path, blob_threshold=10**9, compress_threshold=256)
+    assert db.load_messages("s") == msgs
+    assert db.recompress(batch_size=2) == 5
+    assert db.recompress() == 0
+    assert db.load_messages("s") == msgs
+
+    with db._read() as conn:
+        raw = conn.execute("SELECT payload FROM messages ORDER BY id LIMIT 1").fetchone()[0]
+    assert isinstance(raw, bytes)
+    assert json.loads(db._codec.decode(raw)) == msgs[0]
+
+
+def test_zlib_marker_format():
+    codec = PayloadCodec(threshold=1)
+    raw = CODEC_ZLIB + zlib.compress("payload".encode("utf-8"))
+    assert codec.decode(raw) == "payload"
+
+
+def _payload_type(db):
+    with db._read() as conn:
+        return conn.execute("SELECT typeof(payload) FROM messages").fetchone()[0]
+
+
+def test_background_recompression_job(tmp_path):
+    path = str(tmp_path / "c.db")
+    MessageDB(path, blob_threshold=10**9).append_message("s", _big_tool_msg())
+    db = MessageDB(path, blob_threshold=10**9, compress_threshold=256)
+    job = db.start_recompression_job(interval=60)
+    try:
+        job.trigger()
+        for _ in range(50):
+            if _payload_type(db) == "blob":
+                break
+            job.worker.join(0.05)
+        assert _payload_type(db) == "blob"
+    finally:
+        job.shutdown()
@@ -0,0 +1,141 @@
+"""
+写时复制分叉：不复制行、前缀解析、多级分叉、父 session 修改/删除时物化子 session、Stream_Buffer 共享前缀。
+"""
+import pytest
+
+from backend.infra.database import MessageDB
+from backend.infra.streambuffer import Stream_Buffer
+
+
+def _db(tmp_path):
+    return MessageDB(str(tmp_path / "f.db"), blob_threshold=64)
+
+
+def _row_count(db):
+    with db._read() as conn:
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def _fill(db, session_id, n):
+    msgs = [{"role": "system", "content": "S" * 100}]
+    msgs += [{"role": "user", "content": f"{session_id}-{i}"} for i in range(n)]
+    for m in msgs:
+        db.append_message(session_id, m)
+    return msgs
+
+
+def test_fork_copies_nothing_and_resolves_prefix(tmp_path):
+    db = _db(tmp_path)
+    db.upsert_agent("a", "", "")
+    msgs = _fill(db, "src", 5)
+    ids = db.list_message_ids("src")
+    rows = _row_count(db)
+
+    db.fork_session("src", "retry", at_message_id=ids[2])
+    assert _row_count(db) == rows
+    assert db.load_messages("retry") == msgs[:3]
+    assert db.get_fork_origin("retry") == ("src", ids[2])
+
+    # 两边各自追加，互不可见
+    db.append_message("retry", {"role": "user", "content": "branch"})
+    db.append_message("src", {"role": "user", "content": "main"})
+    assert db.load_messages("retry") == msgs[:3] + [{"role": "user", "content": "branch"}]
+    assert db.load_messages("src") == msgs + [{"role": "user", "content": "main"}]
+    assert db.list_message_ids("retry")[:3] == ids[:3]
+
+
+def test_multi_level_fork_and_parts(tmp_path):
+    db = _db(tmp_path)
+    msgs = _fill(db, "root", 3)
+    db.fork_session("root", "child")
+    db.append_message("child", {"role": "user", "content": "c1"})
+    child_ids = db.list_message_ids("child")
+    db.fork_session("child", "grand", at_message_id=child_ids[1])
+    db.append_message("grand", {"role": "user", "content": "g1"})
+
+    assert db.load_messages("grand") == msgs[:2] + [{"role": "user", "content": "g1"}]
+    origin, own = db.load_session_parts("grand")
+    assert db.load_prefix(*origin) + own == db.load_messages("grand")
+
+
+def test_invalid_fork_arguments(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "a", 1)
+    _fill(db, "b", 1)
+    with pytest.raises(ValueError):
+        db.fork_session("a", "b")
+    with pytest.raises(ValueError):
+        db.fork_session("empty", "x")
+    with pytest.raises(ValueError):
+        db.fork_session("a", "x", at_message_id=db.list_message_ids("b")[0])
+
+
+def test_parent_tail_update_materializes_children(tmp_path):
+    db = _db(tmp_path)
+    msgs = _fill(db, "p", 2)
+    db.fork_session("p", "c")
+    db.fork_session("c", "g")
+    db.update_last_message("p", content="changed")
+
+    assert db.load_messages("p")[-1]["content"] == "changed"
+    assert db.load_messages("c") == msgs
+    assert db.load_messages("g") == msgs
+    assert db.get_fork_origin("c") is None
+    assert db.get_fork_origin("g")[0] == "c"
+
+
+def test_update_on_fork_without_own_rows_is_copy_on_write(tmp_path):
+    db = _db(tmp_path)
+    msgs = _fill(db, "p", 2)
+    db.fork_session("p", "c")
+    db.update_last_message("c", content="mine")
+
+    assert db.load_messages("p") == msgs
+    assert db.load_messages("c") == msgs[:-1] + [{"role": "user", "content": "mine"}]
+
+
+def test_clear_parent_keeps_forks_and_blob_refs(tmp_path):
+    db = _db(tmp_path)
+    db.upsert_agent("a", "", "")
+    db.upsert_agent("b", "", "")
+    db.create_session_for_agent("p", "a")
+    msgs = [{"role": "system", "content": ""}] + _fill(db, "p", 2)
+    db.fork_session("p", "c", agent_name="b")
+    db.append_message("c", {"role": "user", "content": "own"})
+
+    db.delete_agent("a")
+    assert db.load_messages("c") == msgs + [{"role": "user", "content": "own"}]
+    assert db.blob_stats()["refs"] == 1
+    db.clear_session("c")
+    assert db.blob_stats()["blobs"] == 0
+    assert _row_count(db) == 0
+
+
+def test_forked_sessions_are_not_archived(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "p", 1)
+    db.fork_session("p", "c")
+    assert db.archive_session("p") is False
+    assert db.archive_session("c") is False
+
+
+def test_stream_buffer_shares_prefix_between_forks(tmp_path):
+    db = _db(tmp_path)
+    _fill(db, "p", 3)
+    db.fork_session("p", "a")
+    db.fork_session("p", "b")
+    sb = Stream_Buffer(message_store=db, flush_interval=60)
+    try:
+        sb.start_stream("a")
+        sb.start_stream("b")
+        ma, mb = sb.sessions["a"].messages, sb.sessions["b"].messages
+        assert all(x is y for x, y in zip(ma[:-1], mb[:-1]))
+        assert ma[-1] is not mb[-1]
+        sb.append_content("a", "only a")
+        assert mb[-1]["content"] is None
+        sb.end_stream("a")
+        sb.end_stream("b")
+    finally:
+        sb.shutdown()
+    assert db.load_messages("a")[-1]["content"] == "only a"
+    assert db.load_messages("p")[-1]["role"] == "user"
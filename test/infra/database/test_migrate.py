@@ -0,0 +1,98 @@
+"""
+旧版 messages 表迁移：分批、进度回调、中断续跑、离线 CLI。
+"""
+import json
+import sqlite3
+
+import pytest
+
+from backend.infra.database import MessageDB
+from backend.infra.database import migrate as migrate_module
+from backend.infra.database.migrate import migrate_messages_schema, needs_migration
+
+
+def _legacy_db(path, n):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, created_at TIMESTAMP, agent_name TEXT)")
+    conn.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, content TEXT, reasoning_content TEXT, "
+        "tool_calls_json TEXT, tool_call_id TEXT)"
+    )
+    rows = []
+    for i in range(n):
+        if i % 3 == 0:
+            rows.append(("s", "assistant", f"c{i}", f"r{i}", json.dumps([{"id": f"t{i}"}]), None))
+        elif i % 3 == 1:
+            rows.append(("s", "tool", f"c{i}", None, None, f"t{i - 1}"))
+        else:
+            rows.append(("s", "user", f"c{i}", None, None, None))
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, reasoning_content, tool_calls_json, tool_call_id) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    return conn
+
+
+def _expected(n):
+    out = []
+    for i in range(n):
+        if i % 3 == 0:
+            out.append({"role": "assistant", "content": f"c{i}", "model_extra": {"reasoning_content": f"r{i}"},
+                        "tool_calls": [{"id": f"t{i}"}]})
+        elif i % 3 == 1:
+            out.append({"role": "tool", "content": f"c{i}", "tool_call_id": f"t{i - 1}"})
+        else:
+            out.append({"role": "user", "content": f"c{i}"})
+    return out
+
+
+def test_batched_migration_with_progress(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = _legacy_db(path, 25)
+    seen = []
+    assert migrate_messages_schema(conn, batch_size=10, progress=lambda d, t: seen.append((d, t))) == 25
+    assert seen == [(10, 25), (20, 25), (25, 25)]
+    assert not needs_migration(conn)
+    conn.close()
+    assert MessageDB(path).load_messages("s") == _expected(25)
+
+
+def test_interrupted_migration_resumes(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = _legacy_db(path, 30)
+
+    def crash(done, total):
+        if done >= 20:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        migrate_messages_schema(conn, batch_size=10, progress=crash)
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    assert needs_migration(conn)
+    assert conn.execute("SELECT last_id FROM schema_migrations").fetchone()[0] == 20
+    assert migrate_messages_schema(conn, batch_size=10) == 10
+    conn.close()
+    assert MessageDB(path).load_messages("s") == _expected(30)
+
+
+def test_message_db_init_migrates_legacy_table(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    _legacy_db(path, 4).close()
+    db = MessageDB(path)
+    assert db.load_messages("s") == _expected(4)
+    db.append_message("s", {"role": "user", "content": "new"})
+    assert db.load_messages("s")[-1] == {"role": "user", "content": "new"}
+
+
+def test_cli(tmp_path, capsys):
+    path = str(tmp_path / "legacy.db")
+    _legacy_db(path, 7).close()
+    assert migrate_module.main([path, "--batch-size", "3"]) == 0
+    assert "7/7" in capsys.readouterr().out
+    assert migrate_module.main([path]) == 0
+    assert "无需迁移" in capsys.readouterr().out
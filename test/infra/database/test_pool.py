@@ -0,0 +1,79 @@
+"""
+MessageDB 连接池：读连接有上限且只读、写连接同线程可重入、batch 内读到未提交写入、等待统计。
+"""
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.infra.database import MessageDB
+from backend.infra.database.pool import ConnectionPool, PoolTimeout
+
+
+def test_reader_connections_are_bounded_and_reused(tmp_path):
+    db = MessageDB(str(tmp_path / "p.db"), readers=2)
+    db.upsert_agent("a", "", "prompt")
+    db.append_message("s", {"role": "user", "content": "hi"})
+
+    def work(i):
+        assert db.get_agent("a")["system_prompt_text"] == "prompt"
+        return db.load_messages("s")
+
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        results = list(ex.map(work, range(200)))
+    assert all(r == [{"role": "user", "content": "hi"}] for r in results)
+
+    metrics = db.pool_metrics()
+    assert metrics["reader"]["open"] <= 2
+    assert metrics["reader"]["acquired"] >= 400
+    assert metrics["reader"]["max_wait"] >= 0.0
+    assert metrics["writer"]["acquired"] == 2
+
+
+def test_reader_is_read_only(tmp_path):
+    db = MessageDB(str(tmp_path / "p.db"))
+    with db._read() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO sessions (session_id) VALUES ('x')")
+
+
+def test_batch_reads_own_uncommitted_writes(tmp_path):
+    db = MessageDB(str(tmp_path / "p.db"))
+    seen = []
+    with db.batch():
+        db.append_message("s", {"role": "user", "content": "a"})
+        db.update_last_message("s", content="b")
+        assert db.load_messages("s") == [{"role": "user", "content": "b"}]
+        # 其他线程的读连接看不到未提交的写入，且不会被写连接阻塞
+        t = threading.Thread(target=lambda: seen.append(db.load_messages("s")))
+        t.start()
+        t.join(5)
+    assert seen == [[]]
+    assert db.load_messages("s") == [{"role": "user", "content": "b"}]
+
+
+def test_writer_waits_are_recorded_and_time_out(tmp_path):
+    path = str(tmp_path / "p.db")
+    MessageDB(path)
+    pool = ConnectionPool(path, readers=1, timeout=0.05)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.writer():
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait(5)
+    with pytest.raises(PoolTimeout):
+        with pool.writer():
+            pass
+    release.set()
+    t.join(5)
+    with pool.writer():
+        pass
+    assert pool.metrics()["writer"]["acquired"] == 2
+    pool.close()
@@ -0,0 +1,138 @@
+"""
+ShardedMessageDB：路由、跨分片目录查询、离线改分片。
+"""
+import concurrent.futures
+
+import pytest
+
+from backend.infra.database import ShardedMessageDB
+from backend.infra.database.sharded import DIRECTORY_READERS, ROUTE_BY_AGENT, reshard, shard_of
+from backend.infra.streambuffer import Stream_Buffer
+
+
+def _msgs(sid, n=3):
+    return [{"role": "user", "content": f"{sid}-{i}"} for i in range(n)]
+
+
+def test_routes_sessions_across_shards(tmp_path):
+    db = ShardedMessageDB(str(tmp_path), shards=4)
+    sessions = [f"s{i}" for i in range(20)]
+    for sid in sessions:
+        for m in _msgs(sid):
+            db.append_message(sid, m)
+    for sid in sessions:
+        assert db.load_messages(sid) == _msgs(sid)
+        assert db.shard_for(sid) is db.shards[shard_of(sid, 4)]
+    used = {shard_of(sid, 4) for sid in sessions}
+    assert len(used) > 1
+    db.update_last_message("s0", content="edited")
+    assert db.load_messages("s0")[-1]["content"] == "edited"
+    assert db.load_messages("missing") == []
+
+
+def test_directory_queries(tmp_path):
+    db = ShardedMessageDB(str(tmp_path), shards=3)
+    db.upsert_agent("a", "yaml", "prompt-a")
+    db.upsert_agent("b", "yaml", "prompt-b")
+    assert sorted(db.list_agent_names()) == ["a", "b"]
+    assert db.get_agent("a")["system_prompt_text"] == "prompt-a"
+
+    for i in range(6):
+        sid = db.get_new_session_id()
+        db.create_session_for_agent(sid, "a" if i % 2 else "b")
+    assert db.get_new_session_id() == "session_7"
+    assert db.get_session_agent_name("session_2") == "a"
+    assert db.load_messages("session_2") == [{"role": "system", "content": "prompt-a"}]
+
+    db.delete_agent("a")
+    assert db.list_agent_names() == ["b"]
+    assert db.get_session_agent_name("session_2") is None
+    assert db.load_messages("session_2") == []
+    assert db.load_messages("session_1") == [{"role": "system", "content": "prompt-b"}]
+
+
+def test_route_by_agent_colocates_sessions(tmp_path):
+    db = ShardedMessageDB(str(tmp_path), shards=8, route_by=ROUTE_BY_AGENT)
+    db.upsert_agent("a", "", "p")
+    for i in range(5):
+        db.create_session_for_agent(f"x{i}", "a")
+    assert {db._lookup_shard(f"x{i}") for i in range(5)} == {shard_of("a", 8)}
+
+
+def test_directory_connections_are_bounded(tmp_path):
+    db = ShardedMessageDB(str(tmp_path), shards=2)
+
+    def run(i):
+        sid = f"t{i}"
+        db.append_message(sid, {"role": "user", "content": "q"})
+        return db.get_session_agent_name(sid), db.load_messages(sid)
+
+    with concurrent.futures.ThreadPoolExecutor(16) as ex:
+        results = list(ex.map(run, range(64)))
+    assert all(messages == [{"role": "user", "content": "q"}] for _, messages in results)
+    # 每个线程不再各自持有一个目录库连接
+    assert db._directory.metrics()["reader"]["open"] <= DIRECTORY_READERS
+    db.close()
+
+
+def test_reopen_with_different_layout_is_rejected(tmp_path):
+    ShardedMessageDB(str(tmp_path), shards=2)
+    with pytest.raises(ValueError):
+        ShardedMessageDB(str(tmp_path), shards=4)
+
+
+def test_reshard_preserves_everything(tmp_path):
+    src = ShardedMessageDB(str(tmp_path / "src"), shards=2)
+    src.upsert_agent("a", "yaml", "prompt")
+    src.create_session_for_agent("bound", "a")
+    src.append_message("bound", {"role": "user", "content": "hi"})
+    for i in range(10):
+        for m in _msgs(f"s{i}", n=i):
+            src.append_message(f"s{i}", m)
+
+    assert reshard(str(tmp_path / "src"), str(tmp_path / "dst"), shards=5) == 10
+
+    dst = ShardedMessageDB(str(tmp_path / "dst"), shards=5)
+    assert dst.get_agent("a")["role_settings_yaml"] == "yaml"
+    assert dst.get_session_agent_name("bound") == "a"
+    assert dst.load_messages("bound") == src.load_messages("bound")
+    for i in range(1, 10):
+        assert dst.load_messages(f"s{i}") == _msgs(f"s{i}", n=i)
+
+
+def test_reshard_carries_compaction(tmp_path):
+    src = ShardedMessageDB(str(tmp_path / "src"), shards=2)
+    # 交错写入：各 session 的 id 不连续，迁移后重新分配
+    for i in range(8):
+        for sid in ("s", "t", "u"):
+            src.append_message(sid, {"role": "user" if i % 2 else "assistant", "content": f"{sid}-{i}"})
+    ids = src.list_message_ids("s")
+    src.put_summary("h1", "早前的摘要")
+    src.set_compaction("s", ids[5], "h1")
+
+    reshard(str(tmp_path / "src"), str(tmp_path / "dst"), shards=3)
+
+    dst = ShardedMessageDB(str(tmp_path / "dst"), shards=3)
+    new_ids = dst.list_message_ids("s")
+    assert dst.get_compaction("s") == (new_ids[5], "h1")
+    assert dst.load_recall_messages("s") == src.load_recall_messages("s")
+    assert dst.get_compaction("t") is None
+
+
+def test_plugs_into_stream_buffer_concurrently(tmp_path):
+    db = ShardedMessageDB(str(tmp_path), shards=4)
+    buffer = Stream_Buffer(message_store=db, flush_interval=0.01)
+    try:
+        def run(sid):
+            buffer.append_message(sid, {"role": "user", "content": "q"})
+            buffer.start_stream(sid)
+            for ch in "hello":
+                buffer.append_content(sid, ch)
+            buffer.end_stream(sid)
+
+        with concurrent.futures.ThreadPoolExecutor(8) as ex:
+            list(ex.map(run, [f"c{i}" for i in range(16)]))
+    finally:
+        buffer.shutdown()
+    for i in range(16):
+        assert db.load_messages(f"c{i}")[-1]["content"] == "hello"
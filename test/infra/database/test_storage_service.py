@@ -0,0 +1,143 @@
+"""
+单写者存储服务：Unix socket 帧协议、流水线、组提交，以及作为 MessageStore 注入 Stream_Buffer。
+"""
+import concurrent.futures
+import socket
+
+import pytest
+
+from backend.infra.database import MessageDB
+from backend.infra.database.storage_service import StorageClient, StorageServer, StorageServiceError
+from backend.infra.streambuffer import Stream_Buffer
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="需要 Unix domain socket")
+
+
+@pytest.fixture
+def service(tmp_path):
+    db = MessageDB(str(tmp_path / "svc.db"))
+    # AF_UNIX 路径长度有限，放在短路径下
+    sock_path = str(tmp_path / "s.sock")
+    server = StorageServer(db, sock_path).start()
+    yield db, server, sock_path
+    server.shutdown()
+
+
+def test_roundtrip(service):
+    db, _, sock_path = service
+    client = StorageClient(sock_path)
+    try:
+        client.upsert_agent("a", "yaml", "prompt")
+        sid = client.get_new_session_id()
+        client.create_session_for_agent(sid, "a")
+        client.append_message(sid, {"role": "user", "content": "你好"})
+        client.append_message(sid, {"role": "assistant", "content": None})
+        client.update_last_message(sid, content="done", reasoning="think")
+        assert client.load_messages(sid) == db.load_messages(sid)
+        assert client.load_messages(sid)[-1]["model_extra"] == {"reasoning_content": "think"}
+        assert client.get_session_agent_name(sid) == "a"
+        assert client.list_agent_names() == ["a"]
+    finally:
+        client.close()
+
+
+def test_checkpoint_and_compaction_ops(service):
+    db, _, sock_path = service
+    client = StorageClient(sock_path)
+    try:
+        for i in range(4):
+            client.append_message("s", {"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"})
+        ids = client.list_message_ids("s")
+        client.set_checkpoint("s", "tools", tool_calls=[{"id": "c1"}])
+        client.mark_tool_call("s", "c1")
+        client.mark_tool_call("s", "c1", done=True)
+        assert client.get_checkpoint("s") == db.get_checkpoint("s")
+        assert client.get_checkpoint("s")["done"] == ["c1"]
+        client.clear_checkpoint("s")
+        assert client.get_checkpoint("s") is None
+
+        client.put_summary("h", "摘要", "cheap")
+        assert client.get_summary("h") == "摘要"
+        assert client.load_recall_messages("s") is None
+        client.set_compaction("s", ids[1], "h")
+        assert client.get_compaction("s") == (ids[1], "h")
+        assert client.load_recall_messages("s") == db.load_recall_messages("s")
+        assert client.recall_size("s") == db.recall_size("s")
+
+        client.truncate_session("s", ids[2])
+        assert client.list_message_ids("s") == ids[:3]
+    finally:
+        client.close()
+
+
+def test_errors_are_isolated_within_group(service):
+    _, _, sock_path = service
+    client = StorageClient(sock_path)
+    try:
+        futures = client.submit_many([
+            ("append_message", {"session_id": "s", "msg": {"role": "user", "content": "1"}}),
+            ("drop_everything", {}),
+            ("append_message", {"session_id": "s", "msg": {"role": "user", "content": "2"}}),
+        ])
+        assert futures[0].result(5) is None
+        with pytest.raises(StorageServiceError):
+            futures[1].result(5)
+        assert futures[2].result(5) is None
+        assert [m["content"] for m in client.load_messages("s")] == ["1", "2"]
+    finally:
+        client.close()
+
+
+def test_pipelined_clients_are_coalesced(service):
+    db, server, sock_path = service
+    clients = [StorageClient(sock_path) for _ in range(4)]
+    try:
+        def work(k):
+            client = clients[k % len(clients)]
+            for i in range(50):
+                client.append_message(f"s{k}", {"role": "user", "content": str(i)})
+
+        with concurrent.futures.ThreadPoolExecutor(16) as ex:
+            list(ex.map(work, range(16)))
+        for k in range(16):
+            assert [m["content"] for m in db.load_messages(f"s{k}")] == [str(i) for i in range(50)]
+        # 并发请求被合并进更少的事务
+        assert server.commits < server.requests
+    finally:
+        for c in clients:
+            c.close()
+
+
+def test_client_plugs_into_stream_buffer(service):
+    db, _, sock_path = service
+    client = StorageClient(sock_path)
+    buffer = Stream_Buffer(message_store=client, flush_interval=0.01)
+    try:
+        buffer.append_message("s", {"role": "user", "content": "q"})
+        buffer.start_stream("s")
+        buffer.append_reasoning("s", "hmm")
+        buffer.append_content("s", "answer")
+        buffer.end_stream("s")
+    finally:
+        buffer.shutdown()
+        client.close()
+    assert db.load_messages("s")[-1] == {
+        "role": "assistant", "content": "answer", "model_extra": {"reasoning_content": "hmm"}
+    }
+
+
+def test_timed_out_call_is_forgotten(tmp_path):
+    # 只接受连接、从不回复的服务端
+    sock_path = str(tmp_path / "mute.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(sock_path)
+    listener.listen(1)
+    client = StorageClient(sock_path, timeout=0.05)
+    try:
+        for _ in range(3):
+            with pytest.raises(concurrent.futures.TimeoutError):
+                client.get_new_session_id()
+        assert client._pending == {}
+    finally:
+        client.close()
+        listener.close()
@@ -0,0 +1,82 @@
+import pytest
+
+from backend.infra.fileio.artifacts import LINE_WIDTH, ArtifactStore, split_lines
+
+
+def test_put_dedups_and_reads_back(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    first = store.put("s1", "hello\nworld")
+    assert store.put("s1", "hello\nworld") == first
+    assert store.read("s1", first) == "hello\nworld"
+    assert [a["artifact_id"] for a in store.list("s1")] == [first]
+    # 按 session 隔离
+    with pytest.raises(KeyError):
+        store.read("s2", first)
+
+
+def test_read_lines_pages(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    artifact_id = store.put("s", "\n".join(f"line {i}" for i in range(1, 11)))
+    page = store.read_lines("s", artifact_id, start_line=4, max_lines=3)
+    assert page == {"text": "line 4\nline 5\nline 6", "start_line": 4, "end_line": 6, "total_lines": 10}
+    # 字符上限同样截断，但至少返回一行
+    page = store.read_lines("s", artifact_id, start_line=9, max_chars=1)
+    assert page["text"] == "line 9" and page["end_line"] == 9
+    page = store.read_lines("s", artifact_id, start_line=99)
+    assert page["text"] == "" and page["end_line"] == page["total_lines"]
+
+
+def test_long_line_is_wrapped():
+    lines = split_lines("x" * (LINE_WIDTH * 2 + 1))
+    assert [len(line) for line in lines] == [LINE_WIDTH, LINE_WIDTH, 1]
+
+
+def test_invalid_ids_and_delete(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    with pytest.raises(KeyError):
+        store.read("s", "../../etc/passwd")
+    # 含特殊字符的 session id 映射到哈希目录，不会逃出 root
+    artifact_id = store.put("../evil", "data")
+    assert store.read("../evil", artifact_id) == "data"
+    assert all(tmp_path in path.parents for path in tmp_path.rglob("*.txt"))
+    assert store.size() == 4
+    store.delete_session("../evil")
+    assert store.size() == 0 and store.list("../evil") == []
+
+
+def test_forks_read_and_inherit_parent_artifacts(tmp_path):
+    from backend.infra.database.db_manager import MessageDB
+
+    db = MessageDB(str(tmp_path / "chat.db"))
+    try:
+        store = ArtifactStore(str(tmp_path / "artifacts"), fork_origin=db.get_fork_origin)
+        db.append_message("parent", {"role": "user", "content": "hi"})
+        artifact_id = store.put("parent", "big output")
+        db.fork_session("parent", "child")
+        db.fork_session("child", "grandchild")
+        assert store.read_lines("grandchild", artifact_id)["text"] == "big output"
+        with pytest.raises(KeyError):
+            store.read("unrelated", artifact_id)
+
+        # 删除父 session：分叉接过引用，内容保留；最后一个引用删除后内容随之删除
+        forks = db.list_forks("parent")
+        assert forks == ["child"]
+        db.clear_session("parent")
+        store.delete_session("parent", heirs=forks)
+        assert store.read("child", artifact_id) == "big output"
+        assert store.read("grandchild", artifact_id) == "big output"
+        store.delete_session("child", heirs=db.list_forks("child"))
+        db.clear_session("child")
+        assert store.read("grandchild", artifact_id) == "big output"
+        store.delete_session("grandchild")
+        assert store.size() == 0
+    finally:
+        db.close()
+
+
+def test_store_is_picklable(tmp_path):
+    import pickle
+
+    store = ArtifactStore(str(tmp_path))
+    artifact_id = store.put("s", "data")
+    assert pickle.loads(pickle.dumps(store)).read("s", artifact_id) == "data"
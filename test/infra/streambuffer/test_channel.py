@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from backend.infra.streambuffer import Stream_Buffer
+from backend.infra.streambuffer.channel import (
+    EVENT_LAGGED,
+    EVENT_RESYNC,
+    BroadcastChannel,
+)
+
+
+@pytest.fixture
+def manager():
+    store = MagicMock()
+    store.load_messages.side_effect = lambda session_id: []
+    mgr = Stream_Buffer(message_store=store, flush_interval=0.05, channel_capacity=64)
+    yield mgr
+    mgr.shutdown()
+
+
+def _types(events):
+    return [e["type"] for e in events]
+
+
+class TestBroadcastChannel:
+
+    def test_multiple_subscribers_see_same_events(self):
+        ch = BroadcastChannel(16)
+        a, b = ch.subscribe(), ch.subscribe()
+        ch.publish("start")
+        ch.publish("content", "hi")
+        assert a.poll() == b.poll()
+        assert _types(a.poll()) == []
+
+    def test_mid_stream_attach_replays_current_turn(self):
+        ch = BroadcastChannel(16)
+        ch.publish("start")
+        ch.publish("reasoning", "r")
+        ch.publish("end")
+        ch.publish("start")
+        ch.publish("content", "x")
+        late = ch.subscribe()
+        assert _types(late.poll()) == ["start", "content"]
+
+    def test_replay_from_offset(self):
+        ch = BroadcastChannel(16)
+        offsets = [ch.publish("content", str(i)) for i in range(5)]
+        sub = ch.subscribe(offset=offsets[2])
+        assert [e["data"] for e in sub.poll()] == ["2", "3", "4"]
+
+    def test_drop_policy_on_overrun(self):
+        ch = BroadcastChannel(4)
+        sub = ch.subscribe(offset=0, policy="drop")
+        for i in range(10):
+            ch.publish("content", str(i))
+        events = sub.poll()
+        assert _types(events) == [EVENT_LAGGED]
+        assert sub.dropped and sub.finished
+        assert sub.poll() == []
+
+    def test_coalesce_policy_resyncs_on_overrun(self):
+        ch = BroadcastChannel(4)
+        ch.publish("start")
+        sub = ch.subscribe()
+        for ch_ in "abcdefgh":
+            ch.publish("content", ch_)
+        events = sub.poll()
+        assert _types(events) == [EVENT_RESYNC]
+        assert events[0]["data"]["content"] == "abcdefgh"
+        assert sub.resyncs == 1
+        # resync 之后从最新位置继续
+        ch.publish("content", "i")
+        assert [e["data"] for e in sub.poll()] == ["i"]
+
+    def test_coalesce_merges_backlog(self):
+        ch = BroadcastChannel(64)
+        sub = ch.subscribe(max_lag=2)
+        for text in ("a", "b", "c"):
+            ch.publish("reasoning", text)
+        for text in ("d", "e"):
+            ch.publish("content", text)
+        events = sub.poll()
+        assert [(e["type"], e["data"]) for e in events] == [("reasoning", "abc"), ("content", "de")]
+        assert sub.coalesced == 3
+
+    def test_producer_never_blocks_on_stalled_subscriber(self):
+        ch = BroadcastChannel(8)
+        ch.subscribe(offset=0)  # 从不读取
+        start = time.perf_counter()
+        for i in range(10_000):
+            ch.publish("content", "x")
+        assert time.perf_counter() - start < 1.0
+        assert ch.head == 10_000
+
+    def test_blocking_get_wakes_on_publish_and_close(self):
+        ch = BroadcastChannel(16)
+        sub = ch.subscribe()
+        received = []
+
+        def consume():
+            for event in sub:
+                received.append(event["data"])
+
+        t = threading.Thread(target=consume)
+        t.start()
+        ch.publish("content", "a")
+        ch.publish("content", "b")
+        ch.close()
+        t.join(timeout=2)
+        assert not t.is_alive()
+        assert received == ["a", "b"]
+
+    def test_get_timeout_returns_empty(self):
+        sub = BroadcastChannel(4).subscribe()
+        assert sub.get(timeout=0.05) == []
+
+    def test_async_iteration(self):
+        ch = BroadcastChannel(16)
+        sub = ch.subscribe()
+
+        def produce():
+            for text in ("a", "b", "c"):
+                time.sleep(0.01)
+                ch.publish("content", text)
+            ch.close()
+
+        async def consume():
+            return [event["data"] async for event in sub]
+
+        t = threading.Thread(target=produce)
+        t.start()
+        received = asyncio.run(asyncio.wait_for(consume(), 2))
+        t.join()
+        assert received == ["a", "b", "c"]
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            BroadcastChannel(4).subscribe(policy="block")
+
+
+class TestStreamBufferChannel:
+
+    def test_stream_events_are_published(self, manager):
+        path = "live"
+        sub = manager.channel(path).subscribe(offset=0)
+        manager.start_stream(path)
+        manager.append_reasoning(path, "think")
+        manager.append_content(path, "hello")
+        calls = [{"id": "c1", "type": "function", "function": {"name": "f", "arguments": "{}"}}]
+        manager.end_stream(path, tool_calls=calls)
+        manager.append_message(path, {"role": "tool", "tool_call_id": "c1", "content": "ok"})
+
+        events = sub.poll()
+        assert _types(events) == ["start", "reasoning", "content", "tool_calls", "end", "message"]
+        assert events[3]["data"] == calls
+
+    def test_observer_attaches_mid_stream(self, manager):
+        path = "mid"
+        manager.start_stream(path)
+        manager.append_content(path, "he")
+        sub = manager.channel(path).subscribe()
+        manager.append_content(path, "llo")
+        assert "".join(e["data"] for e in sub.poll() if e["type"] == "content") == "hello"
+
+    def test_close_channel_finishes_subscribers(self, manager):
+        path = "closing"
+        manager.start_stream(path)
+        sub = manager.channel(path).subscribe()
+        manager.close_channel(path)
+        assert _types(sub.get(timeout=1)) == ["start"]
+        assert sub.finished
+        assert path not in manager.channels
+
+    def test_idle_channels_are_released(self):
+        store = MagicMock()
+        store.load_messages.side_effect = lambda session_id: []
+        manager = Stream_Buffer(message_store=store, flush_interval=0.05, channel_capacity=64, channel_ttl=0.05)
+        try:
+            watched = manager.channel("watched").subscribe()
+            for i in range(50):
+                path = f"s{i}"
+                manager.start_stream(path)
+                manager.append_content(path, "hi")
+                manager.end_stream(path)
+                manager.publish(path, "done")
+            deadline = time.monotonic() + 2
+            while len(manager.channels) > 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            # 有订阅者的通道保留，其余在 ttl 后释放
+            assert list(manager.channels) == ["watched"]
+            # 通道不存在时，非 start 事件不会重新创建通道
+            assert manager.publish("s0", "done") == -1 and "s0" not in manager.channels
+            watched.close()
+            deadline = time.monotonic() + 2
+            while manager.channels and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert manager.channels == {}
+        finally:
+            manager.shutdown()
@@ -0,0 +1,43 @@
+import json
+import pickle
+
+import pytest
+
+from backend.infra.frozen import freeze
+from backend.infra.streambuffer.compact_message import CompactMessage, compact, to_openai_messages
+
+
+def test_roundtrip_keeps_shape():
+    msgs = [
+        {"role": "system", "content": "prompt"},
+        {"role": "assistant", "content": None, "model_extra": {},
+         "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "f", "arguments": "{}"}}]},
+        {"role": "tool", "content": "out", "tool_call_id": "c1"},
+        {"role": "user", "content": "hi", "name": "alice", "vendor_field": {"x": 1}},
+    ]
+    compacted = [compact(m) for m in msgs]
+    assert compacted == msgs
+    assert to_openai_messages(compacted) == msgs
+    assert json.loads(json.dumps(to_openai_messages(compacted))) == msgs
+    assert "content" in compacted[1] and compacted[1]["content"] is None
+    assert "model_extra" not in compacted[0]
+    assert compacted[0].get("model_extra", {}) == {}
+    assert pickle.loads(pickle.dumps(compacted[3])) == msgs[3]
+
+
+def test_shared_role_and_empty_containers():
+    a = CompactMessage({"role": "".join(["assis", "tant"]), "content": "1", "model_extra": {}})
+    b = CompactMessage(freeze({"role": "assistant", "content": "2", "model_extra": {}}))
+    assert a["role"] is b["role"]
+    assert a["model_extra"] is b["model_extra"]
+
+
+def test_immutable_and_passthrough():
+    m = compact({"role": "user", "content": "x"})
+    assert compact(m) is m
+    with pytest.raises(TypeError):
+        m["content"] = "y"
+    with pytest.raises(TypeError):
+        m.content = "y"
+    live = {"role": "assistant", "content": "streaming"}
+    assert to_openai_messages([m, live])[1] is live
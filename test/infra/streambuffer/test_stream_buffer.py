@@ -66,6 +66,7 @@ class TestMemoryManager:
             if mock_store.update_last_message.called:
                 call = mock_store.update_last_message.call_args
                 if self._get_arg(call, 1, "content") == "Streaming...":
+                    assert call.kwargs["partial"] is True
                     return
             time.sleep(0.1)
 
@@ -85,6 +86,7 @@ class TestMemoryManager:
         call = mock_store.update_last_message.call_args
         assert self._get_arg(call, 1, "content") == "Done."
         assert self._get_arg(call, 3, "tool_calls") == tools
+        assert not call.kwargs.get("partial")
 
     def test_append_message_forces_end_stream(self, manager, mock_store):
         path = "interrupt"
@@ -189,4 +191,33 @@ class TestConcurrencyStress:
             results = ex.map(worker, paths * 3)
 
         for p, obj_id in zip(paths * 3, results):
-            assert obj_id == ids[p]
\ No newline at end of file
+            assert obj_id == ids[p]
+
+class TestStructuralSharing:
+
+    def test_history_is_shared_not_copied(self):
+        from backend.infra.frozen import freeze
+        history = [freeze({"role": "tool", "content": "x" * 1000, "tool_call_id": "c1"})]
+        store = MagicMock()
+        store.load_messages.side_effect = lambda session_id: history
+        a = SessionState("A", store)
+        b = SessionState("B", store)
+        assert a.messages == b.messages == history
+        # 每个 SessionState 持有自己的 CompactMessage，共享的是 store 对象里的字段值（分叉前缀另经 PrefixCache 共享）
+        assert a.messages[0]["content"] is history[0]["content"]
+        with pytest.raises(TypeError):
+            a.messages[0]["content"] = "changed"
+
+    def test_snapshot_is_stable_view(self, manager):
+        path = "snapshot"
+        manager.start_stream(path)
+        manager.append_content(path, "part1")
+        state = manager.sessions[path]
+        with state.lock:
+            snap = state.snapshot_messages()
+        manager.append_content(path, "part2")
+
+        assert len(snap) == 1
+        assert snap[-1]["content"] == "part1"
+        assert state.messages[-1]["content"] == "part1part2"
+        assert list(snap) == [{"role": "assistant", "content": "part1", "model_extra": {"reasoning_content": ""}}]
@@ -0,0 +1,39 @@
+import copy
+import json
+import pickle
+
+import pytest
+
+from backend.infra.frozen import FrozenDict, FrozenList, freeze, thaw
+
+
+def test_freeze_is_deep_and_compatible():
+    msg = {"role": "assistant", "tool_calls": [{"id": "1", "function": {"name": "f"}}]}
+    frozen = freeze(msg)
+    assert isinstance(frozen, FrozenDict)
+    assert isinstance(frozen["tool_calls"], FrozenList)
+    assert frozen == msg
+    assert json.loads(json.dumps(frozen)) == msg
+    assert freeze(frozen) is frozen
+
+
+def test_frozen_rejects_mutation():
+    frozen = freeze({"a": [1], "b": {}})
+    for op in (
+        lambda: frozen.__setitem__("a", 2),
+        lambda: frozen.update(a=2),
+        lambda: frozen.setdefault("c", 1),
+        lambda: frozen["a"].append(2),
+        lambda: frozen["b"].pop("x", None),
+    ):
+        with pytest.raises(TypeError):
+            op()
+
+
+def test_copy_pickle_and_thaw():
+    frozen = freeze({"a": [1, {"b": 2}]})
+    assert copy.deepcopy(frozen) is frozen
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+    mutable = thaw(frozen)
+    mutable["a"].append(3)
+    assert type(mutable) is dict and frozen["a"] == [1, {"b": 2}]
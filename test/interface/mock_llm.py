@@ -0,0 +1,164 @@
+"""
+本地 mock LLM：OpenAI 兼容的 /v1/chat/completions 流式接口（SSE），供 HTTP 服务的测试与压测使用。
+
+- 每次请求先流式输出 reasoning_content，再输出 content，按 chunk_chars 切分，delta 间隔 delay 秒；
+- 最后一条消息是 user 且以 "/tool <name> <json args>" 开头时，改为输出一次工具调用；
+  收到 tool 结果后的下一次请求正常回答；
+- ttft 为首个 chunk 前的额外等待（模拟排队 / 过载的 provider）；status 非 200 时直接返回该错误码；
+- 未带 stream=true 的请求返回 400（服务只用流式）。
+用法：python test/interface/mock_llm.py --port 9000
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class MockLLM:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        reasoning: str = "让我想一想。",
+        content: str = "这是 mock 模型的回答。",
+        chunk_chars: int = 2,
+        delay: float = 0.0,
+        ttft: float = 0.0,
+        status: int = 200,
+        name: str = "mock",
+    ):
+        self.reasoning = reasoning
+        self.content = content
+        self.chunk_chars = chunk_chars
+        self.delay = delay
+        self.ttft = ttft
+        self.status = status
+        self.name = name
+        self.models: List[str] = []
+        # 每次请求的 messages，供测试检查请求内容
+        self.received: List[List[Dict]] = []
+        self.requests = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+        handler = type("_Handler", (_Handler,), {"llm": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLM":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockLLM":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def chunks(self, messages: List[Dict]) -> List[Dict]:
+        """按请求的最后一条消息生成 delta 序列。"""
+        # RDAS 会带上本轮的空 assistant 占位消息，跳过它
+        while messages and messages[-1].get("role") == "assistant" and not messages[-1].get("content") \
+                and not messages[-1].get("tool_calls"):
+            messages = messages[:-1]
+        last = messages[-1] if messages else {}
+        text = last.get("content") or ""
+        if last.get("role") == "user" and text.startswith("/tool "):
+            _, name, *rest = text.split(" ", 2)
+            return [{"reasoning_content": "需要调用工具。", "content": None, "tool_calls": [{
+                "index": 0, "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                "function": {"name": name, "arguments": rest[0] if rest else "{}"},
+            }]}]
+        n = self.chunk_chars
+        out = [{"reasoning_content": self.reasoning[i:i + n], "content": None}
+               for i in range(0, len(self.reasoning), n)]
+        out += [{"reasoning_content": None, "content": self.content[i:i + n]}
+                for i in range(0, len(self.content), n)]
+        return out
+
+
+class _Handler(BaseHTTPRequestHandler):
+    llm: MockLLM
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not body.get("stream"):
+            self.send_error(400, "only stream=true is supported")
+            return
+        self.llm._count("requests")
+        self.llm.models.append(body.get("model"))
+        self.llm.received.append(body.get("messages") or [])
+        if self.llm.status != 200:
+            self.send_error(self.llm.status, "injected failure")
+            return
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        deltas = self.llm.chunks(body.get("messages") or [])
+        finish = "tool_calls" if any(d.get("tool_calls") for d in deltas) else "stop"
+        try:
+            if self.llm.ttft:
+                time.sleep(self.llm.ttft)
+            for i, delta in enumerate(deltas):
+                if self.llm.delay:
+                    time.sleep(self.llm.delay)
+                self._send(completion_id, body.get("model"), {"role": "assistant", **delta} if i == 0 else delta, None)
+            self._send(completion_id, body.get("model"), {}, finish)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.llm._count("disconnects")
+        self.close_connection = True
+
+    def _send(self, completion_id, model, delta, finish_reason):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model or self.llm.name,
+            "choices": [{"index": 0, "delta": {"reasoning_content": None, **delta}, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+    llm = MockLLM(args.host, args.port, delay=args.delay)
+    print(f"mock LLM at {llm.base_url}")
+    llm.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Cassette：用本地 mock LLM 录制，停掉 mock 后离线回放。"""
+import gzip
+import time
+
+import pytest
+from openai import OpenAI
+
+import backend.app.service.request_display_action_and_save as rdas
+from backend.app.service.cassette import Cassette, CassetteMiss, RecordingClient, ReplayClient, request_key
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.streambuffer import Stream_Buffer
+from backend.infra.streambuffer.compact_message import compact
+from mock_llm import MockLLM
+
+TOOLS = [{"type": "function", "function": {
+    "name": "echo", "description": "原样返回", "parameters": {"type": "object", "properties": {"text": {"type": "string"}}},
+}}]
+
+
+def _echo(ctx, text=""):
+    return f"echo:{text}"
+
+
+SETTINGS = {"model": "mock", "tools": TOOLS, "tool_registry": {"echo": _echo}}
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    db = MessageDB(str(tmp_path / "chat.db"))
+    buffer = Stream_Buffer(message_store=db, flush_interval=0.05)
+    monkeypatch.setattr(rdas, "stream_buffer", buffer)
+    yield db
+    buffer.shutdown()
+    db.close()
+
+
+def _run_session(db, client, session_id):
+    """一轮带工具调用的对话：/tool → 执行 echo → 最终回答。"""
+    db.append_message(session_id, {"role": "system", "content": "你是测试助手"})
+    db.append_message(session_id, {"role": "user", "content": '/tool echo {"text": "hi"}'})
+    tokens = []
+    steps = 0
+    while not rdas.request_display_action_and_save(client, session_id, SETTINGS, tokens.append, token_coalesce=False):
+        steps += 1
+    return steps + 1, "".join(tokens)
+
+
+def _record(tmp_path, db, **mock_kwargs):
+    path = str(tmp_path / "llm.cassette.gz")
+    with MockLLM(reasoning="想一想", content="这是回答。", **mock_kwargs) as llm:
+        client = RecordingClient(OpenAI(api_key="sk-test", base_url=llm.base_url, max_retries=0), Cassette(path))
+        result = _run_session(db, client, "recorded")
+        assert llm.requests == 2
+    client.cassette.save()
+    return path, result
+
+
+def test_replay_rdas_offline(tmp_path, env):
+    path, (steps, tokens) = _record(tmp_path, env)
+    # mock 已停止：回放不访问网络
+    replay = ReplayClient(Cassette(path))
+    assert _run_session(env, replay, "replayed") == (steps, tokens)
+    assert env.load_messages("replayed") == env.load_messages("recorded")
+    assert "echo:hi" in tokens and "这是回答。" in tokens
+    assert replay.hits == 2 and replay.misses == 0
+
+
+def test_cassette_file_roundtrip_is_compact(tmp_path, env):
+    path, _ = _record(tmp_path, env)
+    recorded = Cassette(path)
+    assert len(recorded) == 2
+    # 每个 chunk 只存与首个 chunk 不同的字段
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert '"id"' not in lines[-1].split('"chunks":', 1)[1]
+    replayed = list(ReplayClient(recorded).replay(recorded.recordings[1].key))
+    assert [c.model_dump(mode="json", exclude_unset=True) for c in replayed] == recorded.recordings[1].chunks
+    assert "".join(c.choices[0].delta.content or "" for c in replayed if c.choices) == "这是回答。"
+
+
+def test_request_key_ignores_message_representation():
+    messages = [{"role": "user", "content": "hi"},
+                {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": "c", "type": "function", "function": {"name": "echo", "arguments": "{}"}}]}]
+    key = request_key("m", messages, TOOLS)
+    assert key == request_key("m", [compact(m) for m in messages], TOOLS)
+    assert key != request_key("m", messages, [])
+    assert key != request_key("other", messages, TOOLS)
+
+
+def test_replay_timing(tmp_path, env):
+    path, _ = _record(tmp_path, env, chunk_chars=1, delay=0.03)
+    cassette = Cassette(path)
+    recording = cassette.recordings[1]
+    assert recording.offsets[-1] > 0.15
+
+    def elapsed(speed):
+        start = time.perf_counter()
+        list(ReplayClient(cassette, speed=speed).replay(recording.key))
+        return time.perf_counter() - start
+
+    assert elapsed(1.0) == pytest.approx(recording.offsets[-1], abs=0.1)
+    assert elapsed(4.0) < recording.offsets[-1] / 2
+    assert elapsed(None) < 0.05
+
+
+def test_replay_miss(tmp_path, env):
+    path, _ = _record(tmp_path, env)
+    messages = [{"role": "user", "content": "没录过"}]
+    strict = ReplayClient(Cassette(path))
+    with pytest.raises(CassetteMiss):
+        strict.chat.completions.create(model="mock", messages=messages, stream=True)
+    lenient = ReplayClient(Cassette(path), on_miss="sequential")
+    first = list(lenient.chat.completions.create(model="mock", messages=messages, stream=True))
+    assert first[0].choices[0].delta.tool_calls
+    list(lenient.chat.completions.create(model="mock", messages=messages, stream=True))
+    with pytest.raises(CassetteMiss):
+        lenient.chat.completions.create(model="mock", messages=messages, stream=True)
+    assert lenient.misses == 3
@@ -0,0 +1,168 @@
+"""检查点与 resume：在模型流中途 / 工具执行中途模拟进程退出，再从检查点继续。"""
+import pytest
+
+import backend.app.service.request_display_action_and_save as rdas
+import backend.interface.chat as chat
+from backend.app.agent_registry import AgentRegistry
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.function_calling import tool_manager
+from backend.infra.streambuffer import Stream_Buffer
+from mock_llm import MockLLM
+
+
+class Crash(BaseException):
+    """模拟进程退出：不被 RDAS 的工具异常处理吞掉。"""
+
+
+calls = {"write": 0, "read": 0}
+crash_in = set()
+
+
+@tool_manager.register(name="ckpt_write", description="有副作用的写操作", parameters={"type": "object"})
+def ckpt_write(ctx):
+    calls["write"] += 1
+    if "write" in crash_in:
+        crash_in.discard("write")
+        raise Crash()
+    return "written"
+
+
+@tool_manager.register(name="ckpt_read", description="只读查询", parameters={"type": "object"}, idempotent=True)
+def ckpt_read(ctx):
+    calls["read"] += 1
+    if "read" in crash_in:
+        crash_in.discard("read")
+        raise Crash()
+    return "read-ok"
+
+
+@pytest.fixture
+def llm():
+    with MockLLM(reasoning="", content="完成了。", chunk_chars=1) as server:
+        yield server
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch, llm):
+    db = MessageDB(str(tmp_path / "chat.db"))
+    buffer = Stream_Buffer(message_store=db, flush_interval=0.05)
+    monkeypatch.setattr(chat, "db", db)
+    for module in (chat, rdas):
+        monkeypatch.setattr(module, "stream_buffer", buffer)
+    registry = AgentRegistry(db)
+    monkeypatch.setattr(chat, "agent_registry", registry)
+    db.upsert_agent(
+        "ckpt_agent",
+        "description: mock\nsoul: test\ntools: [ckpt_write, ckpt_read]\n"
+        f"llm_settings:\n  model: mock\n  url: {llm.base_url}\n  api_key: x\n",
+        "你是测试助手",
+    )
+    db.create_session_for_agent("s", "ckpt_agent")
+    calls.update(write=0, read=0)
+    crash_in.clear()
+    yield db
+    registry.close()
+    buffer.shutdown()
+    db.close()
+
+
+def _roles(db):
+    return [m["role"] for m in db.load_messages("s")]
+
+
+def _continue(text, **kwargs):
+    return chat.continue_chat("s", text, compactor=None, **kwargs)
+
+
+def test_resume_after_crash_mid_stream_drops_partial_answer(env, llm, monkeypatch):
+    buffer = rdas.stream_buffer
+    append_content = buffer.append_content
+    received = []
+
+    def crash_on_second_chunk(session_id, chunk):
+        received.append(chunk)
+        if len(received) == 2:
+            raise Crash()
+        append_content(session_id, chunk)
+
+    monkeypatch.setattr(buffer, "append_content", crash_on_second_chunk)
+    with pytest.raises(Crash):
+        _continue("你好")
+    monkeypatch.setattr(buffer, "append_content", append_content)
+    assert env.get_checkpoint("s")["phase"] == "stream"
+    assert _roles(env)[-1] == "assistant"
+
+    assert chat.resume_chat("s", compactor=None) is True
+    assert llm.requests == 2
+    messages = env.load_messages("s")
+    assert _roles(env) == ["system", "user", "assistant"]
+    assert messages[-1]["content"] == "完成了。"
+    # 重新请求时不带半截的回答
+    assert [m["role"] for m in llm.received[1] if m.get("content")] == ["system", "user"]
+    assert env.get_checkpoint("s")["phase"] == "done"
+
+
+def test_resume_does_not_repeat_non_idempotent_tool(env, llm):
+    crash_in.add("write")
+    with pytest.raises(Crash):
+        _continue("/tool ckpt_write {}")
+    checkpoint = env.get_checkpoint("s")
+    assert checkpoint["phase"] == "tools" and checkpoint["done"] == []
+    assert calls["write"] == 1 and llm.requests == 1
+
+    assert chat.resume_chat("s", compactor=None) is True
+    # 工具没有重新执行，模型收到"被中断"的结果后继续；之前的模型请求没有重发
+    assert calls["write"] == 1
+    assert llm.requests == 2
+    tool_message = env.load_messages("s")[-2]
+    assert tool_message["role"] == "tool" and tool_message["content"].startswith("[tool interrupted]")
+    assert tool_message["tool_call_id"] == checkpoint["tool_calls"][0]["id"]
+    assert _roles(env) == ["system", "user", "assistant", "tool", "assistant"]
+
+
+def test_resume_reruns_idempotent_tool(env, llm):
+    crash_in.add("read")
+    with pytest.raises(Crash):
+        _continue("/tool ckpt_read {}")
+    assert chat.resume_chat("s", compactor=None) is True
+    assert calls["read"] == 2 and llm.requests == 2
+    assert env.load_messages("s")[-2]["content"] == "read-ok"
+
+
+class _CrashOnSecondStep:
+    """每步请求模型前被调用：第二步（工具结果已写入、下一次模型请求之前）退出。"""
+
+    def __init__(self):
+        self.steps = 0
+
+    def maybe_compact(self, session_id):
+        self.steps += 1
+        if self.steps == 2:
+            raise Crash()
+
+
+def test_resume_after_tool_result_saved_skips_tool(env, llm):
+    with pytest.raises(Crash):
+        chat.continue_chat("s", "/tool ckpt_write {}", compactor=_CrashOnSecondStep())
+    assert chat.resume_chat("s", compactor=None) is True
+    assert calls["write"] == 1 and llm.requests == 2
+    assert _roles(env) == ["system", "user", "assistant", "tool", "assistant"]
+    assert env.load_messages("s")[-2]["content"] == "written"
+
+
+def test_resume_finished_session_is_noop(env, llm):
+    assert _continue("你好") is True
+    assert chat.resume_chat("s", compactor=None) is True
+    assert llm.requests == 1
+
+
+class _FailingCompactor:
+    def maybe_compact(self, session_id):
+        raise RuntimeError("摘要模型返回了空内容")
+
+
+def test_failed_compaction_does_not_fail_the_turn(env, llm):
+    with pytest.warns(RuntimeWarning, match="上下文压缩失败"):
+        assert chat.continue_chat("s", "你好", compactor=_FailingCompactor()) is True
+    assert llm.requests == 1
+    assert _roles(env) == ["system", "user", "assistant"]
@@ -0,0 +1,159 @@
+"""ContextCompactor：真实 MessageDB + 本地 mock LLM 生成摘要。"""
+import pytest
+from openai import OpenAI
+
+from backend.app.service.context_compactor import SUMMARY_HEADER, ContextCompactor
+from backend.app.service.llm_scheduler import CHARS_PER_TOKEN, estimate_tokens
+from backend.domain.predefined.property import LLMSettingsProperty
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.database.sharded import ShardedMessageDB
+from backend.infra.streambuffer.stream_buffer_module import Stream_Buffer
+from mock_llm import MockLLM
+
+SUMMARY = "用户在整理季度报表，已确认数据来源。"
+
+
+@pytest.fixture
+def llm():
+    with MockLLM(content=SUMMARY, reasoning="", name="cheap") as server:
+        yield server
+
+
+@pytest.fixture
+def store(tmp_path):
+    db = MessageDB(str(tmp_path / "chat.db"))
+    yield db
+    db.close()
+
+
+def _compactor(store, llm, **kwargs) -> ContextCompactor:
+    settings = LLMSettingsProperty(model="cheap-model", url=llm.base_url, api_key="sk-test")
+    client = OpenAI(api_key="sk-test", base_url=llm.base_url, max_retries=0)
+    kwargs.setdefault("threshold_tokens", 2000)
+    kwargs.setdefault("keep_tokens", 600)
+    return ContextCompactor(settings, store=store, client=client, **kwargs)
+
+
+def _fill(store, session_id: str, turns: int, start: int = 0) -> None:
+    if start == 0:
+        store.append_message(session_id, {"role": "system", "content": "你是报表助手。"})
+    for i in range(start, start + turns):
+        store.append_message(session_id, {"role": "user", "content": f"第 {i} 个问题：" + "数" * 200})
+        store.append_message(session_id, {"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{i}", "type": "function", "function": {"name": "read_file", "arguments": "{}"}}
+        ]})
+        store.append_message(session_id, {"role": "tool", "tool_call_id": f"call_{i}", "content": "据" * 200})
+        store.append_message(session_id, {"role": "assistant", "content": f"第 {i} 个回答"})
+
+
+def test_below_threshold_does_nothing(store, llm):
+    _fill(store, "s", 2)
+    compactor = _compactor(store, llm)
+    assert compactor.maybe_compact("s") is False
+    assert llm.requests == 0
+    assert store.load_recall_messages("s") is None
+
+
+def test_below_threshold_is_decided_without_decoding(store, llm, monkeypatch):
+    _fill(store, "s", 2)
+
+    def fail(session_id):
+        raise AssertionError("不应解码历史")
+
+    monkeypatch.setattr(store, "load_messages", fail)
+    monkeypatch.setattr(store, "load_recall_messages", fail)
+    assert _compactor(store, llm).maybe_compact("s") is False
+
+
+def test_recall_size_bounds_token_estimate(store, llm):
+    _fill(store, "s", 20)
+    # 超过 blob_threshold 的工具输出在 payload 里只是引用，仍按原文长度计
+    store.append_message("s", {"role": "tool", "tool_call_id": "big", "content": "长" * 5000})
+    size = store.recall_size("s")
+    assert size // CHARS_PER_TOKEN >= estimate_tokens(store.load_messages("s"), max_tokens=0)
+    _compactor(store, llm).compact("s")
+    compacted = store.recall_size("s")
+    assert compacted < size
+    assert compacted // CHARS_PER_TOKEN >= estimate_tokens(store.load_recall_messages("s"), max_tokens=0)
+
+
+def test_compaction_replaces_old_turns_with_summary(store, llm):
+    _fill(store, "s", 20)
+    full = store.load_messages("s")
+    compactor = _compactor(store, llm)
+    assert compactor.maybe_compact("s") is True
+    assert llm.requests == 1 and llm.models == ["cheap-model"]
+    transcript = llm.received[0][-1]["content"]
+    assert "第 0 个问题" in transcript and "read_file" in transcript
+
+    recalled = store.load_recall_messages("s")
+    assert recalled[0]["role"] == "system"
+    assert recalled[0]["content"].startswith("你是报表助手。")
+    assert SUMMARY_HEADER + SUMMARY in recalled[0]["content"]
+    assert len(recalled) < len(full)
+    # 保留部分从一个 user / assistant 消息开始，以原样的最近消息结尾
+    assert recalled[1]["role"] in ("user", "assistant")
+    assert list(recalled[-3:]) == list(full[-3:])
+    # 原消息仍在库中
+    assert store.load_messages("s") == full
+    upto, _ = store.get_compaction("s")
+    assert upto in store.list_message_ids("s")
+    # 压缩后不再超过阈值
+    assert compactor.maybe_compact("s") is False
+    assert llm.requests == 1
+
+
+def test_stream_buffer_recalls_compacted_context(store, llm):
+    _fill(store, "s", 20)
+    _compactor(store, llm).compact("s")
+    buffer = Stream_Buffer(message_store=store)
+    try:
+        buffer.start_stream("s")
+        messages = buffer.recall("s")
+        assert SUMMARY in messages[0]["content"]
+        # 占位 assistant 消息同时写入了库
+        assert len(messages) == len(store.load_recall_messages("s"))
+        assert messages[-1]["role"] == "assistant" and messages[-1]["content"] is None
+        buffer.end_stream("s")
+    finally:
+        buffer.shutdown()
+    # 新写入的消息在压缩后的上下文里照常出现
+    store.append_message("s", {"role": "user", "content": "继续"})
+    assert store.load_recall_messages("s")[-1]["content"] == "继续"
+
+
+def test_summaries_are_cached_by_content(store, llm):
+    _fill(store, "a", 20)
+    _fill(store, "b", 20)
+    compactor = _compactor(store, llm)
+    assert compactor.compact("a") and compactor.compact("b")
+    assert llm.requests == 1
+    assert compactor.summarized == 1 and compactor.cache_hits == 1
+    assert store.get_compaction("a")[1] == store.get_compaction("b")[1]
+
+
+def test_recompaction_folds_previous_summary(store, llm):
+    _fill(store, "s", 20)
+    compactor = _compactor(store, llm)
+    compactor.compact("s")
+    first_upto, first_hash = store.get_compaction("s")
+    _fill(store, "s", 20, start=20)
+    assert compactor.maybe_compact("s") is True
+    upto, summary_hash = store.get_compaction("s")
+    assert upto > first_upto and summary_hash != first_hash
+    transcript = llm.received[-1][-1]["content"]
+    assert "【上一份摘要】\n" + SUMMARY in transcript
+    # 已压缩过的消息不会再次发给摘要模型
+    assert "第 0 个问题" not in transcript
+    assert store.load_recall_messages("s")[0]["content"].count(SUMMARY_HEADER) == 1
+
+
+def test_sharded_store_copies_summary_to_session_shard(tmp_path, llm):
+    store = ShardedMessageDB(str(tmp_path / "shards"), shards=4)
+    try:
+        _fill(store, "s", 20)
+        _compactor(store, llm).compact("s")
+        assert SUMMARY in store.load_recall_messages("s")[0]["content"]
+    finally:
+        for shard in store.shards:
+            shard.close()
@@ -0,0 +1,258 @@
+"""EndpointRouter / RoutedClient：多个本地 mock LLM，注入不同的 TTFT 与错误。"""
+import json
+import threading
+import time
+
+import pytest
+from openai import BadRequestError, OpenAI
+
+from backend.app.service.chat_request import create_chat_stream
+from backend.app.service.endpoint_router import EndpointRouter, NoHealthyEndpoint, RoutedClient, RoutedStream, _Attempt
+from backend.app.service.llm_scheduler import PRIORITY_BATCH, LLMScheduler, scheduling
+from backend.domain.predefined.property import LLMSettingsProperty
+from mock_llm import MockLLM
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def make(**kwargs):
+        llm = MockLLM(**kwargs).start()
+        started.append(llm)
+        return llm
+
+    yield make
+    for llm in started:
+        llm.stop()
+
+
+def _router(llms, **kwargs) -> EndpointRouter:
+    endpoints = {
+        llm.name: LLMSettingsProperty(model=f"model-{llm.name}", url=llm.base_url, api_key="sk-test") for llm in llms
+    }
+    return EndpointRouter(endpoints, **kwargs)
+
+
+def _consume(stream) -> str:
+    text = ""
+    for chunk in stream:
+        delta = chunk.choices[0].delta
+        text += delta.content or ""
+    return text
+
+
+def test_prefers_fastest_endpoint(servers):
+    slow = servers(name="slow", ttft=0.15)
+    fast = servers(name="fast", ttft=0.0)
+    client = RoutedClient(_router([slow, fast]))
+    # 前两次分别探测两个 endpoint，之后都应落到 fast
+    for _ in range(6):
+        stream = client.chat.completions.create(messages=MESSAGES, stream=True)
+        assert _consume(stream) == "这是 mock 模型的回答。"
+    assert slow.requests == 1
+    assert fast.requests == 5
+    # 每个 endpoint 收到的是自己的 model 名
+    assert set(fast.models) == {"model-fast"}
+    stats = client.router.stats()
+    assert stats["slow"]["ttft_ewma"] > stats["fast"]["ttft_ewma"]
+    assert all(s["in_flight"] == 0 for s in stats.values())
+
+
+def test_fails_over_before_first_chunk(servers):
+    broken = servers(name="a-broken", status=500)
+    good = servers(name="b-good")
+    router = _router([broken, good], cooldown=60.0)
+    client = RoutedClient(router)
+    stream = client.chat.completions.create(messages=MESSAGES, stream=True)
+    assert _consume(stream) == "这是 mock 模型的回答。"
+    assert stream.endpoint == "b-good"
+    # 客户端自身不重试：失败的 endpoint 只收到一次请求
+    assert broken.requests == 1
+    assert router.stats()["a-broken"]["errors"] == 1
+    # 刚失败过且没有 TTFT 样本，冷却期内排在最后
+    for _ in range(3):
+        _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert broken.requests == 1
+
+
+def test_rate_limited_endpoint_fails_over(servers):
+    limited = servers(name="a-limited", status=429)
+    good = servers(name="b-good")
+    router = _router([limited, good])
+    stream = RoutedClient(router).chat.completions.create(messages=MESSAGES, stream=True)
+    assert _consume(stream) == "这是 mock 模型的回答。"
+    assert stream.endpoint == "b-good"
+    assert router.stats()["a-limited"]["errors"] == 1
+
+
+def test_client_error_is_raised_without_failover(servers):
+    invalid = servers(name="a-invalid", status=400)
+    good = servers(name="b-good")
+    router = _router([invalid, good])
+    # 请求本身有问题：换 endpoint 也一样，直接抛出，也不算 endpoint 的错误
+    with pytest.raises(BadRequestError):
+        _consume(RoutedClient(router).chat.completions.create(messages=MESSAGES, stream=True))
+    assert invalid.requests == 1 and good.requests == 0
+    stats = router.stats()["a-invalid"]
+    assert stats["errors"] == 0 and stats["in_flight"] == 0
+    assert router.rank()[0].name == "a-invalid"
+
+
+def test_in_flight_held_until_stream_closed(servers):
+    llm = servers(name="only")
+    router = _router([llm])
+    stream = RoutedClient(router).chat.completions.create(messages=MESSAGES, stream=True)
+    chunks = iter(stream)
+    next(chunks)
+    # 已有首个 chunk、TTFT 已记录，但流仍在输出
+    assert router.stats()["only"]["ttft_ewma"] is not None
+    assert router.stats()["only"]["in_flight"] == 1
+    stream.close()
+    assert router.stats()["only"]["in_flight"] == 0
+
+
+def test_cancel_while_opening_closes_late_stream():
+    router = EndpointRouter(
+        {"only": LLMSettingsProperty(model="m", url="http://unused", api_key="sk-test")},
+        client_factory=lambda **kwargs: None,
+    )
+    opening = threading.Event()
+    release = threading.Event()
+    closed = []
+
+    class LateStream:
+        def __iter__(self):
+            return iter(["chunk"])
+
+        def close(self):
+            closed.append(True)
+
+    def open_stream(endpoint):
+        opening.set()
+        release.wait(5)
+        return LateStream()
+
+    attempt = _Attempt(router, router.endpoints["only"], open_stream)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(attempt.run()))
+    thread.start()
+    assert opening.wait(5)
+    attempt.cancel()
+    release.set()
+    thread.join(5)
+    # 取消时流尚未返回；返回后 run() 自己关闭它，不计错误，并释放 in_flight
+    assert result == [False]
+    assert closed == [True]
+    stats = router.stats()["only"]
+    assert stats["in_flight"] == 0 and stats["errors"] == 0
+
+
+def test_hedge_threads_inherit_scheduling_context():
+    router = EndpointRouter(
+        {name: LLMSettingsProperty(model="m", url="http://unused", api_key="sk-test") for name in ("a", "b")},
+        client_factory=lambda **kwargs: None,
+        hedge_percentile=0.9,
+    )
+    # a 更快且有足够样本：走对冲竞速（后台线程）
+    for _ in range(5):
+        router._record("a", ttft=0.01)
+        router._record("b", ttft=0.05)
+    scheduler = LLMScheduler()
+
+    def open_stream(endpoint):
+        # 在对冲线程里取令牌：应按调用方 scheduling() 设置的优先级排队
+        scheduler.acquire("http://unused", "m", 1)
+        return iter(["chunk"])
+
+    with scheduling(PRIORITY_BATCH, "agent-x"):
+        stream = RoutedStream(router, open_stream)
+        assert list(stream) == ["chunk"]
+    assert list(scheduler.metrics()["priorities"]) == [str(PRIORITY_BATCH)]
+
+
+def test_unhealthy_endpoint_probed_after_cooldown(servers):
+    broken = servers(name="a-broken", status=500)
+    good = servers(name="b-good")
+    now = [0.0]
+    router = _router([broken, good], cooldown=10.0, eject_after=1, clock=lambda: now[0])
+    client = RoutedClient(router)
+    _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert [e.name for e in router.rank()] == ["b-good"]
+    now[0] = 11.0
+    broken.status = 200
+    # 冷却期过后重新参与排序；尚无 TTFT 样本，优先被探测
+    assert router.rank()[0].name == "a-broken"
+    _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert broken.requests == 2
+
+
+def test_all_endpoints_failing_raises(servers):
+    a = servers(name="a", status=500)
+    b = servers(name="b", status=503)
+    client = RoutedClient(_router([a, b]))
+    with pytest.raises(NoHealthyEndpoint):
+        _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert a.requests == 1 and b.requests == 1
+
+
+def test_hedge_wins_over_slow_primary(servers):
+    primary = servers(name="a-primary")
+    backup = servers(name="b-backup", ttft=0.15)
+    router = _router([primary, backup], hedge_percentile=0.9, min_hedge_delay=0.05)
+    client = RoutedClient(router)
+    # 预热：primary 积累一批很快的 TTFT 样本，backup 也有一个较慢的样本
+    for _ in range(20):
+        _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert router.hedge_delay("a-primary") < 0.1
+    assert router.rank()[0].name == "a-primary"
+
+    # primary 突然变慢：超过对冲延迟后向 backup 再发一个请求，backup 先出首个 chunk
+    primary.ttft, primary.delay = 1.0, 0.01
+    before = primary.requests, backup.requests
+    start = time.perf_counter()
+    stream = client.chat.completions.create(messages=MESSAGES, stream=True)
+    assert _consume(stream) == "这是 mock 模型的回答。"
+    elapsed = time.perf_counter() - start
+    assert stream.hedged and stream.endpoint == "b-backup"
+    assert elapsed < 0.8
+    assert (primary.requests, backup.requests) == (before[0] + 1, before[1] + 1)
+    assert router.hedges == 1 and router.hedge_wins == 1
+    # 输掉的请求已被关闭：mock 恢复输出后发现连接断开；被取消的请求不计为错误
+    deadline = time.time() + 3
+    while (primary.disconnects == 0 or router.stats()["a-primary"]["in_flight"]) and time.time() < deadline:
+        time.sleep(0.02)
+    assert primary.disconnects == 1
+    assert router.stats()["a-primary"]["in_flight"] == 0
+    assert router.stats()["a-primary"]["errors"] == 0
+
+
+def test_no_hedge_when_primary_fast(servers):
+    primary = servers(name="a-primary")
+    backup = servers(name="b-backup", ttft=0.05)
+    router = _router([primary, backup], hedge_percentile=0.9, min_hedge_delay=0.2)
+    client = RoutedClient(router)
+    for _ in range(10):
+        _consume(client.chat.completions.create(messages=MESSAGES, stream=True))
+    assert router.hedges == 0
+    assert backup.requests == 1
+
+
+def test_create_chat_stream_hook_dispatches_to_endpoint(servers):
+    llm = servers(name="only")
+    seen = []
+
+    def factory(**kwargs):
+        client = OpenAI(**kwargs)
+        seen.append(client)
+        return client
+
+    client = RoutedClient(_router([llm], client_factory=factory))
+    tools_json = json.dumps([{"type": "function", "function": {"name": "t", "parameters": {}}}]).encode()
+    model_settings = {"model": "ignored", "tools": [], "tools_json": tools_json}
+    stream = create_chat_stream(client, model_settings, MESSAGES)
+    assert _consume(stream) == "这是 mock 模型的回答。"
+    assert llm.models == ["model-only"]
+    assert len(seen) == 1 and seen[0].max_retries == 0
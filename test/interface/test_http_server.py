@@ -0,0 +1,207 @@
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+import backend.app.service.request_display_action_and_save as rdas
+import backend.interface.chat as chat
+import backend.interface.http_server as http_server
+from backend.app.agent_registry import AgentRegistry
+from backend.infra.database.db_manager import MessageDB
+from backend.infra.streambuffer import Stream_Buffer
+from mock_llm import MockLLM
+
+
+@pytest.fixture
+def llm():
+    with MockLLM(content="这是一段很长的回答，" * 20, chunk_chars=2, delay=0.002) as server:
+        yield server
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch, llm):
+    """独立的 db / stream_buffer，注入到 chat、RDAS 与 HTTP 服务模块。"""
+    db = MessageDB(str(tmp_path / "chat.db"))
+    buffer = Stream_Buffer(message_store=db, flush_interval=0.05)
+    for module in (chat, http_server):
+        monkeypatch.setattr(module, "db", db)
+    for module in (chat, http_server, rdas):
+        monkeypatch.setattr(module, "stream_buffer", buffer)
+    registry = AgentRegistry(db)
+    monkeypatch.setattr(chat, "agent_registry", registry)
+    db.upsert_agent(
+        "mock_agent",
+        f"description: mock\nsoul: test\ntools: []\nllm_settings:\n  model: mock\n  url: {llm.base_url}\n  api_key: x\n",
+        "你是测试助手",
+    )
+    yield db, buffer
+    registry.close()
+    buffer.shutdown()
+    db.close()
+
+
+class _Server:
+    def __init__(self, app):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="error"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 5
+        while not self.server.started and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        payload = json.dumps(body) if body is not None else None
+        conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+        return conn, conn.getresponse()
+
+    def json(self, method, path, body=None):
+        conn, resp = self.request(method, path, body)
+        try:
+            return resp.status, json.loads(resp.read() or b"null")
+        finally:
+            conn.close()
+
+
+def _sse_events(resp, limit=None):
+    """逐条解析 SSE，limit 条后停止。"""
+    events, current = [], {}
+    while limit is None or len(events) < limit:
+        line = resp.fp.readline()
+        if not line:
+            break
+        line = line.decode("utf-8").rstrip("\n")
+        if not line:
+            if current:
+                events.append(current)
+                if current.get("event") == "done":
+                    break
+            current = {}
+        elif line.startswith(":"):
+            continue
+        else:
+            key, _, value = line.partition(": ")
+            current[key] = json.loads(value) if key == "data" else value
+    return events
+
+
+@pytest.fixture
+def server(env):
+    service = http_server.ChatService(max_workers=4, keepalive=0.2)
+    with _Server(http_server.create_app(service)) as srv:
+        srv.service = service
+        yield srv
+
+
+def _new_session(server):
+    status, body = server.json("POST", "/chats", {"agent_name": "mock_agent"})
+    assert status == 200
+    return body["session_id"]
+
+
+def test_stream_turn_over_sse(server, env, llm):
+    db, _ = env
+    sid = _new_session(server)
+    conn, resp = server.request("POST", f"/chats/{sid}/messages?stream=true", {"text": "你好"})
+    assert resp.status == 200
+    assert resp.getheader("content-type").startswith("text/event-stream")
+    events = _sse_events(resp)
+    conn.close()
+
+    types = [e["event"] for e in events]
+    assert types[0] == "message" and types[1] == "start"
+    assert types[-2:] == ["end", "done"]
+    assert events[-1]["data"] == {"cancelled": False, "failed": False}
+    content = "".join(e["data"] for e in events if e["event"] == "content")
+    assert content == llm.content
+    messages = db.load_messages(sid)
+    assert [m["role"] for m in messages] == ["system", "user", "assistant"]
+    assert messages[-1]["content"] == llm.content
+
+
+def test_tool_events_and_observer(server, env):
+    sid = _new_session(server)
+    status, body = server.json("POST", f"/chats/{sid}/messages", {"text": '/tool unknown_tool {"a": 1}'})
+    assert status == 200
+    conn, resp = server.request("GET", f"/chats/{sid}/events?offset={body['offset']}")
+    events = _sse_events(resp)
+    conn.close()
+    types = [e["event"] for e in events]
+    assert "tool_calls" in types
+    tool_messages = [e["data"] for e in events if e["event"] == "message" and e["data"]["role"] == "tool"]
+    assert tool_messages and "not allowed" in tool_messages[0]["content"]
+    assert types[-1] == "done"
+
+
+def test_concurrent_turn_rejected(server, llm):
+    llm.delay = 0.01
+    sid = _new_session(server)
+    assert server.json("POST", f"/chats/{sid}/messages", {"text": "a"})[0] == 200
+    assert server.json("POST", f"/chats/{sid}/messages", {"text": "b"})[0] == 409
+    assert server.json("POST", f"/chats/{sid}/cancel")[1]["cancelled"] is True
+
+
+def test_disconnect_cancels_turn(server, env, llm):
+    llm.delay = 0.02
+    db, _ = env
+    sid = _new_session(server)
+    conn, resp = server.request("POST", f"/chats/{sid}/messages?stream=true", {"text": "你好"})
+    events = _sse_events(resp, limit=4)
+    assert len(events) == 4
+    conn.sock.shutdown(socket.SHUT_RDWR)
+    conn.close()
+
+    deadline = time.monotonic() + 5
+    while server.service.is_running(sid) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not server.service.is_running(sid)
+    # 已收到的部分内容被保存，远未读完整个回答
+    content = db.load_messages(sid)[-1]["content"] or ""
+    assert len(content) < len(llm.content)
+
+
+def test_unknown_session_and_agent(server):
+    assert server.json("POST", "/chats/missing/messages", {"text": "x"})[0] == 404
+    assert server.json("POST", "/chats", {"agent_name": "nobody"})[0] == 404
+
+
+def test_session_lookup_runs_off_event_loop(server, env, monkeypatch):
+    db, _ = env
+    lookup = db.get_session_agent_name
+    on_loop = []
+
+    def checked(session_id):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return lookup(session_id)
+
+    monkeypatch.setattr(db, "get_session_agent_name", checked)
+    assert server.json("POST", "/chats/missing/messages", {"text": "x"})[0] == 404
+    assert server.json("GET", "/chats/missing/events")[0] == 404
+    assert on_loop == [False, False]
+
+
+def test_delete_chat(server, env):
+    db, _ = env
+    sid = _new_session(server)
+    assert server.json("DELETE", f"/chats/{sid}")[0] == 200
+    assert db.get_session_agent_name(sid) is None
@@ -1,3 +1,4 @@
+import json
 import pytest
 from pydantic import ValidationError
 
@@ -144,4 +145,27 @@ def test_missing_tool_handling():
     tm = ToolManager()
     defs, registry = tm.get_payload_components(["non_existent_tool"])
     assert len(defs) == 0
-    assert len(registry) == 0
\ No newline at end of file
+    assert len(registry) == 0
+
+
+def test_agent_payload_is_cached_until_tools_change(monkeypatch):
+    """payload 按工具列表缓存，并附带预编码的 tools JSON；set_tools 后重建"""
+    tm = ToolManager()
+    monkeypatch.setattr("backend.app.agent.tool_manager", tm)
+
+    @tm.register("get_price", "获取价格", {"type": "object", "properties": {}})
+    def get_price(ctx, **kwargs): pass
+
+    base_config = LLMSettingsProperty(model="deepseek-V3", api_key="sk-123", url="https://api.deepseek.ai")
+    agent = basic_agent(name="a", description="", skills=[], rules=[], soul="", tools=[], llm_settings=base_config)
+
+    payload = agent.get_payload()
+    assert agent.get_payload() is payload
+    assert json.loads(payload["tools_json"]) == []
+    with pytest.raises(TypeError):
+        payload["model"] = "other"
+
+    agent.set_tools(["get_price"])
+    payload = agent.get_payload()
+    assert [t["function"]["name"] for t in json.loads(payload["tools_json"])] == ["get_price"]
+    assert json.loads(payload["tools_json"]) == payload["tools"]